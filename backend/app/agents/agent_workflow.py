@@ -70,6 +70,7 @@ from __future__ import annotations
 
 import json
 import logging
+import time
 from dataclasses import dataclass, field
 from typing import Any
 
@@ -88,6 +89,7 @@ from llama_index.core.llms import LLM
 from llama_index.core.schema import NodeWithScore, TextNode
 from llama_index.core.settings import Settings
 from llama_index.core.workflow import WorkflowRuntimeError, WorkflowTimeoutError
+from utils import request_timing
 
 logger = logging.getLogger(__name__)
 _RUN_FAILED_MESSAGE = "刚才没能查完，请稍后再试一次。"
@@ -266,13 +268,19 @@ async def run_agent(
 
     tool_calls: list[ToolCallTrace] = []
     agent_output_events = 0
+    tool_started: dict[str, float] = {}
     try:
-        async for ev in handler.stream_events():
-            if isinstance(ev, ToolCallResult):
-                tool_calls.append(_tool_call_result_to_trace(ev))
-            elif isinstance(ev, AgentOutput):
-                agent_output_events += 1
-        output: AgentOutput = await handler
+        with request_timing.stage("agent"):
+            async for ev in handler.stream_events():
+                if isinstance(ev, ToolCall):
+                    tool_started[ev.tool_id] = time.perf_counter()
+                elif isinstance(ev, ToolCallResult):
+                    if ev.tool_id in tool_started:
+                        request_timing.add("agent_tools", time.perf_counter() - tool_started.pop(ev.tool_id))
+                    tool_calls.append(_tool_call_result_to_trace(ev))
+                elif isinstance(ev, AgentOutput):
+                    agent_output_events += 1
+            output: AgentOutput = await handler
     except (WorkflowTimeoutError, WorkflowRuntimeError):
         logger.warning("Agent 运行超时或撞到运行时错误，降级返回兜底文案。", exc_info=True)
         return AgentRunResult(
@@ -332,14 +340,23 @@ async def stream_agent_events(
 
     tool_calls: list[ToolCallTrace] = []
     agent_output_events = 0
+    # 分阶段耗时（utils/request_timing.py）：整个 Agent 运行记 agent，其中工具
+    # 执行（ToolCall 到对应 ToolCallResult 之间）的合计记 agent_tools，剩下的
+    # 基本就是决策/生成 LLM 的时间。这是个生成器，不能用 with 包住 yield。
+    started = time.perf_counter()
+    tool_started: dict[str, float] = {}
     try:
         async for ev in handler.stream_events():
             if isinstance(ev, AgentStream):
                 if ev.delta:
+                    request_timing.mark("first_token")
                     yield {"type": "token", "content": ev.delta}
             elif isinstance(ev, ToolCall):
+                tool_started[ev.tool_id] = time.perf_counter()
                 yield {"type": "tool_call", "tool_name": ev.tool_name, "tool_kwargs": ev.tool_kwargs}
             elif isinstance(ev, ToolCallResult):
+                if ev.tool_id in tool_started:
+                    request_timing.add("agent_tools", time.perf_counter() - tool_started.pop(ev.tool_id))
                 trace = _tool_call_result_to_trace(ev)
                 tool_calls.append(trace)
                 yield {
@@ -353,12 +370,15 @@ async def stream_agent_events(
         output: AgentOutput = await handler
     except (WorkflowTimeoutError, WorkflowRuntimeError):
         logger.warning("Agent 流式运行超时或撞到运行时错误，降级返回兜底文案。", exc_info=True)
+        request_timing.add("agent", time.perf_counter() - started)
         yield {"type": "error", "message": _RUN_FAILED_MESSAGE}
         return
     except Exception:
         logger.exception("Agent 流式运行失败（决策 LLM 调用异常等），降级返回兜底文案。")
+        request_timing.add("agent", time.perf_counter() - started)
         yield {"type": "error", "message": _RUN_FAILED_MESSAGE}
         return
+    request_timing.add("agent", time.perf_counter() - started)
 
     truncated = _detect_truncation(agent_output_events, max_iterations)
     response_text = _agent_output_text(output)
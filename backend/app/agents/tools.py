@@ -28,7 +28,7 @@
 ``build_retriever_for_index(index, top_k)``——调用方（LLM）已经明确指定了
 索引，不需要也不应该再走一次 selector 决策。没传 ``index_name`` 时调用
 ``handlers.qa_workflow._build_retriever()``，复用它已经测试过的 0/1/多个
-索引三分支（多个索引时用 ``RouterRetriever`` + ``LLMSingleSelector``）——
+索引三分支（多个索引时走 ``handlers/index_router`` 的嵌入路由）——
 这跟 ``QAWorkflow`` 自己不指定索引时的行为完全一致，两处用同一份索引选择
 逻辑，不会出现"Agent 工具和 QAWorkflow 对同一个问题选了不同索引"这种
 不一致。
@@ -139,7 +139,7 @@ async def search_knowledge_base(query: str, index_name: str | None = None, top_k
 
         query_bundle = QueryBundle(query_str=query)
         nodes = await retriever.aretrieve(query_bundle)
-        nodes = ConditionalRerankPostprocessor().postprocess_nodes(nodes, query_bundle=query_bundle)
+        nodes = await ConditionalRerankPostprocessor().apostprocess_nodes(nodes, query_bundle=query_bundle)
     except Exception:
         logger.exception("search_knowledge_base 检索失败: query=%r index_name=%r", query, index_name)
         return json.dumps(
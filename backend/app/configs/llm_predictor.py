@@ -1,9 +1,32 @@
+"""全局 LLM / 嵌入模型的构造与 ``Settings`` 初始化。
+
+torch、transformers（``HuggingFaceEmbedding``）和 openai（``OpenAILike``）都在
+函数里面才 import：``main``、``router.index``、``utils.llm_config`` 在模块顶层
+import 这里，之前光是 import 就要十几秒（大头是 torch + transformers），
+``--help`` 一类的 CLI、只想调 ``build_llm`` 的脚本和每个测试进程都得付一遍。
+真正用到模型的是 ``init_settings``（lifespan 里只调一次），那时再加载。
+导入耗时的预算见 ``evals/bench_import_time.py``。
+"""
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING, Any
+
 import configs.load_env as env_config
-import torch
 from llama_index.core import Settings
 from llama_index.core.node_parser import SentenceSplitter
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.llms.openai_like import OpenAILike
+from utils.embedding_batcher import BatchedEmbedding
+from utils.embedding_cache import CachedEmbedding
+from utils.model_backend import onnx_load_args, quantize_dynamic_int8, resolve_backend
+from utils.sparse_embedding import BGEM3SparseEmbedding, with_sparse_head
+
+if TYPE_CHECKING:
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+    from llama_index.llms.openai_like import OpenAILike
+
+logger = logging.getLogger(__name__)
+
+EMBED_MODEL_NAME = "BAAI/bge-m3"
 
 _CONTEXT_WINDOWS = {
     'sensenova-6.7-flash-lite': 262144,
@@ -23,6 +46,8 @@ _MAX_TOKENS = 4096
 
 
 def build_llm() -> OpenAILike:
+    from llama_index.llms.openai_like import OpenAILike
+
     model = env_config.openai_model
     return OpenAILike(
         model=model,
@@ -35,17 +60,57 @@ def build_llm() -> OpenAILike:
     )
 
 
+def build_embed_model(device: str) -> HuggingFaceEmbedding:
+    """按 ``EMBEDDING_BACKEND`` 加载 bge-m3（后端说明见 utils/model_backend.py）。
+    ONNX 后端加载失败时退回全精度 torch。"""
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+    backend = resolve_backend(env_config.EMBEDDING_BACKEND, device)
+    kwargs: dict[str, Any] = {"device": device, "normalize": True, "trust_remote_code": True}
+    if backend in ("onnx", "onnx-int8"):
+        try:
+            from sentence_transformers import SentenceTransformer
+
+            path, extra = onnx_load_args(SentenceTransformer, EMBED_MODEL_NAME, backend, trust_remote_code=True)
+            return HuggingFaceEmbedding(model_name=path, **kwargs, **extra)
+        except Exception:
+            logger.warning("bge-m3 的 %s 后端加载失败，使用 torch。", backend, exc_info=True)
+    embed_model = HuggingFaceEmbedding(model_name=EMBED_MODEL_NAME, **kwargs)
+    if backend == "torch-int8":
+        quantize_dynamic_int8(embed_model._model)
+    return embed_model
+
+
 def init_settings():
+    import torch
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+    from llama_index.llms.openai_like import OpenAILike
+
     _sentinel = object()
     embed_model = getattr(Settings, '_embed_model', _sentinel)
-    if embed_model is _sentinel or not isinstance(embed_model, HuggingFaceEmbedding):
+    if embed_model is _sentinel or not isinstance(
+        embed_model, (HuggingFaceEmbedding, BGEM3SparseEmbedding, BatchedEmbedding, CachedEmbedding)
+    ):
         device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        Settings.embed_model = HuggingFaceEmbedding(
-            model_name="BAAI/bge-m3",
-            device=device,
-            normalize=True,
-            trust_remote_code=True,
-        )
+        embed_model = build_embed_model(device)
+        # 稀疏检索模式：挂上 bge-m3 的稀疏头，dense 和稀疏权重同一次前向出来，
+        # 见 utils/sparse_embedding.py。挂在 CachedEmbedding 里面，缓存照常生效。
+        # ONNX int8 后端的 model_name 是本地导出目录，稀疏头要从原仓库下载。
+        if env_config.LEXICAL_RETRIEVAL_MODE == "sparse":
+            embed_model = with_sparse_head(embed_model, repo_id=EMBED_MODEL_NAME)
+        # 并发请求的查询嵌入攒批前向，见 utils/embedding_batcher.py。装在缓存里面：
+        # 缓存命中的问题不进队列。
+        if env_config.EMBEDDING_BATCH_ENABLED:
+            embed_model = BatchedEmbedding(
+                embed_model,
+                max_batch=env_config.EMBEDDING_BATCH_MAX_SIZE,
+                max_wait_ms=env_config.EMBEDDING_BATCH_WAIT_MS,
+            )
+        # 包一层进程级 LRU，qa_cache / dense 检索 / updateNodeById 共享同一份
+        # 嵌入缓存，见 utils/embedding_cache.py 模块 docstring。
+        if env_config.EMBEDDING_CACHE_ENABLED:
+            embed_model = CachedEmbedding(embed_model, max_bytes=env_config.EMBEDDING_CACHE_MAX_MB * 1024 * 1024)
+        Settings.embed_model = embed_model
     llm = getattr(Settings, '_llm', _sentinel)
     if llm is _sentinel or not isinstance(llm, OpenAILike):
         Settings.llm = build_llm()
@@ -29,7 +29,28 @@ RERANK_RECALL_K = 20
 RERANK_TOP_N = 5
 RERANK_SCORE_THRESHOLD = 0.75
 RERANKER_MODEL = "BAAI/bge-reranker-v2-m3"
+# 跳过重排的判断依据（utils/rerank.py:_skip_rerank）。score：top1 分数 >=
+# RERANK_SCORE_THRESHOLD 时跳过（混合检索下比的是 RRF 分，实际从不触发）；
+# fusion：两路 top1 一致且 dense 余弦 top1 >= RERANK_SKIP_DENSE_MIN、
+# top1-top2 间隔 >= RERANK_SKIP_DENSE_MARGIN 时跳过。两个阈值必须用
+# evals/run_rerank_eval.py --calibrate-skip 在真实语料上标定后再切 fusion，
+# 下面的默认值只是 bge-m3 的保守起点，没有评测数据背书。余弦由 Chroma 的
+# L2 距离换算（handlers/vector_store.chroma_score_to_cosine），不是 Chroma 原始 score。
+RERANK_SKIP_MODE = "score"
+RERANK_SKIP_DENSE_MIN = 0.75
+RERANK_SKIP_DENSE_MARGIN = 0.05
 HYBRID_RETRIEVAL_ENABLED = True
+# 混合检索 BM25 腿的专用线程池大小（handlers/hybrid_retriever.py）：异步检索时
+# jieba 分词 + 倒排打分在这里跑，不占事件循环。并发检索数超过它时排队。
+BM25_EXECUTOR_WORKERS = 4
+# 两路在 RRF 融合里的权重：score = Σ w / (60 + rank)。默认等权。
+HYBRID_DENSE_WEIGHT = 1.0
+HYBRID_BM25_WEIGHT = 1.0
+# 混合检索词项那一路用什么：bm25 = jieba 分词 + BM25（handlers/bm25_index.py）；
+# sparse = bge-m3 稀疏权重（handlers/sparse_index.py），跟 dense 同一次前向算出，
+# 查询热路径上不再跑 jieba。sparse 需要嵌入模型是 bge-m3 且能加载到稀疏头，
+# 否则自动退回 bm25。切到 sparse 之前摄取的 chunk 没存权重，第一次建稀疏索引时补算。
+LEXICAL_RETRIEVAL_MODE = "bm25"
 
 # 条件触发查询改写（handlers/qa_workflow.py 的 retrieve step）：检索结果 top1
 # 分数低于 QUERY_REWRITE_SCORE_THRESHOLD 时，用 LLM 把原始问题改写得更适合
@@ -95,6 +116,20 @@ DEFAULT_SIMILARITY_TOP_K = 5
 QUERY_ENDPOINT_TOP_K = 2
 MULTI_INDEX_FALLBACK_TOP_K = 3
 
+# 多索引路由（handlers/index_router.py）。embedding：问题向量跟各索引画像（摘要
+# 嵌入按 INDEX_ROUTE_CENTROID_WEIGHT 混入随机抽样的 INDEX_ROUTE_CENTROID_SAMPLE 个
+# chunk 嵌入的质心）比余弦，落在 top1 - INDEX_ROUTE_MARGIN 以内的索引不超过
+# INDEX_ROUTE_MAX_FANOUT 个时并发查它们，否则退回 LLM 选择器；llm：每个问题都
+# 走 RouterRetriever + LLMSingleSelector（旧行为，多一次 LLM 往返）；fanout：
+# 所有索引并发查、全局 RRF 合并。多个索引并发检索时每个索引最多等
+# INDEX_FANOUT_TIMEOUT_S 秒，超时的索引本次当作没结果（0 表示不限时）。
+INDEX_ROUTING_MODE = "embedding"
+INDEX_ROUTE_MARGIN = 0.05
+INDEX_ROUTE_MAX_FANOUT = 3
+INDEX_ROUTE_CENTROID_WEIGHT = 0.3
+INDEX_ROUTE_CENTROID_SAMPLE = 512
+INDEX_FANOUT_TIMEOUT_S = 5.0
+
 # Rerank 配置（Phase 3.2 条件触发 + 轻量候选；Phase C 默认转正）。
 # 仅在向量/混合检索 top1 分数低于阈值时才触发 rerank。RERANK_RECALL_K=20 是
 # evals/run_rerank_eval.py 和 run_hybrid_eval.py 的 C 组实际验证过的召回量
@@ -106,6 +141,26 @@ RERANK_TOP_N = 5
 RERANK_SCORE_THRESHOLD = 0.75
 RERANKER_MODEL = "BAAI/bge-reranker-v2-m3"
 
+# 异步重排服务（utils/rerank.py:RerankService）：cross-encoder 前向在专用
+# 工作线程里执行，并发请求的 (query, passage) 对攒成一批一次前向。CPU 部署下
+# torch 一次前向本来就吃满所有核，worker 默认 1 个，多开只会互相抢核；GPU 或
+# 多 NUMA 节点机器可以调大。RERANK_BATCH_WAIT_MS 是拿到第一个请求后最多再等
+# 多久捎带别的请求——默认 2ms，相对几百毫秒的前向可以忽略，0 表示只捎带
+# 已经在排队的请求、不额外等待。
+RERANK_WORKERS = 1
+RERANK_MAX_BATCH_PAIRS = 64
+RERANK_BATCH_WAIT_MS = 2.0
+# 重排分数缓存（utils/rerank.py:RerankScoreCache）：key 是 (归一化 query,
+# node_id, 节点内容 hash)，节点内容一改 hash 就变，不需要 TTL。一条只存一个
+# float，两万条也就几 MB。
+RERANK_CACHE_ENABLED = True
+RERANK_CACHE_MAX_ENTRIES = 20000
+# 检索结果缓存（handlers/retrieval_cache.py）：key 是 (索引, 内容版本号, 归一化
+# 问题, top_k)，值只存 node_id 和分数，命中后按 id 回 Chroma 取原文。索引内容
+# 一变版本号就变，不需要 TTL。
+RETRIEVAL_CACHE_ENABLED = True
+RETRIEVAL_CACHE_MAX_ENTRIES = 4096
+
 # 摄取管道的噪声块过滤阈值（handlers/ingestion_pipeline.py:NoiseNodeFilter）。
 # 实测 campus 索引 1537 个 chunk 里 42 个（2.7%）纯空白、38 个（2.5%）内容只剩
 # "扫描全能王 创建" 这类 OCR 软件水印、62 个（4.0%）不足 30 字的碎片（比如
@@ -114,6 +169,51 @@ RERANKER_MODEL = "BAAI/bge-reranker-v2-m3"
 # 单元（差不多是一句短话的长度），可通过 MIN_CHUNK_LENGTH 按语料实际情况调整。
 MIN_CHUNK_LENGTH = 30
 
+# 进程级嵌入缓存（utils/embedding_cache.py）：全局嵌入模型外面包一层有界
+# LRU，同一个问题在一次请求里不再被 qa_cache 查找、dense 检索、qa_cache
+# 写入各嵌入一遍。预算按 MB 计（1024 维 float32 一条 4KB，64MB 约一万六千条），
+# 只缓存单条嵌入，摄取时的批量嵌入透传不占预算。
+EMBEDDING_CACHE_ENABLED = True
+EMBEDDING_CACHE_MAX_MB = 64
+
+# 查询嵌入微批（utils/embedding_batcher.py）：并发请求的问题在专用工作线程里
+# 攒成一批、一次前向。拿到第一个问题后最多再等 EMBEDDING_BATCH_WAIT_MS 毫秒，
+# 一批最多 EMBEDDING_BATCH_MAX_SIZE 条。跟重排服务（RERANK_BATCH_WAIT_MS）同理，
+# 没有并发时只多付一个等待窗口。
+EMBEDDING_BATCH_ENABLED = True
+EMBEDDING_BATCH_MAX_SIZE = 32
+EMBEDDING_BATCH_WAIT_MS = 5.0
+
+# 启动预热（handlers/warmup.py）：lifespan 启动完成后在后台把 bge-m3 首次前向、
+# jieba 词典、cross-encoder、各索引的混合检索 retriever 预先跑一遍，全部跑完
+# /health/ready 才返回 200。负载均衡拿它做就绪探针，冷实例不接流量。
+# WARMUP_PHASES 是逗号分隔的预热项，可选 embedding / jieba / reranker / retrievers。
+WARMUP_ENABLED = True
+WARMUP_PHASES = ["embedding", "jieba", "reranker", "retrievers"]
+
+# bge-m3 / bge-reranker 的推理后端（utils/model_backend.py）：torch（fp32，默认）/
+# torch-int8 / onnx / onnx-int8。int8 和 ONNX 只对 CPU 部署有意义，CUDA 上自动用
+# torch。切换前先跑 evals/bench_model_backend.py 确认 golden 集上准确率不掉。
+# onnx-int8 第一次启动时把量化后的模型导出到 MODEL_EXPORT_DIR，之后直接加载。
+EMBEDDING_BACKEND = "torch"
+RERANKER_BACKEND = "torch"
+MODEL_EXPORT_DIR = ''
+
+# 跨 worker 共享状态（utils/shared_state.py）：会话历史、限流、索引变更通知。
+# sqlite 是同机多个 uvicorn worker 共用的 SQLite-WAL 文件 STATE_DB_PATH；
+# memory 是进程内状态，只适合单 worker；auto（默认）在 WEB_CONCURRENCY>1 时用
+# sqlite，否则 memory。其他 worker 改了索引之后，本 worker
+# 每 INDEX_EVENT_POLL_SECONDS 秒检查一次并重载（handlers/index_events.py）。
+STATE_BACKEND = "auto"
+STATE_DB_PATH = ''
+INDEX_EVENT_POLL_SECONDS = 2.0
+
+# 按分钟分桶的请求指标（utils/request_metrics.py，/manage/stats/requests）：
+# 内存里最多攒 REQUEST_METRICS_RING_MINUTES 分钟还没落库的桶，库里保留
+# REQUEST_METRICS_RETENTION_DAYS 天（0 表示不清理）。
+REQUEST_METRICS_RING_MINUTES = 60
+REQUEST_METRICS_RETENTION_DAYS = 30
+
 
 def reload_env_variables():
     load_dotenv(ENV_PATH, override=True)
@@ -123,7 +223,12 @@ def reload_env_variables():
         RERANK_ENABLED, RERANK_RECALL_K, RERANK_TOP_N, RERANK_SCORE_THRESHOLD, RERANKER_MODEL, \
         HYBRID_RETRIEVAL_ENABLED, QUERY_REWRITE_ENABLED, QUERY_REWRITE_SCORE_THRESHOLD, \
         AUTO_ROUTE_SCORE_THRESHOLD, QA_CACHE_ENABLED, QA_CACHE_COLLECTION, QA_CACHE_AUTO_THRESHOLD, \
-        QA_CACHE_CURATED_THRESHOLD, QA_CACHE_MAX_AUTO_ENTRIES, MIN_CHUNK_LENGTH
+        QA_CACHE_CURATED_THRESHOLD, QA_CACHE_MAX_AUTO_ENTRIES, MIN_CHUNK_LENGTH, \
+        EMBEDDING_CACHE_ENABLED, EMBEDDING_CACHE_MAX_MB, BM25_EXECUTOR_WORKERS, \
+        EMBEDDING_BATCH_ENABLED, EMBEDDING_BATCH_MAX_SIZE, EMBEDDING_BATCH_WAIT_MS, \
+        HYBRID_DENSE_WEIGHT, HYBRID_BM25_WEIGHT, LEXICAL_RETRIEVAL_MODE, WARMUP_ENABLED, WARMUP_PHASES, \
+        EMBEDDING_BACKEND, RERANKER_BACKEND, MODEL_EXPORT_DIR, STATE_BACKEND, STATE_DB_PATH, \
+        INDEX_EVENT_POLL_SECONDS, REQUEST_METRICS_RING_MINUTES, REQUEST_METRICS_RETENTION_DAYS
 
     openai_api_key = os.environ.get("OPENAI_API_KEY")
     openai_api_base = os.environ.get('OPENAI_API_BASE') or 'https://api.openai.com/v1'
@@ -156,17 +261,49 @@ def reload_env_variables():
     QUERY_ENDPOINT_TOP_K = int(os.environ.get('QUERY_ENDPOINT_TOP_K', '2'))
     MULTI_INDEX_FALLBACK_TOP_K = int(os.environ.get('MULTI_INDEX_FALLBACK_TOP_K', '3'))
 
-    global RERANK_ENABLED, RERANK_RECALL_K, RERANK_TOP_N, RERANK_SCORE_THRESHOLD, RERANKER_MODEL
+    global INDEX_ROUTING_MODE, INDEX_ROUTE_MARGIN, INDEX_ROUTE_MAX_FANOUT, INDEX_ROUTE_CENTROID_WEIGHT, \
+        INDEX_ROUTE_CENTROID_SAMPLE, INDEX_FANOUT_TIMEOUT_S
+    INDEX_ROUTING_MODE = os.environ.get('INDEX_ROUTING_MODE', 'embedding').strip().lower()
+    INDEX_ROUTE_MARGIN = float(os.environ.get('INDEX_ROUTE_MARGIN', '0.05'))
+    INDEX_ROUTE_MAX_FANOUT = int(os.environ.get('INDEX_ROUTE_MAX_FANOUT', '3'))
+    INDEX_ROUTE_CENTROID_WEIGHT = float(os.environ.get('INDEX_ROUTE_CENTROID_WEIGHT', '0.3'))
+    INDEX_ROUTE_CENTROID_SAMPLE = int(os.environ.get('INDEX_ROUTE_CENTROID_SAMPLE', '512'))
+    INDEX_FANOUT_TIMEOUT_S = float(os.environ.get('INDEX_FANOUT_TIMEOUT_S', '5'))
+
+    global RERANK_ENABLED, RERANK_RECALL_K, RERANK_TOP_N, RERANK_SCORE_THRESHOLD, RERANKER_MODEL, \
+        RERANK_WORKERS, RERANK_MAX_BATCH_PAIRS, RERANK_BATCH_WAIT_MS, RERANK_CACHE_ENABLED, \
+        RERANK_CACHE_MAX_ENTRIES, RERANK_SKIP_MODE, RERANK_SKIP_DENSE_MIN, RERANK_SKIP_DENSE_MARGIN, \
+        RETRIEVAL_CACHE_ENABLED, RETRIEVAL_CACHE_MAX_ENTRIES
     RERANK_ENABLED = os.environ.get('RERANK_ENABLED', 'True').lower() in ('true', '1', 't')
     RERANK_RECALL_K = int(os.environ.get('RERANK_RECALL_K', '20'))
     RERANK_TOP_N = int(os.environ.get('RERANK_TOP_N', '5'))
     RERANK_SCORE_THRESHOLD = float(os.environ.get('RERANK_SCORE_THRESHOLD', '0.75'))
     RERANKER_MODEL = os.environ.get('RERANKER_MODEL', 'BAAI/bge-reranker-v2-m3')
+    RERANK_SKIP_MODE = os.environ.get('RERANK_SKIP_MODE', 'score').strip().lower()
+    RERANK_SKIP_DENSE_MIN = float(os.environ.get('RERANK_SKIP_DENSE_MIN', '0.75'))
+    RERANK_SKIP_DENSE_MARGIN = float(os.environ.get('RERANK_SKIP_DENSE_MARGIN', '0.05'))
+    # 重排服务在首次使用时按当时的值创建，之后改这三项要重启进程才生效。
+    RERANK_WORKERS = int(os.environ.get('RERANK_WORKERS', '1'))
+    RERANK_MAX_BATCH_PAIRS = int(os.environ.get('RERANK_MAX_BATCH_PAIRS', '64'))
+    RERANK_BATCH_WAIT_MS = float(os.environ.get('RERANK_BATCH_WAIT_MS', '2'))
+    RERANK_CACHE_ENABLED = os.environ.get('RERANK_CACHE_ENABLED', 'True').lower() in ('true', '1', 't')
+    RERANK_CACHE_MAX_ENTRIES = int(os.environ.get('RERANK_CACHE_MAX_ENTRIES', '20000'))
+    # 开关每次检索时读，可热更新；容量在缓存首次创建时读，改了要重启进程。
+    RETRIEVAL_CACHE_ENABLED = os.environ.get('RETRIEVAL_CACHE_ENABLED', 'True').lower() in ('true', '1', 't')
+    RETRIEVAL_CACHE_MAX_ENTRIES = int(os.environ.get('RETRIEVAL_CACHE_MAX_ENTRIES', '4096'))
 
     # 混合检索（BM25+dense RRF 融合，见 handlers/hybrid_retriever.py）。
     # evals/run_hybrid_eval.py 在 campus-corpus 上验证过收益（20 题：
     # hit@1 75%->85%、MRR 0.852->0.896，延迟只多约 2ms），默认开启。
     HYBRID_RETRIEVAL_ENABLED = os.environ.get('HYBRID_RETRIEVAL_ENABLED', 'True').lower() in ('true', '1', 't')
+    # 线程池在首次异步检索时按当时的值创建，之后改要重启进程才生效。
+    BM25_EXECUTOR_WORKERS = int(os.environ.get('BM25_EXECUTOR_WORKERS', '4'))
+    # 融合权重在构建 retriever 时读取；改了之后已缓存的 retriever 要等索引
+    # 变化或进程重启才换成新权重。
+    HYBRID_DENSE_WEIGHT = float(os.environ.get('HYBRID_DENSE_WEIGHT', '1.0'))
+    HYBRID_BM25_WEIGHT = float(os.environ.get('HYBRID_BM25_WEIGHT', '1.0'))
+    # 稀疏头在 init_settings 加载嵌入模型时挂上，改这项要重启进程才生效。
+    LEXICAL_RETRIEVAL_MODE = os.environ.get('LEXICAL_RETRIEVAL_MODE', 'bm25').strip().lower()
 
     # 条件触发查询改写。默认开启：只在检索 top1 置信度低时付出一次 LLM 改写
     # 调用的成本，高置信度（>= 阈值）时零额外开销，不影响单轮问答主路径的
@@ -188,6 +325,37 @@ def reload_env_variables():
     # 摄取管道噪声块过滤的最小保留长度。校准依据见上方模块级常量注释。
     MIN_CHUNK_LENGTH = int(os.environ.get('MIN_CHUNK_LENGTH', '30'))
 
+    # 嵌入缓存。默认开启，说明见上方模块级常量注释。只在 init_settings 构建
+    # 全局嵌入模型时读取，热重载改这两个值要等下次进程启动才生效。
+    EMBEDDING_CACHE_ENABLED = os.environ.get('EMBEDDING_CACHE_ENABLED', 'True').lower() in ('true', '1', 't')
+    EMBEDDING_CACHE_MAX_MB = int(os.environ.get('EMBEDDING_CACHE_MAX_MB', '64'))
+
+    # 查询嵌入微批。同嵌入缓存，只在 init_settings 构建全局嵌入模型时读取。
+    EMBEDDING_BATCH_ENABLED = os.environ.get('EMBEDDING_BATCH_ENABLED', 'True').lower() in ('true', '1', 't')
+    EMBEDDING_BATCH_MAX_SIZE = int(os.environ.get('EMBEDDING_BATCH_MAX_SIZE', '32'))
+    EMBEDDING_BATCH_WAIT_MS = float(os.environ.get('EMBEDDING_BATCH_WAIT_MS', '5'))
+
+    # 启动预热。只在 lifespan 启动时读取，说明见上方模块级常量注释。
+    WARMUP_ENABLED = os.environ.get('WARMUP_ENABLED', 'True').lower() in ('true', '1', 't')
+    WARMUP_PHASES = [
+        phase.strip().lower()
+        for phase in os.environ.get('WARMUP_PHASES', 'embedding,jieba,reranker,retrievers').split(',')
+        if phase.strip()
+    ]
+
+    # 推理后端只在模型加载时读（init_settings / 第一次重排），改了要重启进程。
+    EMBEDDING_BACKEND = os.environ.get('EMBEDDING_BACKEND', 'torch').strip().lower()
+    RERANKER_BACKEND = os.environ.get('RERANKER_BACKEND', 'torch').strip().lower()
+    MODEL_EXPORT_DIR = os.path.join(PROJECT_ROOT, os.environ.get('MODEL_EXPORT_DIR', '../../data/models/'))
+
+    # 共享状态后端在 lifespan 启动时打开（init_shared_state），改了要重启进程。
+    STATE_BACKEND = os.environ.get('STATE_BACKEND', 'auto').strip().lower()
+    STATE_DB_PATH = os.path.join(PROJECT_ROOT, os.environ.get('STATE_DB_PATH', '../../data/state.db'))
+    INDEX_EVENT_POLL_SECONDS = float(os.environ.get('INDEX_EVENT_POLL_SECONDS', '2'))
+
+    REQUEST_METRICS_RING_MINUTES = max(1, int(os.environ.get('REQUEST_METRICS_RING_MINUTES', '60')))
+    REQUEST_METRICS_RETENTION_DAYS = max(0, int(os.environ.get('REQUEST_METRICS_RETENTION_DAYS', '30')))
+
     # 启动时校验必需的 env 变量
     if not openai_api_key:
         logging.warning("OPENAI_API_KEY is not set. LLM queries will fail until configured.")
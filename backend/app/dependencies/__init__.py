@@ -1,3 +1,5 @@
 from .index_dep import get_index as get_index
+from .manage import access_counter as access_counter
 from .manage import access_stats as access_stats
 from .manage import access_stats_lock as access_stats_lock
+from .manage import request_metrics as request_metrics
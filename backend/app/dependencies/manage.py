@@ -1,7 +1,10 @@
 import asyncio
 from collections import defaultdict
 
-# 存储访问信息的字典
+from utils.access_counter import AccessCounter
+from utils.request_metrics import RequestMetrics
+
+# 存储访问信息的字典：已经刷进库的合计（多 worker 时是所有 worker 的合计）
 access_stats = {
     "total_visits": 0,
     "ip_count": 0,
@@ -12,6 +15,12 @@ access_stats = {
 # 访问统计的异步锁，放在这里避免 router/manage.py 从 main.py 导入造成的循环依赖
 access_stats_lock = asyncio.Lock()
 
+# 请求中间件只往这里累加，不碰 access_stats、不拿锁；定期刷库时合并（utils/access_counter.py）
+access_counter = AccessCounter()
+
+# 按分钟分桶的请求数/错误数/耗时分布，同样由中间件累加、定期刷库（utils/request_metrics.py）
+request_metrics = RequestMetrics()
+
 
 if __name__ == '__main__':
     print(access_stats)
@@ -83,7 +83,8 @@ from llama_index.core.base.llms.types import ChatMessage
 from llama_index.core.llms import LLM
 from llama_index.core.schema import NodeWithScore, QueryBundle
 from llama_index.core.settings import Settings
-from utils.rerank import rerank_nodes
+from utils import request_timing
+from utils.rerank import arerank_nodes
 
 logger = logging.getLogger(__name__)
 
@@ -150,7 +151,8 @@ async def route_query(
 
     active_retriever = retriever if retriever is not None else _build_retriever(top_k)
     try:
-        nodes = await active_retriever.aretrieve(QueryBundle(query_str=query_str))
+        with request_timing.stage("retrieve"):
+            nodes = await active_retriever.aretrieve(QueryBundle(query_str=query_str))
     except Exception:
         # 检索失败：standard 分支反正给不出答案（QAWorkflow 的 retrieve step
         # 遇到这种情况也是降级成空 nodes 走兜底文案），不如交给 agent 试试
@@ -166,9 +168,10 @@ async def route_query(
         )
 
     # 复用生产环境已有的条件触发式 rerank，不重新实现触发条件/阈值判断。
-    # 要 rerank_nodes 而不是 ConditionalRerankPostprocessor：这里必须知道这次
+    # 要 arerank_nodes 而不是 ConditionalRerankPostprocessor：这里必须知道这次
     # 到底有没有真的重排，否则可能拿 RRF 分去比 cross-encoder 阈值，见下。
-    nodes, did_rerank = rerank_nodes(nodes, QueryBundle(query_str=query_str))
+    with request_timing.stage("rerank"):
+        nodes, did_rerank = await arerank_nodes(nodes, QueryBundle(query_str=query_str))
 
     if not did_rerank:
         # 没真的重排时 nodes[0].score 是没有区分度的 RRF 融合分（0.026~0.033），
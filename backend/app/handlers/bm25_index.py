@@ -0,0 +1,502 @@
+"""按索引持久化、增量维护的 jieba BM25 倒排索引（handlers/bm25_index.py）。
+
+## 解决什么问题
+
+原来的 ``JiebaBM25Retriever`` 在每次混合检索缓存 miss 时都要
+``ChromaVectorStore.get_nodes(None)`` 拉全量 chunk、逐条 jieba 分词、再建一次
+``bm25s`` 矩阵；而任何一次上传/删除都会把缓存整体清空——于是"上传后的第一个
+问题"固定要替全库付一次冷启动（``campus`` 1.5k chunk 已经是秒级，语料越大越
+糟）。这里把 BM25 变成一份**跟着 Chroma 增量变化的持久化索引**：
+
+- 摄取（``IngestionPipeline`` upsert）、``deleteDocById``、``deleteNodeById``、
+  ``updateNodeById`` 各自只对**变化的那几个 chunk** 增删倒排表，不再重分词
+  全库；
+- 落盘在 ``{index_save_directory}/{name}_bm25/``，跟 ``{name}_docstore.json``
+  放在一起，进程重启后直接 ``np.load(mmap_mode="r")`` 映射回来，不用 jieba
+  也不用拉 Chroma 全量；
+- 查询只返回 ``(node_id, score)``，节点原文由调用方按 id 从 Chroma 取 top-k
+  条（见 ``hybrid_retriever.JiebaBM25Retriever``），索引本身不持有原文。
+
+## 打分公式：跟 bm25s 默认（lucene 变体）逐位一致
+
+不再依赖 bm25s 的急切打分矩阵（它把 idf/文档长度在建索引时就烤进了分数，
+任何增删都得整体重建，天然不支持增量），改成存原始词频、查询时现算：
+
+    idf(t)   = ln(1 + (N - df + 0.5) / (df + 0.5))
+    score(d) = Σ_t idf(t) * tf / (tf + k1 * (1 - b + b * |d| / avgdl))
+
+k1=1.5、b=0.75，与 ``bm25s.BM25()`` 默认参数相同，查询词重复出现时按次数累加
+也与 bm25s 一致——``evals/run_hybrid_eval.py`` 校准过的检索质量基线不因为换
+实现而漂移（``tests/test_bm25_index.py`` 有拿 bm25s 做对照的一致性用例）。
+
+## 存储布局：mmap 基线段 + 内存增量段（LSM 式）
+
+- **基线段**：按词项组织的 CSR 倒排表（``indptr``/``slots``/``tfs`` 三个
+  ``.npy``）+ ``doc_len.npy``，词表和 slot -> node_id 映射在 ``meta.json``。
+  启动时 mmap 映射，只读。
+- **增量段**：进程内 ``dict[term, dict[slot, tf]]``，新增 chunk 只写这里。
+- **删除**：只打墓碑（``alive[slot] = False``），倒排表不动，查询时按 alive
+  过滤掉；df/avgdl 只统计存活文档。
+- **落盘**（``save``）时把两段合并、丢掉墓碑、重新编号写出新的基线段——每次
+  上传后调用一次，写 1.5k chunk 的倒排表是毫秒级，不在查询路径上。
+
+## 与 Chroma 的一致性
+
+Chroma collection 仍然是"这个索引有哪些 chunk"的唯一可信来源（理由见
+``hybrid_retriever`` 模块 docstring）。BM25 索引是它的派生物，可能因为绕过
+``index_crud`` 的写入（比如 ``evals/ingest_corpus.py`` 直接调
+``ingest_files``）或进程在两次写之间崩溃而落后；所以 ``get_bm25_index`` 首次
+加载时比对一次存活文档数和 ``collection.count()``，对不上就从 Chroma 全量
+重建一次（幂等安全，顶多多付一次冷启动）。
+
+## 分词结果随节点存进 Chroma
+
+即便有上面的持久化，"从 Chroma 全量重建"这条路径（首次查询、倒排表跟 Chroma
+对不上、落盘文件损坏）原来仍要对每个 chunk 跑一遍 jieba——而且 jieba 词典
+（约 1 秒）就是在这时第一次加载的。现在摄取管道里的 ``JiebaTokenizeTransform``
+（``handlers/ingestion_pipeline.py``）在写 Chroma 之前就把分词结果存进节点
+metadata 的 ``TOKENS_METADATA_KEY``，``node_tokens`` 有存的就直接用、没有
+（这个改动之前摄取的老 chunk、``/insertdoc`` 直接插入的文本）才现分词。
+于是重建只剩"读 metadata + 建表"，整个进程生命周期里 jieba 词典只在第一个
+BM25 查询给问题分词时才加载，启动和重建都不碰它。
+"""
+from __future__ import annotations
+
+import glob
+import json
+import logging
+import math
+import os
+import shutil
+import tempfile
+import threading
+from collections import Counter
+from collections.abc import Iterable
+from typing import Literal
+
+import configs.load_env as load_env
+import jieba
+import numpy as np
+from llama_index.core.schema import BaseNode
+
+logger = logging.getLogger(__name__)
+
+_K1 = 1.5
+_B = 0.75
+_FORMAT_VERSION = 1
+
+
+# 摄取时存进节点 metadata（也就进了 Chroma）的分词结果，空格拼接成一个字符串
+# （Chroma 的 metadata 值只能是标量）。jieba 会把空白单独切成 token、
+# jieba_tokenize 再把它们丢掉，所以留下的词里不会有空白，按空白拆回去是无损的。
+TOKENS_METADATA_KEY = "bm25_tokens"
+
+
+def jieba_tokenize(text: str) -> list[str]:
+    return [tok for tok in jieba.lcut(text) if tok.strip()]
+
+
+def dumps_tokens(tokens: list[str]) -> str:
+    return " ".join(tokens)
+
+
+def node_tokens(node: BaseNode) -> list[str]:
+    """节点的 BM25 词项：摄取时存过分词结果就直接用，否则现跑 jieba。"""
+    stored = (node.metadata or {}).get(TOKENS_METADATA_KEY)
+    if isinstance(stored, str):
+        return stored.split()
+    return jieba_tokenize(node.get_content())
+
+
+class BM25Index:
+    """一个索引（collection）的 BM25 倒排表，线程安全。
+
+    ``slot`` 是文档在本索引内部的稠密编号（数组下标），删除只打墓碑、不回收，
+    ``save`` 压实时才重新编号。对外只暴露 node_id，slot 是实现细节。
+
+    倒排表里每个 posting 的值（这里是词频）的类型由 ``_WEIGHT_DTYPE`` 决定，
+    ``handlers.sparse_index.SparseIndex`` 复用同一套存储、改存 float 权重。
+    """
+
+    _WEIGHT_DTYPE = np.int32
+
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._node_ids: list[str] = []
+        self._ref_doc_ids: list[str] = []
+        self._slot_of: dict[str, int] = {}
+        self._slots_by_ref: dict[str, set[int]] = {}
+        self._doc_len: list[int] = []
+        self._alive: list[bool] = []
+        self._live_count = 0
+        self._total_len = 0
+        # 基线段（可能是 np.memmap）
+        self._base_vocab: dict[str, int] = {}
+        self._base_indptr = np.zeros(1, dtype=np.int64)
+        self._base_slots = np.zeros(0, dtype=np.int32)
+        self._base_tfs = np.zeros(0, dtype=self._WEIGHT_DTYPE)
+        # 增量段
+        self._delta: dict[str, dict[int, int | float]] = {}
+        # search 用的 numpy 视图，增删后失效、下次查询时重建
+        self._arrays_cache: tuple[np.ndarray, np.ndarray] | None = None
+
+    def __len__(self) -> int:
+        return self._live_count
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self._slot_of
+
+    def ref_doc_id_of(self, node_id: str) -> str | None:
+        slot = self._slot_of.get(node_id)
+        if slot is None:
+            return None
+        return self._ref_doc_ids[slot] or None
+
+    # ------------------------------------------------------------------ 增删
+
+    def add(self, node_id: str, tokens: list[str], ref_doc_id: str | None = None) -> None:
+        """加入一个 chunk；同 node_id 已存在时先删后加（等价于更新）。"""
+        with self._lock:
+            self._remove_locked(node_id)
+            slot = len(self._node_ids)
+            self._node_ids.append(node_id)
+            self._ref_doc_ids.append(ref_doc_id or "")
+            self._slot_of[node_id] = slot
+            if ref_doc_id:
+                self._slots_by_ref.setdefault(ref_doc_id, set()).add(slot)
+            self._doc_len.append(len(tokens))
+            self._alive.append(True)
+            self._live_count += 1
+            self._total_len += len(tokens)
+            for term, tf in Counter(tokens).items():
+                self._delta.setdefault(term, {})[slot] = tf
+            self._arrays_cache = None
+
+    def add_nodes(self, nodes: Iterable[BaseNode]) -> None:
+        for node in nodes:
+            self.add(node.node_id, node_tokens(node), node.ref_doc_id)
+
+    def remove(self, node_id: str) -> bool:
+        with self._lock:
+            return self._remove_locked(node_id)
+
+    def remove_ref_doc(self, ref_doc_id: str) -> int:
+        """删除某个源文档切出来的全部 chunk，返回删掉的个数。"""
+        with self._lock:
+            slots = list(self._slots_by_ref.get(ref_doc_id, ()))
+            for slot in slots:
+                self._remove_locked(self._node_ids[slot])
+            return len(slots)
+
+    def _remove_locked(self, node_id: str) -> bool:
+        slot = self._slot_of.pop(node_id, None)
+        if slot is None:
+            return False
+        self._alive[slot] = False
+        self._live_count -= 1
+        self._total_len -= self._doc_len[slot]
+        ref_doc_id = self._ref_doc_ids[slot]
+        if ref_doc_id:
+            ref_slots = self._slots_by_ref.get(ref_doc_id)
+            if ref_slots is not None:
+                ref_slots.discard(slot)
+                if not ref_slots:
+                    del self._slots_by_ref[ref_doc_id]
+        self._arrays_cache = None
+        return True
+
+    # ------------------------------------------------------------------ 查询
+
+    def _arrays(self) -> tuple[np.ndarray, np.ndarray]:
+        if self._arrays_cache is None:
+            self._arrays_cache = (
+                np.asarray(self._alive, dtype=bool),
+                np.asarray(self._doc_len, dtype=np.float32),
+            )
+        return self._arrays_cache
+
+    def _postings(self, term: str) -> tuple[np.ndarray, np.ndarray] | None:
+        parts_slots: list[np.ndarray] = []
+        parts_tfs: list[np.ndarray] = []
+        term_id = self._base_vocab.get(term)
+        if term_id is not None:
+            start, end = int(self._base_indptr[term_id]), int(self._base_indptr[term_id + 1])
+            parts_slots.append(np.asarray(self._base_slots[start:end]))
+            parts_tfs.append(np.asarray(self._base_tfs[start:end]))
+        delta = self._delta.get(term)
+        if delta:
+            parts_slots.append(np.fromiter(delta.keys(), dtype=np.int32, count=len(delta)))
+            parts_tfs.append(np.fromiter(delta.values(), dtype=self._WEIGHT_DTYPE, count=len(delta)))
+        if not parts_slots:
+            return None
+        if len(parts_slots) == 1:
+            return parts_slots[0], parts_tfs[0]
+        return np.concatenate(parts_slots), np.concatenate(parts_tfs)
+
+    def search(self, query_tokens: list[str], k: int) -> list[tuple[str, float]]:
+        """返回按 BM25 分数降序的 ``(node_id, score)``，只含分数 > 0 的文档。"""
+        if k <= 0 or not query_tokens:
+            return []
+        with self._lock:
+            if self._live_count == 0:
+                return []
+            alive, doc_len = self._arrays()
+            n_docs = self._live_count
+            avgdl = self._total_len / n_docs if self._total_len else 1.0
+            scores = np.zeros(len(self._node_ids), dtype=np.float32)
+            for term in query_tokens:
+                postings = self._postings(term)
+                if postings is None:
+                    continue
+                slots, tfs = postings
+                mask = alive[slots]
+                slots, tfs = slots[mask], tfs[mask].astype(np.float32)
+                df = len(slots)
+                if df == 0:
+                    continue
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                norm = _K1 * ((1 - _B) + _B * doc_len[slots] / avgdl)
+                np.add.at(scores, slots, idf * tfs / (tfs + norm))
+            candidates = np.flatnonzero(scores > 0)
+            if len(candidates) > k:
+                top = np.argpartition(-scores[candidates], k - 1)[:k]
+                candidates = candidates[top]
+            order = candidates[np.argsort(-scores[candidates], kind="stable")]
+            return [(self._node_ids[slot], float(scores[slot])) for slot in order]
+
+    # ------------------------------------------------------------------ 持久化
+
+    def _compacted(self) -> tuple[list[str], list[str], np.ndarray, list[str], np.ndarray, np.ndarray, np.ndarray]:
+        """合并基线段 + 增量段、丢掉墓碑、重新编号，返回可直接写盘的数组。"""
+        live_slots = [slot for slot, ok in enumerate(self._alive) if ok]
+        remap = np.full(len(self._node_ids), -1, dtype=np.int64)
+        remap[live_slots] = np.arange(len(live_slots))
+        node_ids = [self._node_ids[s] for s in live_slots]
+        ref_doc_ids = [self._ref_doc_ids[s] for s in live_slots]
+        doc_len = np.asarray([self._doc_len[s] for s in live_slots], dtype=np.int32)
+
+        vocab: list[str] = []
+        indptr = [0]
+        slot_parts: list[np.ndarray] = []
+        tf_parts: list[np.ndarray] = []
+        for term in sorted(set(self._base_vocab) | set(self._delta)):
+            postings = self._postings(term)
+            if postings is None:
+                continue
+            slots, tfs = postings
+            new_slots = remap[slots]
+            keep = new_slots >= 0
+            if not keep.any():
+                continue
+            new_slots, tfs = new_slots[keep], tfs[keep]
+            order = np.argsort(new_slots, kind="stable")
+            vocab.append(term)
+            slot_parts.append(new_slots[order].astype(np.int32))
+            tf_parts.append(tfs[order].astype(self._WEIGHT_DTYPE))
+            indptr.append(indptr[-1] + len(order))
+        slots_arr = np.concatenate(slot_parts) if slot_parts else np.zeros(0, dtype=np.int32)
+        tfs_arr = np.concatenate(tf_parts) if tf_parts else np.zeros(0, dtype=self._WEIGHT_DTYPE)
+        return node_ids, ref_doc_ids, doc_len, vocab, np.asarray(indptr, dtype=np.int64), slots_arr, tfs_arr
+
+    def save(self, path: str) -> None:
+        """压实后原子地写到 ``path`` 目录（先写临时目录再整体替换）。
+
+        临时目录用 ``mkdtemp`` 在同级目录下取唯一名字：多个 worker 同时落盘同一个
+        索引时，固定的 ``{path}.tmp`` 会让它们互相 rmtree 掉对方写了一半的文件。
+        """
+        with self._lock:
+            node_ids, ref_doc_ids, doc_len, vocab, indptr, slots, tfs = self._compacted()
+            parent, name = os.path.split(os.path.normpath(path))
+            tmp_path = tempfile.mkdtemp(prefix=f"{name}.tmp.", dir=parent or None)
+            try:
+                np.save(os.path.join(tmp_path, "indptr.npy"), indptr)
+                np.save(os.path.join(tmp_path, "slots.npy"), slots)
+                np.save(os.path.join(tmp_path, "tfs.npy"), tfs)
+                np.save(os.path.join(tmp_path, "doc_len.npy"), doc_len)
+                with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+                    json.dump(
+                        {"version": _FORMAT_VERSION, "vocab": vocab, "node_ids": node_ids, "ref_doc_ids": ref_doc_ids},
+                        f,
+                        ensure_ascii=False,
+                    )
+                # 换下来的旧目录也用跟临时目录配对的唯一名字，理由同上。
+                old_path = f"{tmp_path}.old"
+                if os.path.exists(path):
+                    os.replace(path, old_path)
+                os.replace(tmp_path, path)
+            finally:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            # 旧目录里的文件可能仍被本进程 mmap 着（Windows 上删不掉），删不掉
+            # 就留给下一次 save 清理（包括以前各次留下的），不影响正确性。
+            for stale in [old_path, *glob.glob(os.path.join(parent, glob.escape(name) + ".tmp.*.old"))]:
+                shutil.rmtree(stale, ignore_errors=True)
+
+            # 写完后内存态切换成刚压实的这份，墓碑和增量段一并清掉。
+            self._load_arrays(node_ids, ref_doc_ids, doc_len, vocab, indptr, slots, tfs)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> BM25Index:
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != _FORMAT_VERSION:
+            raise ValueError(f"unsupported bm25 index format version: {meta.get('version')!r}")
+        mmap_mode: Literal["r"] | None = "r" if mmap else None
+        index = cls()
+        index._load_arrays(
+            meta["node_ids"],
+            meta["ref_doc_ids"],
+            np.load(os.path.join(path, "doc_len.npy")),
+            meta["vocab"],
+            np.load(os.path.join(path, "indptr.npy"), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, "slots.npy"), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, "tfs.npy"), mmap_mode=mmap_mode),
+        )
+        return index
+
+    def _load_arrays(self, node_ids, ref_doc_ids, doc_len, vocab, indptr, slots, tfs) -> None:
+        self._node_ids = list(node_ids)
+        self._ref_doc_ids = list(ref_doc_ids)
+        self._slot_of = {node_id: slot for slot, node_id in enumerate(self._node_ids)}
+        self._slots_by_ref = {}
+        for slot, ref_doc_id in enumerate(self._ref_doc_ids):
+            if ref_doc_id:
+                self._slots_by_ref.setdefault(ref_doc_id, set()).add(slot)
+        self._doc_len = [int(n) for n in doc_len]
+        self._alive = [True] * len(self._node_ids)
+        self._live_count = len(self._node_ids)
+        self._total_len = sum(self._doc_len)
+        self._base_vocab = {term: i for i, term in enumerate(vocab)}
+        self._base_indptr = indptr
+        self._base_slots = slots
+        self._base_tfs = tfs
+        self._delta = {}
+        self._arrays_cache = None
+
+
+# ---------------------------------------------------------------------------
+# 按索引名的进程级注册表 + 跟 Chroma 写路径对接的增量钩子
+# ---------------------------------------------------------------------------
+
+_registry: dict[str, BM25Index] = {}
+_registry_lock = threading.Lock()
+
+
+def _bm25_persist_dir(index_name: str) -> str:
+    # 跟 handlers/vector_store._docstore_persist_path 同一目录、同一命名习惯，
+    # load_env.X 属性访问的理由也相同（热重载后能读到新值）。
+    return os.path.join(load_env.index_save_directory, f"{index_name}_bm25")
+
+
+def _load_persisted(index_name: str) -> BM25Index | None:
+    """注册表里有就用，没有就尝试从磁盘 mmap 加载；都没有返回 None。"""
+    with _registry_lock:
+        index = _registry.get(index_name)
+        if index is not None:
+            return index
+        path = _bm25_persist_dir(index_name)
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return None
+        try:
+            index = BM25Index.load(path)
+        except Exception:
+            # 文件损坏/格式版本不对：当作没有持久化索引，调用方会从 Chroma 重建。
+            logger.warning("BM25 持久化索引 %s 加载失败，将从 Chroma 重建。", path, exc_info=True)
+            return None
+        _registry[index_name] = index
+        return index
+
+
+def _persist(index_name: str, index: BM25Index) -> None:
+    try:
+        os.makedirs(load_env.index_save_directory, exist_ok=True)
+        index.save(_bm25_persist_dir(index_name))
+    except Exception:
+        # 落盘失败不影响本进程内的查询（内存态已经是新的），只是下次启动会因为
+        # 文档数对不上而从 Chroma 重建一次。
+        logger.warning("BM25 索引 %s 落盘失败（best-effort）。", index_name, exc_info=True)
+
+
+def rebuild_bm25_index(index_name: str, vector_store) -> BM25Index:
+    """从 Chroma 全量重建，落盘并登记。摄取时存过分词结果的 chunk 不再跑 jieba。"""
+    index = BM25Index()
+    index.add_nodes(vector_store.get_nodes(None))
+    _persist(index_name, index)
+    with _registry_lock:
+        _registry[index_name] = index
+    logger.info("BM25 索引 %s 从 Chroma 全量重建：%d 个 chunk。", index_name, len(index))
+    return index
+
+
+def get_bm25_index(index_name: str, vector_store) -> BM25Index:
+    """取某个索引的 BM25 倒排表：注册表 -> 磁盘 mmap -> Chroma 全量重建。
+
+    从磁盘加载后比对一次存活文档数和 ``collection.count()``，对不上说明有写入
+    绕过了增量钩子，直接重建，见模块 docstring"与 Chroma 的一致性"一节。
+    """
+    with _registry_lock:
+        index = _registry.get(index_name)
+    if index is not None:
+        return index
+    index = _load_persisted(index_name)
+    if index is not None:
+        try:
+            expected = vector_store.client.count()
+        except Exception:
+            expected = len(index)
+        if expected == len(index):
+            return index
+        logger.info(
+            "BM25 索引 %s 与 Chroma 不一致（%d vs %d），重建。", index_name, len(index), expected
+        )
+    return rebuild_bm25_index(index_name, vector_store)
+
+
+def apply_upserts(index_name: str, nodes: list[BaseNode]) -> None:
+    """``IngestionPipeline.run`` 写入 Chroma 之后调用：先按 ref_doc_id 删掉旧
+    chunk（UPSERTS 策略对"同 doc_id 内容变了"的文档会整体替换），再加入新 chunk。
+
+    该索引还没有 BM25 索引（从没被查询过、也没落过盘）时什么都不做——第一次
+    查询时会从 Chroma 全量构建，那时这批 chunk 自然已经在里面了。
+    """
+    if not nodes:
+        return
+    index = _load_persisted(index_name)
+    if index is None:
+        return
+    for ref_doc_id in {n.ref_doc_id for n in nodes if n.ref_doc_id}:
+        index.remove_ref_doc(ref_doc_id)
+    index.add_nodes(nodes)
+    _persist(index_name, index)
+
+
+def remove_nodes(index_name: str, node_ids: list[str]) -> None:
+    index = _load_persisted(index_name)
+    if index is None or not node_ids:
+        return
+    for node_id in node_ids:
+        index.remove(node_id)
+    _persist(index_name, index)
+
+
+def update_node_text(index_name: str, node_id: str, text: str, tokens: list[str] | None = None) -> None:
+    """节点文本被改写后调用；调用方已经分过词时传 ``tokens``，省一次 jieba。"""
+    index = _load_persisted(index_name)
+    if index is None:
+        return
+    index.add(node_id, tokens if tokens is not None else jieba_tokenize(text), index.ref_doc_id_of(node_id))
+    _persist(index_name, index)
+
+
+def drop_bm25_index(index_name: str) -> None:
+    """删除索引时调用：清掉注册表和磁盘文件（同 docstore 文件的清理理由）。"""
+    with _registry_lock:
+        _registry.pop(index_name, None)
+    path = _bm25_persist_dir(index_name)
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def clear_bm25_registry() -> None:
+    """只清进程内注册表，不动磁盘（测试隔离用）。"""
+    with _registry_lock:
+        _registry.clear()
@@ -9,8 +9,10 @@ deprecation warning，然后被丢弃，分词仍然走内置正则
 Unicode 模式下匹配所有 CJK 字符，中间没有空格就没有 ``\\b``），一整句中文会
 被当成一个 token，BM25 的词频匹配直接失效。
 
-这里改用 ``bm25s``（前者的底层依赖）+ jieba 自己实现一个轻量 retriever，
-分词、建索引、查询全程用 jieba，不依赖那个失效的钩子。
+这里改用 jieba 自己实现一个轻量 retriever，分词、建索引、查询全程用 jieba，
+不依赖那个失效的钩子。打分最早直接用 ``bm25s``（前者的底层依赖），现在倒排表
+和打分挪到了 ``handlers/bm25_index.py``（公式与 bm25s 默认的 lucene 变体一致，
+换成自己维护是为了支持增量增删和落盘，见下文）。
 
 ## 节点来源：Chroma 而不是任何 docstore
 
@@ -21,74 +23,468 @@ Chroma collection 本身才是"这个索引当前实际有哪些 chunk"的唯一
 所以 BM25 语料用 ``ChromaVectorStore.get_nodes(None)``（这是该 vector store
 类已有的公开方法，内部走 ``metadata_dict_to_node`` 正确还原原文，不是我们
 自己拼 Chroma 的 ``collection.get()`` 再重新发明一遍）现取现建。
+
+## 倒排表持久化、增量维护
+
+上面说的"现取现建"现在只在该索引**第一次**需要 BM25、或者磁盘上的倒排表跟
+Chroma 对不上时才发生：倒排表本身挪到了 ``handlers/bm25_index.py``，按索引
+落盘、启动时 mmap 加载，上传/删除走增量钩子只改变化的 chunk。这里的
+retriever 只持有倒排表的引用，命中后按 node_id 从 Chroma 取回 top-k 条原文
+——混合检索缓存被清掉之后重建 retriever 不再需要重新分词全库。
+
+## 融合前的置信度信号
+
+RRF 融合分只跟排名有关，top1 恒落在 0.026~0.033，拿它判断"检索够不够有把握"
+没有区分度（``utils/rerank.py`` 的"已知问题"一节）。``HybridFusionRetriever``
+在融合**之前**从两路原始结果里取一份 ``FusionSignal``（dense 腿的余弦
+top1 和 top1-top2 间隔、两路 top1 是否是同一个节点），挂在融合后的每个
+``FusedNodeWithScore`` 上；``score`` 本身仍是 RRF 分，下游语义不变。每个节点
+另外带着自己在两路里的原始分（``dense_score``/``bm25_score``）。
+
+dense 腿从 ``ChromaVectorStore`` 拿到的 score 不是余弦：索引 collection 建在
+Chroma 默认的 l2 空间里，score 是 ``exp(-欧氏距离²)``。``RERANK_SKIP_DENSE_MIN``
+这类阈值按余弦标定，所以 dense 腿的分数在融合前先按 collection 的距离空间
+换算回余弦（``handlers.vector_store.chroma_score_to_cosine``），``dense_score``
+和 ``FusionSignal`` 里都是换算后的值；名次不受影响（换算是单调的）。
+
+## 融合：按 node_id 的向量化 RRF
+
+融合不再借道 ``QueryFusionRetriever``：两路各自按分数排好名次，按 node_id
+合并成一张名次表，``fuse_legs`` 用 numpy 一次算出
+``Σ w / (60 + rank)`` 再稳定排序截断。两路权重由 ``HYBRID_DENSE_WEIGHT`` /
+``HYBRID_BM25_WEIGHT`` 配置，默认等权，结果与原来的 RRF 完全一致。
+
+## 异步检索：BM25 腿不在事件循环上跑
+
+``HybridFusionRetriever._aretrieve`` 用 ``asyncio.gather`` 同时 await 两路，但
+``BaseRetriever`` 默认的 ``_aretrieve`` 就是直接调同步 ``_retrieve``——jieba
+分词 + 倒排打分 + 按 id 回 Chroma 取原文全在事件循环线程上同步执行，这几十
+毫秒里所有并发的流式回答都卡住，而且 dense 腿要等它跑完才开始，总耗时是两路
+之和。``JiebaBM25Retriever._aretrieve`` 把整段同步检索丢进一个有界线程池
+（``BM25_EXECUTOR_WORKERS``，不用默认线程池：那里还跑着 to_thread 的其他
+阻塞调用，BM25 的突发不该挤占它们），跟 dense 腿的 Chroma 查询真正并行，
+总耗时变成 max(dense, bm25)。dense 腿同理：``ChromaVectorStore`` 没有实现
+``aquery``，llama_index 的默认实现直接调同步 ``query``，HNSW 查询同样会卡住
+事件循环，所以整条 dense 检索（嵌入问题 + Chroma 查询）走 ``asyncio.to_thread``。
+
+每次检索两路各自的墙钟耗时记在 ``FusedNodeWithScore.leg_ms`` 上，并累计进
+``hybrid_leg_stats()``（``/manage/stats`` 的 ``retrieval`` 字段）。
+
+## 词项腿的另一种实现：bge-m3 稀疏权重
+
+``LEXICAL_RETRIEVAL_MODE=sparse`` 时词项那一路换成 ``SparseLexicalRetriever``：
+倒排表是 ``handlers/sparse_index.py`` 的稀疏权重表，查询权重来自 dense 腿嵌入
+问题的同一次前向，热路径上没有 jieba。融合、权重配置、``bm25_score`` 字段名
+都不变——"bm25"在这里指的是词项那一路，而不一定是 BM25 公式。
 """
 from __future__ import annotations
 
+import asyncio
+import logging
 import threading
+import time
 from collections import OrderedDict
+from collections.abc import Awaitable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, cast
 
 # load_env.X 属性访问而不是 from...import：reload_env_variables() 热重载改的
 # 是 configs.load_env 模块内的变量，from...import 在导入时就把值拷贝进了当前
 # 命名空间，之后源模块改了值这里感知不到（同样的坑见
 # handlers/graph_builder.py 顶部注释）。
 import configs.load_env as load_env
-import jieba
+import numpy as np
+from handlers.bm25_index import BM25Index, get_bm25_index, jieba_tokenize
+from handlers.index_events import publish_index_change
+from handlers.retrieval_cache import invalidate_retrieval_cache, with_result_cache
+from handlers.sparse_index import SparseIndex, get_sparse_index
+from handlers.vector_store import (
+    bump_collection_generation,
+    chroma_score_to_cosine,
+    collection_space,
+    get_collection_generation,
+    is_chroma_store,
+)
 from llama_index.core import VectorStoreIndex
-from llama_index.core.retrievers import BaseRetriever, QueryFusionRetriever
-from llama_index.core.retrievers.fusion_retriever import FUSION_MODES
+from llama_index.core.retrievers import BaseRetriever
 from llama_index.core.schema import BaseNode, NodeWithScore, QueryBundle
-from llama_index.vector_stores.chroma import ChromaVectorStore
+from utils.sparse_embedding import get_sparse_encoder
+
+if TYPE_CHECKING:
+    from llama_index.vector_stores.chroma import ChromaVectorStore
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class FusionSignal:
+    """一次混合检索融合前的置信度信号（整次查询一份，不是逐节点的）。
+
+    - ``dense_top1``：dense 腿 top1 的余弦相似度（由 Chroma 的距离换算，见模块
+      docstring"融合前的置信度信号"）。
+    - ``dense_margin``：dense 腿 top1 与 top2 的余弦差；只召回到一条时等于
+      ``dense_top1``。
+    - ``legs_agree``：dense 与 BM25 两路的 top1 是同一个节点——这时它的 RRF
+      分必然是全场最高，也就是融合后的 top1。
+    """
+
+    dense_top1: float
+    dense_margin: float
+    legs_agree: bool
+
+
+class FusedNodeWithScore(NodeWithScore):
+    """``HybridFusionRetriever`` 的输出节点：``score`` 是 RRF 分；
+    ``dense_score``/``bm25_score`` 是该节点在两路里的分数（dense 是换算后的余弦，
+    BM25 是原始分；没被那一路召回时为 None）；``signal`` 是这次查询融合前的置信度信号，给 ``utils.rerank``
+    判断能不能跳过重排；``leg_ms`` 是这次查询两路各自的耗时
+    （``{"dense": ..., "bm25": ...}``）。"""
+
+    dense_score: float | None = None
+    bm25_score: float | None = None
+    signal: FusionSignal | None = None
+    leg_ms: dict[str, float] | None = None
+
+
+# BM25 腿专用线程池，首次异步检索时按 BM25_EXECUTOR_WORKERS 创建。
+_bm25_executor: ThreadPoolExecutor | None = None
+_bm25_executor_lock = threading.Lock()
+
+
+def _get_bm25_executor() -> ThreadPoolExecutor:
+    global _bm25_executor
+    if _bm25_executor is None:
+        with _bm25_executor_lock:
+            if _bm25_executor is None:
+                _bm25_executor = ThreadPoolExecutor(
+                    max_workers=max(1, load_env.BM25_EXECUTOR_WORKERS), thread_name_prefix="bm25"
+                )
+    return _bm25_executor
+
+
+_LEG_NAMES = ("dense", "bm25")
+
 
+class _LegStats:
+    """两路检索耗时的累计统计（进程级，``/manage/stats`` 用）。"""
 
-def jieba_tokenize(text: str) -> list[str]:
-    return [tok for tok in jieba.lcut(text) if tok.strip()]
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.queries = 0
+        self.total_ms = dict.fromkeys(_LEG_NAMES, 0.0)
+        self.max_ms = dict.fromkeys(_LEG_NAMES, 0.0)
+
+    def record(self, leg_ms: dict[str, float]) -> None:
+        with self._lock:
+            self.queries += 1
+            for leg, ms in leg_ms.items():
+                self.total_ms[leg] += ms
+                self.max_ms[leg] = max(self.max_ms[leg], ms)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reset()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            queries = self.queries or 1
+            return {
+                "queries": self.queries,
+                **{f"avg_{leg}_ms": round(self.total_ms[leg] / queries, 2) for leg in _LEG_NAMES},
+                **{f"max_{leg}_ms": round(self.max_ms[leg], 2) for leg in _LEG_NAMES},
+            }
+
+
+_leg_stats = _LegStats()
+
+
+def hybrid_leg_stats() -> dict:
+    """混合检索两路的平均/最大耗时（``/manage/stats`` 的 ``retrieval`` 字段）。"""
+    return _leg_stats.snapshot()
 
 
 class JiebaBM25Retriever(BaseRetriever):
-    """用 jieba 分词喂给 bm25s 的 BM25 检索器。
+    """jieba 分词 + BM25 打分的检索器。
 
-    检索到的 ``NodeWithScore.node`` 永远是传入的原始 node 对象（保留原文、
+    检索到的 ``NodeWithScore.node`` 永远是原始 node 对象（保留原文、
     metadata），分词只用于建索引和查询打分，不会把"分词后空格拼接的文本"
     误当成节点内容返回给上层——这是刻意避开 BM25Retriever 那条
     node_to_metadata_dict/model_dump() 还原路径可能引入的类似问题。
-    """
 
-    def __init__(self, nodes: list[BaseNode], similarity_top_k: int = 5):
-        import bm25s
+    两种构造方式：直接传 ``nodes``（在内存里现建一份倒排表，节点原文就地
+    保留，测试和小语料用）；或者 ``from_index``（共享
+    ``handlers.bm25_index`` 里持久化的倒排表，命中后按 node_id 从
+    ``vector_store`` 取原文，生产路径用）。
+    """
 
-        self._nodes = list(nodes)
-        self._similarity_top_k = max(1, min(similarity_top_k, len(self._nodes))) if self._nodes else 0
-        self._bm25 = None
-        if self._nodes:
-            corpus_tokens = [jieba_tokenize(n.get_content()) for n in self._nodes]
-            self._bm25 = bm25s.BM25()
-            self._bm25.index(corpus_tokens, show_progress=False)
+    def __init__(
+        self,
+        nodes: list[BaseNode] | None = None,
+        similarity_top_k: int = 5,
+        *,
+        bm25_index: BM25Index | None = None,
+        vector_store: ChromaVectorStore | None = None,
+    ):
+        if bm25_index is None:
+            self._nodes_by_id: dict[str, BaseNode] | None = {n.node_id: n for n in nodes or []}
+            self._bm25 = BM25Index()
+            self._bm25.add_nodes(nodes or [])
+        else:
+            self._nodes_by_id = None
+            self._bm25 = bm25_index
+        self._vector_store = vector_store
+        self._similarity_top_k = max(1, similarity_top_k)
         super().__init__()
 
+    @classmethod
+    def from_index(
+        cls, bm25_index: BM25Index, vector_store: ChromaVectorStore, similarity_top_k: int = 5
+    ) -> JiebaBM25Retriever:
+        return cls(similarity_top_k=similarity_top_k, bm25_index=bm25_index, vector_store=vector_store)
+
+    def _resolve_nodes(self, node_ids: list[str]) -> dict[str, BaseNode]:
+        if self._nodes_by_id is not None:
+            return {i: self._nodes_by_id[i] for i in node_ids if i in self._nodes_by_id}
+        # get_nodes([]) 会被 ChromaVectorStore 当成 None -> 返回全量，空列表必须在这里拦住。
+        if not node_ids or self._vector_store is None:
+            return {}
+        return {n.node_id: n for n in self._vector_store.get_nodes(node_ids)}
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        # 分词、打分、回 Chroma 取原文都是同步阻塞的，整段丢进 BM25 专用线程池。
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_bm25_executor(), self._retrieve, query_bundle)
+
     def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
-        if self._bm25 is None:
-            return []
         query_tokens = jieba_tokenize(query_bundle.query_str)
         if not query_tokens:
             return []
-        indexes, scores = self._bm25.retrieve(
-            [query_tokens], k=self._similarity_top_k, show_progress=False
-        )
+        hits = self._bm25.search(query_tokens, self._similarity_top_k)
+        nodes = self._resolve_nodes([node_id for node_id, _ in hits])
+        # Chroma 里已经不存在的 id（倒排表短暂落后于 Chroma）直接跳过。
         return [
-            NodeWithScore(node=self._nodes[int(idx)], score=float(score))
-            for idx, score in zip(indexes[0], scores[0], strict=True)
-            if score > 0
+            NodeWithScore(node=nodes[node_id], score=score)
+            for node_id, score in hits
+            if node_id in nodes
         ]
 
 
+class SparseLexicalRetriever(JiebaBM25Retriever):
+    """bge-m3 稀疏权重的词项检索器（``LEXICAL_RETRIEVAL_MODE=sparse``）。
+
+    在混合检索里顶替 ``JiebaBM25Retriever`` 的位置：倒排表换成
+    ``handlers.sparse_index.SparseIndex``，查询不分词，而是向编码器要问题的
+    稀疏权重——编码器按问题文本去重，dense 腿嵌入问题时那次前向已经把它算
+    好了（见 ``utils/sparse_embedding.py``"查询侧去重"）。取原文、异步走 BM25
+    专用线程池这些都跟父类一样。
+    """
+
+    def __init__(
+        self,
+        encoder,
+        sparse_index: SparseIndex,
+        vector_store: ChromaVectorStore | None = None,
+        similarity_top_k: int = 5,
+    ):
+        self._encoder = encoder
+        super().__init__(similarity_top_k=similarity_top_k, bm25_index=sparse_index, vector_store=vector_store)
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        query_weights = self._encoder.query_sparse(query_bundle.query_str)
+        if not query_weights:
+            return []
+        hits = self._bm25.search(query_weights, self._similarity_top_k)
+        nodes = self._resolve_nodes([node_id for node_id, _ in hits])
+        return [
+            NodeWithScore(node=nodes[node_id], score=score)
+            for node_id, score in hits
+            if node_id in nodes
+        ]
+
+
+class HybridFusionRetriever(BaseRetriever):
+    """dense + BM25 两路检索的专用融合器：按 node_id 做（可加权的）RRF。
+
+    原来是 ``QueryFusionRetriever(num_queries=1)`` 的子类。那是为"一个问题扩写
+    成多个查询、多路结果任意融合"设计的通用件，用在这里每次检索都要走一遍
+    查询扩写分支、按 ``(query_str, i)`` 组结果字典、按节点**内容 hash** 去重
+    （还得逐个算 sha256），构造时还要解析一次 ``Settings.llm``——而这里永远只有
+    一个查询、两路结果、节点天然有 id。现在直接按 id 建名次数组、用 numpy
+    一次算完融合分（``fuse_legs``），开销见 ``evals/bench_fusion.py``。
+
+    ``dense_weight``/``bm25_weight`` 是两路在 RRF 里的权重（默认都是 1，跟原来
+    等权 RRF 的分数逐位一致）。每个结果是 ``FusedNodeWithScore``：``score`` 是
+    融合分，另外带上两路各自的原始分数、这次查询的 ``FusionSignal`` 和两路耗时。
+    """
+
+    def __init__(
+        self,
+        dense_retriever: BaseRetriever,
+        bm25_retriever: BaseRetriever,
+        similarity_top_k: int,
+        *,
+        dense_weight: float = 1.0,
+        bm25_weight: float = 1.0,
+        rrf_k: float = 60.0,
+        dense_space: str | None = None,
+    ) -> None:
+        self._dense = dense_retriever
+        # dense 腿所在 collection 的距离空间；None 表示 dense 分数已经是余弦（测试桩）
+        self._dense_space = dense_space
+        self._bm25 = bm25_retriever
+        self._similarity_top_k = similarity_top_k
+        self._weights = (dense_weight, bm25_weight)
+        self._rrf_k = rrf_k
+        super().__init__()
+
+    def _fuse(self, dense: list[NodeWithScore], bm25: list[NodeWithScore], leg_ms: dict[str, float]):
+        _leg_stats.record(leg_ms)
+        if self._dense_space is not None:
+            dense = [
+                NodeWithScore(node=n.node, score=chroma_score_to_cosine(n.score, self._dense_space)) for n in dense
+            ]
+        return fuse_legs(dense, bm25, self._similarity_top_k, weights=self._weights, rrf_k=self._rrf_k, leg_ms=leg_ms)
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        started = time.perf_counter()
+        dense = self._dense.retrieve(query_bundle)
+        dense_done = time.perf_counter()
+        bm25 = self._bm25.retrieve(query_bundle)
+        leg_ms = {
+            "dense": (dense_done - started) * 1000,
+            "bm25": (time.perf_counter() - dense_done) * 1000,
+        }
+        return self._fuse(dense, bm25, leg_ms)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        started = time.perf_counter()
+        leg_ms: dict[str, float] = {}
+
+        async def timed(leg: str, retrieval: Awaitable[list[NodeWithScore]]) -> list[NodeWithScore]:
+            try:
+                return await retrieval
+            finally:
+                leg_ms[leg] = (time.perf_counter() - started) * 1000
+
+        # dense 腿的 aretrieve 最终还是在事件循环上同步调 Chroma 的 query，
+        # 所以直接把同步 retrieve 整个放进线程（嵌入走批处理器时在线程里等结果）。
+        dense, bm25 = await asyncio.gather(
+            timed("dense", asyncio.to_thread(self._dense.retrieve, query_bundle)),
+            timed("bm25", self._bm25.aretrieve(query_bundle)),
+        )
+        return self._fuse(dense, bm25, leg_ms)
+
+
+def fuse_legs(
+    dense: list[NodeWithScore],
+    bm25: list[NodeWithScore],
+    top_k: int,
+    *,
+    weights: tuple[float, float] = (1.0, 1.0),
+    rrf_k: float = 60.0,
+    leg_ms: dict[str, float] | None = None,
+) -> list[FusedNodeWithScore]:
+    """两路结果按 node_id 做加权 RRF：``score = Σ w_leg / (rrf_k + rank_leg)``。
+
+    rank 从 0 开始、按各路原始分数降序（跟 QueryFusionRetriever 一致），同分
+    时先出现的（dense 在前）排前面。同一路里重复出现的 id 按各自名次累加，
+    同样跟原实现一致。
+    """
+    signal = _fusion_signal(dense, bm25)
+    position: dict[str, int] = {}
+    first_node: list[NodeWithScore] = []
+    raw: tuple[list[float | None], list[float | None]] = ([], [])
+    fused = None
+    for leg, nodes in enumerate((dense, bm25)):
+        columns = []
+        for node in sorted(nodes, key=lambda n: n.score or 0.0, reverse=True):
+            node_id = node.node.node_id
+            column = position.get(node_id)
+            if column is None:
+                column = position[node_id] = len(first_node)
+                first_node.append(node)
+                raw[0].append(None)
+                raw[1].append(None)
+            if raw[leg][column] is None:
+                raw[leg][column] = node.score
+            columns.append(column)
+        if not columns:
+            continue
+        contribution = np.bincount(
+            np.asarray(columns),
+            weights=weights[leg] / (rrf_k + np.arange(len(columns), dtype=np.float64)),
+            minlength=len(first_node),
+        )
+        fused = contribution if fused is None else contribution + np.pad(fused, (0, len(contribution) - len(fused)))
+    if fused is None:
+        return []
+
+    order = np.argsort(-fused, kind="stable")[:top_k].tolist()
+    scores = fused.tolist()
+    return [
+        FusedNodeWithScore(
+            node=first_node[i].node,
+            score=scores[i],
+            dense_score=raw[0][i],
+            bm25_score=raw[1][i],
+            signal=signal,
+            leg_ms=leg_ms,
+        )
+        for i in order
+    ]
+
+
+def _fusion_signal(dense: list[NodeWithScore], bm25: list[NodeWithScore]) -> FusionSignal | None:
+    dense = sorted(dense, key=lambda n: n.score or 0.0, reverse=True)
+    if not dense:
+        return None
+    bm25_top = max(bm25, key=lambda n: n.score or 0.0) if bm25 else None
+    top1 = dense[0].score or 0.0
+    margin = top1 - (dense[1].score or 0.0) if len(dense) > 1 else top1
+    agree = bm25_top is not None and bm25_top.node.node_id == dense[0].node.node_id
+    return FusionSignal(dense_top1=top1, dense_margin=margin, legs_agree=agree)
+
+
 _hybrid_retriever_cache: OrderedDict[tuple[str, int], BaseRetriever] = OrderedDict()
 _HYBRID_CACHE_MAX = 64
 _hybrid_cache_lock = threading.Lock()
-
-
-def invalidate_hybrid_retriever_cache() -> None:
+# index_id -> 缓存里该索引的 retriever 是按哪个内容版本号（Chroma collection
+# metadata 里的 generation，见 handlers.vector_store.bump_collection_generation）
+# 构建的。查缓存时跟 collection 当前版本号比一次，对不上就当 miss——兜住
+# "内容变了但调用方忘了失效缓存"的情况。
+_hybrid_cache_generation: dict[str, int] = {}
+# 后台预热任务的强引用：asyncio 事件循环只对 task 持弱引用，fire-and-forget
+# 的 task 不自己留一份引用可能在跑完前就被 GC 掉。
+_prewarm_tasks: set[asyncio.Task] = set()
+
+
+def invalidate_hybrid_retriever_cache(index_id: str | None = None) -> list[int]:
+    """失效混合检索缓存，返回被清掉的 similarity_top_k 列表（供预热复用）。
+
+    传 ``index_id`` 时只清这一个索引的条目——往小的院系索引上传一个文件不该
+    连带把 ``campus`` 这种大索引的 retriever 也清掉、让它的下一个用户替它付
+    重建开销。不传时整体清空（测试隔离、删除后全量重载索引列表时用）。
+
+    同一范围内的检索结果缓存（``handlers.retrieval_cache``）一起清掉：删掉
+    索引再建同名索引时内容版本号会从 0 重新数，只靠版本号比对会让新索引
+    查到旧索引的缓存结果。
+    """
+    invalidate_retrieval_cache(index_id)
     with _hybrid_cache_lock:
-        _hybrid_retriever_cache.clear()
+        if index_id is None:
+            top_ks = [top_k for _, top_k in _hybrid_retriever_cache]
+            _hybrid_retriever_cache.clear()
+            _hybrid_cache_generation.clear()
+            return top_ks
+        keys = [key for key in _hybrid_retriever_cache if key[0] == index_id]
+        for key in keys:
+            del _hybrid_retriever_cache[key]
+        _hybrid_cache_generation.pop(index_id, None)
+        return [top_k for _, top_k in keys]
 
 
 def _hybrid_cache_evict_if_needed() -> None:
@@ -96,10 +492,64 @@ def _hybrid_cache_evict_if_needed() -> None:
         _hybrid_retriever_cache.popitem(last=False)
 
 
+def _index_generation(index: VectorStoreIndex) -> int:
+    vector_store = getattr(index, "vector_store", None)
+    if not is_chroma_store(vector_store):
+        return 0
+    return get_collection_generation(cast("ChromaVectorStore", vector_store).client)
+
+
+def refresh_index_retrievers(index: VectorStoreIndex) -> asyncio.Task | None:
+    """某个索引内容变化后调用（上传/删除文档或节点/insertdoc）：版本号加一、
+    只失效这个索引的缓存条目，并在后台把刚才还在用的那几个 top_k 的
+    retriever 重建好，下一个用户问题直接命中缓存。
+
+    只预热失效前确实被缓存过的 top_k——没被缓存过说明这个索引最近没人查，
+    没必要为它提前付构建开销。版本号写回是一次同步的 Chroma ``modify``
+    （SQLite 写），跟预热一起放进后台线程，不占事件循环。必须在事件循环里
+    调用；返回后台 task（既不用写版本号也没有需要预热的 top_k 时返回 None），
+    调用方不需要 await 它。
+    """
+    vector_store = getattr(index, "vector_store", None)
+    collection = cast("ChromaVectorStore", vector_store).client if is_chroma_store(vector_store) else None
+    # 多 worker 部署时让其他 worker 也重载（handlers/index_events.py），单 worker 是空操作。
+    publish_index_change(index.index_id, "content")
+    top_ks = invalidate_hybrid_retriever_cache(index.index_id)
+    if not load_env.HYBRID_RETRIEVAL_ENABLED:
+        top_ks = []
+    if collection is None and not top_ks:
+        return None
+    task = asyncio.create_task(asyncio.to_thread(_refresh_in_background, index, collection, sorted(set(top_ks))))
+    _prewarm_tasks.add(task)
+    task.add_done_callback(_prewarm_tasks.discard)
+    return task
+
+
+def _refresh_in_background(index: VectorStoreIndex, collection, top_ks: list[int]) -> None:
+    # 先写版本号再预热：预热出来的 retriever 记的是新版本号，不会被当成过期。
+    # 中间这段时间里按旧版本号建出来/缓存的条目，版本号一变就自然当 miss。
+    if collection is not None:
+        try:
+            bump_collection_generation(collection)
+        except Exception:
+            # 版本号只是缓存一致性的兜底，写失败不影响这一次的显式失效。
+            logger.warning("索引 %s 内容版本号更新失败（best-effort）。", index.index_id, exc_info=True)
+    _prewarm(index, top_ks)
+
+
+def _prewarm(index: VectorStoreIndex, top_ks: list[int]) -> None:
+    for top_k in top_ks:
+        try:
+            build_retriever_for_index(index, top_k)
+        except Exception:
+            # 预热失败不影响正确性：下一次真实查询会在请求路径上重新构建一次。
+            logger.warning("索引 %s top_k=%d 的混合检索器预热失败。", index.index_id, top_k, exc_info=True)
+
+
 # 每路（dense/BM25）召回宽度相对最终 top_k 的放大倍数，以及召回下限。
-# 关键原因：QueryFusionRetriever 不会替子 retriever 加宽召回——每个子
+# 关键原因：融合器不会替子 retriever 加宽召回——每个子
 # retriever 用自己构造时固定的 similarity_top_k 去召回，融合完再按
-# QueryFusionRetriever 自己的 similarity_top_k 截断。如果两路都只召回最终
+# HybridFusionRetriever 自己的 similarity_top_k 截断。如果两路都只召回最终
 # 需要的这么多条，会出现"某一路的真正相关文档因为该路排名恰好在截断线以外、
 # 根本没进入候选池"的情况——RRF 没机会看到它，等于白丢（用真实语料 smoke
 # 测试过：similarity_top_k=2 时向量侧因为分数打平截断，命中的文档被截没了，
@@ -114,26 +564,36 @@ def _build_hybrid_retriever(index: VectorStoreIndex, similarity_top_k: int) -> B
     # 只是防御性兜底）直接退化成纯向量检索，不要在判断"能不能做混合"之前就
     # 先花一次 as_retriever(recall_k) 的调用——那次调用在这个分支里注定被
     # 丢弃，没有意义。
-    vector_store = index.vector_store
-    if not isinstance(vector_store, ChromaVectorStore):
+    if not is_chroma_store(index.vector_store):
         return index.as_retriever(similarity_top_k=similarity_top_k)
-
-    nodes = vector_store.get_nodes(None)
-    if not nodes:
+    vector_store = cast("ChromaVectorStore", index.vector_store)
+
+    # 词项那一路：稀疏模式且全局嵌入模型带 bge-m3 稀疏头时用稀疏权重，
+    # 否则（默认，或稀疏头没加载成功）用 jieba BM25。两者在融合里都占"bm25"
+    # 这一路的位置，权重、bm25_score、leg_ms 的 key 都沿用这个名字。
+    encoder = get_sparse_encoder() if load_env.LEXICAL_RETRIEVAL_MODE == "sparse" else None
+    if encoder is not None:
+        lexical_index = get_sparse_index(index.index_id, vector_store, encoder)
+    else:
+        lexical_index = get_bm25_index(index.index_id, vector_store)
+    if not len(lexical_index):
         return index.as_retriever(similarity_top_k=similarity_top_k)
 
     recall_k = max(similarity_top_k * _RECALL_MULTIPLIER, _RECALL_FLOOR)
     vector_retriever = index.as_retriever(similarity_top_k=recall_k)
-    bm25_retriever = JiebaBM25Retriever(nodes=nodes, similarity_top_k=recall_k)
-
-    return QueryFusionRetriever(
-        retrievers=[vector_retriever, bm25_retriever],
-        mode=FUSION_MODES.RECIPROCAL_RANK,
-        similarity_top_k=similarity_top_k,
-        # num_queries 必须显式设成 1：QueryFusionRetriever 默认 4，会用 LLM
-        # 生成 3 个额外查询变体——不设置这个会给每次检索偷偷插入意料之外的
-        # LLM 调用（延迟和费用都不是我们要的）。
-        num_queries=1,
+    bm25_retriever: BaseRetriever
+    if encoder is not None:
+        bm25_retriever = SparseLexicalRetriever(encoder, lexical_index, vector_store, similarity_top_k=recall_k)
+    else:
+        bm25_retriever = JiebaBM25Retriever.from_index(lexical_index, vector_store, similarity_top_k=recall_k)
+
+    return HybridFusionRetriever(
+        vector_retriever,
+        bm25_retriever,
+        similarity_top_k,
+        dense_weight=load_env.HYBRID_DENSE_WEIGHT,
+        bm25_weight=load_env.HYBRID_BM25_WEIGHT,
+        dense_space=collection_space(vector_store.client),
     )
 
 
@@ -145,28 +605,50 @@ def build_retriever_for_index(index: VectorStoreIndex, similarity_top_k: int) ->
     ``RERANK_ENABLED`` 是同一个模式。
 
     ``HYBRID_RETRIEVAL_ENABLED`` 关闭时直接退化成普通向量检索，不触碰
-    Chroma 的 ``get_nodes(None)``/BM25 构建，不引入额外开销。
+    BM25 倒排表（``handlers.bm25_index``）的加载/构建，不引入额外开销。
 
     打开时按 (index_id, similarity_top_k) 缓存构造好的融合 retriever。缓存
     key 必须带 similarity_top_k，不能只用 index_id——否则跟
     ``graph_builder.compose_graph_query_engine`` 修过的那个坑一样：不同调用点
     传不同 top_k（比如生产主路径 5、``/query`` 接口 2）时，谁先调用就把那个
     top_k 对应的 retriever 永久缓存住，后面用另一个 top_k 调用的调用方会静默
-    拿到错误 top_k 的结果。索引内容变化（上传/删除文档）后靠
-    ``invalidate_hybrid_retriever_cache()`` 整体清空重建。
+    拿到错误 top_k 的结果。索引内容变化（上传/删除文档）后由
+    ``refresh_index_retrievers(index)`` 只失效这一个索引的条目并后台预热——
+    倒排表本身已经由 ``handlers.bm25_index`` 的增量钩子更新过，重建 retriever
+    只是重新包一层，不再重新分词全库。另外每次查缓存都会比对该 collection 的
+    内容版本号，版本号变了的旧条目视同失效。
+
+    同一个索引的不同 top_k 条目共享**同一份**倒排表：``handlers.bm25_index``
+    的注册表按索引名只持有一个 ``BM25Index``，每个缓存条目只是
+    ``HybridFusionRetriever`` + 两个子 retriever 的一层薄包装，top_k（召回宽度）
+    在查询时才作用到 ``BM25Index.search(k)`` 上。``/query``（top_k 2）、
+    QAWorkflow（``RERANK_RECALL_K``）、agent 工具各自的 top_k 不再各持一份
+    分词语料和打分矩阵，多一个 top_k 变体也不多一次分词。
+
+    返回的 retriever 外面还包着一层 ``handlers.retrieval_cache.CachedRetriever``
+    （Chroma 索引才有）：同一版本、同一问题、同一 top_k 的检索结果直接复用，
+    不再重跑嵌入/HNSW/BM25/融合。
     """
     if not load_env.HYBRID_RETRIEVAL_ENABLED:
-        return index.as_retriever(similarity_top_k=similarity_top_k)
+        return with_result_cache(index.as_retriever(similarity_top_k=similarity_top_k), index, similarity_top_k)
 
     cache_key = (index.index_id, similarity_top_k)
+    generation = _index_generation(index)
     with _hybrid_cache_lock:
+        if _hybrid_cache_generation.get(index.index_id, generation) != generation:
+            for key in [key for key in _hybrid_retriever_cache if key[0] == index.index_id]:
+                del _hybrid_retriever_cache[key]
         if cache_key in _hybrid_retriever_cache:
             _hybrid_retriever_cache.move_to_end(cache_key)
             return _hybrid_retriever_cache[cache_key]
-    retriever = _build_hybrid_retriever(index, similarity_top_k)
+    retriever = with_result_cache(_build_hybrid_retriever(index, similarity_top_k), index, similarity_top_k)
     with _hybrid_cache_lock:
         if cache_key in _hybrid_retriever_cache:
             return _hybrid_retriever_cache[cache_key]
-        _hybrid_retriever_cache[cache_key] = retriever
-        _hybrid_cache_evict_if_needed()
+        # 构建期间版本号又变了（并发上传）：这份 retriever 照常返回给本次调用，
+        # 但不进缓存，免得把旧版本号下建的东西登记成新版本的。
+        if _index_generation(index) == generation:
+            _hybrid_retriever_cache[cache_key] = retriever
+            _hybrid_cache_generation[index.index_id] = generation
+            _hybrid_cache_evict_if_needed()
     return retriever
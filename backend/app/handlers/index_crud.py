@@ -4,6 +4,8 @@ import os
 from pathlib import Path
 
 import configs.load_env as load_env
+from handlers import bm25_index, sparse_index
+from handlers.index_events import publish_index_change
 from handlers.vector_store import (
     _get_client,
     build_index_from_collection,
@@ -11,9 +13,12 @@ from handlers.vector_store import (
     delete_collection,
     get_or_create_collection,
     list_index_names,
+    patch_node_metadata,
+    update_collection_metadata,
 )
 from llama_index.core import Document, VectorStoreIndex
 from utils.logger import customer_logger
+from utils.sparse_embedding import SPARSE_METADATA_KEY, dumps_weights, get_sparse_encoder
 
 indexes: list[VectorStoreIndex] = []
 _indexes_lock = asyncio.Lock()
@@ -91,6 +96,9 @@ def _ingest_and_persist(index: VectorStoreIndex, doc_file_path: str) -> None:
         raise DocumentParseError("摄取没有产出任何文档")
 
     persist_docstore(index.index_id, docstore)
+    # BM25 倒排表只增删这次真正写进 Chroma 的 chunk，不重新分词全库。
+    bm25_index.apply_upserts(index.index_id, result.nodes)
+    sparse_index.apply_upserts(index.index_id, result.nodes, get_sparse_encoder())
 
 
 async def insert_into_index(index: VectorStoreIndex, doc_file_path: str, skip_summary: bool = False):
@@ -143,8 +151,10 @@ def _embed_qa_and_persist(index: VectorStoreIndex, qa_pairs: list) -> None:
 
     docstore = load_or_create_docstore(index.index_id)
     pipeline = build_pipeline(vector_store=index.vector_store, docstore=docstore)
-    pipeline.run(documents=docs)
+    nodes = pipeline.run(documents=docs)
     persist_docstore(index.index_id, docstore)
+    bm25_index.apply_upserts(index.index_id, nodes)
+    sparse_index.apply_upserts(index.index_id, nodes, get_sparse_encoder())
 
 
 async def embeddingQA(index: VectorStoreIndex, qa_pairs: list, id: str | None = None):
@@ -186,9 +196,34 @@ def updateNodeById(index: VectorStoreIndex, id_: str, text: str):
     data = collection.get(ids=[id_])
     if not data or not data['ids']:
         raise KeyError(f"node_id {id_} not found")
-    from llama_index.core import Settings
-    emb = Settings.embed_model.get_text_embedding(text)
-    collection.update(ids=[id_], documents=[text], embeddings=[emb])
+    # 摄取时存进节点 metadata 的派生数据（分词结果、稀疏权重）要跟着新文本一起
+    # 写回 Chroma，免得以后从 Chroma 重建倒排表时读到改写前的旧值。
+    old_metadata = (data.get('metadatas') or [None])[0] or {}
+    metadata_updates = {}
+    tokens = None
+    if bm25_index.TOKENS_METADATA_KEY in old_metadata:
+        tokens = bm25_index.jieba_tokenize(text)
+        metadata_updates[bm25_index.TOKENS_METADATA_KEY] = bm25_index.dumps_tokens(tokens)
+    encoder = get_sparse_encoder() if load_env.LEXICAL_RETRIEVAL_MODE == "sparse" else None
+    if encoder is not None:
+        # 稀疏模式：一次前向同时拿新向量和新稀疏权重。
+        emb, weights = encoder.encode([text])[0]
+        metadata_updates[SPARSE_METADATA_KEY] = dumps_weights(weights)
+    else:
+        from llama_index.core import Settings
+        emb = Settings.embed_model.get_text_embedding(text)
+        weights = None
+    if metadata_updates:
+        collection.update(
+            ids=[id_],
+            documents=[text],
+            embeddings=[emb],
+            metadatas=[patch_node_metadata(old_metadata, metadata_updates)],
+        )
+    else:
+        collection.update(ids=[id_], documents=[text], embeddings=[emb])
+    bm25_index.update_node_text(index.index_id, id_, text, tokens)
+    sparse_index.update_node_weights(index.index_id, id_, weights)
 
 
 def deleteNodeById(index: VectorStoreIndex, id_: str):
@@ -198,6 +233,8 @@ def deleteNodeById(index: VectorStoreIndex, id_: str):
     if not data or not data['ids']:
         raise KeyError(f"node_id {id_} not found")
     collection.delete(ids=[id_])
+    bm25_index.remove_nodes(index.index_id, [id_])
+    sparse_index.remove_nodes(index.index_id, [id_])
 
 
 def deleteDocById(index: VectorStoreIndex, doc_id: str):
@@ -219,6 +256,8 @@ def deleteDocById(index: VectorStoreIndex, doc_id: str):
 
     if ids_to_delete:
         collection.delete(ids=ids_to_delete)
+        bm25_index.remove_nodes(index.index_id, ids_to_delete)
+        sparse_index.remove_nodes(index.index_id, ids_to_delete)
 
 
 def saveIndex(index: VectorStoreIndex):
@@ -228,7 +267,10 @@ def saveIndex(index: VectorStoreIndex):
 def _save_summary(index: VectorStoreIndex):
     collection = get_or_create_collection(index.index_id)
     summary_val = getattr(index, 'summary', '')
-    collection.modify(metadata={"summary": summary_val or ''})
+    # 合并写：整体替换会把内容版本号（handlers.vector_store）一起抹掉，上传后
+    # 版本号就会在"存摘要清零 -> refresh 加一"之间来回，永远停在 1。
+    update_collection_metadata(collection, summary=summary_val or '')
+    publish_index_change(index.index_id, "summary")
 
 
 def get_index_by_name(index_name: str) -> VectorStoreIndex | None:
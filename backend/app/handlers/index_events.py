@@ -0,0 +1,85 @@
+"""多 worker 部署下的索引变更通知。
+
+## 为什么
+
+每个 worker 都有自己的一份索引状态：``index_crud.indexes`` 列表、BM25 / 稀疏
+倒排表注册表、混合检索器缓存，还有 chromadb 客户端本身——chromadb 的向量索引
+（HNSW）加载在进程内存里，别的进程往同一个 collection 写入后，本进程的
+``count()``/``get()`` 能读到新行（走 SQLite），向量查询却仍然查不到新 chunk，
+直到重新打开客户端。所以一个 worker 处理了上传/删除/建索引/改摘要之后，其他
+worker 必须知道并重载，否则同一个问题分到不同 worker 会得到不同的答案。
+
+## 做法
+
+- 发生变化的 worker 在原有的本地失效之后调 ``publish_index_change``，往共享
+  状态库（utils/shared_state.py）的 ``events`` 表写一条；
+- 每个 worker 在 lifespan 里跑 ``watch_index_changes``，每
+  ``INDEX_EVENT_POLL_SECONDS`` 秒查一次别的进程发来的事件。一轮里不管来了几条、
+  涉及几个索引，都只重载一次（``apply_remote_index_changes``）：重开 chromadb
+  客户端、``loadAllIndexes``、清空检索器缓存和倒排表注册表。倒排表由发起变更的
+  worker 落过盘，下一次查询从磁盘 mmap 回来，文档数对不上时照常从 Chroma 重建。
+
+索引变更是低频的管理操作，整体重载比逐个索引精细失效简单得多，也不会漏掉
+某一类进程内状态。没有共享后端（单 worker）时发布和监听都是空操作。
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+
+import configs.load_env as load_env
+from utils.shared_state import shared_backend
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "index"
+
+
+def publish_index_change(index_name: str, kind: str) -> None:
+    """通知其他 worker：``index_name`` 发生了 ``kind``（created / deleted / content / summary）变化。
+
+    best-effort：通知写失败只记警告，不影响本 worker 已经完成的变更。
+    """
+    backend = shared_backend()
+    if backend is None:
+        return
+    try:
+        backend.publish(CHANNEL, {"index": index_name, "kind": kind})
+    except Exception:
+        logger.warning("索引 %s 的变更通知（%s）写入失败。", index_name, kind, exc_info=True)
+
+
+async def apply_remote_index_changes(changes: list[dict]) -> None:
+    """其他 worker 改过索引之后，把本进程的索引状态整体重载一次。"""
+    from handlers.bm25_index import clear_bm25_registry
+    from handlers.hybrid_retriever import invalidate_hybrid_retriever_cache
+    from handlers.index_crud import loadAllIndexes
+    from handlers.sparse_index import clear_sparse_registry
+    from handlers.vector_store import reset_client
+
+    logger.info("其他 worker 变更了索引 %s，重载。", sorted({str(c.get("index")) for c in changes}))
+    await asyncio.to_thread(reset_client)
+    await loadAllIndexes()
+    invalidate_hybrid_retriever_cache()
+    clear_bm25_registry()
+    clear_sparse_registry()
+
+
+async def watch_index_changes() -> None:
+    """lifespan 里的后台任务：轮询其他 worker 发来的索引变更事件。"""
+    backend = shared_backend()
+    if backend is None:
+        return
+    # 只关心本进程启动之后的变更：启动时 loadAllIndexes 已经读到了最新状态。
+    last_id = await asyncio.to_thread(backend.latest_event_id)
+    while True:
+        await asyncio.sleep(load_env.INDEX_EVENT_POLL_SECONDS)
+        try:
+            events = await asyncio.to_thread(backend.events_since, CHANNEL, last_id)
+            if not events:
+                continue
+            await apply_remote_index_changes([payload for _, payload in events])
+            last_id = events[-1][0]
+        except Exception:
+            # 一轮失败不退出：游标没推进的话下一轮会重试同一批事件。
+            logger.warning("索引变更事件处理失败，下一轮重试。", exc_info=True)
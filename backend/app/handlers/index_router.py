@@ -0,0 +1,320 @@
+"""多索引场景的本地嵌入路由：按问题和各索引"画像向量"的相似度选索引。
+
+## 为什么不再默认用 LLMSingleSelector
+
+``handlers/qa_workflow._build_retriever`` 多索引分支原来是
+``RouterRetriever`` + ``LLMSingleSelector``：每个问题在检索开始之前先付一次
+完整的 LLM 往返（选择 prompt 里列出所有索引描述，让模型挑一个），而且选择器
+偶尔会解析出越界索引（"Failed to select retriever"，见 ``utils/llama.py``
+``_INDEX_DESCRIPTION_MAX_CHARS`` 的说明）。选索引本质上是"问题和哪个索引的
+主题最像"，这正是嵌入模型擅长的事，而且问题向量反正要算——dense 检索腿要用
+同一个向量（``utils/embedding_cache.CachedEmbedding`` 会命中缓存，路由不多付
+一次前向）。
+
+## 索引画像
+
+每个索引一个单位向量：``summary`` 全文（不是 ``index_description`` 截断后的
+120 字，嵌入模型不怕长）的嵌入，按 ``INDEX_ROUTE_CENTROID_WEIGHT`` 混入该
+collection 里抽样 chunk 嵌入的质心——摘要是 LLM 写的"这个索引讲什么"，质心是
+"这个索引实际装了什么"，没有摘要的索引（只有 index_id）全靠质心。画像按
+(collection 内容版本号, 摘要文本) 缓存，上传/删除文档 bump 版本号后下一次
+路由自动重算，不需要在写路径上挂失效钩子。
+
+## 选择规则
+
+按相似度排序后，取所有落在 ``top1 - INDEX_ROUTE_MARGIN`` 以内的索引：
+
+- 只有一个：它明显最像，只查它；
+- 不超过 ``INDEX_ROUTE_MAX_FANOUT`` 个：说不清是哪个（跨院系的问题常见），
+  并发查这几个、合并结果；
+- 更多：画像区分不开（摘要都很空泛、或问题跟哪个都不沾边），这时才退回
+  原来的 LLM 选择器。
+
+画像/问题嵌入任何一步失败也退回 LLM 选择器：路由是省延迟的优化，不能让
+检索本身失败。
+
+## 全量扇出（INDEX_ROUTING_MODE=fanout）
+
+``FanOutRetriever`` 不做任何选择：所有索引并发检索，结果按全局 RRF 合并。
+跨院系的问题召回最好，也完全不碰 LLM；代价是每个问题都查所有索引。
+
+两种多索引检索（嵌入路由选中多个时、全量扇出）共用 ``afan_out``：
+
+- 每个索引一个 ``INDEX_FANOUT_TIMEOUT_S`` 超时，超时或报错的索引记一条
+  warning、当作没结果，不拖住整个请求——总延迟由最慢的那个（或超时上限）
+  决定，而不是各索引之和；
+- 问题向量在扇出前算一次、塞进 ``QueryBundle.embedding``：N 个 dense 腿
+  同时开跑时嵌入缓存还没有这条，不预先算好就是 N 次同样的前向。
+
+合并用 RRF（``rrf_merge``）而不是直接比分数：各索引的分数量级不可比（混合
+检索是索引内 RRF 分，纯向量是余弦，语料规模不同分布也不同），按名次融合
+跟 ``hybrid_retriever`` 融合两路的思路一致。
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import threading
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import configs.load_env as load_env
+import numpy as np
+from handlers.hybrid_retriever import build_retriever_for_index
+from handlers.vector_store import get_collection_generation, is_chroma_store
+from llama_index.core import VectorStoreIndex
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.settings import Settings
+from utils.llama import index_description
+
+if TYPE_CHECKING:
+    from llama_index.vector_stores.chroma import ChromaVectorStore
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class _Profile:
+    key: tuple[int, str]
+    vector: np.ndarray
+
+
+_profile_cache: dict[str, _Profile] = {}
+_profile_lock = threading.Lock()
+
+
+def clear_index_profiles() -> None:
+    with _profile_lock:
+        _profile_cache.clear()
+
+
+def _unit(vector) -> np.ndarray | None:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm > 0 else None
+
+
+def _chunk_centroid(vector_store: ChromaVectorStore) -> np.ndarray | None:
+    """随机抽 ``INDEX_ROUTE_CENTROID_SAMPLE`` 个 chunk，取它们嵌入的质心。
+
+    不能直接 ``get(limit=N)``：Chroma 按写入顺序返回，大索引上拿到的总是最早
+    摄取的那几个文档，质心偏向它们。先只取 id（不带嵌入，便宜），随机抽一个
+    子集再按 id 取嵌入；chunk 数不超过抽样数时全取。
+    """
+    collection = vector_store.client
+    sample = load_env.INDEX_ROUTE_CENTROID_SAMPLE
+    if collection.count() > sample:
+        ids = collection.get(include=[])["ids"]
+        result = collection.get(ids=random.sample(ids, sample), include=["embeddings"])
+    else:
+        result = collection.get(include=["embeddings"])
+    embeddings = result.get("embeddings")
+    if embeddings is None or len(embeddings) == 0:
+        return None
+    unit_rows = np.asarray(embeddings, dtype=np.float32)
+    unit_rows /= np.maximum(np.linalg.norm(unit_rows, axis=1, keepdims=True), 1e-12)
+    return _unit(unit_rows.mean(axis=0))
+
+
+def index_profile(index: VectorStoreIndex) -> np.ndarray | None:
+    """索引的画像向量（单位向量），见模块 docstring。算不出来时返回 None。"""
+    summary = (getattr(index, "summary", None) or "").strip() or index_description(index)
+    vector_store = getattr(index, "vector_store", None)
+    chroma_store = vector_store if is_chroma_store(vector_store) else None
+    key = (get_collection_generation(chroma_store.client) if chroma_store is not None else 0, summary)
+    with _profile_lock:
+        cached = _profile_cache.get(index.index_id)
+    if cached is not None and cached.key == key:
+        return cached.vector
+
+    profile = _unit(Settings.embed_model.get_text_embedding(summary))
+    weight = load_env.INDEX_ROUTE_CENTROID_WEIGHT
+    if weight > 0 and chroma_store is not None:
+        centroid = _chunk_centroid(chroma_store)
+        if centroid is not None and (profile is None or len(centroid) == len(profile)):
+            profile = _unit(centroid if profile is None else (1 - weight) * profile + weight * centroid)
+    if profile is not None:
+        with _profile_lock:
+            _profile_cache[index.index_id] = _Profile(key=key, vector=profile)
+    return profile
+
+
+def select_indexes(ranked: list[tuple[str, float]], margin: float, max_fanout: int) -> list[str] | None:
+    """``ranked`` 是按相似度降序的 ``(index_id, score)``。返回要查的索引，
+    画像区分不开（候选超过 ``max_fanout``）时返回 None，交给 LLM 选择器。"""
+    if not ranked:
+        return None
+    floor = ranked[0][1] - margin
+    chosen = [index_id for index_id, score in ranked if score >= floor]
+    if len(chosen) > max(1, max_fanout):
+        return None
+    return chosen
+
+
+_RRF_K = 60.0
+
+
+def rrf_merge(results: list[list[NodeWithScore]], top_k: int) -> list[NodeWithScore]:
+    """多个索引的结果按名次做 RRF 合并（k=60，同 QueryFusionRetriever），截断到
+    top_k。返回的是节点的浅拷贝（混合检索带的 ``signal`` 等字段还在），``score``
+    改成全局 RRF 分；传进来的节点不动——它们可能还被检索结果缓存、融合信号
+    引用着。只有一路结果时原样截断返回，不改分数。"""
+    non_empty = [nodes for nodes in results if nodes]
+    if len(non_empty) <= 1:
+        return (non_empty[0] if non_empty else [])[:top_k]
+    fused: dict[str, float] = {}
+    first_seen: dict[str, NodeWithScore] = {}
+    for nodes in non_empty:
+        for rank, node in enumerate(sorted(nodes, key=lambda n: n.score or 0.0, reverse=True)):
+            node_id = node.node.node_id
+            first_seen.setdefault(node_id, node)
+            fused[node_id] = fused.get(node_id, 0.0) + 1.0 / (_RRF_K + rank)
+    merged = []
+    for node_id, score in sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]:
+        merged.append(first_seen[node_id].model_copy(update={"score": score}))
+    return merged
+
+
+async def _aretrieve_one(index: VectorStoreIndex, top_k: int, query_bundle: QueryBundle) -> list[NodeWithScore]:
+    # 构造 retriever 可能要建 BM25 倒排表、读 Chroma（缓存 miss 时），放线程里，
+    # 也让它一起受超时约束。
+    retriever = await asyncio.to_thread(build_retriever_for_index, index, top_k)
+    return await retriever.aretrieve(query_bundle)
+
+
+async def afan_out(
+    indexes: list[VectorStoreIndex], top_k: int, query_bundle: QueryBundle
+) -> list[list[NodeWithScore]]:
+    """并发检索多个索引，返回每个索引的结果（超时/失败的索引为空列表）。"""
+    timeout = load_env.INDEX_FANOUT_TIMEOUT_S or None
+
+    async def guarded(index: VectorStoreIndex) -> list[NodeWithScore]:
+        try:
+            return await asyncio.wait_for(_aretrieve_one(index, top_k, query_bundle), timeout)
+        except TimeoutError:
+            logger.warning("索引 %s 检索超过 %.1fs，本次跳过。", index.index_id, timeout)
+        except Exception:
+            logger.warning("索引 %s 检索失败，本次跳过。", index.index_id, exc_info=True)
+        return []
+
+    return list(await asyncio.gather(*(guarded(index) for index in indexes)))
+
+
+def fan_out(indexes: list[VectorStoreIndex], top_k: int, query_bundle: QueryBundle) -> list[list[NodeWithScore]]:
+    """``afan_out`` 的同步版本（评测脚本等同步调用方）：逐个检索，没有超时，
+    单个索引失败同样不影响其他索引。"""
+    results = []
+    for index in indexes:
+        try:
+            results.append(build_retriever_for_index(index, top_k).retrieve(query_bundle))
+        except Exception:
+            logger.warning("索引 %s 检索失败，本次跳过。", index.index_id, exc_info=True)
+            results.append([])
+    return results
+
+
+def _with_embedding(query_bundle: QueryBundle, embedding) -> QueryBundle:
+    return QueryBundle(
+        query_str=query_bundle.query_str,
+        custom_embedding_strs=query_bundle.custom_embedding_strs,
+        embedding=list(embedding),
+    )
+
+
+class EmbeddingIndexRouter(BaseRetriever):
+    """多索引检索器：嵌入路由选索引，选中多个时走 ``afan_out`` 并发检索、RRF 合并。
+
+    ``fallback_factory`` 构造画像区分不开/路由失败时用的检索器（生产里是
+    ``RouterRetriever`` + ``LLMSingleSelector``），只在真的需要时才构造，
+    不需要 LLM 兜底的请求不碰 ``Settings.llm``。
+    """
+
+    def __init__(
+        self,
+        indexes: list[VectorStoreIndex],
+        similarity_top_k: int,
+        fallback_factory: Callable[[], BaseRetriever],
+    ) -> None:
+        self._indexes = {index.index_id: index for index in indexes}
+        self._similarity_top_k = similarity_top_k
+        self._fallback_factory = fallback_factory
+        self._fallback: BaseRetriever | None = None
+        super().__init__()
+
+    def _get_fallback(self) -> BaseRetriever:
+        if self._fallback is None:
+            self._fallback = self._fallback_factory()
+        return self._fallback
+
+    def route(self, query_embedding) -> list[str] | None:
+        query = _unit(query_embedding)
+        if query is None:
+            return None
+        ranked = []
+        for index_id, index in self._indexes.items():
+            profile = index_profile(index)
+            if profile is not None and len(profile) == len(query):
+                ranked.append((index_id, float(profile @ query)))
+        ranked.sort(key=lambda item: item[1], reverse=True)
+        chosen = select_indexes(ranked, load_env.INDEX_ROUTE_MARGIN, load_env.INDEX_ROUTE_MAX_FANOUT)
+        logger.debug(
+            "index route: %s -> %s",
+            ", ".join(f"{index_id}={score:.3f}" for index_id, score in ranked),
+            chosen if chosen is not None else "llm fallback",
+        )
+        return chosen
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        try:
+            query_embedding = Settings.embed_model.get_query_embedding(query_bundle.query_str)
+            chosen = self.route(query_embedding)
+        except Exception:
+            logger.warning("嵌入路由失败，退回 LLM 选择器。", exc_info=True)
+            chosen = None
+        if chosen is None:
+            return self._get_fallback().retrieve(query_bundle)
+        query_bundle = _with_embedding(query_bundle, query_embedding)
+        indexes = [self._indexes[index_id] for index_id in chosen]
+        return rrf_merge(fan_out(indexes, self._similarity_top_k, query_bundle), self._similarity_top_k)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        try:
+            query_embedding = await Settings.embed_model.aget_query_embedding(query_bundle.query_str)
+            # 画像第一次计算（或版本号变了重算）要嵌入摘要、读 Chroma，放线程里。
+            chosen = await asyncio.to_thread(self.route, query_embedding)
+        except Exception:
+            logger.warning("嵌入路由失败，退回 LLM 选择器。", exc_info=True)
+            chosen = None
+        if chosen is None:
+            return await self._get_fallback().aretrieve(query_bundle)
+        query_bundle = _with_embedding(query_bundle, query_embedding)
+        if len(chosen) == 1:
+            # 只查一个索引时不套超时：超时后返回空结果对单索引来说就是答不上来。
+            return await _aretrieve_one(self._indexes[chosen[0]], self._similarity_top_k, query_bundle)
+        indexes = [self._indexes[index_id] for index_id in chosen]
+        return rrf_merge(await afan_out(indexes, self._similarity_top_k, query_bundle), self._similarity_top_k)
+
+
+class FanOutRetriever(BaseRetriever):
+    """全量扇出：所有索引并发检索、全局 RRF 合并（``INDEX_ROUTING_MODE=fanout``）。"""
+
+    def __init__(self, indexes: list[VectorStoreIndex], similarity_top_k: int) -> None:
+        self._indexes = list(indexes)
+        self._similarity_top_k = similarity_top_k
+        super().__init__()
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        query_bundle = _with_embedding(
+            query_bundle, Settings.embed_model.get_query_embedding(query_bundle.query_str)
+        )
+        return rrf_merge(fan_out(self._indexes, self._similarity_top_k, query_bundle), self._similarity_top_k)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        query_bundle = _with_embedding(
+            query_bundle, await Settings.embed_model.aget_query_embedding(query_bundle.query_str)
+        )
+        results = await afan_out(self._indexes, self._similarity_top_k, query_bundle)
+        return rrf_merge(results, self._similarity_top_k)
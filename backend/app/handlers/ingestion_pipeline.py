@@ -68,6 +68,7 @@ from pathlib import Path
 from typing import Any
 
 import configs.load_env as load_env
+from handlers.bm25_index import TOKENS_METADATA_KEY, dumps_tokens, jieba_tokenize
 from handlers.chunking import TableAwareSentenceSplitter
 from handlers.parsers import ParseStatus, parse_path
 from handlers.parsers.front_matter import promoted_metadata, split_front_matter
@@ -75,11 +76,13 @@ from handlers.parsers.types import DocumentParseError, ParserUnavailableError
 from llama_index.core import Settings
 from llama_index.core.base.embeddings.base import BaseEmbedding
 from llama_index.core.ingestion import DocstoreStrategy, IngestionPipeline
-from llama_index.core.schema import BaseNode, Document, TransformComponent
+from llama_index.core.schema import BaseNode, Document, MetadataMode, TransformComponent
 from llama_index.core.storage.docstore import SimpleDocumentStore
 from llama_index.core.storage.docstore.types import BaseDocumentStore
 from llama_index.core.vector_stores.types import BasePydanticVectorStore
+from pydantic import PrivateAttr
 from utils.logger import customer_logger
+from utils.sparse_embedding import SPARSE_METADATA_KEY, dumps_weights, find_sparse_encoder
 
 # 上传时（router/index.py: f"{uuid.uuid4()}_{filename}"）加的 uuid4 前缀。
 # 摄取管道内部按"逻辑文件名"（去掉这个前缀）识别"这其实是同一份文档"，
@@ -402,6 +405,59 @@ class NoiseNodeFilter(TransformComponent):
         return kept
 
 
+def _exclude_from_embed_and_llm(node: BaseNode, key: str) -> None:
+    """检索用的派生 metadata（分词结果、稀疏权重）既不该参与嵌入文本，也不该
+    出现在给 LLM 的上下文里。"""
+    for excluded in (node.excluded_embed_metadata_keys, node.excluded_llm_metadata_keys):
+        if key not in excluded:
+            excluded.append(key)
+
+
+class JiebaTokenizeTransform(TransformComponent):
+    """把每个 chunk 的 jieba 分词结果存进 ``node.metadata[TOKENS_METADATA_KEY]``。
+
+    随 metadata 一起进 Chroma，``handlers/bm25_index.py`` 从 Chroma 重建倒排表
+    时直接读，不再对全库跑 jieba（见该模块"分词结果随节点存进 Chroma"一节）。
+    分的是 ``get_content()``（不带 metadata），跟 ``BM25Index.add_nodes``
+    现分词时用的文本一致。必须放在 embed 之前：key 要先加进
+    ``excluded_embed_metadata_keys``，分词串才不会混进嵌入文本。
+    """
+
+    def __call__(self, nodes: Sequence[BaseNode], **kwargs: Any) -> Sequence[BaseNode]:
+        for node in nodes:
+            node.metadata[TOKENS_METADATA_KEY] = dumps_tokens(jieba_tokenize(node.get_content()))
+            _exclude_from_embed_and_llm(node, TOKENS_METADATA_KEY)
+        return nodes
+
+
+class SparseEmbedTransform(TransformComponent):
+    """稀疏检索模式下替代 embed_model 的那一步：一次前向同时写 dense 向量和
+    bge-m3 稀疏权重。
+
+    dense 向量照常写到 ``node.embedding``（下游 Chroma 写入与普通 embed_model
+    完全一样）；稀疏权重序列化后写进 ``node.metadata[SPARSE_METADATA_KEY]``，
+    随 metadata 一起进 Chroma，``handlers/sparse_index.py`` 重建倒排表时直接
+    读出来，不再需要对全库跑任何分词。
+    """
+
+    _encoder: Any = PrivateAttr()
+
+    def __init__(self, encoder: Any, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._encoder = encoder
+
+    def __call__(self, nodes: Sequence[BaseNode], **kwargs: Any) -> Sequence[BaseNode]:
+        batch_size = max(1, self._encoder.embed_batch_size)
+        for start in range(0, len(nodes), batch_size):
+            batch = nodes[start : start + batch_size]
+            texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in batch]
+            for node, (dense, weights) in zip(batch, self._encoder.encode(texts)):
+                node.embedding = dense
+                node.metadata[SPARSE_METADATA_KEY] = dumps_weights(weights)
+                _exclude_from_embed_and_llm(node, SPARSE_METADATA_KEY)
+        return nodes
+
+
 def build_pipeline(
     vector_store: BasePydanticVectorStore,
     docstore: BaseDocumentStore | None = None,
@@ -447,12 +503,23 @@ def build_pipeline(
     resolved_embed_model = embed_model if embed_model is not None else Settings.embed_model
     resolved_min_chunk_length = min_chunk_length if min_chunk_length is not None else load_env.MIN_CHUNK_LENGTH
     noise_filter = NoiseNodeFilter(min_length=resolved_min_chunk_length)
+    # 稀疏检索模式（LEXICAL_RETRIEVAL_MODE=sparse）且嵌入模型带 bge-m3 稀疏头时，
+    # 用 SparseEmbedTransform 顶替 embed_model：同一次前向顺手存下稀疏权重。
+    sparse_encoder = (
+        find_sparse_encoder(resolved_embed_model) if load_env.LEXICAL_RETRIEVAL_MODE == "sparse" else None
+    )
+    embed_steps: list[TransformComponent]
+    if sparse_encoder is not None:
+        embed_steps = [SparseEmbedTransform(sparse_encoder)]
+    else:
+        # BM25 模式：分词结果在摄取时存下来，以后重建 BM25 倒排表不用再跑 jieba。
+        embed_steps = [JiebaTokenizeTransform(), resolved_embed_model]
     return IngestionPipeline(
         # 顺序很重要：splitter 先把 Document 切成 chunk，noise_filter 在真正
         # 花算力做 embedding 之前把没有检索价值的 chunk 拦下，embed_model 只
         # 处理留下来的。文件上传（index_crud._ingest_and_persist）和 QA 导入
         # （index_crud.embeddingQA）都走这一个 build_pipeline，两条路都覆盖。
-        transformations=[splitter, noise_filter, resolved_embed_model],
+        transformations=[splitter, noise_filter, *embed_steps],
         docstore=docstore if docstore is not None else SimpleDocumentStore(),
         vector_store=vector_store,
         docstore_strategy=docstore_strategy,
@@ -480,6 +547,10 @@ class IngestResult:
     nodes_by_doc_id: dict[str, int]
     """doc_id -> 本次实际写入的 chunk/node 数量。配合 doc_id_to_paths 可以
     推出"这些文件（可能不止一个文件名）一共贡献了多少 chunk"。"""
+    nodes: list[BaseNode] = field(default_factory=list)
+    """本次实际写入向量库的 node 本身。``handlers/index_crud.py`` 拿它增量更新
+    该索引的 BM25 倒排表（``handlers/bm25_index.apply_upserts``），不用再去
+    Chroma 里把刚写进去的内容读回来。"""
 
 
 def ingest_files(
@@ -548,4 +619,5 @@ def ingest_files(
         nodes_upserted=len(nodes),
         doc_id_to_paths=doc_id_to_paths,
         nodes_by_doc_id=nodes_by_doc_id,
+        nodes=list(nodes),
     )
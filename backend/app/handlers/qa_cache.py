@@ -27,6 +27,32 @@ document 存问题原文（被嵌入），答案/来源/命中次数存 metadata
 不常用的（容量控制只针对无人背书的自动条目）；curated 是人工资产，永不自动
 驱逐。
 
+## 热路径：进程内向量镜像 + 命中计数写回
+
+``lookup`` 在每个 ``/graph/ask_stream`` 请求的关键路径上。auto 条目上限
+``QA_CACHE_MAX_AUTO_ENTRIES``（500）加上人工条目，整个缓存放进一个归一化
+嵌入矩阵绰绰有余（500 × 1024 × 4B ≈ 2MB），所以查找不再走 Chroma：
+
+- 第一次查找时把 collection 全量（嵌入 + metadata）读进进程内 ``_Mirror``，
+  之后查找是一次矩阵-向量点积取 argmax，微秒级，不再 to_thread 跳线程；
+- ``_store`` / ``delete_by_question`` / 驱逐仍然**先写 Chroma**（它是唯一的
+  持久化存储），成功后同步改镜像；
+- 命中计数只在内存里累加，由 ``flush_hits``（``main.py`` 的周期落库任务和
+  关停时调用，驱逐前也会先刷一次）批量写回 Chroma，不再每次命中都多一次
+  ``collection.update`` 往返；
+- 镜像超过 ``_MIRROR_TTL_SECONDS`` 重新从 Chroma 加载一次（加载前先写回待刷
+  的命中计数），多 worker 部署时别的进程写入的条目最迟这么久后可见。过期时
+  并发进来的查找共用同一次加载。
+
+镜像里还维护一张"归一化问题原文 -> 条目"的表（``normalize_text_key``，跟
+嵌入缓存同一套归一化）：逐字重复的提问连嵌入都不算，直接命中；其余问题的
+嵌入由 ``utils/embedding_cache.py`` 的进程级 LRU 兜着，同一问题在 lookup 和
+store_auto 之间只真正嵌入一次。
+
+collection 句柄本身也缓存在进程里（``_get_collection``），命中路径上不碰
+Chroma。镜像按 collection 的 Chroma id 认领：句柄重新打开后是新对象，但 id
+不变；测试里每个用例换一个内存 collection，id 变了镜像自然重建。
+
 ## 设计约束：缓存是 best-effort 的
 
 查找/写入/删除/统计的每一步都可能因为 Chroma 不可用、嵌入模型未配置等原因
@@ -39,12 +65,16 @@ from __future__ import annotations
 import asyncio
 import hashlib
 import logging
+import threading
 import time
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Any
 
 import configs.load_env as load_env
+import numpy as np
 from llama_index.core.schema import NodeWithScore
 from llama_index.core.settings import Settings
+from utils.embedding_cache import normalize_text_key
 
 logger = logging.getLogger(__name__)
 
@@ -61,6 +91,10 @@ _SOURCE_TEXT_MAX_CHARS = 300
 # 生成有 8 秒超时同理，这里给 2 秒，超时按未命中降级。
 _LOOKUP_TIMEOUT_SECONDS = 2.0
 
+# 进程内镜像的最长使用时间，过期后下一次查找从 Chroma 重新加载（见模块
+# docstring"热路径"一节）。
+_MIRROR_TTL_SECONDS = 60.0
+
 
 @dataclass
 class CachedEntry:
@@ -72,7 +106,198 @@ class CachedEntry:
     source_text: str = ""
 
 
+@dataclass
+class _Mirror:
+    """qa_cache collection 的进程内镜像：行归一化的嵌入矩阵 + 每行 metadata，
+    外加还没写回 Chroma 的命中计数（``pending_hits`` 里的 id）。"""
+
+    collection_id: str
+    loaded_at: float
+    ids: list[str] = field(default_factory=list)
+    metadatas: list[dict] = field(default_factory=list)
+    matrix: np.ndarray = field(default_factory=lambda: np.zeros((0, 0), dtype=np.float32))
+    pending_hits: set[str] = field(default_factory=set)
+    # normalize_text_key(问题原文) -> entry id，精确匹配快路径用（见 lookup）。
+    exact: dict[str, str] = field(default_factory=dict)
+    # entry id -> 行号，跟 ids 一起由 reindex 维护。
+    rows: dict[str, int] = field(default_factory=dict)
+
+    def row_of(self, entry_id: str) -> int | None:
+        return self.rows.get(entry_id)
+
+    def reindex(self) -> None:
+        """ids/metadatas 变动后重建 id -> 行号表和精确匹配表。"""
+        self.rows = {entry_id: row for row, entry_id in enumerate(self.ids)}
+        # 同一问题同时有 auto 和 curated 两条时指向 curated：人背过书的答案优先。
+        exact: dict[str, str] = {}
+        for entry_id, metadata in zip(self.ids, self.metadatas):
+            key = normalize_text_key(metadata.get("question") or "")
+            if key and (key not in exact or metadata.get("kind") == KIND_CURATED):
+                exact[key] = entry_id
+        self.exact = exact
+
+
+_mirror: _Mirror | None = None
+# 正在进行的镜像重载：(collection id, task)。镜像过期那一刻并发进来的查找
+# 共用这一次加载，而不是每个请求各自去 Chroma 全量读一遍。
+_mirror_reload: tuple[str, asyncio.Future[_Mirror]] | None = None
+# 镜像的读写都是内存操作（点积/改一行），用线程锁而不是 asyncio.Lock：加载
+# 和写回在 to_thread 的线程里执行，也要跟事件循环上的查找互斥。
+_mirror_lock = threading.Lock()
+
+# (chromadb 客户端, collection 句柄)，见 _get_collection。
+_collection_handle: tuple[object, Any] | None = None
+
+
+def _normalize(vectors) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _flush_hits_sync(collection) -> None:
+    """把镜像里累计的命中计数批量写回 Chroma（同步，供 to_thread 调用）。"""
+    with _mirror_lock:
+        mirror = _mirror
+        if mirror is None or mirror.collection_id != str(collection.id) or not mirror.pending_hits:
+            return
+        rows = {i: mirror.row_of(i) for i in mirror.pending_hits}
+        pending = [(i, row) for i, row in rows.items() if row is not None]
+        ids = [i for i, _ in pending]
+        hits = [int(mirror.metadatas[row].get("hits", 0)) for _, row in pending]
+        mirror.pending_hits.clear()
+    if not ids:
+        return
+    try:
+        collection.update(ids=ids, metadatas=[{"hits": h} for h in hits])
+    except Exception:
+        # 写回失败把这批 id 放回待刷集合，下次再试；计数本身还在镜像里。
+        with _mirror_lock:
+            if _mirror is mirror:
+                mirror.pending_hits.update(ids)
+        raise
+
+
+def _load_mirror_sync(collection) -> _Mirror:
+    """从 Chroma 全量加载镜像（同步，供 to_thread 调用）。加载前先把旧镜像
+    的命中计数写回，否则重新加载会拿 Chroma 里更旧的 hits 覆盖掉它们。"""
+    global _mirror
+    try:
+        _flush_hits_sync(collection)
+    except Exception:
+        logger.warning("语义缓存命中计数写回失败（best-effort）。", exc_info=True)
+    res = collection.get(include=["embeddings", "metadatas"])
+    ids = list(res.get("ids") or [])
+    embeddings = res.get("embeddings")
+    mirror = _Mirror(collection_id=str(collection.id), loaded_at=time.monotonic())
+    if ids:
+        mirror.ids = ids
+        mirror.metadatas = [dict(m or {}) for m in res.get("metadatas") or [{}] * len(ids)]
+        mirror.matrix = _normalize(embeddings)
+        mirror.reindex()
+    with _mirror_lock:
+        _mirror = mirror
+    return mirror
+
+
+async def _get_mirror(collection) -> _Mirror:
+    mirror = _mirror
+    if (
+        mirror is not None
+        and mirror.collection_id == str(collection.id)
+        and time.monotonic() - mirror.loaded_at < _MIRROR_TTL_SECONDS
+    ):
+        return mirror
+    global _mirror_reload
+    collection_id = str(collection.id)
+    reload = _mirror_reload[1] if _mirror_reload and _mirror_reload[0] == collection_id else None
+    # 测试里每个用例各开一个事件循环，上一个循环留下的 task 不能在这里 await。
+    if reload is None or reload.done() or reload.get_loop() is not asyncio.get_running_loop():
+        reload = asyncio.ensure_future(asyncio.to_thread(_load_mirror_sync, collection))
+        _mirror_reload = (collection_id, reload)
+    # shield：某个等待者超时只是它自己放弃，加载本身继续，其他等待者照样拿结果。
+    return await asyncio.wait_for(asyncio.shield(reload), timeout=_LOOKUP_TIMEOUT_SECONDS)
+
+
+def _mirror_upsert(collection, entry_id: str, embedding: list[float], metadata: dict) -> None:
+    """Chroma upsert 成功后同步改镜像；镜像还没加载（或属于别的 collection）
+    时什么都不做——下一次查找加载时自然会读到这条。"""
+    with _mirror_lock:
+        mirror = _mirror
+        if mirror is None or mirror.collection_id != str(collection.id):
+            return
+        vector = _normalize(embedding)
+        row = mirror.row_of(entry_id)
+        if row is not None:
+            mirror.metadatas[row] = dict(metadata)
+            mirror.matrix[row] = vector[0]
+            mirror.pending_hits.discard(entry_id)
+        elif mirror.ids and mirror.matrix.shape[1] != vector.shape[1]:
+            # 嵌入维度变了（换了嵌入模型）：镜像作废，下次查找重新加载。
+            mirror.loaded_at = float("-inf")
+        else:
+            mirror.ids.append(entry_id)
+            mirror.metadatas.append(dict(metadata))
+            mirror.matrix = vector if not len(mirror.matrix) else np.vstack([mirror.matrix, vector])
+        mirror.reindex()
+
+
+def _mirror_remove(collection, entry_ids: list[str]) -> None:
+    with _mirror_lock:
+        mirror = _mirror
+        if mirror is None or mirror.collection_id != str(collection.id):
+            return
+        drop = set(entry_ids)
+        keep = [row for row, entry_id in enumerate(mirror.ids) if entry_id not in drop]
+        mirror.ids = [mirror.ids[row] for row in keep]
+        mirror.metadatas = [mirror.metadatas[row] for row in keep]
+        mirror.matrix = mirror.matrix[keep] if keep else np.zeros((0, 0), dtype=np.float32)
+        mirror.pending_hits -= drop
+        mirror.reindex()
+
+
+async def flush_hits() -> None:
+    """把累计的命中计数写回 Chroma。``main.py`` 周期落库任务和关停时调用；
+    best-effort，不抛异常。"""
+    if not load_env.QA_CACHE_ENABLED or _mirror is None or not _mirror.pending_hits:
+        return
+    try:
+        await asyncio.to_thread(_flush_hits_sync, _get_collection())
+    except Exception:
+        logger.warning("语义缓存命中计数写回失败（best-effort）。", exc_info=True)
+
+
 def _get_collection():
+    """qa_cache collection 句柄，进程内缓存。
+
+    ``get_or_create_collection`` 每次都是一次 Chroma sqlite 往返，而 ``lookup``
+    在每个问答请求的关键路径上、同步跑在事件循环里——镜像命中本身是微秒级，
+    不能每次先付一次 sqlite 查询。句柄跟 chromadb 客户端绑定：
+    ``vector_store.reset_client`` 换了客户端（多 worker 收到索引变更通知）或
+    ``QA_CACHE_COLLECTION`` 改了就重新打开；用句柄出错时由调用方
+    ``_forget_collection`` 丢掉，下次重新打开（比如 collection 被删了）。
+    """
+    global _collection_handle
+    from handlers.vector_store import _get_client
+
+    client = _get_client()
+    cached = _collection_handle
+    if cached is not None and cached[0] is client and cached[1].name == load_env.QA_CACHE_COLLECTION:
+        return cached[1]
+    collection = _open_collection()
+    _collection_handle = (client, collection)
+    return collection
+
+
+def _forget_collection() -> None:
+    global _collection_handle
+    _collection_handle = None
+
+
+def _open_collection():
     from handlers.vector_store import get_or_create_collection
 
     collection = get_or_create_collection(
@@ -81,7 +306,7 @@ def _get_collection():
     # 距离空间只在**新建** collection 时生效（Chroma 对已存在的集合忽略创建
     # 参数）。如果 qa_cache 曾经以默认 L2 空间创建过，这里的
     # similarity = 1 - distance 换算就失真了（L2 距离可以超过 1），阈值判断
-    # 会静默失效——与其悄悄算错，不如每次启动告警一次，让人能发现。
+    # 会静默失效——与其悄悄算错，不如每次打开时告警一次，让人能发现。
     space = (collection.metadata or {}).get("hnsw:space")
     if space != "cosine":
         logger.warning(
@@ -124,59 +349,55 @@ async def lookup(query: str) -> CachedEntry | None:
     if not query:
         return None
     try:
-        embedding = await _embed(query)
         collection = _get_collection()
-        # Chroma 的 query/update 是同步阻塞调用：包 to_thread + wait_for，一个
-        # 挂起的本地 sqlite 也不会拖住事件循环和整条问答流（见模块级
-        # _LOOKUP_TIMEOUT_SECONDS 注释）。
-        result = await asyncio.wait_for(
-            asyncio.to_thread(
-                collection.query,
-                query_embeddings=[embedding],
-                n_results=1,
-                include=["metadatas", "distances"],
-            ),
-            timeout=_LOOKUP_TIMEOUT_SECONDS,
-        )
+        # 只有镜像首次加载/过期重载会碰 Chroma（to_thread + wait_for，见
+        # _get_mirror 和模块级 _LOOKUP_TIMEOUT_SECONDS 注释），其余查找都是
+        # 纯内存操作。
+        mirror = await _get_mirror(collection)
+        # 精确匹配快路径：归一化后逐字相同的重复提问直接命中，连嵌入都不用算
+        # （相似度恒为 1，任何 kind 的阈值都过得去，跟走向量路径结果一致）。
+        with _mirror_lock:
+            row = mirror.row_of(mirror.exact.get(normalize_text_key(query), ""))
+            if row is not None:
+                return _record_hit(mirror, row)
+        embedding = await _embed(query)
     except Exception:
         # TimeoutError 也是 Exception 子类，超时走同一条降级路径
+        _forget_collection()
         logger.warning("语义缓存查找失败或超时，降级为未命中。", exc_info=True)
         return None
 
-    ids = result.get("ids") or [[]]
-    if not ids or not ids[0]:
-        return None
-    entry_id = ids[0][0]
-    metadata = (result.get("metadatas") or [[{}]])[0][0]
-    # cosine 空间下 distance = 1 - cosine_similarity，阈值判断换算回相似度。
-    distance = (result.get("distances") or [[1.0]])[0][0]
-    similarity = 1.0 - float(distance)
-    kind = metadata.get("kind", KIND_AUTO)
-    threshold = (
-        load_env.QA_CACHE_CURATED_THRESHOLD
-        if kind == KIND_CURATED
-        else load_env.QA_CACHE_AUTO_THRESHOLD
-    )
-    if similarity < threshold:
-        return None
-
-    # 命中计数（驱逐排序用）。best-effort：更新失败不影响本次命中。
-    # 并发下是读-改-写，可能丢更新——hits 只是驱逐排序的启发式信号，不是
-    # 精确计数，丢一两次不影响正确性，刻意不做原子化。
-    try:
-        await asyncio.wait_for(
-            asyncio.to_thread(
-                collection.update,
-                ids=[entry_id],
-                metadatas=[{"hits": int(metadata.get("hits", 0)) + 1}],
-            ),
-            timeout=_LOOKUP_TIMEOUT_SECONDS,
+    query_vector = _normalize(embedding)[0]
+    with _mirror_lock:
+        if not mirror.ids or mirror.matrix.shape[1] != query_vector.shape[0]:
+            return None
+        # 行已归一化，点积即余弦相似度（跟 Chroma cosine 空间的
+        # 1 - distance 是同一个量，阈值语义不变）。只看最相似的一条，
+        # 跟原来 n_results=1 的行为一致。
+        similarities = mirror.matrix @ query_vector
+        row = int(np.argmax(similarities))
+        metadata = mirror.metadatas[row]
+        threshold = (
+            load_env.QA_CACHE_CURATED_THRESHOLD
+            if metadata.get("kind", KIND_AUTO) == KIND_CURATED
+            else load_env.QA_CACHE_AUTO_THRESHOLD
         )
-    except Exception:
-        pass
+        if float(similarities[row]) < threshold:
+            return None
+        return _record_hit(mirror, row)
+
+
+def _record_hit(mirror: _Mirror, row: int) -> CachedEntry:
+    """记一次命中并组装返回值，调用方持有 ``_mirror_lock``。
 
+    命中计数（驱逐排序用）只在内存里加，由 flush_hits 批量写回。hits 只是
+    驱逐排序的启发式信号，进程崩溃丢掉最后一批计数不影响正确性。
+    """
+    metadata = mirror.metadatas[row]
+    metadata["hits"] = int(metadata.get("hits", 0)) + 1
+    mirror.pending_hits.add(mirror.ids[row])
     return CachedEntry(
-        kind=kind,
+        kind=metadata.get("kind", KIND_AUTO),
         answer=metadata.get("answer", "") or "",
         source_file=metadata.get("source_file", "") or "",
         source_text=metadata.get("source_text", "") or "",
@@ -199,34 +420,41 @@ async def _store(
         embedding = await _embed(query)
         file_name, source_text = _first_source(source_nodes[0]) if source_nodes else ("", "")
         collection = _get_collection()
+        entry_id = _entry_id(kind, query)
+        metadata = {
+            "kind": kind,
+            "question": query,
+            "answer": _truncate(answer, _ANSWER_MAX_CHARS),
+            "source_file": _truncate(file_name, 200),
+            "source_text": _truncate(source_text, _SOURCE_TEXT_MAX_CHARS),
+            "created_at": time.time(),
+            "hits": 0,
+        }
         collection.upsert(
-            ids=[_entry_id(kind, query)],
+            ids=[entry_id],
             documents=[query],
             embeddings=[embedding],
-            metadatas=[
-                {
-                    "kind": kind,
-                    "question": query,
-                    "answer": _truncate(answer, _ANSWER_MAX_CHARS),
-                    "source_file": _truncate(file_name, 200),
-                    "source_text": _truncate(source_text, _SOURCE_TEXT_MAX_CHARS),
-                    "created_at": time.time(),
-                    "hits": 0,
-                }
-            ],
+            metadatas=[metadata],
         )
+        _mirror_upsert(collection, entry_id, embedding, metadata)
     except Exception:
+        _forget_collection()
         logger.warning("语义缓存写入失败（best-effort，不影响主流程）。", exc_info=True)
         return
 
     if kind == KIND_AUTO:
-        _evict_auto_if_needed(collection)
+        # 驱逐要先写回命中计数、再全量读 auto 条目的 metadata，都是同步 Chroma
+        # 调用，放到线程里跑，不占事件循环。
+        await asyncio.to_thread(_evict_auto_if_needed, collection)
 
 
 def _evict_auto_if_needed(collection) -> None:
-    """auto 条目超上限时，按命中次数升序驱逐最不常用的。curated 不驱逐。"""
+    """auto 条目超上限时，按命中次数升序驱逐最不常用的。curated 不驱逐。
+    （同步，供 to_thread 调用。）"""
     max_auto = load_env.QA_CACHE_MAX_AUTO_ENTRIES
     try:
+        # 先把内存里累计的命中计数写回，驱逐排序才是按真实命中次数排的。
+        _flush_hits_sync(collection)
         res = collection.get(where={"kind": KIND_AUTO}, include=["metadatas"])
         ids, metas = res.get("ids", []), res.get("metadatas", [])
         if len(ids) <= max_auto:
@@ -236,6 +464,7 @@ def _evict_auto_if_needed(collection) -> None:
         )
         victims = [pair[0] for pair in ordered[: len(ids) - max_auto]]
         collection.delete(ids=victims)
+        _mirror_remove(collection, victims)
         logger.info("语义缓存驱逐 %d 条低命中 auto 条目。", len(victims))
     except Exception:
         logger.warning("语义缓存驱逐失败（best-effort）。", exc_info=True)
@@ -268,6 +497,7 @@ async def delete_by_question(query: str) -> None:
         ids = res.get("ids", [])
         if ids:
             collection.delete(ids=ids)
+            _mirror_remove(collection, ids)
     except Exception:
         logger.warning("语义缓存按问题删除失败（best-effort）。", exc_info=True)
 
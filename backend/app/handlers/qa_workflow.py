@@ -13,14 +13,16 @@
 ## 索引选择逻辑：复用，不重新发明
 
 ``_build_retriever()`` 和 ``graph_builder._build_query_engine()`` 走的是**同一
-套**索引数量分支（0 个 / 1 个 / 多个）和**同一个** ``LLMSingleSelector``：
-0 个索引用一个返回空结果的占位 retriever（对应 ``MultiIndexQueryEngine`` 在
-无索引时的"Empty Response"行为）；1 个索引直接 ``index.as_retriever(...)``；
-多个索引用 ``RouterRetriever``（``RetrieverTool`` + 同一个
-``LLMSingleSelector.from_defaults()``）——这不是重新实现路由算法，只是把
-``RouterQueryEngine``/``QueryEngineTool`` 换成检索层的对应物
-``RouterRetriever``/``RetrieverTool``，选择逻辑（哪个索引、用哪个 selector）
-完全没变。
+套**索引数量分支（0 个 / 1 个 / 多个）：0 个索引用一个返回空结果的占位
+retriever（对应 ``MultiIndexQueryEngine`` 在无索引时的"Empty Response"行为）；
+1 个索引直接 ``build_retriever_for_index(...)``；多个索引默认走
+``handlers/index_router.EmbeddingIndexRouter``——问题向量和各索引画像（摘要
+嵌入 + chunk 质心）比相似度选索引，说不清时并发查最像的几个，只有画像完全
+区分不开时才退回原来的 ``RouterRetriever``（``RetrieverTool`` + 同一个
+``LLMSingleSelector.from_defaults()``，由 ``_build_llm_router_retriever``
+构造）。``INDEX_ROUTING_MODE=llm`` 恢复每个问题都走 LLM 选择器的旧行为；
+``INDEX_ROUTING_MODE=fanout`` 不选索引，所有索引并发查、全局 RRF 合并
+（``FanOutRetriever``，每个索引单独超时）。
 
 ## 流式实现：Workflow 原生机制，不复用 chat_engine 的 response_gen 那一套
 
@@ -137,6 +139,7 @@ import configs.load_env as load_env
 from configs.config import Prompts
 from handlers.hybrid_retriever import build_retriever_for_index
 from handlers.index_crud import indexes
+from handlers.index_router import EmbeddingIndexRouter, FanOutRetriever
 from llama_index.core.base.base_retriever import BaseRetriever
 from llama_index.core.base.llms.types import ChatMessage, MessageRole
 from llama_index.core.llms import LLM
@@ -153,6 +156,7 @@ from llama_index.core.workflow import (
     step,
 )
 from pydantic import Field
+from utils import request_timing
 from utils.llama import index_description
 from utils.rerank import ConditionalRerankPostprocessor
 
@@ -200,7 +204,8 @@ async def condense_query(query_str: str, chat_history: list[ChatMessage], llm: L
     )
 
     try:
-        completion = await resolved_llm.acomplete(prompt_str)
+        with request_timing.stage("condense"):
+            completion = await resolved_llm.acomplete(prompt_str)
         condensed = str(completion).strip()
         if not condensed:
             condensed = query_str
@@ -308,9 +313,23 @@ def _build_retriever(top_k: int | None = None) -> BaseRetriever:
     if len(indexes_snapshot) == 1:
         return build_retriever_for_index(indexes_snapshot[0], effective_top_k)
 
+    if load_env.INDEX_ROUTING_MODE == "llm":
+        return _build_llm_router_retriever(indexes_snapshot, effective_top_k)
+    if load_env.INDEX_ROUTING_MODE == "fanout":
+        return FanOutRetriever(indexes_snapshot, effective_top_k)
+    return EmbeddingIndexRouter(
+        indexes_snapshot,
+        effective_top_k,
+        fallback_factory=lambda: _build_llm_router_retriever(indexes_snapshot, effective_top_k),
+    )
+
+
+def _build_llm_router_retriever(indexes_snapshot: list, top_k: int) -> BaseRetriever:
+    """``RouterRetriever`` + ``LLMSingleSelector``：``INDEX_ROUTING_MODE=llm``
+    时的多索引检索器，也是嵌入路由区分不开时的兜底。"""
     retriever_tools = [
         RetrieverTool.from_defaults(
-            retriever=build_retriever_for_index(index, effective_top_k),
+            retriever=build_retriever_for_index(index, top_k),
             name=index.index_id,
             description=index_description(index),
         )
@@ -384,10 +403,12 @@ class QAWorkflow(Workflow):
 
         retriever = self._retriever if self._retriever is not None else _build_retriever()
         try:
-            nodes = await retriever.aretrieve(QueryBundle(query_str=query_str))
+            with request_timing.stage("retrieve"):
+                nodes = await retriever.aretrieve(QueryBundle(query_str=query_str))
         except Exception:
-            # RouterRetriever 的 LLM 选择器偶尔会解析出越界索引（"Failed to
-            # select retriever"），把第一次检索也兜住：检索失败降级为空 nodes，
+            # RouterRetriever 的 LLM 选择器（INDEX_ROUTING_MODE=llm 或嵌入路由
+            # 兜底时）偶尔会解析出越界索引（"Failed to select retriever"），
+            # 把第一次检索也兜住：检索失败降级为空 nodes，
             # 让 synthesize 走"我还不知道"的兜底文案，而不是 500。检索是回答
             # 问题的前置条件，失败不该让整个请求炸穿。
             logger.warning("首次检索失败，降级为空结果。", exc_info=True)
@@ -398,9 +419,12 @@ class QAWorkflow(Workflow):
         # 生产环境的条件触发式 rerank 钩子：见模块 docstring"rerank：挂钩，不
         # 重新实现"一节。ConditionalRerankPostprocessor 内部已经处理好
         # RERANK_ENABLED=False 时的直通截断逻辑，这里不需要再判断一次开关。
-        nodes = ConditionalRerankPostprocessor().postprocess_nodes(
-            nodes, query_bundle=QueryBundle(query_str=query_str)
-        )
+        # 走异步接口：cross-encoder 前向在 RerankService 的工作线程里跑，不卡
+        # 事件循环（见 utils/rerank.py 模块 docstring）。
+        with request_timing.stage("rerank"):
+            nodes = await ConditionalRerankPostprocessor().apostprocess_nodes(
+                nodes, query_bundle=QueryBundle(query_str=query_str)
+            )
 
         return RetrieveEvent(nodes=nodes, query_str=query_str, chat_history=chat_history, streaming=streaming)
 
@@ -423,6 +447,16 @@ class QAWorkflow(Workflow):
         if nodes[0].score >= load_env.QUERY_REWRITE_SCORE_THRESHOLD:
             return query_str, nodes
 
+        # 只有真的触发了改写才记这个阶段：改写的 LLM 调用 + 二次检索
+        with request_timing.stage("rewrite"):
+            return await self._rewrite_and_retrieve(retriever, query_str, nodes)
+
+    async def _rewrite_and_retrieve(
+        self,
+        retriever: BaseRetriever,
+        query_str: str,
+        nodes: list[NodeWithScore],
+    ) -> tuple[str, list[NodeWithScore]]:
         llm = self._llm if self._llm is not None else Settings.llm
         prompt_str = safe_format(
             Prompts.QUERY_REWRITE_PROMPT.value.template,
@@ -483,12 +517,15 @@ class QAWorkflow(Workflow):
 
         if ev.streaming:
             full_text_parts: list[str] = []
-            stream = await llm.astream_chat(messages)
-            async for chunk in stream:
-                delta = chunk.delta or ""
-                if delta:
-                    full_text_parts.append(delta)
-                    ctx.write_event_to_stream(TokenEvent(token=delta))
+            with request_timing.stage("generate"):
+                stream = await llm.astream_chat(messages)
+                async for chunk in stream:
+                    delta = chunk.delta or ""
+                    if delta:
+                        # 首 token 记的是从请求开始算的时间，用户实际等了多久
+                        request_timing.mark("first_token")
+                        full_text_parts.append(delta)
+                        ctx.write_event_to_stream(TokenEvent(token=delta))
             answer_text = "".join(full_text_parts)
             if not answer_text.strip():
                 # LLM 没吐出任何 token（比如空补全）：把兜底文案也当一个 token
@@ -496,7 +533,8 @@ class QAWorkflow(Workflow):
                 answer_text = _FALLBACK_ANSWER
                 ctx.write_event_to_stream(TokenEvent(token=answer_text))
         else:
-            chat_response = await llm.achat(messages)
+            with request_timing.stage("generate"):
+                chat_response = await llm.achat(messages)
             answer_text = chat_response.message.content or ""
             if not answer_text.strip():
                 answer_text = _FALLBACK_ANSWER
@@ -0,0 +1,247 @@
+"""检索结果缓存：同一个索引、同一内容版本、同一个（归一化后的）问题、同一个
+top_k，直接复用上一次的检索结果，跳过整条检索栈。
+
+## 解决什么问题
+
+答案级的 ``handlers/qa_cache`` 只在"问题足够像、且之前那次回答被存下来了"时
+命中；没命中时，一次检索要走 query 嵌入 + Chroma HNSW + jieba/BM25 + RRF 融合，
+然后才轮到 rerank。而同一个压缩后的问题在好几个地方被重复检索：不同同学问
+同一个热门问题（"国家奖学金多少钱"）、``auto_router.route_query`` 路由时先检索
+一次、紧接着 QAWorkflow 的 retrieve step 再检索一次、agent 的
+``search_knowledge_base`` 工具重试时又检索一次。嵌入有 ``CachedEmbedding``、
+重排分数有 ``RerankScoreCache``，中间这段 HNSW + BM25 + 融合每次都重算。
+
+## 缓存什么
+
+key 是 ``(index_id, 内容版本号, normalize_text_key(问题), top_k)``，值只存
+``(node_id, score, 融合附加字段)``，不存节点原文：命中后按 id 从 Chroma 取回
+节点（一次按主键的 ``get``，比 HNSW + BM25 便宜一个量级），缓存本身只占
+几十字节一条。融合附加字段（``FusedNodeWithScore`` 的两路原始分和
+``FusionSignal``）照原样还原——``utils.rerank`` 的 fusion 跳过判断靠它；
+每路耗时 ``leg_ms`` 不还原，命中时根本没跑两路。
+
+命中后的 rerank 也基本不花钱：同一批 (问题, 节点) 对的 cross-encoder 分数
+已经在 ``RerankScoreCache`` 里，所以"检索结果缓存 + 分数缓存"合起来让热门
+问题跳过了整条检索栈，只剩一次 Chroma 按 id 取原文。
+
+## 失效
+
+版本号就是 ``handlers.vector_store`` 存在 collection metadata 里的那个内容
+版本号：``router/index.py`` 上传/删除文档或节点时经
+``refresh_index_retrievers`` 加一，旧版本号的条目再也不会被查到。另外
+``invalidate_hybrid_retriever_cache`` 会顺带把同一索引的条目显式清掉：既不让
+旧条目白占 LRU 位置，也覆盖"删索引再建同名索引、版本号从 0 重新数"这种只靠
+版本号分不出来的情况。非 Chroma 的 vector store 没有版本号可比，不缓存。
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+# load_env.X 属性访问：开关要能被 reload_env_variables() 热更新。
+import configs.load_env as load_env
+from handlers.vector_store import get_collection_generation, is_chroma_store
+from llama_index.core import VectorStoreIndex
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from utils.embedding_cache import normalize_text_key
+
+if TYPE_CHECKING:
+    from llama_index.core.vector_stores.types import BasePydanticVectorStore
+
+logger = logging.getLogger(__name__)
+
+# 命中时还原到 FusedNodeWithScore 上的字段（leg_ms 故意不在里面，见模块 docstring）。
+_FUSED_FIELDS = ("dense_score", "bm25_score", "signal")
+
+CacheKey = tuple[str, int, str, int]
+CachedHit = tuple[str, float | None, dict | None]
+
+
+class RetrievalResultCache:
+    """线程安全的有界 LRU，值是一次检索结果的 ``[(node_id, score, extras)]``。"""
+
+    def __init__(self, max_entries: int) -> None:
+        self._max_entries = max(0, int(max_entries))
+        self._entries: OrderedDict[CacheKey, list[CachedHit]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: CacheKey) -> list[CachedHit] | None:
+        with self._lock:
+            hits = self._entries.get(key)
+            if hits is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return hits
+
+    def put(self, key: CacheKey, hits: list[CachedHit]) -> None:
+        if self._max_entries == 0:
+            return
+        with self._lock:
+            self._entries[key] = hits
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, index_id: str) -> int:
+        """删掉某个索引的全部条目，返回删掉的条数。"""
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == index_id]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self._max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_result_cache: RetrievalResultCache | None = None
+_result_cache_lock = threading.Lock()
+
+
+def get_retrieval_cache() -> RetrievalResultCache | None:
+    """进程级结果缓存；``RETRIEVAL_CACHE_ENABLED`` 关闭时返回 None。"""
+    global _result_cache
+    if not load_env.RETRIEVAL_CACHE_ENABLED:
+        return None
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                _result_cache = RetrievalResultCache(load_env.RETRIEVAL_CACHE_MAX_ENTRIES)
+    return _result_cache
+
+
+def invalidate_retrieval_cache(index_id: str | None = None) -> None:
+    """清掉某个索引（不传时全部）的缓存结果。缓存还没建出来时什么都不做。"""
+    if _result_cache is None:
+        return
+    if index_id is None:
+        _result_cache.clear()
+    else:
+        _result_cache.invalidate(index_id)
+
+
+def retrieval_cache_stats() -> dict:
+    """结果缓存命中统计（``/graph/cache_stats`` 用）。"""
+    if _result_cache is None:
+        return {"enabled": load_env.RETRIEVAL_CACHE_ENABLED, "entries": 0, "hits": 0, "misses": 0}
+    return {"enabled": load_env.RETRIEVAL_CACHE_ENABLED, **_result_cache.stats()}
+
+
+def _to_cached(nodes: list[NodeWithScore]) -> list[CachedHit]:
+    from handlers.hybrid_retriever import FusedNodeWithScore
+
+    return [
+        (
+            n.node.node_id,
+            n.score,
+            {name: getattr(n, name) for name in _FUSED_FIELDS} if isinstance(n, FusedNodeWithScore) else None,
+        )
+        for n in nodes
+    ]
+
+
+class CachedRetriever(BaseRetriever):
+    """给某个索引上的任意 retriever 加一层 ``RetrievalResultCache``。
+
+    开关在每次检索时读（``RETRIEVAL_CACHE_ENABLED``），不是构造时读：包好的
+    retriever 会被 ``handlers.hybrid_retriever`` 的 retriever 缓存长期持有，
+    热重载关掉开关之后不该还继续走缓存。
+    """
+
+    def __init__(self, inner: BaseRetriever, index: VectorStoreIndex, similarity_top_k: int) -> None:
+        self._inner = inner
+        self._index = index
+        # with_result_cache 只给 Chroma 索引包这一层，这里就是 ChromaVectorStore
+        self._vector_store: BasePydanticVectorStore = index.vector_store
+        self._similarity_top_k = similarity_top_k
+        super().__init__()
+
+    @property
+    def inner(self) -> BaseRetriever:
+        return self._inner
+
+    def _key(self, query_bundle: QueryBundle) -> CacheKey:
+        return (
+            self._index.index_id,
+            get_collection_generation(self._vector_store.client),
+            normalize_text_key(query_bundle.query_str),
+            self._similarity_top_k,
+        )
+
+    def _restore(self, hits: list[CachedHit]) -> list[NodeWithScore] | None:
+        """按 id 回 Chroma 取节点；有 id 取不到（版本号没跟上的外部删除）时
+        返回 None，当作没命中重新检索。"""
+        from handlers.hybrid_retriever import FusedNodeWithScore
+
+        if not hits:
+            return []
+        nodes = {n.node_id: n for n in self._vector_store.get_nodes([node_id for node_id, _, _ in hits])}
+        if len(nodes) < len({node_id for node_id, _, _ in hits}):
+            return None
+        return [
+            FusedNodeWithScore(node=nodes[node_id], score=score, **extras)
+            if extras is not None
+            else NodeWithScore(node=nodes[node_id], score=score)
+            for node_id, score, extras in hits
+        ]
+
+    def _lookup(self, query_bundle: QueryBundle) -> tuple[RetrievalResultCache | None, CacheKey | None, list | None]:
+        cache = get_retrieval_cache()
+        if cache is None:
+            return None, None, None
+        try:
+            key = self._key(query_bundle)
+            hits = cache.get(key)
+            return cache, key, None if hits is None else self._restore(hits)
+        except Exception:
+            # 缓存只是加速：读版本号或回 Chroma 取原文失败就当没命中，老老实实检索。
+            logger.warning("检索结果缓存读取失败（best-effort），回退到完整检索。", exc_info=True)
+            return None, None, None
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        cache, key, cached = self._lookup(query_bundle)
+        if cached is not None:
+            return cached
+        nodes = self._inner.retrieve(query_bundle)
+        if cache is not None and key is not None:
+            cache.put(key, _to_cached(nodes))
+        return nodes
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        # 读版本号、按 id 回 Chroma 取原文都是同步 IO，放到线程里做。
+        cache, key, cached = await asyncio.to_thread(self._lookup, query_bundle)
+        if cached is not None:
+            return cached
+        nodes = await self._inner.aretrieve(query_bundle)
+        if cache is not None and key is not None:
+            cache.put(key, _to_cached(nodes))
+        return nodes
+
+
+def with_result_cache(retriever: BaseRetriever, index: VectorStoreIndex, similarity_top_k: int) -> BaseRetriever:
+    """Chroma 索引上的 retriever 包一层 ``CachedRetriever``，其他原样返回。"""
+    if not is_chroma_store(getattr(index, "vector_store", None)):
+        return retriever
+    return CachedRetriever(retriever, index, similarity_top_k)
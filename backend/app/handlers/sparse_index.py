@@ -0,0 +1,230 @@
+"""按索引持久化、增量维护的 bge-m3 稀疏（lexical weight）倒排索引。
+
+``LEXICAL_RETRIEVAL_MODE=sparse`` 时混合检索的词项那一路用它代替 jieba BM25
+（``handlers/bm25_index.py``）。权重来源见 ``utils/sparse_embedding.py``：摄取时
+dense 嵌入的同一次前向顺手算出每个 chunk 的 ``{token_id: weight}``，存进节点
+metadata（也就进了 Chroma）；查询时问题的稀疏权重同样来自 dense 检索那次前向。
+
+## 存储：复用 BM25Index
+
+倒排表的结构跟 BM25 完全一样（词项 -> [(文档, 值)]，mmap 基线段 + 内存增量段
++ 墓碑删除 + 落盘压实），区别只有两点：词项是 token id（字符串形式），posting
+的值是 float 权重而不是整数词频；打分是稀疏点积 ``Σ q_w * d_w``，没有
+idf/文档长度归一。所以 ``SparseIndex`` 直接继承 ``BM25Index``，只换掉 posting
+的类型和 ``search``，落盘格式、增量段、墓碑这些都原样复用。
+
+## 与 Chroma 的一致性、重建
+
+跟 BM25 一样：Chroma 是唯一可信来源，首次加载比对存活文档数，对不上就从
+Chroma 重建。区别在于重建**不跑分词**——权重就在节点 metadata 里，直接读出来
+建表。只有在开启稀疏模式之前摄取的老 chunk（metadata 里没有权重）才需要补跑
+一次前向，这部分算出来的权重只进倒排表（随倒排表落盘），不回写 Chroma；
+重新上传一次文件就会带上。
+"""
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+import threading
+from collections.abc import Iterable
+
+import configs.load_env as load_env
+import numpy as np
+from handlers.bm25_index import BM25Index
+from llama_index.core.schema import BaseNode, MetadataMode
+from utils.sparse_embedding import SparseWeights, loads_weights
+
+logger = logging.getLogger(__name__)
+
+# 没有存权重的老 chunk 补算时每批的条数：一批一次前向。
+_BACKFILL_BATCH = 32
+
+
+class SparseIndex(BM25Index):
+    """一个索引的稀疏权重倒排表，线程安全。对外接口跟 ``BM25Index`` 一致，
+    ``add`` 换成 ``add_weights``、``search`` 的查询换成 ``{token_id: weight}``。"""
+
+    _WEIGHT_DTYPE = np.float32
+
+    def add_weights(self, node_id: str, weights: SparseWeights, ref_doc_id: str | None = None) -> None:
+        """加入一个 chunk；同 node_id 已存在时先删后加（等价于更新）。"""
+        with self._lock:
+            self._remove_locked(node_id)
+            slot = len(self._node_ids)
+            self._node_ids.append(node_id)
+            self._ref_doc_ids.append(ref_doc_id or "")
+            self._slot_of[node_id] = slot
+            if ref_doc_id:
+                self._slots_by_ref.setdefault(ref_doc_id, set()).add(slot)
+            # doc_len 在稀疏打分里用不到，记词项数只是为了沿用父类的存储布局。
+            self._doc_len.append(len(weights))
+            self._alive.append(True)
+            self._live_count += 1
+            self._total_len += len(weights)
+            for term, weight in weights.items():
+                self._delta.setdefault(term, {})[slot] = weight
+            self._arrays_cache = None
+
+    def add(self, node_id: str, tokens: list[str], ref_doc_id: str | None = None) -> None:
+        raise TypeError("SparseIndex 存的是 token 权重，用 add_weights()")
+
+    def add_nodes(self, nodes: Iterable[BaseNode], encoder=None) -> int:
+        """按节点 metadata 里的权重加入；没有权重的节点用 ``encoder`` 补算，
+        没传 encoder 就跳过。返回实际加入的个数。"""
+        added = 0
+        missing: list[BaseNode] = []
+        for node in nodes:
+            weights = loads_weights(node.metadata)
+            if weights is None:
+                missing.append(node)
+                continue
+            self.add_weights(node.node_id, weights, node.ref_doc_id)
+            added += 1
+        if missing and encoder is not None:
+            for start in range(0, len(missing), _BACKFILL_BATCH):
+                batch = missing[start : start + _BACKFILL_BATCH]
+                texts = [n.get_content(metadata_mode=MetadataMode.EMBED) for n in batch]
+                for node, (_, weights) in zip(batch, encoder.encode(texts)):
+                    self.add_weights(node.node_id, weights, node.ref_doc_id)
+                    added += 1
+        elif missing:
+            logger.warning("%d 个 chunk 没有稀疏权重且没有可用的编码器，未加入稀疏索引。", len(missing))
+        return added
+
+    def search(self, query_weights: SparseWeights, k: int) -> list[tuple[str, float]]:
+        """返回按稀疏点积降序的 ``(node_id, score)``，只含分数 > 0 的文档。"""
+        if k <= 0 or not query_weights:
+            return []
+        with self._lock:
+            if self._live_count == 0:
+                return []
+            alive, _ = self._arrays()
+            scores = np.zeros(len(self._node_ids), dtype=np.float32)
+            for term, query_weight in query_weights.items():
+                postings = self._postings(term)
+                if postings is None:
+                    continue
+                slots, weights = postings
+                mask = alive[slots]
+                np.add.at(scores, slots[mask], query_weight * weights[mask])
+            candidates = np.flatnonzero(scores > 0)
+            if len(candidates) > k:
+                top = np.argpartition(-scores[candidates], k - 1)[:k]
+                candidates = candidates[top]
+            order = candidates[np.argsort(-scores[candidates], kind="stable")]
+            return [(self._node_ids[slot], float(scores[slot])) for slot in order]
+
+
+# ---------------------------------------------------------------------------
+# 按索引名的进程级注册表 + 增量钩子（跟 handlers.bm25_index 一一对应）
+# ---------------------------------------------------------------------------
+
+_registry: dict[str, SparseIndex] = {}
+_registry_lock = threading.Lock()
+
+
+def _sparse_persist_dir(index_name: str) -> str:
+    return os.path.join(load_env.index_save_directory, f"{index_name}_sparse")
+
+
+def _load_persisted(index_name: str) -> SparseIndex | None:
+    with _registry_lock:
+        index = _registry.get(index_name)
+        if index is not None:
+            return index
+        path = _sparse_persist_dir(index_name)
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return None
+        try:
+            index = SparseIndex.load(path)
+        except Exception:
+            logger.warning("稀疏持久化索引 %s 加载失败，将从 Chroma 重建。", path, exc_info=True)
+            return None
+        _registry[index_name] = index
+        return index
+
+
+def _persist(index_name: str, index: SparseIndex) -> None:
+    try:
+        os.makedirs(load_env.index_save_directory, exist_ok=True)
+        index.save(_sparse_persist_dir(index_name))
+    except Exception:
+        logger.warning("稀疏索引 %s 落盘失败（best-effort）。", index_name, exc_info=True)
+
+
+def rebuild_sparse_index(index_name: str, vector_store, encoder=None) -> SparseIndex:
+    """从 Chroma 全量重建：读节点 metadata 里的权重，不跑分词。"""
+    index = SparseIndex()
+    index.add_nodes(vector_store.get_nodes(None), encoder)
+    _persist(index_name, index)
+    with _registry_lock:
+        _registry[index_name] = index
+    logger.info("稀疏索引 %s 从 Chroma 全量重建：%d 个 chunk。", index_name, len(index))
+    return index
+
+
+def get_sparse_index(index_name: str, vector_store, encoder=None) -> SparseIndex:
+    """取某个索引的稀疏倒排表：注册表 -> 磁盘 mmap -> Chroma 全量重建。"""
+    with _registry_lock:
+        index = _registry.get(index_name)
+    if index is not None:
+        return index
+    index = _load_persisted(index_name)
+    if index is not None:
+        try:
+            expected = vector_store.client.count()
+        except Exception:
+            expected = len(index)
+        if expected == len(index):
+            return index
+        logger.info("稀疏索引 %s 与 Chroma 不一致（%d vs %d），重建。", index_name, len(index), expected)
+    return rebuild_sparse_index(index_name, vector_store, encoder)
+
+
+def apply_upserts(index_name: str, nodes: list[BaseNode], encoder=None) -> None:
+    """摄取写入 Chroma 之后调用，语义同 ``bm25_index.apply_upserts``。"""
+    if not nodes:
+        return
+    index = _load_persisted(index_name)
+    if index is None:
+        return
+    for ref_doc_id in {n.ref_doc_id for n in nodes if n.ref_doc_id}:
+        index.remove_ref_doc(ref_doc_id)
+    index.add_nodes(nodes, encoder)
+    _persist(index_name, index)
+
+
+def remove_nodes(index_name: str, node_ids: list[str]) -> None:
+    index = _load_persisted(index_name)
+    if index is None or not node_ids:
+        return
+    for node_id in node_ids:
+        index.remove(node_id)
+    _persist(index_name, index)
+
+
+def update_node_weights(index_name: str, node_id: str, weights: SparseWeights | None) -> None:
+    """节点文本被改写后调用；拿不到新权重时把它从稀疏索引里摘掉，不留旧权重。"""
+    index = _load_persisted(index_name)
+    if index is None:
+        return
+    if weights is None:
+        index.remove(node_id)
+    else:
+        index.add_weights(node_id, weights, index.ref_doc_id_of(node_id))
+    _persist(index_name, index)
+
+
+def drop_sparse_index(index_name: str) -> None:
+    with _registry_lock:
+        _registry.pop(index_name, None)
+    path = _sparse_persist_dir(index_name)
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def clear_sparse_registry() -> None:
+    """只清进程内注册表，不动磁盘（测试隔离用）。"""
+    with _registry_lock:
+        _registry.clear()
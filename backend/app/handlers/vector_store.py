@@ -1,11 +1,21 @@
+import json
+import logging
+import math
 import os
 import shutil
+import sys
 
-import chromadb
 import configs.load_env as load_env
 from llama_index.core import Settings, VectorStoreIndex
 from llama_index.core.storage.docstore import SimpleDocumentStore
-from llama_index.vector_stores.chroma import ChromaVectorStore
+
+# chromadb（连同 llama_index 的 ChromaVectorStore，它在模块顶层 import chromadb）
+# 单独 import 就要一秒左右，而且会顺带拉进 sqlalchemy、一堆 embedding function。
+# handlers 包被 dependencies / 各个 router 在顶层 import，所以这里不在模块顶层
+# import 它：第一次真正连库（_get_client）或建 vector store 时再加载。
+_CHROMA_STORE_MODULE = "llama_index.vector_stores.chroma"
+
+logger = logging.getLogger(__name__)
 
 _client_instance = None
 
@@ -13,10 +23,48 @@ _client_instance = None
 def _get_client():
     global _client_instance
     if _client_instance is None:
+        import chromadb
+
         _client_instance = chromadb.PersistentClient(path=load_env.chroma_db_path)
     return _client_instance
 
 
+def reset_client() -> None:
+    """丢掉本进程的 chromadb 客户端，下一次 ``_get_client`` 重新打开。
+
+    chromadb 按路径缓存底层 System（连同加载进内存的 HNSW 向量索引），只把
+    ``_client_instance`` 置空的话新客户端还是同一个 System，看不到其他进程写入
+    的向量，所以连缓存一起清。多 worker 下收到其他 worker 的索引变更通知时用，
+    见 handlers/index_events.py。
+
+    清掉的 System 要先 ``stop()``：只从缓存里拿掉的话它的 SQLite 连接、HNSW
+    索引和后台线程都还在，每收到一次通知就泄漏一份。代价是手里还拿着旧
+    collection 句柄的调用会报错——索引随后由 ``loadAllIndexes`` 整体重建，
+    qa_cache 发现客户端换了会重新打开句柄（见 ``qa_cache._get_collection``）。
+    """
+    global _client_instance
+    _client_instance = None
+    if "chromadb" in sys.modules:
+        from chromadb.api.client import SharedSystemClient
+
+        systems = list(SharedSystemClient._identifier_to_system.values())
+        SharedSystemClient.clear_system_cache()
+        for system in systems:
+            try:
+                system.stop()
+            except Exception:
+                logger.warning("chromadb System 停止失败。", exc_info=True)
+
+
+def is_chroma_store(vector_store) -> bool:
+    """``isinstance(vector_store, ChromaVectorStore)``，但不为了这个判断去 import chromadb。
+
+    ChromaVectorStore 所在模块还没加载过，就不可能存在它的实例，直接返回 False。
+    """
+    module = sys.modules.get(_CHROMA_STORE_MODULE)
+    return module is not None and isinstance(vector_store, module.ChromaVectorStore)
+
+
 def get_or_create_collection(name: str, metadata: dict | None = None):
     """取（不存在则创建）一个 Chroma collection。
 
@@ -28,6 +76,87 @@ def get_or_create_collection(name: str, metadata: dict | None = None):
     return client.get_or_create_collection(name, metadata=metadata)
 
 
+def collection_space(collection) -> str:
+    """collection 的距离空间（``l2``/``cosine``/``ip``）。
+
+    以 configuration 为准（modify 时 ``hnsw:*`` 会从 metadata 里剔掉，见
+    ``update_collection_metadata``），旧版本 Chroma 没有 configuration 时退回
+    metadata；都没写就是 Chroma 默认的 l2——索引的 collection 都是这样建的。
+    """
+    configuration = getattr(collection, "configuration", None) or {}
+    space = (configuration.get("hnsw") or {}).get("space") or (collection.metadata or {}).get("hnsw:space")
+    return str(space or "l2")
+
+
+def chroma_score_to_cosine(score: float | None, space: str) -> float:
+    """把 ``ChromaVectorStore`` 返回的 score 换算回余弦相似度。
+
+    llama_index 给的 score 是 ``exp(-d)``，``d`` 是 Chroma 的原始距离：l2 空间下
+    是欧氏距离的平方，向量归一化（bge-m3 是）时 ``d = 2 - 2·cos``；cosine/ip
+    空间下 ``d = 1 - cos``。所以索引 collection（l2）的 score 既不是余弦，也不在
+    余弦的刻度上，拿它比余弦阈值之前要先换算。
+    """
+    if score is None or score <= 0:
+        return -1.0
+    distance = -math.log(score)
+    if space == "l2":
+        return 1.0 - distance / 2
+    return 1.0 - distance
+
+
+# collection 级"内容版本号"，存在 Chroma collection 自己的 metadata 里：跟
+# collection 同生同灭（删索引自动清零）、进程重启后还在，不需要再维护一份
+# 旁路存储。每次该索引内容变化（上传/删除文档或节点）由 router/index.py 经
+# handlers.hybrid_retriever.refresh_index_retrievers 加一。
+_GENERATION_METADATA_KEY = "cuitcca:generation"
+
+
+def get_collection_generation(collection) -> int:
+    """读 collection 当前的内容版本号，从没写过时为 0。"""
+    return int((collection.metadata or {}).get(_GENERATION_METADATA_KEY, 0))
+
+
+def update_collection_metadata(collection, **updates) -> None:
+    """合并写 collection metadata：只改 ``updates`` 里的 key，其余原样保留。
+
+    ``collection.modify(metadata=...)`` 是**整体替换**而不是合并，所以要带上
+    原有的其他 key；但 ``hnsw:*`` 必须剔掉——Chroma 把它们当成创建参数，
+    modify 时出现就直接报"不支持修改距离函数"（距离空间已经记在 collection
+    的 configuration 里，剔掉不会丢，qa_cache 的 cosine 不受影响）。
+    """
+    metadata = {k: v for k, v in (collection.metadata or {}).items() if not k.startswith("hnsw:")}
+    metadata.update(updates)
+    collection.modify(metadata=metadata)
+
+
+def bump_collection_generation(collection) -> int:
+    """把 collection 的内容版本号加一并写回 Chroma，返回新版本号。"""
+    generation = get_collection_generation(collection) + 1
+    update_collection_metadata(collection, **{_GENERATION_METADATA_KEY: generation})
+    return generation
+
+
+def patch_node_metadata(chroma_metadata: dict | None, updates: dict) -> dict:
+    """把 ``updates`` 写进一条 Chroma 记录的 metadata，返回新 dict（给
+    ``collection.update(metadatas=...)`` 用）。
+
+    ``ChromaVectorStore.get_nodes`` 还原节点时 metadata 取自 ``_node_content``
+    里序列化的整个节点，不是顶层那几个扁平字段，所以两处都要改——只改顶层的话，
+    下次从 Chroma 重建 BM25/稀疏倒排表时读到的还是旧值。
+    """
+    metadata = dict(chroma_metadata or {})
+    metadata.update(updates)
+    raw = metadata.get("_node_content")
+    if raw:
+        try:
+            node = json.loads(raw)
+        except ValueError:
+            return metadata
+        node.setdefault("metadata", {}).update(updates)
+        metadata["_node_content"] = json.dumps(node, ensure_ascii=False)
+    return metadata
+
+
 def list_index_names() -> list[str]:
     client = _get_client()
     return [c.name for c in client.list_collections()]
@@ -46,6 +175,15 @@ def delete_collection(name: str):
         os.remove(_docstore_persist_path(name))
     except FileNotFoundError:
         pass
+    # 同理清理持久化的 BM25 倒排表（{name}_bm25/）和进程内注册表条目：
+    # 重建同名索引后不能拿旧语料的倒排表去打分。延迟导入避免循环依赖
+    # （bm25_index 只依赖 load_env，但 hybrid_retriever -> bm25_index ->
+    # vector_store 的链路以后加东西很容易绕回来）。
+    from handlers.bm25_index import drop_bm25_index
+    from handlers.sparse_index import drop_sparse_index
+
+    drop_bm25_index(name)
+    drop_sparse_index(name)
     # 连带清理 SAVE_PATH 下该索引的源文件目录（{SAVE_PATH}/{name}/，上传时
     # 按 index.index_id 落盘，见 router/index.py uploadFiles）。跟 docstore 是
     # 同类"删除不彻底"问题：不删的话磁盘上会积累孤儿文件，重建同名索引后
@@ -66,6 +204,8 @@ def delete_collection(name: str):
 
 
 def build_index_from_collection(collection) -> VectorStoreIndex:
+    from llama_index.vector_stores.chroma import ChromaVectorStore
+
     vector_store = ChromaVectorStore(chroma_collection=collection)
     index = VectorStoreIndex.from_vector_store(
         vector_store=vector_store,
@@ -75,6 +215,8 @@ def build_index_from_collection(collection) -> VectorStoreIndex:
 
 
 def create_empty_index(index_name: str) -> VectorStoreIndex:
+    from llama_index.vector_stores.chroma import ChromaVectorStore
+
     collection = get_or_create_collection(index_name)
     vector_store = ChromaVectorStore(chroma_collection=collection)
     index = VectorStoreIndex.from_vector_store(
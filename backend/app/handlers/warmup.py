@@ -0,0 +1,247 @@
+"""启动预热和就绪状态（``/health/ready``）。
+
+## 解决什么问题
+
+``lifespan`` 里只有 ``init_settings`` 会加载 bge-m3，其余重量级的东西都是
+第一个用户问题触发的懒加载：
+
+- bge-m3 第一次前向（torch 的算子初始化、内存分配，比之后的前向慢一个量级）；
+- jieba 词典（约 1 秒，BM25 查询第一次分词时加载）；
+- cross-encoder（``utils/rerank._get_reranker``，2GB 级模型，秒级加载 + 首次前向）；
+- 每个索引的混合检索 retriever（``build_retriever_for_index``：从磁盘 mmap 或
+  从 Chroma 重建 BM25 倒排表）。
+
+所以部署或重启后的第一个问题要等好几秒。负载均衡只看进程端口通不通，会把
+流量直接打到这台还没热起来的实例上。
+
+## 做法
+
+``lifespan`` 启动阶段照旧同步跑完（每一步记耗时），然后在后台 task 里按
+``WARMUP_PHASES`` 依次预热上面几项，每一步用 ``asyncio.to_thread`` 跑，不卡
+事件循环——预热期间进程已经能响应请求（包括 ``/health/ready`` 本身）。全部
+预热跑完之后 ``/health/ready`` 才从 503 翻到 200；负载均衡用它做就绪探针，
+冷实例就不会接到流量。
+
+每一步都是 best-effort：某一步失败（比如离线环境拉不到 reranker 模型）只记成
+``failed`` 并打日志，不会让实例永远不就绪——没预热成功的那一项回到原来的
+懒加载路径，第一个用到它的请求多等一会儿，跟没有预热时一样。
+
+启动和预热每一步的耗时、状态都在 ``/health/ready`` 的响应体里，预热结束时
+也会打一条汇总日志，用来看"重启到能接流量"到底花在哪。
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+# load_env.X 属性访问：开关要能被 reload_env_variables() 热更新。
+import configs.load_env as load_env
+
+logger = logging.getLogger(__name__)
+
+# WARMUP_PHASES 里可选的预热项，按这个顺序执行：先把 embedding 和 jieba 热起来，
+# 建 retriever 时（可能要从 Chroma 重建 BM25 倒排表）就不用再等它们。
+KNOWN_PHASES = ("embedding", "jieba", "reranker", "retrievers")
+
+_WARMUP_QUERY = "预热"
+
+
+class PhaseSkipped(Exception):
+    """预热项在当前配置下用不到（比如 rerank 关着），记成 skipped 而不是 failed。"""
+
+
+@dataclass
+class PhaseResult:
+    name: str
+    status: str = "pending"  # pending / running / ok / failed / skipped
+    ms: float | None = None
+    detail: str | None = None
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "status": self.status, "ms": self.ms, "detail": self.detail}
+
+
+class WarmupState:
+    """一次进程启动的阶段耗时记录 + 就绪标记。"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.startup: list[PhaseResult] = []
+        self.warmup: list[PhaseResult] = []
+        self.ready = False
+        self._started = time.perf_counter()
+        self.ready_after_ms: float | None = None
+
+    @contextmanager
+    def startup_phase(self, name: str):
+        """给 lifespan 里的同步启动步骤计时；异常照常往外抛（启动失败就是失败）。"""
+        phase = PhaseResult(name, status="running")
+        with self._lock:
+            self.startup.append(phase)
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException as exc:
+            phase.status, phase.detail = "failed", repr(exc)
+            raise
+        else:
+            phase.status = "ok"
+        finally:
+            phase.ms = round((time.perf_counter() - started) * 1000, 1)
+
+    def mark_ready(self) -> None:
+        with self._lock:
+            self.ready = True
+            self.ready_after_ms = round((time.perf_counter() - self._started) * 1000, 1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "ready_after_ms": self.ready_after_ms,
+                "startup": [p.to_dict() for p in self.startup],
+                "warmup": [p.to_dict() for p in self.warmup],
+            }
+
+
+_state = WarmupState()
+
+
+def warmup_state() -> WarmupState:
+    return _state
+
+
+def reset_warmup_state() -> WarmupState:
+    """lifespan 开始时调用：每次启动一份新的记录（测试里 lifespan 会跑多次）。"""
+    global _state
+    _state = WarmupState()
+    return _state
+
+
+# ---------------------------------------------------------------------------
+# 各预热项
+# ---------------------------------------------------------------------------
+
+
+def _warm_embedding() -> str | None:
+    from llama_index.core import Settings
+
+    embed_model = getattr(Settings, "_embed_model", None)
+    if embed_model is None:
+        raise PhaseSkipped("no embed model configured")
+    embed_model.get_query_embedding(_WARMUP_QUERY)
+    return None
+
+
+def _warm_jieba() -> str | None:
+    # 稀疏模式下查询不分词，混合检索关着时也用不到 BM25。
+    if not load_env.HYBRID_RETRIEVAL_ENABLED or load_env.LEXICAL_RETRIEVAL_MODE == "sparse":
+        raise PhaseSkipped("BM25 leg not in use")
+    import jieba
+
+    jieba.initialize()
+    return None
+
+
+def _warm_reranker() -> str | None:
+    if not load_env.RERANK_ENABLED:
+        raise PhaseSkipped("RERANK_ENABLED is off")
+    from utils.rerank import _cross_encoder_score_pairs
+
+    # 加载模型 + 一次前向：首次前向同样比之后慢得多。
+    _cross_encoder_score_pairs([(_WARMUP_QUERY, _WARMUP_QUERY)])
+    return None
+
+
+def _default_top_ks() -> list[int]:
+    """线上查询路径实际会用的 top_k：QAWorkflow/agent 的缺省值和 /query 接口的。"""
+    from handlers.qa_workflow import resolve_effective_top_k
+
+    return sorted({resolve_effective_top_k(None), load_env.QUERY_ENDPOINT_TOP_K})
+
+
+def _warm_retrievers() -> str | None:
+    from handlers.hybrid_retriever import build_retriever_for_index
+    from handlers.index_crud import indexes
+
+    snapshot = list(indexes)
+    if not snapshot:
+        raise PhaseSkipped("no indexes loaded")
+    top_ks = _default_top_ks()
+    failed = []
+    for index in snapshot:
+        for top_k in top_ks:
+            try:
+                build_retriever_for_index(index, top_k)
+            except Exception:
+                logger.warning("索引 %s top_k=%d 的检索器预热失败。", index.index_id, top_k, exc_info=True)
+                failed.append(f"{index.index_id}@{top_k}")
+    if failed:
+        raise RuntimeError(f"retriever warm-up failed for {', '.join(failed)}")
+    return f"{len(snapshot)} indexes x top_k {top_ks}"
+
+
+_PHASE_FUNCS: dict[str, Callable[[], str | None]] = {
+    "embedding": _warm_embedding,
+    "jieba": _warm_jieba,
+    "reranker": _warm_reranker,
+    "retrievers": _warm_retrievers,
+}
+
+
+def configured_phases() -> list[str]:
+    """按 ``KNOWN_PHASES`` 的顺序返回 ``WARMUP_PHASES`` 里配置的预热项，
+    不认识的名字记一条警告后忽略。"""
+    requested = set(load_env.WARMUP_PHASES)
+    unknown = requested - set(KNOWN_PHASES)
+    if unknown:
+        logger.warning("WARMUP_PHASES 里有不认识的预热项，已忽略：%s", ", ".join(sorted(unknown)))
+    return [name for name in KNOWN_PHASES if name in requested]
+
+
+async def run_warmup(state: WarmupState | None = None) -> WarmupState:
+    """依次跑完配置的预热项，然后把实例标记为就绪。每一项失败都只记录不抛。"""
+    state = state or _state
+    phases = [PhaseResult(name) for name in configured_phases()]
+    with state._lock:
+        state.warmup = phases
+    for phase in phases:
+        phase.status = "running"
+        started = time.perf_counter()
+        try:
+            detail = await asyncio.to_thread(_PHASE_FUNCS[phase.name])
+        except PhaseSkipped as exc:
+            phase.status, phase.detail = "skipped", str(exc)
+        except Exception as exc:
+            logger.warning("预热 %s 失败，相关功能回到首次使用时懒加载。", phase.name, exc_info=True)
+            phase.status, phase.detail = "failed", repr(exc)
+        else:
+            phase.status, phase.detail = "ok", detail
+        phase.ms = round((time.perf_counter() - started) * 1000, 1)
+    state.mark_ready()
+    _log_report(state)
+    return state
+
+
+def _log_report(state: WarmupState) -> None:
+    snapshot = state.snapshot()
+    parts = [
+        f"{p['name']}={p['ms']}ms({p['status']})"
+        for p in snapshot["startup"] + snapshot["warmup"]
+    ]
+    logger.info("实例就绪，启动后 %.1fms：%s", snapshot["ready_after_ms"], " ".join(parts))
+
+
+def start_warmup(state: WarmupState | None = None) -> asyncio.Task | None:
+    """lifespan 启动阶段结束时调用。``WARMUP_ENABLED`` 关闭时直接标记就绪，
+    返回 None；否则返回后台预热 task（lifespan 退出时取消它）。"""
+    state = state or _state
+    if not load_env.WARMUP_ENABLED:
+        state.mark_ready()
+        return None
+    return asyncio.create_task(run_warmup(state))
@@ -1,6 +1,9 @@
 import asyncio
+import http.cookies
+import logging
 import os
 import time
+import types
 import uuid
 from collections import defaultdict
 from contextlib import asynccontextmanager
@@ -11,69 +14,148 @@ from contextlib import asynccontextmanager
 import configs.load_env as load_env
 from configs.llm_predictor import init_settings
 from configs.observability import init_observability
-from dependencies import access_stats
-from dependencies.manage import access_stats as _mgmt_access_stats
-from dependencies.manage import access_stats_lock
+from dependencies import access_counter, access_stats, access_stats_lock, request_metrics
 from fastapi import FastAPI, HTTPException, status
 from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
+from handlers import index_events, qa_cache, warmup
 from handlers.index_crud import loadAllIndexes
 from router.graph import graph_app
 from router.index import index_app
 from router.manage import manage_app
 from router.response import response_app
 from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from utils import db as stats_db
+from utils import request_timing, shared_state
+from utils.rate_limit import BucketedRateLimiter
+from utils.request_metrics import UNMATCHED
 from utils.security import get_client_ip
 
+logger = logging.getLogger(__name__)
+
+
+# 多 worker 时隔多久从库里整表重读一次访问合计（见 _flush_access_stats）
+_STATS_RELOAD_SECONDS = 600
+_stats_reloaded_at = 0.0
+
+
+def _replace_access_stats(loaded: dict) -> None:
+    """用 ``stats_db.load_stats`` 读出的合计整体替换 ``access_stats``。"""
+    global _stats_reloaded_at
+    access_stats["total_visits"] = loaded["total_visits"]
+    access_stats["user_visits"] = defaultdict(int, loaded["user_visits"])
+    access_stats["endpoint_visits"] = defaultdict(int, loaded["endpoint_visits"])
+    access_stats["ip_count"] = len(access_stats["user_visits"])
+    _stats_reloaded_at = time.monotonic()
+
+
+async def _flush_access_stats() -> None:
+    """把中间件攒下的访问计数增量累加进库，再把同一份增量加到 ``access_stats`` 上。
+
+    刷库和更新内存的开销都只跟这一分钟里变化的 key 数有关。单 worker 时库里的
+    合计就等于本进程的计数；多 worker（启用了共享状态库）时其他 worker 的增量
+    只在库里，每 ``_STATS_RELOAD_SECONDS`` 秒才整表重读一次——``load_stats`` 要
+    扫全部 ip_visits，不能每分钟跑。所以 /manage 上其他 worker 的部分最多滞后
+    一个重读周期。刷库期间新来的请求记在 ``access_counter`` 新的增量里，下一轮再刷。
+    """
+    delta = access_counter.drain()
+    try:
+        await asyncio.to_thread(stats_db.add_stats_delta, load_env.db_path, delta)
+    except Exception:
+        access_counter.restore(delta)
+        raise
+    if shared_state.shared_backend() is not None and time.monotonic() - _stats_reloaded_at >= _STATS_RELOAD_SECONDS:
+        loaded = await asyncio.to_thread(stats_db.load_stats, load_env.db_path)
+        async with access_stats_lock:
+            _replace_access_stats(loaded)
+        return
+    async with access_stats_lock:
+        access_stats["total_visits"] += delta["total_visits"]
+        for ip, count in delta["user_visits"].items():
+            access_stats["user_visits"][ip] += count
+        for endpoint, count in delta["endpoint_visits"].items():
+            access_stats["endpoint_visits"][endpoint] += count
+        access_stats["ip_count"] = len(access_stats["user_visits"])
+
+
+async def _flush_request_metrics(include_current: bool = False) -> None:
+    """把已经结束的分钟的请求指标累加进库（进程退出前连同当前分钟一起）。"""
+    rows = request_metrics.drain_completed(include_current=include_current)
+    try:
+        await asyncio.to_thread(
+            stats_db.add_request_metrics, load_env.db_path, rows, load_env.REQUEST_METRICS_RETENTION_DAYS
+        )
+    except Exception:
+        request_metrics.restore(rows)
+        raise
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    load_env.reload_env_variables()
-    init_observability()
-    init_settings()
-    await loadAllIndexes()
+    # 每一步记耗时，连同后台预热的结果一起出现在 /health/ready 里（handlers/warmup.py）。
+    startup = warmup.reset_warmup_state()
+    with startup.startup_phase("env"):
+        load_env.reload_env_variables()
+    with startup.startup_phase("observability"):
+        init_observability()
+    with startup.startup_phase("shared_state"):
+        # 多 worker 部署时会话、限流、索引变更通知都走共享状态库（utils/shared_state.py）。
+        shared_state.init_shared_state()
+    with startup.startup_phase("embedding_model"):
+        init_settings()
+    with startup.startup_phase("indexes"):
+        await loadAllIndexes()
     for directory in [load_env.SAVE_PATH, load_env.LOAD_PATH, load_env.chroma_db_path]:
         if not os.path.exists(directory):
             os.makedirs(directory)
     os.makedirs(os.path.dirname(load_env.db_path), exist_ok=True)
-    await asyncio.to_thread(stats_db.init_db, load_env.db_path)
-
-    loaded = await asyncio.to_thread(stats_db.load_stats, load_env.db_path)
-    _mgmt_access_stats["total_visits"] = loaded["total_visits"]
-    _mgmt_access_stats["user_visits"] = defaultdict(int, loaded["user_visits"])
-    _mgmt_access_stats["endpoint_visits"] = defaultdict(int, loaded["endpoint_visits"])
-    _mgmt_access_stats["ip_count"] = len(_mgmt_access_stats["user_visits"])
+    with startup.startup_phase("stats_db"):
+        await asyncio.to_thread(stats_db.init_db, load_env.db_path)
+        loaded = await asyncio.to_thread(stats_db.load_stats, load_env.db_path)
+    _replace_access_stats(loaded)
+    request_metrics.ring_minutes = load_env.REQUEST_METRICS_RING_MINUTES
 
     async def _periodic_flush():
         while True:
             await asyncio.sleep(60)
-            async with access_stats_lock:
-                snapshot = {
-                    "total_visits": _mgmt_access_stats["total_visits"],
-                    "user_visits": dict(_mgmt_access_stats["user_visits"]),
-                    "endpoint_visits": dict(_mgmt_access_stats["endpoint_visits"]),
-                }
-            await asyncio.to_thread(stats_db.flush_stats, load_env.db_path, snapshot)
+            try:
+                await _flush_access_stats()
+            except Exception:
+                # 增量已经放回 access_counter，下一轮连同新的一起刷
+                logger.warning("访问统计刷库失败，下一轮重试。", exc_info=True)
+            try:
+                await _flush_request_metrics()
+            except Exception:
+                logger.warning("请求指标刷库失败，下一轮重试。", exc_info=True)
+            # 语义缓存的命中计数同样是内存累加、定期批量写回（handlers/qa_cache.py
+            # 模块 docstring"热路径"一节），跟访问统计搭同一个周期。
+            await qa_cache.flush_hits()
 
     flush_task = asyncio.create_task(_periodic_flush())
     rate_limit_cleanup_task = asyncio.create_task(_periodic_rate_limit_cleanup())
+    # 预热在后台跑，不挡 lifespan：进程先能响应（/health/ready 返回 503），
+    # 预热完再翻成就绪。WARMUP_ENABLED 关闭时直接就绪，返回 None。
+    warmup_task = warmup.start_warmup(startup)
+    # 其他 worker 改了索引之后本 worker 跟着重载；没有共享后端时立即返回。
+    index_watch_task = asyncio.create_task(index_events.watch_index_changes())
 
     yield
 
-    for task in (flush_task, rate_limit_cleanup_task):
+    for task in (flush_task, rate_limit_cleanup_task, warmup_task, index_watch_task):
+        if task is None:
+            continue
         task.cancel()
         try:
             await task
         except asyncio.CancelledError:
             pass
-    async with access_stats_lock:
-        final_snapshot = {
-            "total_visits": _mgmt_access_stats["total_visits"],
-            "user_visits": dict(_mgmt_access_stats["user_visits"]),
-            "endpoint_visits": dict(_mgmt_access_stats["endpoint_visits"]),
-        }
-    await asyncio.to_thread(stats_db.flush_stats, load_env.db_path, final_snapshot)
+    await _flush_access_stats()
+    await _flush_request_metrics(include_current=True)
+    await qa_cache.flush_hits()
+    shared_state.close_shared_state()
+    await asyncio.to_thread(stats_db.close_db)
 
 
 app = FastAPI(lifespan=lifespan)
@@ -83,32 +165,36 @@ app.include_router(graph_app, prefix='/graph', tags=['graph'])
 app.include_router(response_app, prefix='/response', tags=['response'])
 app.include_router(manage_app, prefix='/manage', tags=['manage'])
 
+
+@app.get("/health/ready")
+async def health_ready():
+    """就绪探针：后台预热跑完之前返回 503，之后 200；响应体是启动和预热
+    每一步的耗时报告。"""
+    snapshot = warmup.warmup_state().snapshot()
+    code = status.HTTP_200_OK if snapshot["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE
+    return JSONResponse(content=snapshot, status_code=code)
+
 # 速率限制：每 IP 每 60 秒最多 30 次请求（LLM 查询端点）
 RATE_LIMIT_WINDOW = 60
 RATE_LIMIT_MAX_REQUESTS = 30
 _RATE_LIMIT_STORE_MAX = 5000
 RATE_LIMIT_STORE_MAX = _RATE_LIMIT_STORE_MAX  # backward-compat alias
-_rate_limit_store: dict[str, list[float]] = defaultdict(list)
-_rate_limit_lock = asyncio.Lock()
-
-
-def _evict_expired_rate_limits() -> None:
-    now = time.time()
-    expired_keys = [k for k, v in _rate_limit_store.items() if not v or v[-1] < now - RATE_LIMIT_WINDOW]
-    for k in expired_keys:
-        _rate_limit_store.pop(k, None)
-    overflow = len(_rate_limit_store) - _RATE_LIMIT_STORE_MAX
-    if overflow > 0:
-        keys_to_remove = list(_rate_limit_store.keys())[:overflow]
-        for k in keys_to_remove:
-            _rate_limit_store.pop(k, None)
+# 单 worker 时的进程内限流：每个 IP 固定几个计数桶，常数时间检查、不需要锁
+# （utils/rate_limit.py）。_rate_limit_store 是它的 key -> 计数桶字典，测试里用来清空。
+_rate_limiter = BucketedRateLimiter(RATE_LIMIT_MAX_REQUESTS, RATE_LIMIT_WINDOW, max_keys=_RATE_LIMIT_STORE_MAX)
+_rate_limit_store = _rate_limiter.buckets
 
 
 async def _periodic_rate_limit_cleanup():
     while True:
         await asyncio.sleep(30)
-        async with _rate_limit_lock:
-            _evict_expired_rate_limits()
+        _rate_limiter.evict_expired()
+        backend = shared_state.shared_backend()
+        if backend is not None:
+            try:
+                await asyncio.to_thread(backend.prune, RATE_LIMIT_WINDOW)
+            except Exception:
+                logger.warning("共享状态库清理失败，下一轮重试。", exc_info=True)
 
 
 # 会触发 LLM 调用的端点——这些才需要限流。
@@ -150,17 +236,20 @@ def is_llm_endpoint(path: str) -> bool:
 
 async def check_rate_limit(client_ip: str) -> None:
     """检查客户端 IP 是否超过速率限制"""
-    now = time.time()
-    async with _rate_limit_lock:
-        timestamps = _rate_limit_store[client_ip]
-        while timestamps and timestamps[0] < now - RATE_LIMIT_WINDOW:
-            timestamps.pop(0)
-        if len(timestamps) >= RATE_LIMIT_MAX_REQUESTS:
+    backend = shared_state.shared_backend()
+    if backend is not None:
+        # 多 worker：计数放在共享状态库里，"查+记"在一个事务里完成。
+        if not await asyncio.to_thread(backend.rate_limit_hit, client_ip, RATE_LIMIT_WINDOW, RATE_LIMIT_MAX_REQUESTS):
             raise HTTPException(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                 detail=f"请求过于频繁，请 {RATE_LIMIT_WINDOW} 秒后重试",
             )
-        timestamps.append(now)
+        return
+    if not _rate_limiter.hit(client_ip):
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"请求过于频繁，请 {RATE_LIMIT_WINDOW} 秒后重试",
+        )
 
 
 _STATIC_SUFFIXES = frozenset({
@@ -182,48 +271,144 @@ def _is_static_path(path: str) -> bool:
     return dot > path.rfind('/') and path[dot:].lower() in _STATIC_SUFFIXES
 
 
-@app.middleware("http")
-async def session_and_stats_middleware(request, call_next):
-    is_static = _is_static_path(request.url.path)
-    client_ip = get_client_ip(request)
+def _is_health_path(path: str) -> bool:
+    """负载均衡的健康探针每隔几秒打一次，不算访问量、不发 session cookie。"""
+    return path.startswith('/health/')
+
 
-    session_id = request.cookies.get("session_id")
-    has_session = bool(session_id)
-    if not has_session:
-        session_id = str(uuid.uuid4())
-    request.state.session_id = session_id
+def _session_cookie_header(session_id: str) -> bytes:
+    """跟 ``Response.set_cookie`` 拼出来的 Set-Cookie 完全一样，只是不需要 Response 对象。"""
+    cookie: http.cookies.SimpleCookie = http.cookies.SimpleCookie()
+    cookie["session_id"] = session_id
+    cookie["session_id"]["max-age"] = load_env.COOKIE_MAX_AGE
+    cookie["session_id"]["path"] = "/"
+    if load_env.COOKIE_SECURE:
+        cookie["session_id"]["secure"] = True
+    cookie["session_id"]["httponly"] = True
+    cookie["session_id"]["samesite"] = "lax"
+    return cookie.output(header="").strip().encode("latin-1")
+
+
+def _metrics_endpoint(scope: Scope) -> str:
+    """请求指标用的端点名：匹配上的路由模板，比如 ``/index/{index_name}/query``。
+
+    路由匹配之后下游会把 ``route``、``endpoint`` 写回 scope。模板取自
+    ``scope["route"].path``，而不是拿 ``path_params`` 的值去实际路径里换回
+    ``{参数名}``——那样叫 ``query`` 的知识库会把 ``/index/query/query`` 换成
+    ``/index/{index_name}/{index_name}``。include_router 进来的路由 ``route.path``
+    只有子路由自己那段、不带 /index 这样的前缀：路径参数各占一段，实际路径末尾
+    跟模板段数相同的部分就是模板，前面剩下的就是前缀。
+
+    直接挂在 app 上的 Starlette 路由（/docs、/openapi.json）不写 ``route``，
+    没有路径参数，用实际路径。兜底的静态挂载（``/``）也会"匹配"任何路径，它的
+    endpoint 是 StaticFiles 实例而不是函数——这类请求算没匹配上。
+    """
+    template = getattr(scope.get("route"), "path", None)
+    if isinstance(template, str):
+        parts = scope["path"].split("/")
+        return "/".join(parts[:len(parts) - template.count("/")]) + template
+    if isinstance(scope.get("endpoint"), (types.FunctionType, types.MethodType)) and not scope.get("path_params"):
+        return scope["path"]
+    return UNMATCHED
+
+
+class SessionAndStatsMiddleware:
+    """会话 cookie、LLM 端点限流、访问统计、按分钟的请求指标。
+
+    原来是 ``@app.middleware("http")`` 装饰的函数，走 Starlette 的
+    ``BaseHTTPMiddleware``：它把下游的响应体接进一个内存流，再起一个任务从流里
+    一块一块读出来往外转发。/graph/ask_stream、/graph/chat_stream 这类流式响应
+    每个 token 分块都要多过一次"写流 → 切任务 → 读流"，还要额外 new 一个
+    Request、一个 StreamingResponse。
+
+    现在是纯 ASGI 中间件：请求进来时只看 scope（路径、client、cookie 头），
+    响应方向只拦 ``http.response.start`` 这一条消息——补 Set-Cookie、记访问
+    统计、非流式响应补 Server-Timing（utils/request_timing.py）——响应体消息
+    原样交给 ``send``，不缓冲、不换任务。最后一块响应体发出
+    之后（或者下游抛异常时）记一次耗时到 ``request_metrics``（utils/request_metrics.py）。
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        is_static = _is_static_path(path) or _is_health_path(path)
+        conn = HTTPConnection(scope)
+        client_ip = get_client_ip(conn)
+
+        cookie_session = conn.cookies.get("session_id")
+        has_session = bool(cookie_session)
+        session_id = cookie_session or str(uuid.uuid4())
+        # 路由里的 request.state 就是这个字典（graph_session.get_client_id 读它）
+        scope.setdefault("state", {})["session_id"] = session_id
+
+        # 速率限制检查（仅对会触发 LLM 调用的端点）
+        if not is_static and is_llm_endpoint(path):
+            try:
+                await check_rate_limit(client_ip)
+            except HTTPException:
+                response = JSONResponse(
+                    content={"detail": "请求过于频繁，请稍后重试"},
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                )
+                await response(scope, receive, send)
+                return
+
+        if is_static:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 0
+        recorded = False
+        # 本次请求的分阶段耗时（utils/request_timing.py），下游各阶段往里记
+        timings = request_timing.start()
+
+        def record_metrics(error: bool) -> None:
+            nonlocal recorded
+            recorded = True
+            request_metrics.record(_metrics_endpoint(scope), time.perf_counter() - started, error)
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                # 统计（排除静态文件）：只累加增量、不拿锁，定期刷库时合并进 access_stats。
+                # 跟原来一样在响应头发出时记——下游抛异常、没有响应的请求不计。
+                access_counter.record(client_ip, path)
+                extra = []
+                if not has_session:
+                    extra.append((b"set-cookie", _session_cookie_header(session_id)))
+                if timings.stages:
+                    # 非流式端点发响应头时各阶段已经跑完；流式端点这时还没开始，不加
+                    extra.append((b"server-timing", timings.server_timing().encode("latin-1")))
+                if extra:
+                    # 新建列表而不是 append：headers 可能是下游 Response 自己的 raw_headers
+                    message["headers"] = [*message.get("headers", ()), *extra]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False) and not recorded:
+                # 耗时算到最后一块响应体发出为止：流式端点就是整个生成过程
+                record_metrics(status_code >= 500)
 
-    # 速率限制检查（仅对会触发 LLM 调用的端点）
-    if not is_static and is_llm_endpoint(request.url.path):
         try:
-            await check_rate_limit(client_ip)
-        except HTTPException:
-            return JSONResponse(
-                content={"detail": "请求过于频繁，请稍后重试"},
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-            )
+            await self.app(scope, receive, send_wrapper)
+        except BaseException:
+            if not recorded:
+                record_metrics(True)
+            raise
+        finally:
+            request_timing.stop()
+        if not recorded:
+            # 客户端中途断开、流式响应没发到最后一块
+            record_metrics(status_code == 0 or status_code >= 500)
 
-    response = await call_next(request)
 
-    # 统计（排除静态文件）
-    if not is_static:
-        async with access_stats_lock:
-            access_stats["total_visits"] += 1
-            access_stats["user_visits"][client_ip] += 1
-            access_stats["endpoint_visits"][request.url.path] += 1
-            access_stats["ip_count"] = len(access_stats["user_visits"])
-
-    if not has_session and not is_static:
-        response.set_cookie(
-            key="session_id",
-            value=session_id,
-            path="/",
-            httponly=True,
-            samesite="lax",
-            secure=load_env.COOKIE_SECURE,
-            max_age=load_env.COOKIE_MAX_AGE,
-        )
-    return response
+app.add_middleware(SessionAndStatsMiddleware)
 
 
 # CORS origins 从环境变量读取，默认为 localhost
@@ -255,4 +440,6 @@ if __name__ == "__main__":
     import uvicorn
     host = os.environ.get("HOST", "0.0.0.0")  # nosec B104 — standard for containerized web apps
     port = int(os.environ.get("PORT", "8522"))
-    uvicorn.run('main:app', host=host, port=port, reload=False)
+    # WEB_CONCURRENCY>1 时起多个 worker，会话/限流/索引变更靠 STATE_BACKEND 共享。
+    workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+    uvicorn.run('main:app', host=host, port=port, reload=False, workers=workers)
@@ -38,6 +38,36 @@ class StatsResponse(BaseModel):
     ip_count: int
     user_visits: dict
     endpoint_visits: dict
+    # 重排服务的队列深度/批大小等指标（utils/rerank.rerank_service_stats），
+    # 服务还没被用过时为 None。
+    rerank: dict | None = None
+    # 查询嵌入微批服务的队列深度/平均批大小/排队等待（utils/embedding_batcher.
+    # embedding_batcher_stats），没启用微批时为 None。
+    embedding: dict | None = None
+    # 混合检索两路（dense/BM25）的平均/最大耗时（handlers/hybrid_retriever.
+    # hybrid_leg_stats）。
+    retrieval: dict | None = None
+
+
+class RequestMetricsBucket(BaseModel):
+    start: int
+    """这一段时间开始的 Unix 秒（按 ``step`` 分钟对齐）。"""
+    endpoint: str
+    """路由模板，如 ``/index/{index_name}/query``；没匹配上路由的请求是 ``(unmatched)``。"""
+    count: int
+    errors: int
+    """5xx 响应和下游抛异常的请求数。"""
+    p50_ms: float | None = None
+    p95_ms: float | None = None
+    p99_ms: float | None = None
+    max_ms: float | None = None
+
+
+class RequestMetricsResponse(BaseModel):
+    since: int
+    until: int
+    step: int
+    buckets: list[RequestMetricsBucket]
 
 
 class FeedbackResponse(BaseModel):
@@ -15,6 +15,7 @@ from models.response import QueryResponse
 from router.graph_session import _chat_histories, _client_id, _last_query_response
 from starlette import status
 from starlette.responses import JSONResponse, StreamingResponse
+from utils import request_timing
 from utils.logger import error_logger, query_logger
 
 agent_app = APIRouter()
@@ -32,7 +33,7 @@ async def agent_chat(request: Request, query: str = Form(max_length=5000)):
     from agents.agent_workflow import run_agent
 
     client_id = _client_id(request)
-    history: list[ChatMessage] = list(_chat_histories.get(client_id) or [])
+    history: list[ChatMessage] = list(await _chat_histories.aget(client_id) or [])
     query = query.strip()
     query_logger.info(f"agent_chat: {query}")
     try:
@@ -42,14 +43,15 @@ async def agent_chat(request: Request, query: str = Form(max_length=5000)):
         return JSONResponse(content={"status": "detail", "message": "出错了，请稍后在试一下吧"},
                             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    _last_query_response.set(client_id, result.source_nodes)
+    await _last_query_response.aset(client_id, result.source_nodes)
     history.append(ChatMessage(role=MessageRole.USER, content=query))
     history.append(ChatMessage(role=MessageRole.ASSISTANT, content=result.response))
-    _chat_histories.set(client_id, history)
+    await _chat_histories.aset(client_id, history)
     query_logger.info(
         f"agent_chat res: {result.response} "
         f"tool_calls={len(result.tool_calls)} truncated={result.truncated}"
     )
+    query_logger.info(f"agent_chat timings: {request_timing.log_line()}")
     return QueryResponse(response=result.response)
 
 
@@ -67,7 +69,7 @@ async def agent_chat_stream(request: Request, query: str = Form(max_length=5000)
     from agents.agent_workflow import ToolCallTrace, extract_source_nodes, stream_agent_events
 
     client_id = _client_id(request)
-    history: list[ChatMessage] = list(_chat_histories.get(client_id) or [])
+    history: list[ChatMessage] = list(await _chat_histories.aget(client_id) or [])
     query = query.strip()
     query_logger.info(f"agent_chat_stream: {query}")
 
@@ -116,10 +118,10 @@ async def agent_chat_stream(request: Request, query: str = Form(max_length=5000)
         # 消息——宁可这一轮在历史里"没发生过"，也不要留下一条会让后续请求出错
         # 的脏记录。来源节点仍然照常记录：即使生成失败，已经完成的工具调用
         # 结果对用户排查"到底查到了什么"仍然有价值。
-        _last_query_response.set(client_id, extract_source_nodes(tool_calls))
+        await _last_query_response.aset(client_id, extract_source_nodes(tool_calls))
         if not errored and final_response.strip():
             history.append(ChatMessage(role=MessageRole.USER, content=query))
             history.append(ChatMessage(role=MessageRole.ASSISTANT, content=final_response))
-            _chat_histories.set(client_id, history)
+            await _chat_histories.aset(client_id, history)
 
     return StreamingResponse(_event_gen(), media_type="application/x-ndjson")
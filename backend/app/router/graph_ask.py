@@ -14,6 +14,7 @@ from llama_index.core.schema import NodeWithScore, TextNode
 from router.graph_qa import _PrefetchedNodesRetriever
 from router.graph_session import _chat_histories, _client_id, _last_query_response
 from starlette.responses import StreamingResponse
+from utils import request_timing
 from utils.logger import error_logger, query_logger
 
 ask_app = APIRouter()
@@ -37,7 +38,10 @@ async def ask_stream(request: Request, query: str = Form(max_length=5000)):
       ``QAWorkflow`` 没有工具调用），跟 ``/agent_chat_stream`` 语义一致，
       前端复用同一套"工具调用轨迹"展示逻辑。
     - ``done``：本轮回答结束，带最终 ``response``（agent 分支还带
-      ``truncated``）。
+      ``truncated``）和 ``timings``：各阶段毫秒数（``cache``、``condense``、
+      ``retrieve``、``rerank``、``rewrite``、``generate``、``agent``、
+      ``agent_tools``、``first_token``，只有跑过的阶段才有）加 ``total``，
+      见 utils/request_timing.py。
     - ``suggestions``：``{"suggestions": [...]}``，在 ``done`` 之后单独发出。
       追问建议是答案讲完之后才生成的（见
       ``handlers.auto_router.generate_followup_suggestions`` docstring），
@@ -56,16 +60,21 @@ async def ask_stream(request: Request, query: str = Form(max_length=5000)):
     from handlers.qa_workflow import QAWorkflow, TokenEvent
 
     client_id = _client_id(request)
-    history: list[ChatMessage] = list(_chat_histories.get(client_id) or [])
+    history: list[ChatMessage] = list(await _chat_histories.aget(client_id) or [])
     query = query.strip()
     query_logger.info(f"ask_stream: {query}")
 
     async def _event_gen():
+        # 分阶段耗时：中间件已经给这个请求开好了（utils/request_timing.py），
+        # 直接挂 router 测试时没有中间件，这里补一份，done 事件总有 timings。
+        timings = request_timing.current() or request_timing.start()
+
         # 语义缓存优先：命中直接回答案，跳过路由判定/检索/LLM 生成（本地嵌入
         # 毫秒级成本，miss 也不亏）。lookup 自己保证不抛异常，这里不再包 try。
         from handlers import qa_cache
 
-        cached: CachedEntry | None = await qa_cache.lookup(query)
+        with request_timing.stage("cache"):
+            cached: CachedEntry | None = await qa_cache.lookup(query)
         if cached is not None:
             kind_label = "人工沉淀" if cached.kind == "curated" else "历史问答"
             yield json.dumps(
@@ -76,6 +85,7 @@ async def ask_stream(request: Request, query: str = Form(max_length=5000)):
                 },
                 ensure_ascii=False,
             ) + "\n"
+            request_timing.mark("first_token")
             yield json.dumps(
                 {"type": "token", "content": cached.answer}, ensure_ascii=False
             ) + "\n"
@@ -85,6 +95,7 @@ async def ask_stream(request: Request, query: str = Form(max_length=5000)):
                     "response": cached.answer,
                     "tool_call_count": 0,
                     "truncated": False,
+                    "timings": timings.as_dict(),
                 },
                 ensure_ascii=False,
             ) + "\n"
@@ -100,14 +111,17 @@ async def ask_stream(request: Request, query: str = Form(max_length=5000)):
                     ),
                     score=1.0,
                 )
-                _last_query_response.set(client_id, [source_node])
+                await _last_query_response.aset(client_id, [source_node])
             history.append(ChatMessage(role=MessageRole.USER, content=query))
             history.append(ChatMessage(role=MessageRole.ASSISTANT, content=cached.answer))
-            _chat_histories.set(client_id, history)
+            await _chat_histories.aset(client_id, history)
+            query_logger.info(f"ask_stream timings: {timings.log_line()}")
             return
 
         try:
-            decision = await route_query(query, chat_history=history)
+            # route 是整个路由判定的耗时，里面的 condense/retrieve/rerank 另外也各记一份
+            with request_timing.stage("route"):
+                decision = await route_query(query, chat_history=history)
         except Exception as e:
             error_logger.error(f"ask_stream route_query error: {e}")
             yield json.dumps({"type": "error", "message": "出错了，请稍后再试一下吧"}, ensure_ascii=False) + "\n"
@@ -142,6 +156,7 @@ async def ask_stream(request: Request, query: str = Form(max_length=5000)):
                         )
                     elif event["type"] == "done":
                         final_response = event["response"]
+                        event = {**event, "timings": timings.as_dict()}
                     elif event["type"] == "error":
                         # 同 /agent_chat_stream：错误发生时不能让"用拼接
                         # token 兜底"的逻辑往会话历史里写一条空 assistant
@@ -185,15 +200,21 @@ async def ask_stream(request: Request, query: str = Form(max_length=5000)):
             final_response = result.response
             source_nodes = result.source_nodes
             yield json.dumps(
-                {"type": "done", "response": final_response, "tool_call_count": 0, "truncated": False},
+                {
+                    "type": "done",
+                    "response": final_response,
+                    "tool_call_count": 0,
+                    "truncated": False,
+                    "timings": timings.as_dict(),
+                },
                 ensure_ascii=False,
             ) + "\n"
 
-        _last_query_response.set(client_id, source_nodes)
+        await _last_query_response.aset(client_id, source_nodes)
         if not errored and final_response.strip():
             history.append(ChatMessage(role=MessageRole.USER, content=query))
             history.append(ChatMessage(role=MessageRole.ASSISTANT, content=final_response))
-            _chat_histories.set(client_id, history)
+            await _chat_histories.aset(client_id, history)
 
         # 成功回答后写入自动语义缓存（best-effort，store_auto 自己不抛异常）。
         # 下次问同样的问题直接命中，跳过检索 + LLM 生成。
@@ -204,10 +225,13 @@ async def ask_stream(request: Request, query: str = Form(max_length=5000)):
         # try/except 是双保险，防止调用方式本身出现意外（比如未来传参改动）
         # 导致这一步的异常反过来炸穿已经成功完成的主回答。
         try:
-            suggestions = await generate_followup_suggestions(decision.query_str, source_nodes)
+            with request_timing.stage("suggestions"):
+                suggestions = await generate_followup_suggestions(decision.query_str, source_nodes)
         except Exception:
             error_logger.error("ask_stream: 生成追问建议异常，降级为空列表", exc_info=True)
             suggestions = []
         yield json.dumps({"type": "suggestions", "suggestions": suggestions}, ensure_ascii=False) + "\n"
+        # done 事件里的 timings 截止到答案讲完；日志这一行多了追问建议的耗时
+        query_logger.info(f"ask_stream timings: {timings.log_line()}")
 
     return StreamingResponse(_event_gen(), media_type="application/x-ndjson")
@@ -57,7 +57,7 @@ async def qa_feedback(
 
     # 防投毒：response 必须等于本会话最后一条 assistant 消息（归一化到端点
     # 同样的 8000 字符截断再比，避免超长答案被截断后误拒）。
-    history: list[ChatMessage] = list(_chat_histories.get(_client_id(request)) or [])
+    history: list[ChatMessage] = list(await _chat_histories.aget(_client_id(request)) or [])
     last_assistant = next(
         (m.content for m in reversed(history) if m.role == MessageRole.ASSISTANT), None
     )
@@ -67,7 +67,7 @@ async def qa_feedback(
             status_code=status.HTTP_400_BAD_REQUEST,
         )
 
-    source_nodes: list[NodeWithScore] = list(_last_query_response.get(_client_id(request)) or [])
+    source_nodes: list[NodeWithScore] = list(await _last_query_response.aget(_client_id(request)) or [])
     if vote == "up":
         await qa_cache.store_curated(query, response, source_nodes)
     else:
@@ -89,7 +89,13 @@ async def qa_feedback(
 @feedback_app.post("/cache_stats")
 async def cache_stats():
     """语义缓存统计：总量 + auto/curated 分类计数。演示/运维时一眼看到"沉淀
-    了多少人工问答、缓存了多大规模"。"""
+    了多少人工问答、缓存了多大规模"。``rerank`` 字段是重排分数缓存的命中率，
+    ``retrieval`` 字段是检索结果缓存的命中率。"""
     from handlers import qa_cache
+    from handlers.retrieval_cache import retrieval_cache_stats
+    from utils.rerank import rerank_cache_stats
 
-    return await qa_cache.stats()
+    result = await qa_cache.stats()
+    result["rerank"] = rerank_cache_stats()
+    result["retrieval"] = retrieval_cache_stats()
+    return result
@@ -14,6 +14,7 @@ from models.response import QueryResponse, QuerySourcesResponse
 from router.graph_session import _chat_histories, _client_id, _last_query_response
 from starlette import status
 from starlette.responses import JSONResponse, StreamingResponse
+from utils import request_timing
 from utils.logger import customer_logger, error_logger, query_logger
 
 qa_app = APIRouter()
@@ -56,7 +57,7 @@ class _PrefetchedNodesRetriever(BaseRetriever):
 @qa_app.post("/create")
 async def create_graph(request: Request):
     client_id = _client_id(request)
-    _chat_histories.set(client_id, [])
+    await _chat_histories.aset(client_id, [])
     return {"status": "ok"}
 
 
@@ -65,7 +66,7 @@ async def chat_graph_stream(request: Request, query: str = Form(max_length=5000)
     from handlers.qa_workflow import QAWorkflow, TokenEvent
 
     client_id = _client_id(request)
-    history: list[ChatMessage] = list(_chat_histories.get(client_id) or [])
+    history: list[ChatMessage] = list(await _chat_histories.aget(client_id) or [])
     query = query.strip()
     customer_logger.info(f"chat_stream: {query}")
     workflow = QAWorkflow(timeout=60)
@@ -77,10 +78,10 @@ async def chat_graph_stream(request: Request, query: str = Form(max_length=5000)
                 if isinstance(ev, TokenEvent):
                     yield ev.token
             result = await handler
-            _last_query_response.set(client_id, result.source_nodes)
+            await _last_query_response.aset(client_id, result.source_nodes)
             history.append(ChatMessage(role=MessageRole.USER, content=query))
             history.append(ChatMessage(role=MessageRole.ASSISTANT, content=result.response))
-            _chat_histories.set(client_id, history)
+            await _chat_histories.aset(client_id, history)
         except Exception as e:
             error_logger.error(f"chat_stream error: {e}")
             yield "出错了，请稍后在试一下吧"
@@ -104,7 +105,7 @@ async def query_graph_stream(request: Request, query: str = Form(max_length=5000
                 if isinstance(ev, TokenEvent):
                     yield ev.token
             result = await handler
-            _last_query_response.set(client_id, result.source_nodes)
+            await _last_query_response.aset(client_id, result.source_nodes)
         except Exception as e:
             error_logger.error(f"query_stream error: {e}")
             yield "出错了，请稍后在试一下吧"
@@ -114,7 +115,7 @@ async def query_graph_stream(request: Request, query: str = Form(max_length=5000
 
 @qa_app.post("/query_sources", response_model=QuerySourcesResponse)
 async def query_sources(request: Request):
-    source_nodes = _last_query_response.get(_client_id(request))
+    source_nodes = await _last_query_response.aget(_client_id(request))
     if not source_nodes:
         return JSONResponse(content={"status": "detail", "message": "please query first"},
                             status_code=status.HTTP_400_BAD_REQUEST)
@@ -144,10 +145,12 @@ async def query_graph(request: Request, query: str = Form(max_length=5000)):
         return JSONResponse(content={"status": "detail", "message": "出错了，请稍后在试一下吧"},
                             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
     client_id = _client_id(request)
-    _last_query_response.set(client_id, result.source_nodes)
+    await _last_query_response.aset(client_id, result.source_nodes)
     for sn in format_source_nodes_list(result.source_nodes):
         query_logger.info(f"source: {sn}")
     query_logger.info(f"res: {result.response}")
+    # 同样的分阶段耗时中间件会放进 Server-Timing 响应头
+    query_logger.info(f"query timings: {request_timing.log_line()}")
     return QueryResponse(response=result.response)
 
 
@@ -201,7 +204,7 @@ async def websocket_query(websocket: WebSocket):
 
 @qa_app.post("/query_history")
 async def graph_history(request: Request):
-    history = _chat_histories.get(_client_id(request))
+    history = await _chat_histories.aget(_client_id(request))
     if history is None:
         return JSONResponse(content={"status": "detail", "message": "No query graph available"},
                             status_code=status.HTTP_404_NOT_FOUND)
@@ -246,7 +249,7 @@ async def workflow_query(request: Request, query: str = Form(max_length=5000)):
         return JSONResponse(content={"status": "detail", "message": "出错了，请稍后在试一下吧"},
                             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
     client_id = _client_id(request)
-    _last_query_response.set(client_id, result.source_nodes)
+    await _last_query_response.aset(client_id, result.source_nodes)
     return QueryResponse(response=result.response)
 
 
@@ -266,7 +269,7 @@ async def workflow_query_stream(request: Request, query: str = Form(max_length=5
                 if isinstance(ev, TokenEvent):
                     yield ev.token
             result = await handler
-            _last_query_response.set(client_id, result.source_nodes)
+            await _last_query_response.aset(client_id, result.source_nodes)
         except Exception as e:
             error_logger.error(f"workflow_query_stream error: {e}")
             yield "出错了，请稍后在试一下吧"
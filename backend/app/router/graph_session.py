@@ -5,11 +5,18 @@
 状态是四组端点唯一的共享物（写历史的和读历史的在不同端点），必须放在大家
 都能 import 的地方而不是任何一方的模块里。TTLCache 的容量/过期参数原来写
 死在 graph.py 顶部，原样搬过来。
+
+多 worker 部署时（``STATE_BACKEND=sqlite``，见 utils/shared_state.py）同一个
+会话的请求会落到不同进程，TTLCache 的读写改走共享状态库；没有共享后端时仍是
+进程内的 OrderedDict。路由里用 ``aget``/``aset``：共享库的读写放到线程里跑，
+等 SQLite 写锁（最多 busy_timeout）时不卡事件循环。
 """
+import asyncio
 import time
 from collections import OrderedDict
 
 from fastapi import Request
+from utils.shared_state import shared_backend
 
 # 会话缓存最大容量
 _MAX_SESSIONS = 200
@@ -17,14 +24,22 @@ _SESSION_TTL = 3600  # 1小时
 
 
 class TTLCache:
-    """简单的 TTL + LRU 缓存，替代裸 dict"""
+    """简单的 TTL + LRU 缓存，替代裸 dict。
+
+    ``namespace`` 是它在共享状态库里的表内分区；共享后端生效时 get/set 都走
+    共享库，``_data`` 不再使用。事件循环里用 ``aget``/``aset``。
+    """
 
-    def __init__(self, max_size: int = _MAX_SESSIONS, ttl: int = _SESSION_TTL):
+    def __init__(self, namespace: str = "default", max_size: int = _MAX_SESSIONS, ttl: int = _SESSION_TTL):
         self._data: OrderedDict = OrderedDict()
+        self._namespace = namespace
         self._max_size = max_size
         self._ttl = ttl
 
     def get(self, key):
+        backend = shared_backend()
+        if backend is not None:
+            return backend.cache_get(self._namespace, key, self._ttl)
         entry = self._data.get(key)
         if entry is None:
             return None
@@ -35,15 +50,34 @@ class TTLCache:
         return entry[0]
 
     def set(self, key, value):
+        backend = shared_backend()
+        if backend is not None:
+            backend.cache_set(self._namespace, key, value, self._max_size)
+            return
         self._data[key] = (value, time.time())
         self._data.move_to_end(key)
         while len(self._data) > self._max_size:
             self._data.popitem(last=False)
 
+    async def aget(self, key):
+        """``get`` 的协程版：共享后端的读在线程里跑，内存路径直接返回。"""
+        if shared_backend() is None:
+            return self.get(key)
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key, value):
+        if shared_backend() is None:
+            self.set(key, value)
+            return
+        await asyncio.to_thread(self.set, key, value)
+
     def __contains__(self, key):
         return self.get(key) is not None
 
     def __len__(self):
+        backend = shared_backend()
+        if backend is not None:
+            return backend.cache_len(self._namespace)
         return len(self._data)
 
 
@@ -53,5 +87,5 @@ def _client_id(request: Request) -> str:
     return request.cookies.get("session_id") or "unknown"
 
 
-_chat_histories: TTLCache = TTLCache()
-_last_query_response: TTLCache = TTLCache()
+_chat_histories: TTLCache = TTLCache("chat_histories")
+_last_query_response: TTLCache = TTLCache("last_query_response")
@@ -13,9 +13,13 @@ from configs.config import Prompts
 from configs.llm_predictor import build_llm
 from dependencies import get_index
 from fastapi import APIRouter, Depends, File, Form, Query, UploadFile, status
-from handlers import delete_collection, list_index_names
+from handlers import bm25_index, delete_collection, list_index_names, sparse_index
 from handlers.graph_builder import summary_index
-from handlers.hybrid_retriever import build_retriever_for_index, invalidate_hybrid_retriever_cache
+from handlers.hybrid_retriever import (
+    build_retriever_for_index,
+    invalidate_hybrid_retriever_cache,
+    refresh_index_retrievers,
+)
 from handlers.index_crud import (
     _indexes_lock,
     citf,
@@ -30,6 +34,7 @@ from handlers.index_crud import (
     saveIndex,
     updateNodeById,
 )
+from handlers.index_events import publish_index_change
 from handlers.parsers.types import DocumentParseError, ParserUnavailableError
 from llama_index.core import Document
 from llama_index.core.query_engine import RetrieverQueryEngine
@@ -44,6 +49,7 @@ from utils.llama import (
 )
 from utils.logger import customer_logger, error_logger
 from utils.security import require_api_key_if_configured
+from utils.sparse_embedding import get_sparse_encoder
 from utils.upload import FileTooLargeError, InvalidFileTypeError, validate_upload_file
 
 index_app = APIRouter(dependencies=[Depends(require_api_key_if_configured)])
@@ -72,7 +78,8 @@ async def create_index(index_name: str = Form(max_length=100)):
         return JSONResponse(content={'status': 'error', 'msg': 'index already exists'})
     createIndex(sanitized_name)
     await loadAllIndexes()
-    invalidate_hybrid_retriever_cache()
+    invalidate_hybrid_retriever_cache(sanitized_name)
+    publish_index_change(sanitized_name, "created")
     return JSONResponse(content={
         'status': 'success',
         'msg': f'index {sanitized_name} created',
@@ -92,7 +99,8 @@ async def delete_index(index_name: str = Form(max_length=100)):
     if sanitized_name in list_index_names():
         delete_collection(sanitized_name)
         await loadAllIndexes()
-        invalidate_hybrid_retriever_cache()
+        invalidate_hybrid_retriever_cache(sanitized_name)
+        publish_index_change(sanitized_name, "deleted")
         return {"status": "deleted"}
     else:
         return JSONResponse(content={'status': 'detail', 'message': 'index not exist'},
@@ -121,6 +129,7 @@ async def update_doc(nodeId, index=Depends(get_index), text: str = Form(max_leng
     except (ValueError, KeyError):
         return JSONResponse(content={'status': 'detail', 'message': 'node_id not exist'},
                             status_code=status.HTTP_404_NOT_FOUND)
+    refresh_index_retrievers(index)
     return JSONResponse(content={"status": "updated"})
 
 
@@ -146,7 +155,7 @@ async def upload_file(index=Depends(get_index), file: UploadFile = File(...)):
         async with aiofiles.open(savepath, 'wb') as f:
             await f.write(file_bytes)
         await insert_into_index(index, filepath, skip_summary=True)
-        invalidate_hybrid_retriever_cache()
+        refresh_index_retrievers(index)
     except Exception as e:
         error_logger.error(f"Error while handling file: {str(e)}")
         if savepath is not None and os.path.exists(savepath):
@@ -192,7 +201,7 @@ async def upload_files(index=Depends(get_index), files: list[UploadFile] = File(
         index.summary = await summary_index(index)
         from handlers.index_crud import _save_summary
         _save_summary(index)
-        invalidate_hybrid_retriever_cache()
+        refresh_index_retrievers(index)
 
     except Exception as e:
         error_logger.error(f"Error while handling files: {str(e)}")
@@ -237,6 +246,7 @@ async def upload_qa(index=Depends(get_index), prompt: str = Form(None, max_lengt
     qa_data = formatted_pairs(qa_pairs)
     id = extract_content_after_backslash(file.filename)
     await embeddingQA(index, qa_data, id)
+    refresh_index_retrievers(index)
     return {"status": 'ok'}
 
 
@@ -253,7 +263,7 @@ async def delete_doc(doc_id: str = Query(max_length=200), index=Depends(get_inde
         error_logger.error(f"delete doc error: {e}")
         return JSONResponse(content={"status": "detail", "message": "删除文档时出错"},
                             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    invalidate_hybrid_retriever_cache()
+    refresh_index_retrievers(index)
     return {"status": "deleted"}
 
 
@@ -264,7 +274,7 @@ async def delete_node(node_id: str = Query(max_length=200), index=Depends(get_in
     except Exception:
         return JSONResponse(content={"status": "detail", "message": "node_id: not found"},
                             status_code=status.HTTP_400_BAD_REQUEST)
-    invalidate_hybrid_retriever_cache()
+    refresh_index_retrievers(index)
     return {"status": "deleted"}
 
 
@@ -303,7 +313,9 @@ async def insert_docs(
     async with lock:
         await asyncio.to_thread(index.insert_nodes, [doc])
         saveIndex(index)
-    invalidate_hybrid_retriever_cache()
+        bm25_index.apply_upserts(index.index_id, [doc])
+        sparse_index.apply_upserts(index.index_id, [doc], get_sparse_encoder())
+    refresh_index_retrievers(index)
     return {"status": "ok"}
 
 
@@ -1,21 +1,31 @@
 import asyncio
 import os
+import time
 
 import configs.load_env as load_env
-from dependencies.manage import access_stats, access_stats_lock
+from dependencies.manage import access_counter, access_stats, access_stats_lock, request_metrics
 from dotenv import dotenv_values
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from handlers.hybrid_retriever import hybrid_leg_stats
 from models.llm_config import (
     LLMConfigResponse,
     LLMConfigUpdate,
     LLMProbeRequest,
     LLMProbeResponse,
 )
-from models.response import FeedbackListResponse, FeedbackResponse, StatsResponse
+from models.response import (
+    FeedbackListResponse,
+    FeedbackResponse,
+    RequestMetricsResponse,
+    StatsResponse,
+)
 from models.user import Feedback
 from starlette.requests import Request
 from utils import llm_config
+from utils.embedding_batcher import embedding_batcher_stats
 from utils.file import save_feedback
+from utils.request_metrics import merge_rows
+from utils.rerank import rerank_service_stats
 from utils.security import get_client_ip, require_configured_api_key
 
 manage_app = APIRouter()
@@ -25,14 +35,51 @@ manage_app = APIRouter()
 async def get_stats():
     """获取访问统计"""
     async with access_stats_lock:
+        # 叠上中间件里还没刷库的增量，看到的是实时数
+        merged = access_counter.merged_with(access_stats)
         return StatsResponse(
-            total_visits=access_stats["total_visits"],
-            ip_count=access_stats["ip_count"],
-            user_visits=dict(access_stats["user_visits"]),
-            endpoint_visits=dict(access_stats["endpoint_visits"]),
+            total_visits=merged["total_visits"],
+            ip_count=merged["ip_count"],
+            user_visits=merged["user_visits"],
+            endpoint_visits=merged["endpoint_visits"],
+            rerank=rerank_service_stats(),
+            embedding=embedding_batcher_stats(),
+            retrieval=hybrid_leg_stats(),
         )
 
 
+# 一次最多查多少天：按分钟、每个端点一行，范围太大时响应会非常大
+_REQUEST_METRICS_MAX_RANGE = 7 * 24 * 3600
+
+
+@manage_app.get(
+    "/stats/requests", response_model=RequestMetricsResponse, dependencies=[Depends(require_configured_api_key)]
+)
+async def get_request_metrics(
+    since: int | None = Query(None, description="起始 Unix 秒，默认 until 前一小时"),
+    until: int | None = Query(None, description="结束 Unix 秒（含），默认现在"),
+    endpoint: str | None = Query(None, description="只看这个路由模板，如 /graph/ask_stream"),
+    step: int = Query(1, ge=1, le=1440, description="每几分钟合成一个桶"),
+):
+    """按时间段查每个端点的请求数、错误数和 p50/p95/p99 耗时。
+
+    库里是所有 worker 已经落库的分钟，再叠上本进程还没刷库的部分（当前分钟、
+    刷库失败攒下的），所以最近一分钟也看得到。跨分钟合桶时合并的是直方图本身，
+    百分位是重新算的，不是把每分钟的 p99 取平均。
+    """
+    until = int(time.time()) if until is None else until
+    since = until - 3600 if since is None else since
+    if since > until:
+        raise HTTPException(status_code=422, detail="since 不能晚于 until")
+    if until - since > _REQUEST_METRICS_MAX_RANGE:
+        raise HTTPException(status_code=422, detail="一次最多查 7 天")
+    from utils import db
+    since_minute, until_minute = since // 60, until // 60
+    rows = await asyncio.to_thread(db.load_request_metrics, load_env.db_path, since_minute, until_minute)
+    rows.extend(request_metrics.pending_rows(since_minute, until_minute))
+    return RequestMetricsResponse(since=since, until=until, step=step, buckets=merge_rows(rows, endpoint, step))
+
+
 @manage_app.post("/feedback", response_model=FeedbackResponse, dependencies=[Depends(require_configured_api_key)])
 async def create_feedback(feedback: Feedback, request: Request):
     """创建反馈"""
@@ -0,0 +1,61 @@
+"""请求中间件里的访问计数：只累加，不加锁，定期一次性取走。
+
+原来中间件每个非静态请求都要拿全局的 ``access_stats_lock``，在锁里改
+``access_stats`` 的三个计数。这把锁同时被 /manage/stats 和每 60 秒一次的刷库
+拿着——刷库要 ``to_thread`` 写 SQLite，期间所有请求都卡在统计这一步。
+
+现在中间件只调 ``AccessCounter.record``：同步函数、没有 await，在事件循环里
+执行时不会被别的协程打断，本身就是原子的，不需要锁。计数先记在"待刷"的
+增量里，由 ``main._flush_access_stats`` 定期 ``drain`` 一次性取走、累加进库、
+再合并进 ``access_stats``。/manage/stats 读的时候用 ``merged_with`` 把还没刷的
+增量叠上去，看到的仍然是实时数。
+
+没有按 key 分片：所有调用都在事件循环线程上，分片不会减少任何竞争，只会让
+``drain`` 多一次合并。
+"""
+from __future__ import annotations
+
+from collections import Counter
+
+
+class AccessCounter:
+    def __init__(self) -> None:
+        self.total = 0
+        self.user_visits: Counter[str] = Counter()
+        self.endpoint_visits: Counter[str] = Counter()
+
+    def record(self, client_ip: str, endpoint: str) -> None:
+        self.total += 1
+        self.user_visits[client_ip] += 1
+        self.endpoint_visits[endpoint] += 1
+
+    def drain(self) -> dict:
+        """取走当前累计的增量并清零，返回 ``utils.db.add_stats_delta`` 要的形状。"""
+        delta = {
+            "total_visits": self.total,
+            "user_visits": dict(self.user_visits),
+            "endpoint_visits": dict(self.endpoint_visits),
+        }
+        self.total = 0
+        self.user_visits = Counter()
+        self.endpoint_visits = Counter()
+        return delta
+
+    def restore(self, delta: dict) -> None:
+        """刷库失败时把取走的增量放回去，下一轮再刷，计数不丢。"""
+        self.total += delta["total_visits"]
+        self.user_visits.update(delta["user_visits"])
+        self.endpoint_visits.update(delta["endpoint_visits"])
+
+    def merged_with(self, stats: dict) -> dict:
+        """已刷库的 ``stats`` 叠上还没刷的增量，不修改任何一方。"""
+        user_visits = Counter(stats["user_visits"])
+        user_visits.update(self.user_visits)
+        endpoint_visits = Counter(stats["endpoint_visits"])
+        endpoint_visits.update(self.endpoint_visits)
+        return {
+            "total_visits": stats["total_visits"] + self.total,
+            "ip_count": len(user_visits),
+            "user_visits": dict(user_visits),
+            "endpoint_visits": dict(endpoint_visits),
+        }
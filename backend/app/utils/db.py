@@ -1,5 +1,35 @@
+"""访问统计、按分钟的请求指标和反馈的 SQLite 存储（``DB_PATH``）。
+
+## 连接
+
+原来每个函数都 ``sqlite3.connect`` 一个新连接、重新执行四条 PRAGMA、用完就关：
+刷库、记反馈、/manage 读统计，每次都付一遍打开文件、建 WAL 索引映射、解析
+PRAGMA 的开销。现在每个数据库文件一个 ``_Database``，连接常驻：
+
+- **写**：一个专门的写线程独占一个连接，所有写操作排进队列由它串行执行。
+  调用方（都在 ``asyncio.to_thread`` 里）阻塞到自己那一批提交完成才返回，所以
+  "写完立刻读"仍然读得到。队列里同时积压的写一次最多取 ``_MAX_BATCH`` 个，放进
+  同一个事务里提交（每个写操作一个 SAVEPOINT，某一个失败只回滚它自己）——
+  高峰期的反馈提交、刷库不再各自 fsync 一次。
+- **读**：最多 ``_READ_POOL_SIZE`` 个只读连接的小池子，WAL 模式下读不挡写。
+
+进程退出前（lifespan 收尾）调 ``close_db()`` 停掉写线程、关掉连接；之后再调用
+任何函数会重新打开。
+
+## 访问统计刷库
+
+``add_stats_delta`` 只累加变化过的 key（多 worker 必须累加，见函数说明），
+``flush_stats`` 是整体覆盖写、但只写跟上一次 flush 相比值变了的行——两种方式
+刷库的开销都跟"这段时间里变化的 key 数"成正比，而不是跟 IP 表的总行数。
+"""
+import concurrent.futures
+import json
+import os
+import queue
 import sqlite3
-from contextlib import closing
+import threading
+from contextlib import contextmanager
+from typing import Any
 
 _SCHEMA = """
 CREATE TABLE IF NOT EXISTS access_stats (
@@ -21,9 +51,22 @@ CREATE TABLE IF NOT EXISTS feedback (
     email TEXT,
     message TEXT NOT NULL
 );
+CREATE TABLE IF NOT EXISTS request_metrics (
+    minute INTEGER NOT NULL,
+    endpoint TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    errors INTEGER NOT NULL,
+    histogram TEXT NOT NULL,
+    PRIMARY KEY (minute, endpoint)
+);
 """
 
 
+# 一个事务里最多合并多少个排队的写操作；读连接池大小。
+_MAX_BATCH = 64
+_READ_POOL_SIZE = 4
+
+
 def _connect(db_path: str) -> sqlite3.Connection:
     conn = sqlite3.connect(db_path, check_same_thread=False)
     conn.row_factory = sqlite3.Row
@@ -34,38 +77,231 @@ def _connect(db_path: str) -> sqlite3.Connection:
     return conn
 
 
-def init_db(db_path: str) -> None:
-    with closing(_connect(db_path)) as conn:
+class _Database:
+    """一个数据库文件的常驻连接：一个写线程 + 一个写队列 + 一个读连接池。"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        # 建连接、建表在调用方线程上做，打不开直接抛给调用方，而不是卡在写线程里。
+        conn = _connect(path)
         conn.executescript(_SCHEMA)
-        conn.commit()
+        conn.isolation_level = None  # 事务由写线程自己 BEGIN / COMMIT
+        self._writes: queue.Queue = queue.Queue()
+        self._readers: queue.LifoQueue = queue.LifoQueue()
+        self._reader_count = 0
+        self._reader_lock = threading.Lock()
+        # flush_stats 上一次写进去的值，只在写线程里读写。
+        self.last_flushed: dict | None = None
+        self._writer = threading.Thread(
+            target=self._run_writer, args=(conn,), name=f"sqlite-writer-{os.path.basename(path)}", daemon=True
+        )
+        self._writer.start()
+
+    # ---- 写 -------------------------------------------------------------
+
+    def write(self, fn, *args):
+        """把 ``fn(conn, *args)`` 排进写队列，阻塞到它所在的事务提交后返回它的返回值。"""
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        self._writes.put((fn, args, future))
+        return future.result()
+
+    def _run_writer(self, conn: sqlite3.Connection) -> None:
+        try:
+            stop = False
+            while not stop:
+                item = self._writes.get()
+                if item is None:
+                    break
+                batch = [item]
+                while len(batch) < _MAX_BATCH:
+                    try:
+                        item = self._writes.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+                self._commit_batch(conn, batch)
+        finally:
+            conn.close()
+
+    def _commit_batch(self, conn: sqlite3.Connection, batch: list) -> None:
+        results: list[tuple[Any, Exception | None]] = []
+        try:
+            # IMMEDIATE：一开始就拿写锁。多 worker 共用一个库时，"先读后写"的
+            # 延迟事务在升级成写锁那一步会直接 SQLITE_BUSY，不会等 busy timeout。
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, _ in batch:
+                conn.execute("SAVEPOINT write")
+                try:
+                    results.append((fn(conn, *args), None))
+                    conn.execute("RELEASE write")
+                except Exception as exc:
+                    conn.execute("ROLLBACK TO write")
+                    conn.execute("RELEASE write")
+                    results.append((None, exc))
+            conn.execute("COMMIT")
+        except Exception as exc:
+            # 整个事务没提交成功：这一批全部失败，flush_stats 的"上次写入"也不可信了。
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            self.last_flushed = None
+            for _, _, future in batch:
+                future.set_exception(exc)
+            return
+        for (_, _, future), (result, error) in zip(batch, results):
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    # ---- 读 -------------------------------------------------------------
+
+    @contextmanager
+    def reader(self):
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            with self._reader_lock:
+                create = self._reader_count < _READ_POOL_SIZE
+                if create:
+                    self._reader_count += 1
+            if create:
+                try:
+                    conn = _connect(self.path)
+                    conn.execute("PRAGMA query_only=ON")
+                except Exception:
+                    with self._reader_lock:
+                        self._reader_count -= 1
+                    raise
+            else:
+                conn = self._readers.get()  # 池子满了，等别人还回来
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    def close(self) -> None:
+        self._writes.put(None)
+        self._writer.join()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_databases: dict[str, _Database] = {}
+_databases_lock = threading.Lock()
+
+
+def _database(db_path: str) -> _Database:
+    key = os.path.abspath(db_path)
+    database = _databases.get(key)
+    if database is None:
+        with _databases_lock:
+            database = _databases.get(key)
+            if database is None:
+                database = _databases[key] = _Database(db_path)
+    return database
+
+
+def close_db(db_path: str | None = None) -> None:
+    """停掉写线程、关掉连接（不传路径就全部关掉）。排在队列里的写会先执行完。"""
+    with _databases_lock:
+        keys = list(_databases) if db_path is None else [os.path.abspath(db_path)]
+        databases = [_databases.pop(key) for key in keys if key in _databases]
+    for database in databases:
+        database.close()
+
+
+def init_db(db_path: str) -> None:
+    _database(db_path)
 
 
 def flush_stats(db_path: str, stats: dict) -> None:
-    with closing(_connect(db_path)) as conn:
-        conn.execute(
-            "INSERT INTO access_stats (key, value) VALUES ('total_visits', ?) "
-            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
-            (stats.get('total_visits', 0),),
-        )
-        user_visits = dict(stats.get('user_visits', {}))
-        endpoint_visits = dict(stats.get('endpoint_visits', {}))
+    """把访问统计整体覆盖写进库，但只写跟上一次 flush 相比变了的行。
+
+    多 worker 下要用 ``add_stats_delta``：覆盖写的话最后一个刷库的 worker 会把
+    别人的计数冲掉。
+    """
+    database = _database(db_path)
+    snapshot = {
+        'total_visits': stats.get('total_visits', 0),
+        'user_visits': dict(stats.get('user_visits', {})),
+        'endpoint_visits': dict(stats.get('endpoint_visits', {})),
+    }
+
+    def _changed(key):
+        previous = (database.last_flushed or {}).get(key, {})
+        return [(k, v) for k, v in snapshot[key].items() if previous.get(k) != v]
+
+    def _write(conn):
+        previous_total = None if database.last_flushed is None else database.last_flushed['total_visits']
+        if snapshot['total_visits'] != previous_total:
+            conn.execute(
+                "INSERT INTO access_stats (key, value) VALUES ('total_visits', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (snapshot['total_visits'],),
+            )
+        user_visits = _changed('user_visits')
+        endpoint_visits = _changed('endpoint_visits')
         if user_visits:
             conn.executemany(
                 "INSERT INTO ip_visits (ip, count) VALUES (?, ?) "
                 "ON CONFLICT(ip) DO UPDATE SET count = excluded.count",
-                list(user_visits.items()),
+                user_visits,
             )
         if endpoint_visits:
             conn.executemany(
                 "INSERT INTO endpoint_visits (endpoint, count) VALUES (?, ?) "
                 "ON CONFLICT(endpoint) DO UPDATE SET count = excluded.count",
-                list(endpoint_visits.items()),
+                endpoint_visits,
+            )
+        database.last_flushed = snapshot
+
+    database.write(_write)
+
+
+def add_stats_delta(db_path: str, delta: dict) -> None:
+    """把一段时间内的**增量**累加进库（``flush_stats`` 是整体覆盖）。
+
+    多个 worker 各自计数、各自定期刷库时只能累加：覆盖写的话最后一个刷库的
+    worker 会把别人的计数冲掉。``delta`` 跟 ``flush_stats`` 的参数同形，只带
+    变化过的 key；全空时不碰数据库。
+    """
+    total = delta.get('total_visits', 0)
+    user_visits = list(dict(delta.get('user_visits', {})).items())
+    endpoint_visits = list(dict(delta.get('endpoint_visits', {})).items())
+    if not (total or user_visits or endpoint_visits):
+        return
+
+    def _write(conn):
+        if total:
+            conn.execute(
+                "INSERT INTO access_stats (key, value) VALUES ('total_visits', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+                (total,),
+            )
+        if user_visits:
+            conn.executemany(
+                "INSERT INTO ip_visits (ip, count) VALUES (?, ?) "
+                "ON CONFLICT(ip) DO UPDATE SET count = count + excluded.count",
+                user_visits,
+            )
+        if endpoint_visits:
+            conn.executemany(
+                "INSERT INTO endpoint_visits (endpoint, count) VALUES (?, ?) "
+                "ON CONFLICT(endpoint) DO UPDATE SET count = count + excluded.count",
+                endpoint_visits,
             )
-        conn.commit()
+
+    _database(db_path).write(_write)
 
 
 def record_visit(db_path: str, client_ip: str, endpoint: str) -> None:
-    with closing(_connect(db_path)) as conn:
+    def _write(conn):
         conn.execute(
             "INSERT INTO ip_visits (ip, count) VALUES (?, 1) "
             "ON CONFLICT(ip) DO UPDATE SET count = count + 1",
@@ -76,11 +312,12 @@ def record_visit(db_path: str, client_ip: str, endpoint: str) -> None:
             "ON CONFLICT(endpoint) DO UPDATE SET count = count + 1",
             (endpoint,),
         )
-        conn.commit()
+
+    _database(db_path).write(_write)
 
 
 def load_stats(db_path: str) -> dict:
-    with closing(_connect(db_path)) as conn:
+    with _database(db_path).reader() as conn:
         total_row = conn.execute(
             "SELECT value FROM access_stats WHERE key = 'total_visits'"
         ).fetchone()
@@ -101,19 +338,70 @@ def load_stats(db_path: str) -> dict:
 
 
 def save_feedback(db_path: str, client_ip: str, email: str | None, message: str) -> None:
-    with closing(_connect(db_path)) as conn:
+    def _write(conn):
         conn.execute(
             "INSERT INTO feedback (client_ip, email, message) VALUES (?, ?, ?)",
             (client_ip, email, message),
         )
-        conn.commit()
+
+    _database(db_path).write(_write)
 
 
 def list_feedback(db_path: str, limit: int = 100) -> list[dict]:
-    with closing(_connect(db_path)) as conn:
+    with _database(db_path).reader() as conn:
         rows = conn.execute(
             "SELECT created_at, client_ip, email, message FROM feedback "
             "ORDER BY id DESC LIMIT ?",
             (limit,),
         ).fetchall()
     return [dict(row) for row in rows]
+
+
+def add_request_metrics(db_path: str, rows: list[dict], retention_days: int = 0) -> None:
+    """把按分钟分桶的请求指标（utils/request_metrics.py 的 ``drain_completed``）累加进库。
+
+    同一 (分钟, 端点) 已经有行时累加计数、合并直方图——多个 worker 各自刷同一
+    分钟也不会互相覆盖。``retention_days`` 大于 0 时顺手删掉更早的行。
+    """
+    if not rows:
+        return
+
+    def _write(conn):
+        for row in rows:
+            existing = conn.execute(
+                "SELECT count, errors, histogram FROM request_metrics WHERE minute = ? AND endpoint = ?",
+                (row['minute'], row['endpoint']),
+            ).fetchone()
+            count, errors, histogram = row['count'], row['errors'], dict(row['histogram'])
+            if existing is not None:
+                count += existing['count']
+                errors += existing['errors']
+                for index, value in json.loads(existing['histogram']):
+                    histogram[index] = histogram.get(index, 0) + value
+            conn.execute(
+                "INSERT OR REPLACE INTO request_metrics (minute, endpoint, count, errors, histogram) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (row['minute'], row['endpoint'], count, errors, json.dumps(sorted(histogram.items()))),
+            )
+        if retention_days > 0:
+            newest = max(row['minute'] for row in rows)
+            conn.execute("DELETE FROM request_metrics WHERE minute < ?", (newest - retention_days * 24 * 60,))
+
+    _database(db_path).write(_write)
+
+
+def load_request_metrics(db_path: str, since_minute: int, until_minute: int) -> list[dict]:
+    """``[since_minute, until_minute]``（分钟序号，即 Unix 秒 // 60）里已经落库的请求指标。"""
+    with _database(db_path).reader() as conn:
+        rows = conn.execute(
+            "SELECT minute, endpoint, count, errors, histogram FROM request_metrics "
+            "WHERE minute BETWEEN ? AND ? ORDER BY minute, endpoint",
+            (since_minute, until_minute),
+        ).fetchall()
+    return [
+        {
+            'minute': row['minute'], 'endpoint': row['endpoint'], 'count': row['count'],
+            'errors': row['errors'], 'histogram': json.loads(row['histogram']),
+        }
+        for row in rows
+    ]
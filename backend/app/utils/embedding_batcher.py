@@ -0,0 +1,241 @@
+"""查询嵌入的动态微批：并发请求的问题攒成一批，在专用工作线程里一次前向。
+
+## 解决什么问题
+
+每个请求各自调 ``Settings.embed_model.aget_query_embedding``：
+``HuggingFaceEmbedding`` 的异步版本就是在默认线程池里跑一次 batch=1 的前向。
+招生季的突发流量下，CPU 上同时有十几个 bge-m3 前向互相抢核——torch 一次
+前向本来就会用满所有核，并发只会让每一个都变慢，吞吐反而不如串行。
+
+## 做法
+
+跟 ``utils/rerank.RerankService`` 同一个思路：``BatchedEmbedding`` 包在嵌入
+模型外面，查询嵌入不直接算，而是把问题放进队列；专用工作线程（只有一个，
+前向串行）取到第一个问题后最多再等 ``EMBEDDING_BATCH_WAIT_MS``，把这段时间
+里到达的问题（最多 ``EMBEDDING_BATCH_MAX_SIZE`` 条）一起做一次前向。一批
+8 条短问题的前向比 8 次单条前向快得多（padding 到同一长度后一次矩阵乘），
+并发越高摊得越薄；没有并发时只多付一个等待窗口（默认 5ms，相对 CPU 上
+几十毫秒的前向可以忽略）。
+
+用 ``queue.Queue`` + ``concurrent.futures.Future``：同步调用方（dense 检索器的
+``get_query_embedding``、qa_cache 查找）阻塞在 ``Future.result()`` 上，异步
+调用方用 ``asyncio.wrap_future`` 等，两者共用同一个工作线程和同一批前向。
+
+## 只批查询嵌入
+
+文本嵌入（``updateNodeById`` 的单条、摄取的批量）原样透传：摄取本来就是
+大批量，单条文本嵌入是低频的管理操作，不值得排队。
+
+``BatchedEmbedding`` 装在 ``CachedEmbedding`` 里面：缓存命中的问题根本不进
+队列，只有真正要前向的才排队。队列深度、平均批大小、排队等待时间见
+``embedding_batcher_stats()``，挂在 ``/manage/stats``。
+"""
+from __future__ import annotations
+
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from pydantic import PrivateAttr
+
+
+@dataclass
+class _EmbedRequest:
+    query: str
+    future: Future = field(default_factory=Future)
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+def _resolve(future: Future, result=None, exception: BaseException | None = None) -> None:
+    # 跟 utils/rerank._resolve 一样：await 方被取消时 Future 已经是 cancelled，
+    # 再 set_result 会抛 InvalidStateError，不能让它打死工作线程。
+    if future.cancelled():
+        return
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except Exception:
+        pass
+
+
+def embed_queries(embed_model: BaseEmbedding, queries: list[str]) -> list[Embedding]:
+    """对一批问题做**一次**前向。
+
+    llama_index 的 ``BaseEmbedding`` 没有批量查询嵌入的接口，只能按模型类型找：
+    bge-m3 稀疏编码器用 ``encode_queries``（顺带把稀疏权重记进它的 memo，稀疏
+    检索那一路不用再前向）；``HuggingFaceEmbedding`` 用它内部的
+    ``_embed(..., prompt_name="query")``——单条 ``_get_query_embedding`` 也是这么
+    实现的，批量版结果一致。其余模型退回逐条，至少前向仍然是串行的。
+    """
+    encode_queries = getattr(embed_model, "encode_queries", None)
+    if encode_queries is not None:
+        return [dense for dense, _ in encode_queries(queries)]
+    embed = getattr(embed_model, "_embed", None)
+    if embed is not None:
+        return list(embed(queries, prompt_name="query"))
+    return [embed_model._get_query_embedding(q) for q in queries]
+
+
+class EmbeddingBatcher:
+    """查询嵌入服务：``submit(query)`` 返回 ``Future[Embedding]``。
+
+    ``embed_batch`` 是真正的批量前向（``list[str] -> list[Embedding]``），测试可以
+    注入假的。工作线程首次提交时才启动。
+    """
+
+    def __init__(self, embed_batch, max_batch: int = 32, max_wait_ms: float = 5.0) -> None:
+        self._embed_batch = embed_batch
+        self._max_batch = max(1, max_batch)
+        self._max_wait = max(0.0, max_wait_ms) / 1000
+        self._queue: queue.Queue[_EmbedRequest] = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._requests = 0
+        self._batches = 0
+        self._forwarded = 0
+        self._max_batch_seen = 0
+        self._last_batch = 0
+        self._wait_ms_total = 0.0
+        self._infer_ms_total = 0.0
+
+    def submit(self, query: str) -> Future:
+        self._ensure_started()
+        request = _EmbedRequest(query=query)
+        self._queue.put(request)
+        return request.future
+
+    async def embed(self, query: str) -> Embedding:
+        return await asyncio.wrap_future(self.submit(query))
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                thread.start()
+                self._thread = thread
+
+    def _next_batch(self) -> list[_EmbedRequest]:
+        """阻塞等第一个请求，然后在 ``max_wait`` 内尽量多捎带，最多 ``max_batch`` 个。"""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self._max_wait
+        while len(batch) < self._max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            # 同一窗口里的相同问题（同一个热门问题被很多人同时问）只前向一次。
+            unique = list(dict.fromkeys(request.query for request in batch))
+            started = time.perf_counter()
+            try:
+                vectors = dict(zip(unique, self._embed_batch(unique)))
+            except Exception as exc:
+                for request in batch:
+                    _resolve(request.future, exception=exc)
+                continue
+            finished = time.perf_counter()
+            for request in batch:
+                _resolve(request.future, result=vectors[request.query])
+            with self._stats_lock:
+                self._requests += len(batch)
+                self._batches += 1
+                self._forwarded += len(unique)
+                self._max_batch_seen = max(self._max_batch_seen, len(unique))
+                self._last_batch = len(unique)
+                self._wait_ms_total += sum((started - r.enqueued_at) * 1000 for r in batch)
+                self._infer_ms_total += (finished - started) * 1000
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            batches = self._batches or 1
+            requests = self._requests or 1
+            return {
+                "queue_depth": self._queue.qsize(),
+                "requests": self._requests,
+                "batches": self._batches,
+                "embedded": self._forwarded,
+                "avg_batch_size": round(self._forwarded / batches, 2),
+                "max_batch_size": self._max_batch_seen,
+                "last_batch_size": self._last_batch,
+                "avg_queue_wait_ms": round(self._wait_ms_total / requests, 2),
+                "avg_inference_ms": round(self._infer_ms_total / batches, 2),
+            }
+
+
+class BatchedEmbedding(BaseEmbedding):
+    """把查询嵌入交给 ``EmbeddingBatcher`` 的透明包装，文本嵌入透传。
+
+    跟 ``CachedEmbedding`` 一样覆盖私有钩子而不是公开方法，避免重复上报
+    instrumentation 事件。
+    """
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _batcher: EmbeddingBatcher = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, max_batch: int = 32, max_wait_ms: float = 5.0, **kwargs) -> None:
+        super().__init__(model_name=inner.model_name, embed_batch_size=inner.embed_batch_size, **kwargs)
+        self._inner = inner
+        self._batcher = EmbeddingBatcher(lambda queries: embed_queries(inner, queries), max_batch, max_wait_ms)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "BatchedEmbedding"
+
+    @property
+    def inner(self) -> BaseEmbedding:
+        return self._inner
+
+    @property
+    def batcher(self) -> EmbeddingBatcher:
+        return self._batcher
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._batcher.submit(query).result()
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return await self._batcher.embed(query)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._inner._get_text_embedding(text)
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return await self._inner._aget_text_embedding(text)
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        return self._inner._get_text_embeddings(texts)
+
+    async def _aget_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        return await self._inner._aget_text_embeddings(texts)
+
+
+def embedding_batcher_stats() -> dict | None:
+    """全局嵌入模型的微批服务指标（``/manage/stats`` 用）；没启用微批时返回 None。
+
+    跟 ``utils/sparse_embedding.get_sparse_encoder`` 一样读 ``Settings._embed_model``，
+    沿 ``.inner`` 包装链找，不触发任何模型加载。
+    """
+    from llama_index.core import Settings
+
+    embed_model = getattr(Settings, "_embed_model", None)
+    for _ in range(4):
+        if embed_model is None:
+            return None
+        if isinstance(embed_model, BatchedEmbedding):
+            return embed_model.batcher.stats()
+        embed_model = getattr(embed_model, "inner", None)
+    return None
@@ -0,0 +1,189 @@
+"""进程级嵌入缓存：包在全局嵌入模型（bge-m3）外面的有界 LRU。
+
+## 解决什么问题
+
+一次 ``/graph/ask_stream`` 请求里同一个问题会被嵌入好几次：
+``handlers/qa_cache.lookup`` 嵌入一次，``build_retriever_for_index`` 里 dense
+检索的 ``VectorIndexRetriever`` 再嵌入一次，回答完 ``qa_cache.store_auto``
+还要再嵌入一次。CPU 部署下 bge-m3 一次前向是除 LLM 之外最大的单项开销，
+三次里有两次是纯重复劳动。
+
+## 为什么包在 Settings.embed_model 上，而不是各调用点自己查缓存
+
+上面三个调用点（还有 ``handlers/index_crud.updateNodeById`` 的单条
+``get_text_embedding``）拿的都是同一个全局 ``Settings.embed_model``——索引在
+``handlers/vector_store.build_index_from_collection`` 里也是用它构建的，dense
+检索器内部就是调它的 ``get_query_embedding``。所以在
+``configs/llm_predictor.init_settings`` 里把真实模型包一层
+``CachedEmbedding`` 再装回去，所有调用点零改动共享同一份缓存；缓存逻辑只在
+这一处，不会出现"qa_cache 缓存了、检索器没缓存"这种半截优化。
+
+## 缓存什么、不缓存什么
+
+- 缓存 key 是 ``(模式, normalize_text_key(文本))``：query 和 text 两种模式分开
+  存（有些模型给查询加 instruction 前缀，两者向量不同）；文本先做 NFKC +
+  空白折叠，" 图书馆　几点开门"和"图书馆  几点开门 "共用一条。中间的空白只折叠
+  成一个空格、不删除，"图书馆 几点开门"和"图书馆几点开门"是两条——分词器会把
+  空格编码进去，两者向量并不完全相同。
+- 只缓存**单条**嵌入。批量 ``_get_text_embeddings``（摄取时的 chunk 嵌入）直接
+  透传：摄取一次几千个 chunk，塞进 LRU 只会把热的查询向量全挤出去，而且
+  这些 chunk 文本几乎不会被重复嵌入。
+- 容量按字节预算（``EMBEDDING_CACHE_MAX_MB``）而不是条目数：换一个维度不同的
+  嵌入模型时预算的含义不变。向量按 float32 存（模型本身就是 float32 输出，
+  往返无损），1024 维一条 4KB，默认 64MB 约一万六千条。
+"""
+from __future__ import annotations
+
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from pydantic import PrivateAttr
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text_key(text: str) -> str:
+    """缓存/精确匹配用的文本归一化：NFKC（全角半角统一）+ 空白折叠 + 去首尾空白。
+
+    中间的空白折叠成一个空格但保留，"图书馆 几点开门"和"图书馆几点开门"不是同一个 key。
+
+    不做大小写折叠：bge-m3 对大小写敏感，"CET" 和 "cet" 的向量不一样，归一成
+    同一个 key 会让后来者拿到别人的向量。
+    """
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+class EmbeddingLRU:
+    """按字节预算淘汰的线程安全 LRU，值是 float32 向量。"""
+
+    def __init__(self, max_bytes: int) -> None:
+        self._max_bytes = max(0, int(max_bytes))
+        self._entries: OrderedDict[tuple[str, str], np.ndarray] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple[str, str]) -> Embedding | None:
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return vector.tolist()
+
+    def put(self, key: tuple[str, str], embedding: Embedding) -> None:
+        vector = np.asarray(embedding, dtype=np.float32)
+        if vector.nbytes > self._max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._entries[key] = vector
+            self._bytes += vector.nbytes
+            while self._bytes > self._max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self._max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class CachedEmbedding(BaseEmbedding):
+    """给任意 ``BaseEmbedding`` 加一层 ``EmbeddingLRU`` 的透明包装。
+
+    覆盖的是 ``_get_query_embedding`` 这一层私有钩子而不是公开方法：公开的
+    ``get_query_embedding`` 会发 instrumentation 事件、走 callback_manager，
+    包装层再调一次内层的公开方法就会重复上报一次嵌入事件。
+    """
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _cache: EmbeddingLRU = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, max_bytes: int, **kwargs) -> None:
+        super().__init__(
+            model_name=inner.model_name,
+            embed_batch_size=inner.embed_batch_size,
+            **kwargs,
+        )
+        self._inner = inner
+        self._cache = EmbeddingLRU(max_bytes)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def inner(self) -> BaseEmbedding:
+        return self._inner
+
+    @property
+    def cache(self) -> EmbeddingLRU:
+        return self._cache
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        key = ("query", normalize_text_key(query))
+        embedding = self._cache.get(key)
+        if embedding is None:
+            embedding = self._inner._get_query_embedding(query)
+            self._cache.put(key, embedding)
+        return embedding
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        key = ("query", normalize_text_key(query))
+        embedding = self._cache.get(key)
+        if embedding is None:
+            embedding = await self._inner._aget_query_embedding(query)
+            self._cache.put(key, embedding)
+        return embedding
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        key = ("text", normalize_text_key(text))
+        embedding = self._cache.get(key)
+        if embedding is None:
+            embedding = self._inner._get_text_embedding(text)
+            self._cache.put(key, embedding)
+        return embedding
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        key = ("text", normalize_text_key(text))
+        embedding = self._cache.get(key)
+        if embedding is None:
+            embedding = await self._inner._aget_text_embedding(text)
+            self._cache.put(key, embedding)
+        return embedding
+
+    # 批量接口透传不缓存，理由见模块 docstring。
+    def _get_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        return self._inner._get_text_embeddings(texts)
+
+    async def _aget_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        return await self._inner._aget_text_embeddings(texts)
+
+
+def embedding_cache_stats(embed_model) -> dict | None:
+    """``embed_model`` 是 ``CachedEmbedding`` 时返回其缓存统计，否则 None。"""
+    if isinstance(embed_model, CachedEmbedding):
+        return embed_model.cache.stats()
+    return None
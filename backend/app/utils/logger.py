@@ -5,10 +5,10 @@ from logging.handlers import RotatingFileHandler
 # 属性访问而不是 from...import：reload 后 from-import 的旧绑定感知不到
 # 新的 LOG_PATH（handlers 在 import 时配置一次，这里至少保证读的是 reload
 # 之后的值）。见 tests/test_load_env_binding_hygiene.py 的守卫说明。
+# configs.load_env 在自己被 import 时已经调过一次 reload_env_variables()，
+# 这里不再重复读一遍 .env。
 import configs.load_env as load_env
 
-load_env.reload_env_variables()
-
 if not os.path.exists(load_env.LOG_PATH):
     os.makedirs(load_env.LOG_PATH)
 
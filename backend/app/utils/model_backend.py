@@ -0,0 +1,157 @@
+"""bge-m3 / bge-reranker 的推理后端：全精度 torch、torch 动态 int8、ONNX Runtime、ONNX int8。
+
+## 为什么
+
+线上跑在只有 CPU 的节点上。``init_settings`` 和 ``utils/rerank._get_reranker``
+原来都是 sentence-transformers 默认的 fp32 torch 前向：bge-m3 和
+bge-reranker-v2-m3 都是 XLM-R large（5.6 亿参数，fp32 权重 2.2GB），每个问题
+一次嵌入前向 + 一次 20 对的重排前向，CPU 时间和常驻内存都花在这两个模型上。
+
+两个模型的算力几乎全在 Linear 层（注意力投影 + FFN），正好是动态 int8 量化
+最擅长的部分：权重离线量化成 int8，激活在运行时按 batch 动态量化，不需要
+校准数据。代价是分数有小幅漂移，所以改后端之前必须用
+``evals/bench_model_backend.py`` 在 golden 集上确认准确率没掉。
+
+## 四种后端（``EMBEDDING_BACKEND`` / ``RERANKER_BACKEND``）
+
+- ``torch``：原来的行为，默认值。
+- ``torch-int8``：照常加载 torch 模型，然后 ``torch.ao.quantization.quantize_dynamic``
+  把所有 ``nn.Linear`` 就地换成 int8 动态量化版本。不需要额外依赖。
+- ``onnx``：sentence-transformers 的 ONNX Runtime 后端（``backend="onnx"``），
+  需要 ``optimum[onnxruntime]``；模型仓库里没有 onnx 文件时第一次加载会现场导出。
+- ``onnx-int8``：在 ``onnx`` 的基础上用 ``export_dynamic_quantized_onnx_model``
+  导出动态 int8 量化的 onnx 文件（x86 用 avx2 指令集配置，ARM 用 arm64），
+  连同 tokenizer/配置一起存到 ``MODEL_EXPORT_DIR`` 下，之后的启动直接加载导出
+  结果，不再重复量化。
+
+量化只在 CPU 上有意义：检测到 CUDA 时一律回到 ``torch``。任何非 torch 后端
+加载失败（没装 optimum、导出失败……）都记一条警告退回 ``torch``，跟稀疏头、
+OCR 这些可选能力一样 best-effort，不会因为配置了优化后端就起不来。
+
+## 对已有向量的影响
+
+嵌入后端换成 int8 之后，查询向量跟库里 fp32 摄取的向量会有偏差。偏差多大、
+影不影响检索排名要看 bench 脚本报的"跟 fp32 的余弦"和 hit-rate，不要凭感觉
+换。新摄取的文档用当前后端嵌入。
+"""
+from __future__ import annotations
+
+import logging
+import os
+import platform
+import warnings
+
+# load_env.X 属性访问：后端在模型加载那一刻读取，跟其他配置一样支持热重载后重启生效。
+import configs.load_env as load_env
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+
+def resolve_backend(requested: str | None, device: str) -> str:
+    """把配置值归一成 ``BACKENDS`` 之一：不认识的值和 CUDA 上的量化/ONNX 后端都回到 torch。"""
+    backend = (requested or "torch").strip().lower()
+    if backend not in BACKENDS:
+        logger.warning("未知的模型后端 %r，使用 torch。可选：%s", requested, ", ".join(BACKENDS))
+        return "torch"
+    if backend != "torch" and device != "cpu":
+        logger.info("设备是 %s，%s 后端只针对 CPU，使用 torch。", device, backend)
+        return "torch"
+    return backend
+
+
+def _quantization_config() -> str:
+    """``export_dynamic_quantized_onnx_model`` 的指令集配置：ARM 用 arm64，其余用
+    avx2（比 avx512/avx512_vnni 兼容面广，云上 x86 节点基本都支持）。"""
+    return "arm64" if platform.machine().lower() in ("arm64", "aarch64") else "avx2"
+
+
+def _export_dir(model_name: str) -> str:
+    return os.path.join(load_env.MODEL_EXPORT_DIR, f"{model_name.replace('/', '__')}-onnx-int8")
+
+
+def _quantized_file_name() -> str:
+    return f"onnx/model_qint8_{_quantization_config()}.onnx"
+
+
+def export_onnx_int8(model_cls, model_name: str, **kwargs) -> str:
+    """导出（或复用已导出的）动态 int8 量化 onnx 模型，返回可以直接加载的本地目录。
+
+    ``model_cls`` 是 ``SentenceTransformer`` 或 ``CrossEncoder``，导出流程对两者一样：
+    先按 ONNX 后端加载 fp32 模型，整体 ``save_pretrained`` 到导出目录（tokenizer、
+    配置、pooling 都要带上），再在同一目录下写出量化后的 onnx 文件。
+    """
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    path = _export_dir(model_name)
+    if os.path.exists(os.path.join(path, _quantized_file_name())):
+        return path
+    logger.info("导出 %s 的 int8 ONNX 模型到 %s（只在第一次启动时做）。", model_name, path)
+    model = model_cls(model_name, device="cpu", backend="onnx", **kwargs)
+    os.makedirs(path, exist_ok=True)
+    model.save_pretrained(path)
+    export_dynamic_quantized_onnx_model(model, _quantization_config(), path)
+    return path
+
+
+def onnx_load_args(model_cls, model_name: str, backend: str, **kwargs) -> tuple[str, dict]:
+    """ONNX 后端的加载参数：返回 ``(model_name_or_path, 额外构造参数)``。"""
+    if backend == "onnx":
+        return model_name, {"backend": "onnx"}
+    path = export_onnx_int8(model_cls, model_name, **kwargs)
+    return path, {"backend": "onnx", "model_kwargs": {"file_name": _quantized_file_name()}}
+
+
+def quantize_dynamic_int8(module):
+    """把 ``module`` 里所有 ``nn.Linear`` 就地换成 int8 动态量化版本，返回 ``module``。"""
+    import torch
+
+    # torch.ao.quantization 在新版 torch 里标了弃用（迁到 torchao），eager 模式的
+    # quantize_dynamic 仍然可用；不为这一个调用引入 torchao 依赖，弃用警告不往日志里刷。
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        warnings.simplefilter("ignore", UserWarning)
+        torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return module
+
+
+def cross_encoder(reranker):
+    """``SentenceTransformerRerank`` 内部加载好的 ``CrossEncoder``。
+
+    llama_index 没有公开这个属性（私有的 ``_model``），只在这里碰它：批量打分
+    （utils/rerank.py）、int8 量化都要直接拿模型本身。
+    """
+    return reranker._model
+
+
+def build_cross_encoder_rerank(model: str, top_n: int, backend: str):
+    """按后端构造 ``SentenceTransformerRerank``。
+
+    llama_index 的 ``SentenceTransformerRerank.__init__`` 固定用 fp32 torch 加载
+    ``CrossEncoder``，没有透传 backend 的口子。torch-int8 直接量化它加载好的
+    模型；ONNX 后端要避免先加载一遍 2GB 的 torch 模型再扔掉，所以跳过
+    ``__init__``（``model_construct``），自己加载 ``CrossEncoder`` 塞进 ``_model``。
+    """
+    from llama_index.core.postprocessor import SentenceTransformerRerank
+
+    if backend in ("onnx", "onnx-int8"):
+        from llama_index.core.postprocessor.sbert_rerank import DEFAULT_SENTENCE_TRANSFORMER_MAX_LENGTH
+        from sentence_transformers import CrossEncoder
+
+        path, extra = onnx_load_args(CrossEncoder, model, backend, trust_remote_code=True)
+        reranker = SentenceTransformerRerank.model_construct(
+            top_n=top_n, model=model, device="cpu", keep_retrieval_score=False
+        )
+        reranker._model = CrossEncoder(
+            path,
+            max_length=DEFAULT_SENTENCE_TRANSFORMER_MAX_LENGTH,
+            device="cpu",
+            trust_remote_code=True,
+            **extra,
+        )
+        return reranker
+    reranker = SentenceTransformerRerank(model=model, top_n=top_n)
+    if backend == "torch-int8":
+        quantize_dynamic_int8(cross_encoder(reranker))
+    return reranker
@@ -0,0 +1,81 @@
+"""进程内限流：分桶的滑动窗口计数。
+
+## 为什么不再存时间戳列表
+
+原来的实现给每个 IP 存一个时间戳列表，每次检查先 ``pop(0)`` 把窗口外的
+时间戳逐个弹掉（列表头删除本身是 O(n)），整个过程套在一把全局
+``asyncio.Lock`` 里。校园网出口是 NAT，一个公网 IP 后面可能是一整栋宿舍楼，
+高峰期所有 LLM 请求都要在这把锁前排队。
+
+## 分桶计数
+
+把时间切成宽 ``window / buckets`` 秒的桶，每个 key 只存固定 ``buckets + 1``
+个 (桶编号, 计数)——当前桶加上前面 ``buckets`` 个桶。检查就是把这几个计数
+加起来跟 ``limit`` 比，放行就给当前桶 +1：不管一个 IP 打了多少次，开销都是
+常数。整个检查是同步的、中间没有 await，在事件循环里天然是原子的，不需要锁。
+
+``buckets + 1`` 个桶覆盖的时间比一个窗口略长（多出不到一个桶宽），所以任意
+长为 ``window`` 的区间里放行的次数都不会超过 ``limit``——"每 60 秒最多 30 次"
+的约束跟原来一样严格，代价是打满之后最多要多等一个桶宽（默认 10 秒）才恢复。
+没有用 GCRA / 令牌桶：它们在一个 key 刚开始活跃的那个窗口里会放行接近
+``2 * limit`` 次（先一口气打满，再按平均速率续上），放宽了原来的约束。
+
+多 worker 部署时计数走共享状态库（utils/shared_state.py），不用这里；库里的
+``rate_limit_buckets`` 表是同一套分桶，每个 key 同样只有几行。
+"""
+from __future__ import annotations
+
+import time
+
+
+class BucketedRateLimiter:
+    """``window`` 秒内最多 ``limit`` 次；最多跟踪 ``max_keys`` 个 key。"""
+
+    def __init__(self, limit: int, window: float, buckets: int = 6, max_keys: int = 5000) -> None:
+        self.limit = limit
+        self.window = window
+        self.width = window / buckets
+        self.slots = buckets + 1
+        self.max_keys = max_keys
+        # key -> (桶编号列表, 计数列表)，按 桶编号 % slots 取下标。
+        self.buckets: dict[str, tuple[list[int], list[int]]] = {}
+
+    def hit(self, key: str, now: float | None = None) -> bool:
+        """放行就记一次并返回 True；超限返回 False，不记账。"""
+        now = time.time() if now is None else now
+        epoch = int(now // self.width)
+        state = self.buckets.get(key)
+        if state is None:
+            if len(self.buckets) >= self.max_keys:
+                # 满了先丢最早加入的 key（dict 保持插入顺序），O(1)。定时清理会把
+                # 过期的 key 提前清掉，正常流量下走不到这里。
+                self.buckets.pop(next(iter(self.buckets)))
+            state = self.buckets[key] = ([-1] * self.slots, [0] * self.slots)
+        epochs, counts = state
+        oldest = epoch - self.slots
+        total = 0
+        for i in range(self.slots):
+            if epochs[i] > oldest:
+                total += counts[i]
+        if total >= self.limit:
+            return False
+        slot = epoch % self.slots
+        if epochs[slot] != epoch:
+            epochs[slot], counts[slot] = epoch, 0
+        counts[slot] += 1
+        return True
+
+    def evict_expired(self, now: float | None = None) -> int:
+        """丢掉所有桶都已经滑出窗口的 key，返回丢掉的个数（由定时清理任务调用）。"""
+        now = time.time() if now is None else now
+        oldest = int(now // self.width) - self.slots
+        expired = [key for key, (epochs, _) in self.buckets.items() if max(epochs) <= oldest]
+        for key in expired:
+            del self.buckets[key]
+        return len(expired)
+
+    def clear(self) -> None:
+        self.buckets.clear()
+
+    def __len__(self) -> int:
+        return len(self.buckets)
@@ -0,0 +1,208 @@
+"""按分钟分桶的请求指标：每个端点每分钟的请求数、错误数、耗时分布。
+
+/manage/stats 原来只有累计的访问次数（总数、每个 IP、每个端点），看不出
+"高峰那十分钟 /graph/ask_stream 的 p99 是多少"。做容量规划、判断高峰期是重排
+还是 LLM 拖慢了整体，要的是按时间切开的数据。
+
+## 结构
+
+- ``LatencyHistogram``：HdrHistogram 式的对数-线性分桶。耗时按微秒取整，
+  每个 2 的幂区间再均分 ``_HALF`` 份，任何值落进的桶宽不超过它本身的
+  ``1 / _HALF``（约 1.6%）——从 1ms 到十分钟都是这个相对精度。只存非零的桶
+  （稀疏字典），一个端点一分钟通常就几十个桶；合并就是按桶号相加，所以多个
+  worker、多个分钟的直方图可以直接合起来再算百分位，不会像"平均 p99"那样失真。
+- ``RequestMetrics``：内存里还没落库的 (分钟, 端点) 桶，最多 ``ring_minutes``
+  分钟（一直刷不进库就丢最老的），是个有上限的环形缓冲。中间件每个请求结束时
+  ``record`` 一次：同步、不加锁（只在事件循环线程上调用，同
+  utils/access_counter.py）。
+- 定期刷库时 ``drain_completed`` 取走已经过去的分钟，由
+  ``utils.db.add_request_metrics`` 累加进 SQLite 的 ``request_metrics`` 表
+  （多 worker 各自累加，直方图在库里合并）。刷库失败就 ``restore``，下一轮再来。
+
+查询时库里是已经落库的部分，再叠加本进程内存里还没落库的部分（``pending_rows``），
+同一个请求不会算两遍。
+
+端点用路由模板（``/index/{index_name}/query``）而不是实际路径：否则每个知识库名、
+每个扫描器乱打的 404 路径都是一个新端点，表会无限膨胀。没匹配上任何路由的请求
+统一记成 ``UNMATCHED``。
+"""
+from __future__ import annotations
+
+import time
+
+# 每个 2 的幂区间分多少个桶（相对误差 1/_HALF）
+_HALF = 64
+_LINEAR = 2 * _HALF
+
+UNMATCHED = "(unmatched)"
+
+
+def _bucket_index(value_us: int) -> int:
+    if value_us < _LINEAR:
+        return max(value_us, 0)
+    shift = value_us.bit_length() - _LINEAR.bit_length() + 1
+    return shift * _HALF + (value_us >> shift)
+
+
+def _bucket_upper_us(index: int) -> int:
+    """桶里的最大值（HdrHistogram 的 highest equivalent value）。"""
+    if index < _LINEAR:
+        return index
+    shift = index // _HALF - 1
+    mantissa = index - shift * _HALF
+    return ((mantissa + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    def __init__(self, counts: dict[int, int] | None = None) -> None:
+        self.counts: dict[int, int] = dict(counts or {})
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def record(self, seconds: float) -> None:
+        index = _bucket_index(int(seconds * 1_000_000))
+        self.counts[index] = self.counts.get(index, 0) + 1
+
+    def merge(self, other: LatencyHistogram) -> None:
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+
+    def percentile(self, q: float) -> float | None:
+        """第 ``q``（0-100）百分位，毫秒；没有数据返回 None。"""
+        total = self.total
+        if not total:
+            return None
+        rank = max(1, -(-total * q // 100))  # 向上取整，至少第 1 个
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return round(_bucket_upper_us(index) / 1000, 3)
+        return round(_bucket_upper_us(max(self.counts)) / 1000, 3)
+
+    def to_pairs(self) -> list[list[int]]:
+        """``[[桶号, 次数], ...]``，存库用（JSON）。"""
+        return [[index, self.counts[index]] for index in sorted(self.counts)]
+
+    @classmethod
+    def from_pairs(cls, pairs) -> LatencyHistogram:
+        return cls({int(index): int(count) for index, count in pairs})
+
+
+class _MinuteBucket:
+    __slots__ = ("count", "errors", "histogram")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.histogram = LatencyHistogram()
+
+
+def summarize(minute: int, endpoint: str, count: int, errors: int, histogram: LatencyHistogram) -> dict:
+    """一个 (时间段, 端点) 桶的对外形状（/manage/stats/requests）：``start`` 是时间段开始的 Unix 秒。"""
+    return {
+        "start": minute * 60,
+        "endpoint": endpoint,
+        "count": count,
+        "errors": errors,
+        "p50_ms": histogram.percentile(50),
+        "p95_ms": histogram.percentile(95),
+        "p99_ms": histogram.percentile(99),
+        "max_ms": histogram.percentile(100),
+    }
+
+
+class RequestMetrics:
+    """还没落库的 (分钟, 端点) 桶，最多 ``ring_minutes`` 分钟。"""
+
+    def __init__(self, ring_minutes: int = 60) -> None:
+        self.ring_minutes = max(1, ring_minutes)
+        # 分钟序号（Unix 秒 // 60）-> {端点 -> 桶}
+        self.minutes: dict[int, dict[str, _MinuteBucket]] = {}
+
+    def _bucket(self, minute: int, endpoint: str) -> _MinuteBucket:
+        endpoints = self.minutes.get(minute)
+        if endpoints is None:
+            endpoints = self.minutes[minute] = {}
+            while len(self.minutes) > self.ring_minutes:
+                # 一直刷不进库时丢掉最老的分钟：内存有上限比数据完整更重要
+                del self.minutes[min(self.minutes)]
+            if minute not in self.minutes:
+                return _MinuteBucket()  # 本身就是最老的，已经被挤出去了
+        bucket = endpoints.get(endpoint)
+        if bucket is None:
+            bucket = endpoints[endpoint] = _MinuteBucket()
+        return bucket
+
+    def record(self, endpoint: str, seconds: float, error: bool, now: float | None = None) -> None:
+        bucket = self._bucket(int((time.time() if now is None else now) // 60), endpoint)
+        bucket.count += 1
+        if error:
+            bucket.errors += 1
+        bucket.histogram.record(seconds)
+
+    @staticmethod
+    def _rows(minute: int, endpoints: dict[str, _MinuteBucket]) -> list[dict]:
+        return [
+            {
+                "minute": minute, "endpoint": endpoint, "count": bucket.count,
+                "errors": bucket.errors, "histogram": bucket.histogram.to_pairs(),
+            }
+            for endpoint, bucket in endpoints.items()
+        ]
+
+    def drain_completed(self, now: float | None = None, include_current: bool = False) -> list[dict]:
+        """取走已经结束的分钟（``include_current`` 时连同当前分钟，进程退出前用）。
+
+        返回 ``utils.db.add_request_metrics`` 要的行：``minute``、``endpoint``、
+        ``count``、``errors``、``histogram``（``LatencyHistogram.to_pairs``）。
+        """
+        current = int((time.time() if now is None else now) // 60)
+        rows = []
+        for minute in sorted(self.minutes):
+            if minute >= current and not include_current:
+                continue
+            rows.extend(self._rows(minute, self.minutes.pop(minute)))
+        return rows
+
+    def restore(self, rows: list[dict]) -> None:
+        """刷库失败时把 ``drain_completed`` 取走的行放回去，下一轮再刷。"""
+        for row in rows:
+            bucket = self._bucket(row["minute"], row["endpoint"])
+            bucket.count += row["count"]
+            bucket.errors += row["errors"]
+            bucket.histogram.merge(LatencyHistogram.from_pairs(row["histogram"]))
+
+    def pending_rows(self, since_minute: int, until_minute: int) -> list[dict]:
+        """``[since_minute, until_minute]`` 里还没落库的行，查询时叠加到库里的数据上。"""
+        rows = []
+        for minute in sorted(self.minutes):
+            if since_minute <= minute <= until_minute:
+                rows.extend(self._rows(minute, self.minutes[minute]))
+        return rows
+
+    def clear(self) -> None:
+        self.minutes.clear()
+
+
+def merge_rows(rows: list[dict], endpoint: str | None = None, step: int = 1) -> list[dict]:
+    """把行按 ``step`` 分钟一组、按端点合起来（库里的和内存里的同一分钟也在这里合），
+    算好百分位，按时间、端点排序。``endpoint`` 不为 None 时只要这一个端点。"""
+    step = max(1, step)
+    merged: dict[tuple[int, str], _MinuteBucket] = {}
+    for row in rows:
+        if endpoint is not None and row["endpoint"] != endpoint:
+            continue
+        key = (row["minute"] - row["minute"] % step, row["endpoint"])
+        bucket = merged.get(key)
+        if bucket is None:
+            bucket = merged[key] = _MinuteBucket()
+        bucket.count += row["count"]
+        bucket.errors += row["errors"]
+        bucket.histogram.merge(LatencyHistogram.from_pairs(row["histogram"]))
+    return [
+        summarize(minute, name, bucket.count, bucket.errors, bucket.histogram)
+        for (minute, name), bucket in sorted(merged.items())
+    ]
@@ -0,0 +1,125 @@
+"""请求内的分阶段耗时：一次提问在压缩、缓存、检索、重排、改写、首 token 上各花了多久。
+
+原来只有 ``utils.rerank`` 自己往日志里打一行重排耗时，其余阶段——
+``condense_query`` 的 LLM 调用、语义缓存查询、混合检索、条件触发的查询改写、
+首 token 延迟——都没有记录。用户说"这次回答好慢"时，只能猜是哪一步慢。
+
+## 用法
+
+请求入口（``main.SessionAndStatsMiddleware``）对每个非静态请求 ``start()``
+一个 ``RequestTimings``，放进 ``ContextVar``；下游各阶段用
+
+    with request_timing.stage("retrieve"):
+        nodes = await retriever.aretrieve(...)
+
+或 ``request_timing.mark("first_token")``（记"从请求开始到现在"）往里记。
+不在请求里调用时（测试、evals 脚本直接调 ``QAWorkflow``）``current()`` 是
+None，``stage``/``mark`` 什么都不做。
+
+为什么是 ContextVar 而不是一路传参：阶段散落在 ``QAWorkflow`` 的 step、
+``handlers/auto_router``、``agents/agent_workflow`` 里，中间隔着 llama_index
+的 Workflow 调度，没法给每一层加参数。asyncio 建任务时复制当前上下文，
+Workflow 的 step 任务、``StreamingResponse`` 跑生成器的任务都是在请求任务里
+建的，拿到的是同一个 ``RequestTimings`` 对象（复制的是引用），往里记的东西
+请求入口都看得到。
+
+## 输出
+
+- ``/graph/ask_stream`` 的 ``done`` 事件带 ``timings`` 字段；
+- 非流式端点：中间件在响应头里加 ``Server-Timing``（浏览器开发者工具的
+  Timing 面板直接能看）。流式端点发响应头时各阶段还没开始跑，不加；
+- 问答端点往 query 日志里写一行 ``timings: condense=12ms retrieve=48ms ...``。
+
+同名阶段多次记录会累加（比如一次请求里跑了两次检索）。Agent 分支的
+``agent_tools`` 是所有工具调用的合计，工具内部的检索/重排不再单独拆出来。
+``/graph/ask_stream`` 的 ``route`` 是 ``auto_router.route_query`` 整体，
+跟它里面的 ``condense``/``retrieve``/``rerank`` 重叠，不能跟它们相加。
+"""
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+class RequestTimings:
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        # 阶段名 -> 毫秒，按第一次记录的顺序
+        self.stages: dict[str, float] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds * 1000
+
+    def mark(self, name: str) -> None:
+        """记"从请求开始到现在"，同名只记第一次（首 token 之类）。"""
+        if name not in self.stages:
+            self.stages[name] = (time.perf_counter() - self.started) * 1000
+
+    def as_dict(self) -> dict[str, float]:
+        """各阶段毫秒数（保留一位小数），最后加上到目前为止的 ``total``。"""
+        result = {name: round(ms, 1) for name, ms in self.stages.items()}
+        result["total"] = round((time.perf_counter() - self.started) * 1000, 1)
+        return result
+
+    def server_timing(self) -> str:
+        """``Server-Timing`` 响应头的值。"""
+        return ", ".join(f"{name};dur={ms}" for name, ms in self.as_dict().items())
+
+    def log_line(self) -> str:
+        return " ".join(f"{name}={ms:.0f}ms" for name, ms in self.as_dict().items())
+
+
+_current: ContextVar[RequestTimings | None] = ContextVar("request_timings", default=None)
+
+
+def start() -> RequestTimings:
+    """给当前上下文（请求）开一份新的计时，返回它。"""
+    timings = RequestTimings()
+    _current.set(timings)
+    return timings
+
+
+def stop() -> None:
+    """请求结束：当前上下文不再记录（已经复制出去的子任务不受影响）。"""
+    _current.set(None)
+
+
+def current() -> RequestTimings | None:
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str):
+    """把 with 块的耗时记到当前请求的 ``name`` 阶段；不在请求里时什么都不做。
+
+    块里抛异常也照样记（失败的检索同样花了时间）。
+    """
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+
+def add(name: str, seconds: float) -> None:
+    """没法用 with 包住的阶段（比如跨好几个事件的工具调用）自己算好耗时再记。"""
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+def mark(name: str) -> None:
+    timings = _current.get()
+    if timings is not None:
+        timings.mark(name)
+
+
+def log_line() -> str:
+    """当前请求各阶段耗时的一行摘要，写 query 日志用；不在请求里时是 ``-``。"""
+    timings = _current.get()
+    return timings.log_line() if timings is not None else "-"
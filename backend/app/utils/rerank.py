@@ -4,8 +4,18 @@
 - 默认关闭，不改变现有线上行为。
 - 打开后，向量召回候选数由 RERANK_RECALL_K 控制；
   若 top1 分数 >= RERANK_SCORE_THRESHOLD，直接截断到 RERANK_TOP_N 返回；
-  否则对全部候选做 rerank，取 RERANK_TOP_N。
+  否则对全部候选做 rerank，取 RERANK_TOP_N。混合检索下 top1 是 RRF 分、没有
+  区分度，``RERANK_SKIP_MODE=fusion`` 改用融合前的 dense/BM25 信号判断（见
+  ``_skip_rerank``）。
 - Reranker 延迟加载，首次触发时才 import sentence-transformers。
+- 异步调用方（QAWorkflow.retrieve、auto_router.route_query、agent 检索工具、
+  query engine 的 apostprocess_nodes）走 ``arerank_nodes``：cross-encoder 前向
+  交给 ``RerankService`` 的专用工作线程，不再在事件循环里同步跑几百毫秒把
+  其他流式回答全卡住；并发请求的 (query, passage) 对在工作线程里攒成一批、
+  一次前向打完分。队列深度/批大小等指标见 ``rerank_service_stats()``。
+- 异步路径前面挡一层 ``RerankScoreCache``：同一 (query, node, 节点内容) 对
+  打过分就不再进模型（追问、agent 重试、自动路由之后再走工作流都会重复打
+  同一批候选）。命中率见 ``rerank_cache_stats()``，挂在 ``/graph/cache_stats``。
 
 用法:
     from utils.rerank import ConditionalRerankPostprocessor
@@ -16,11 +26,19 @@
 """
 from __future__ import annotations
 
+import asyncio
 import logging
+import queue
+import threading
 import time
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import Future
+from dataclasses import dataclass, field
 
 from llama_index.core.postprocessor.types import BaseNodePostprocessor
-from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+from utils.embedding_cache import normalize_text_key
 
 logger = logging.getLogger(__name__)
 
@@ -32,13 +50,382 @@ def _get_reranker():
     if _reranker_instance is None:
         import configs.load_env as load_env
         from llama_index.core.postprocessor import SentenceTransformerRerank
-        _reranker_instance = SentenceTransformerRerank(
-            model=load_env.RERANKER_MODEL,
-            top_n=load_env.RERANK_TOP_N,
-        )
+        from llama_index.core.utils import infer_torch_device
+        from utils.model_backend import build_cross_encoder_rerank, resolve_backend
+
+        # 推理后端（fp32 torch / int8 / ONNX）见 utils/model_backend.py；
+        # 优化后端加载失败时退回原来的 fp32 torch。
+        backend = resolve_backend(load_env.RERANKER_BACKEND, infer_torch_device())
+        reranker = None
+        if backend != "torch":
+            try:
+                reranker = build_cross_encoder_rerank(load_env.RERANKER_MODEL, load_env.RERANK_TOP_N, backend)
+            except Exception:
+                logger.warning("reranker 的 %s 后端加载失败，使用 torch。", backend, exc_info=True)
+        if reranker is None:
+            reranker = SentenceTransformerRerank(
+                model=load_env.RERANKER_MODEL,
+                top_n=load_env.RERANK_TOP_N,
+            )
+        _reranker_instance = reranker
     return _reranker_instance
 
 
+# ── RerankService：专用工作线程 + 并发请求微批 ─────────────────────────────
+#
+# 为什么是自己的工作线程而不是 asyncio.to_thread：to_thread 只解决"不卡事件
+# 循环"，但 N 个并发请求会变成默认线程池里 N 次互相抢 CPU 的独立前向——CPU
+# 上 torch 本来就会用满所有核，并发前向只会互相拖慢。专用线程池（默认 1 个
+# worker）让前向串行执行，而排队期间攒下来的其他请求在下一次前向里一起打分：
+# 20 条候选的前向和 60 条候选的前向耗时差得远没有 3 倍（padding 到同一长度
+# 后一次矩阵乘），并发越高摊得越薄。
+#
+# 用 queue.Queue + concurrent.futures.Future 而不是 asyncio.Queue：工作线程
+# 跟事件循环无关，同步调用方（老的 rerank_nodes 路径、测试里的 asyncio.run）
+# 和任意事件循环都能共用同一个服务实例，await 侧用 asyncio.wrap_future 桥接。
+
+
+@dataclass
+class _RerankRequest:
+    query: str
+    texts: list[str]
+    future: Future = field(default_factory=Future)
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+class RerankService:
+    """cross-encoder 打分服务：``score(query, texts)`` 返回每段文本的相关度分数。
+
+    ``score_pairs`` 是真正的打分函数（``list[(query, text)] -> list[float]``），
+    生产里是 bge-reranker 的 ``CrossEncoder.predict``，测试可以注入假的。工作
+    线程首次提交时才启动，模型加载也发生在工作线程里，不在事件循环上。
+    """
+
+    def __init__(
+        self,
+        score_pairs: Callable[[list[tuple[str, str]]], list[float]],
+        workers: int = 1,
+        max_batch_pairs: int = 64,
+        max_wait_ms: float = 2.0,
+    ) -> None:
+        self._score_pairs = score_pairs
+        self._workers = max(1, workers)
+        self._max_batch_pairs = max(1, max_batch_pairs)
+        self._max_wait = max(0.0, max_wait_ms) / 1000
+        self._queue: queue.Queue[_RerankRequest] = queue.Queue()
+        self._threads: list[threading.Thread] = []
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._requests = 0
+        self._batches = 0
+        self._pairs = 0
+        self._max_batch_seen = 0
+        self._last_batch_pairs = 0
+        self._wait_ms_total = 0.0
+        self._infer_ms_total = 0.0
+
+    def submit(self, query: str, texts: list[str]) -> Future:
+        self._ensure_started()
+        request = _RerankRequest(query=query, texts=list(texts))
+        self._queue.put(request)
+        return request.future
+
+    async def score(self, query: str, texts: list[str]) -> list[float]:
+        return await asyncio.wrap_future(self.submit(query, texts))
+
+    def _ensure_started(self) -> None:
+        if self._threads:
+            return
+        with self._start_lock:
+            if self._threads:
+                return
+            for i in range(self._workers):
+                thread = threading.Thread(target=self._run, name=f"rerank-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _next_batch(self) -> list[_RerankRequest]:
+        """阻塞等第一个请求，然后在 ``max_wait`` 内尽量多捎带排队中的请求，
+        直到凑满 ``max_batch_pairs`` 对。单个请求本身超过上限也照样整批跑，
+        不拆分（拆了反而要多次前向）。"""
+        batch = [self._queue.get()]
+        pairs = len(batch[0].texts)
+        deadline = time.perf_counter() + self._max_wait
+        while pairs < self._max_batch_pairs:
+            remaining = deadline - time.perf_counter()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(request)
+            pairs += len(request.texts)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            pairs = [(request.query, text) for request in batch for text in request.texts]
+            started = time.perf_counter()
+            try:
+                scores = [float(s) for s in self._score_pairs(pairs)] if pairs else []
+            except Exception as exc:
+                for request in batch:
+                    _resolve(request.future, exception=exc)
+                continue
+            finished = time.perf_counter()
+            offset = 0
+            for request in batch:
+                _resolve(request.future, result=scores[offset: offset + len(request.texts)])
+                offset += len(request.texts)
+            with self._stats_lock:
+                self._requests += len(batch)
+                self._batches += 1
+                self._pairs += len(pairs)
+                self._max_batch_seen = max(self._max_batch_seen, len(pairs))
+                self._last_batch_pairs = len(pairs)
+                self._wait_ms_total += sum((started - r.enqueued_at) * 1000 for r in batch)
+                self._infer_ms_total += (finished - started) * 1000
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            batches = self._batches or 1
+            requests = self._requests or 1
+            return {
+                "workers": self._workers,
+                "queue_depth": self._queue.qsize(),
+                "requests": self._requests,
+                "batches": self._batches,
+                "pairs": self._pairs,
+                "avg_batch_pairs": round(self._pairs / batches, 2),
+                "avg_batch_requests": round(self._requests / batches, 2),
+                "max_batch_pairs": self._max_batch_seen,
+                "last_batch_pairs": self._last_batch_pairs,
+                "avg_queue_wait_ms": round(self._wait_ms_total / requests, 2),
+                "avg_inference_ms": round(self._infer_ms_total / batches, 2),
+            }
+
+
+def _resolve(future: Future, result=None, exception: BaseException | None = None) -> None:
+    # await 方被取消（客户端断开流）时 wrap_future 会连带取消这个 Future，
+    # 再 set_result 会抛 InvalidStateError——不能让它把工作线程打死。
+    if future.cancelled():
+        return
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except Exception:
+        pass
+
+
+_service_instance: RerankService | None = None
+_service_lock = threading.Lock()
+
+
+# ── RerankScoreCache：(query, node_id, 节点内容 hash) -> cross-encoder 分数 ──
+#
+# cross-encoder 分数是 (query, passage) 的纯函数，模型不变就不会变，所以只要
+# key 能唯一确定这一对就可以无限期复用，不需要 TTL：
+# - query 用 normalize_text_key 归一（跟嵌入缓存同一套规则，不折叠大小写）；
+# - node_id 之外再带 ``node.hash``（文本+元数据的 sha256）：/updateNodeById
+#   改了节点内容 hash 就变，旧分数自然失效，不需要跟索引写入路径打通失效钩子。
+# 值是一个 float，按条目数而不是字节数限容。
+
+
+class RerankScoreCache:
+    """线程安全的有界 LRU，值是单个 (query, node) 对的 cross-encoder 分数。"""
+
+    def __init__(self, max_entries: int) -> None:
+        self._max_entries = max(0, int(max_entries))
+        self._entries: OrderedDict[tuple[str, str, str], float] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(query: str, node: NodeWithScore) -> tuple[str, str, str]:
+        return normalize_text_key(query), node.node.node_id, node.node.hash
+
+    def get_many(self, keys: list[tuple[str, str, str]]) -> list[float | None]:
+        with self._lock:
+            results = []
+            for key in keys:
+                score = self._entries.get(key)
+                if score is None:
+                    self.misses += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                results.append(score)
+            return results
+
+    def put_many(self, items: list[tuple[tuple[str, str, str], float]]) -> None:
+        if self._max_entries == 0:
+            return
+        with self._lock:
+            for key, score in items:
+                self._entries[key] = score
+                self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self._max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_score_cache: RerankScoreCache | None = None
+
+
+def get_rerank_score_cache() -> RerankScoreCache | None:
+    """进程级分数缓存；``RERANK_CACHE_ENABLED`` 关闭时返回 None。"""
+    global _score_cache
+    import configs.load_env as load_env
+
+    if not load_env.RERANK_CACHE_ENABLED:
+        return None
+    if _score_cache is None:
+        with _service_lock:
+            if _score_cache is None:
+                _score_cache = RerankScoreCache(load_env.RERANK_CACHE_MAX_ENTRIES)
+    return _score_cache
+
+
+def rerank_cache_stats() -> dict:
+    """分数缓存命中统计（``/graph/cache_stats`` 用）。"""
+    import configs.load_env as load_env
+
+    stats = {"enabled": load_env.RERANK_CACHE_ENABLED}
+    if _score_cache is not None:
+        stats.update(_score_cache.stats())
+    return stats
+
+
+async def _score_nodes(query: str, nodes: list[NodeWithScore]) -> list[float]:
+    """给 nodes 逐个打 cross-encoder 分：先查分数缓存，只把没命中的送进
+    ``RerankService``，打完回填缓存。全部命中时完全不碰模型。"""
+    cache = get_rerank_score_cache()
+    if cache is None:
+        texts = [n.node.get_content(metadata_mode=MetadataMode.EMBED) for n in nodes]
+        return await get_rerank_service().score(query, texts)
+
+    keys = [RerankScoreCache.key(query, n) for n in nodes]
+    cached = cache.get_many(keys)
+    scores = {i: score for i, score in enumerate(cached) if score is not None}
+    missing = [i for i, score in enumerate(cached) if score is None]
+    if missing:
+        texts = [nodes[i].node.get_content(metadata_mode=MetadataMode.EMBED) for i in missing]
+        fresh = await get_rerank_service().score(query, texts)
+        scores.update(zip(missing, fresh))
+        cache.put_many([(keys[i], score) for i, score in zip(missing, fresh)])
+    return [scores[i] for i in range(len(nodes))]
+
+
+def _cross_encoder_score_pairs(pairs: list[tuple[str, str]]) -> list[float]:
+    # 直接调 SentenceTransformerRerank 内部的 CrossEncoder：它的
+    # postprocess_nodes 一次只接受一个 query，没法把多个请求拼进同一次前向。
+    from utils.model_backend import cross_encoder
+
+    return cross_encoder(_get_reranker()).predict(pairs)
+
+
+def get_rerank_service() -> RerankService:
+    global _service_instance
+    if _service_instance is None:
+        with _service_lock:
+            if _service_instance is None:
+                import configs.load_env as load_env
+
+                _service_instance = RerankService(
+                    _cross_encoder_score_pairs,
+                    workers=load_env.RERANK_WORKERS,
+                    max_batch_pairs=load_env.RERANK_MAX_BATCH_PAIRS,
+                    max_wait_ms=load_env.RERANK_BATCH_WAIT_MS,
+                )
+    return _service_instance
+
+
+def rerank_service_stats() -> dict | None:
+    """服务指标（``/manage/stats`` 用）；服务还没被用过时返回 None。"""
+    return _service_instance.stats() if _service_instance is not None else None
+
+
+def _skip_rerank(nodes: list[NodeWithScore]) -> list[NodeWithScore] | None:
+    """``rerank_nodes`` / ``arerank_nodes`` 共用的"不重排"判断：该跳过时返回
+    原样（或截断后）的 nodes，需要真的重排时返回 None。"""
+    import configs.load_env as load_env
+
+    if not load_env.RERANK_ENABLED:
+        return nodes[: load_env.RERANK_TOP_N]
+
+    if not nodes:
+        return nodes
+
+    # 已知问题（2026-08，实现 handlers/auto_router.py 自动路由时在真实语料
+    # 上测出来的）：混合检索下 nodes[0].score 是**融合后**的 RRF 分数，不是
+    # cross-encoder 重排分数。campus-corpus 实测下来，RRF top1 无论问题是否
+    # 被语料覆盖都落在 0.026~0.033 这个极窄区间——完全没有区分度，恒小于
+    # RERANK_SCORE_THRESHOLD=0.75，也就是默认的 ``RERANK_SKIP_MODE=score``
+    # 下"top1 >= 阈值时跳过 rerank"这个分支在混合检索里事实上从未触发过，
+    # rerank 一直在无条件触发。
+    #
+    # ``RERANK_SKIP_MODE=fusion`` 改用 handlers/hybrid_retriever.py 在融合前
+    # 取的 FusionSignal（dense 余弦 top1/间隔 + 两路 top1 是否一致）判断，
+    # 阈值由 ``evals/run_rerank_eval.py --calibrate-skip`` 在 golden 集上标定
+    # （取"跳过后 hit@k 不低于全量重排"的最大跳过率那一组）。默认仍是
+    # score：改触发逻辑会直接影响线上检索质量基线，必须先在有索引数据的机器
+    # 上跑一轮标定、把结果写进 .env 再切。节点不带信号（混合检索关闭，纯
+    # 向量检索的 score 是 Chroma 的 exp(-L2 距离²)）时两种模式都按原来的分数阈值判断。
+    #
+    # 跳过时返回的 nodes 仍带 RRF 分，did_rerank=False，调用方（auto_router）
+    # 按"没重排"处理，不会拿 RRF 分去比 cross-encoder 阈值。
+    signal = getattr(nodes[0], "signal", None)
+    if load_env.RERANK_SKIP_MODE == "fusion" and signal is not None:
+        if (
+            signal.legs_agree
+            and signal.dense_top1 >= load_env.RERANK_SKIP_DENSE_MIN
+            and signal.dense_margin >= load_env.RERANK_SKIP_DENSE_MARGIN
+        ):
+            logger.debug(
+                "rerank skipped: legs agree, dense top1=%.3f margin=%.3f",
+                signal.dense_top1,
+                signal.dense_margin,
+            )
+            return nodes[: load_env.RERANK_TOP_N]
+    else:
+        top1_score = nodes[0].score or 0.0
+        if top1_score >= load_env.RERANK_SCORE_THRESHOLD:
+            logger.debug(
+                "rerank skipped: top1=%.3f >= threshold=%.2f",
+                top1_score,
+                load_env.RERANK_SCORE_THRESHOLD,
+            )
+            return nodes[: load_env.RERANK_TOP_N]
+
+    if len(nodes) <= load_env.RERANK_TOP_N:
+        logger.debug(
+            "rerank skipped: recall=%d <= top_n=%d",
+            len(nodes),
+            load_env.RERANK_TOP_N,
+        )
+        return nodes
+    return None
+
+
 def rerank_nodes(
     nodes: list[NodeWithScore],
     query_bundle: QueryBundle | None = None,
@@ -62,44 +449,11 @@ def rerank_nodes(
     """
     import configs.load_env as load_env
 
-    if not load_env.RERANK_ENABLED:
-        return nodes[: load_env.RERANK_TOP_N], False
-
-    if not nodes:
-        return nodes, False
+    skipped = _skip_rerank(nodes)
+    if skipped is not None:
+        return skipped, False
 
-    # 已知问题（2026-08，实现 handlers/auto_router.py 自动路由时在真实语料
-    # 上测出来的，如实记录、这次不改）：这里的 top1_score 是**融合后**的
-    # RRF 分数（混合检索 BM25+dense 的 RRF 融合结果），不是 cross-encoder
-    # 重排分数。campus-corpus 实测下来，RRF top1 无论问题是否被语料覆盖都
-    # 落在 0.026~0.033 这个极窄区间——完全没有区分度，恒小于
-    # RERANK_SCORE_THRESHOLD=0.75，也就是"top1 >= 阈值时跳过 rerank"这个
-    # 条件分支在生产环境里事实上从未被触发过，rerank 其实一直在无条件
-    # 触发（等价于 RERANK_ENABLED 打开后 always-on，只是顶着"条件触发"的
-    # 名字）。这不是这次改动引入的新问题，是在验证自动路由分数区分度时
-    # 顺带发现的既有行为；不在这次改动里修（改这个阈值/触发逻辑会直接
-    # 影响线上检索质量基线和已归档的评测数据，需要单独一轮评测验证，
-    # 不应该夹在"去掉模式切换器"这个不相关的改动里悄悄改掉）。真正有
-    # 区分度的是重排*之后*的 cross-encoder 分数，用于路由判断见
-    # handlers/auto_router.py 和 configs/load_env.py 的 AUTO_ROUTE_
-    # SCORE_THRESHOLD 注释。
     top1_score = nodes[0].score or 0.0
-    if top1_score >= load_env.RERANK_SCORE_THRESHOLD:
-        logger.debug(
-            "rerank skipped: top1=%.3f >= threshold=%.2f",
-            top1_score,
-            load_env.RERANK_SCORE_THRESHOLD,
-        )
-        return nodes[: load_env.RERANK_TOP_N], False
-
-    if len(nodes) <= load_env.RERANK_TOP_N:
-        logger.debug(
-            "rerank skipped: recall=%d <= top_n=%d",
-            len(nodes),
-            load_env.RERANK_TOP_N,
-        )
-        return nodes, False
-
     reranker = _get_reranker()
     q = query_bundle.query_str if query_bundle else ""
     t0 = time.perf_counter()
@@ -116,6 +470,40 @@ def rerank_nodes(
     return reranked, True
 
 
+async def arerank_nodes(
+    nodes: list[NodeWithScore],
+    query_bundle: QueryBundle | None = None,
+) -> tuple[list[NodeWithScore], bool]:
+    """``rerank_nodes`` 的异步版本：跳过条件、返回值语义完全相同，真正的
+    cross-encoder 前向交给 ``RerankService`` 的工作线程（跟其他并发请求一起
+    攒批），事件循环只 await 结果。异步调用方都应该用这个。"""
+    import configs.load_env as load_env
+
+    skipped = _skip_rerank(nodes)
+    if skipped is not None:
+        return skipped, False
+
+    top1_score = nodes[0].score or 0.0
+    q = query_bundle.query_str if query_bundle else ""
+    t0 = time.perf_counter()
+    scores = await _score_nodes(q, nodes)
+    # 跟 SentenceTransformerRerank._postprocess_nodes 同样的落分方式：原地改
+    # score、按分数降序取 top_n。
+    for node, score in zip(nodes, scores):
+        node.score = score
+    reranked = sorted(nodes, key=lambda n: -(n.score or 0.0))[: load_env.RERANK_TOP_N]
+    ms = (time.perf_counter() - t0) * 1000
+    logger.info(
+        "rerank triggered: top1=%.3f < %.2f, recall=%d -> top_n=%d, latency=%.0fms",
+        top1_score,
+        load_env.RERANK_SCORE_THRESHOLD,
+        len(nodes),
+        load_env.RERANK_TOP_N,
+        ms,
+    )
+    return reranked, True
+
+
 class ConditionalRerankPostprocessor(BaseNodePostprocessor):
     """``rerank_nodes`` 的 ``BaseNodePostprocessor`` 包装，可直接挂进 query engine。
 
@@ -133,3 +521,10 @@ class ConditionalRerankPostprocessor(BaseNodePostprocessor):
         query_bundle: QueryBundle | None = None,
     ) -> list[NodeWithScore]:
         return rerank_nodes(nodes, query_bundle)[0]
+
+    async def _apostprocess_nodes(
+        self,
+        nodes: list[NodeWithScore],
+        query_bundle: QueryBundle | None = None,
+    ) -> list[NodeWithScore]:
+        return (await arerank_nodes(nodes, query_bundle))[0]
@@ -0,0 +1,266 @@
+"""跨 worker 共享的运行时状态：会话、限流、索引变更通知。
+
+## 为什么
+
+会话历史（``router/graph_session``）、限流计数（``main._rate_limit_store``）
+原来都是进程内的 dict——同一个用户的两次请求被分到两个 uvicorn worker 上，
+第二个 worker 既不知道他的聊天历史，也不知道他已经问了多少次。所以一直只能
+跑单 worker，整台机器只有一个核在处理请求（嵌入/重排的前向会释放 GIL，但
+事件循环、分词、RRF 融合、序列化都挤在这一个进程里）。
+
+## 后端（``STATE_BACKEND``）
+
+- ``auto``（默认）：``WEB_CONCURRENCY`` 大于 1 时用 ``sqlite``，否则 ``memory``。
+  单 worker 没有别的进程要同步，每个请求多几次 SQLite 读写纯属开销。
+- ``sqlite``：同一台机器上的所有 worker 共用 ``STATE_DB_PATH`` 这一个
+  SQLite 文件，WAL 模式下读不挡写、写之间靠 SQLite 自己的文件锁串行。不需要
+  另外部署 Redis 之类的服务——跨机器扩容不在这个后端的范围内。直接
+  ``uvicorn --workers N``（不设 ``WEB_CONCURRENCY``）时要显式选它。
+- ``memory``：原来的进程内状态，只适合单 worker（测试也用它）。
+
+共享后端只在 lifespan 里 ``init_shared_state()`` 之后生效；之前（以及
+``memory`` 模式下）``shared_backend()`` 返回 None，调用方走原来的内存路径。
+
+## 三类状态
+
+- **会话缓存**：``kv`` 表，按 (namespace, key) 存 pickle 后的值和写入时间。
+  过期按写入时间算（跟内存版 ``TTLCache`` 一样），容量超了按写入时间淘汰最旧的
+  ——内存版是按最近访问淘汰，这里为了读路径不写库放宽成按最近写入。pickle 只
+  反序列化本机本进程组自己写进去的数据，跟 Chroma、BM25 落盘文件是同一个信任
+  边界。
+- **限流**：``rate_limit_buckets`` 表，跟进程内的 ``utils/rate_limit.py`` 同样的
+  分桶计数——每个 key 只有当前窗口里的几行 (桶编号, 计数)，检查是按主键范围
+  求和、放行是对当前桶 upsert +1，不管一个 IP 打了多少次都是常数开销。检查和
+  记账在同一个 ``BEGIN IMMEDIATE`` 事务里，多个 worker 同时打进来也不会超发。
+- **事件**：``events`` 表，自增 id 当游标。索引的增删、内容和摘要变化由发生
+  变化的 worker 写一条（``handlers/index_events.py``），其他 worker 定时轮询
+  ``events_since`` 拿到后各自重载，自己写的事件按 ``origin`` 跳过。
+
+访问统计不走这里：它本来就定期写进 ``DB_PATH`` 的 SQLite（``utils/db.py``），
+多 worker 下改成按增量累加，见 ``main._flush_access_stats``。
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import pickle  # nosec B403 — 只反序列化本机 worker 自己写入的状态，见模块 docstring
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+import configs.load_env as load_env
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("auto", "sqlite", "memory")
+
+# 本进程的身份：事件的 origin，用来跳过自己发出的事件。pid 在容器里经常都是 1，
+# 所以再拼一段随机串。
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# 事件只是"让其他 worker 知道要重载"的通知，不是审计日志，保留一小时足够
+# 覆盖任何 worker 的轮询间隔。
+_EVENT_RETENTION_SECONDS = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS kv_updated ON kv (namespace, updated_at);
+DROP TABLE IF EXISTS rate_limit_hits;
+CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+    key TEXT NOT NULL,
+    epoch INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (key, epoch)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rate_limit_epoch ON rate_limit_buckets (epoch);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    origin TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+class SqliteStateBackend:
+    """同一台机器上多个 worker 共用的 SQLite-WAL 状态库。
+
+    每个进程一个连接，所有调用都很短（单行读写），用一把线程锁串起来：事件
+    循环线程和 ``to_thread`` 里的调用可能同时进来。``busy_timeout`` 处理的是
+    跨进程的写锁等待。
+    """
+
+    def __init__(self, path: str, busy_timeout_s: float = 5.0) -> None:
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # isolation_level=None：自己写 BEGIN IMMEDIATE，限流的"查+记"才是原子的。
+        self._conn = sqlite3.connect(path, timeout=busy_timeout_s, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # ---- 会话缓存 -------------------------------------------------------
+
+    def cache_get(self, namespace: str, key: str, ttl: float):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, updated_at FROM kv WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            if row is None:
+                return None
+            if time.time() - row[1] > ttl:
+                self._conn.execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+                return None
+        return pickle.loads(row[0])  # nosec B301 — 同上，本机 worker 写入的数据
+
+    def cache_set(self, namespace: str, key: str, value, max_size: int) -> None:
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO kv (namespace, key, value, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(namespace, key) DO UPDATE SET "
+                    "value = excluded.value, updated_at = excluded.updated_at",
+                    (namespace, key, blob, time.time()),
+                )
+                # 超出容量的按写入时间淘汰：找到第 max_size 新的那一行，比它旧的删掉。
+                self._conn.execute(
+                    "DELETE FROM kv WHERE namespace = ? AND updated_at < ("
+                    "SELECT updated_at FROM kv WHERE namespace = ? ORDER BY updated_at DESC LIMIT 1 OFFSET ?)",
+                    (namespace, namespace, max(0, max_size - 1)),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def cache_len(self, namespace: str) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM kv WHERE namespace = ?", (namespace,)).fetchone()[0]
+
+    # ---- 限流 -----------------------------------------------------------
+
+    def rate_limit_hit(
+        self, key: str, window: float, limit: int, now: float | None = None, buckets: int = 6
+    ) -> bool:
+        """分桶滑动窗口限流（算法同 ``utils.rate_limit.BucketedRateLimiter``）：窗口内
+        不到 ``limit`` 次就记一次并返回 True，否则返回 False（不记）。"""
+        now = time.time() if now is None else now
+        epoch = int(now // (window / buckets))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                total = self._conn.execute(
+                    "SELECT COALESCE(SUM(count), 0) FROM rate_limit_buckets WHERE key = ? AND epoch > ?",
+                    (key, epoch - (buckets + 1)),
+                ).fetchone()[0]
+                allowed = total < limit
+                if allowed:
+                    self._conn.execute(
+                        "INSERT INTO rate_limit_buckets (key, epoch, count) VALUES (?, ?, 1) "
+                        "ON CONFLICT(key, epoch) DO UPDATE SET count = count + 1",
+                        (key, epoch),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return allowed
+
+    # ---- 事件 -----------------------------------------------------------
+
+    def publish(self, channel: str, payload: dict) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO events (channel, payload, origin, created_at) VALUES (?, ?, ?, ?)",
+                (channel, json.dumps(payload, ensure_ascii=False), PROCESS_ID, time.time()),
+            )
+            return int(cursor.lastrowid or 0)
+
+    def latest_event_id(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+    def events_since(self, channel: str, after_id: int) -> list[tuple[int, dict]]:
+        """``after_id`` 之后别的进程发到 ``channel`` 的事件，按 id 升序。"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, payload FROM events WHERE id > ? AND channel = ? AND origin != ? ORDER BY id",
+                (after_id, channel, PROCESS_ID),
+            ).fetchall()
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    # ---- 清理 -----------------------------------------------------------
+
+    def prune(self, rate_limit_window: float, now: float | None = None, buckets: int = 6) -> None:
+        """删掉滑出限流窗口的计数桶和过了保留期的事件（由 main 的定时清理任务调用）。"""
+        now = time.time() if now is None else now
+        oldest = int(now // (rate_limit_window / buckets)) - (buckets + 1)
+        with self._lock:
+            self._conn.execute("DELETE FROM rate_limit_buckets WHERE epoch <= ?", (oldest,))
+            self._conn.execute("DELETE FROM events WHERE created_at < ?", (now - _EVENT_RETENTION_SECONDS,))
+
+
+_backend: SqliteStateBackend | None = None
+
+
+def _web_concurrency() -> int:
+    """``WEB_CONCURRENCY``：uvicorn 和 ``main.py`` 的默认 worker 数，没设或不是整数按 1。"""
+    try:
+        return int(os.environ.get("WEB_CONCURRENCY", "1"))
+    except ValueError:
+        return 1
+
+
+def init_shared_state() -> SqliteStateBackend | None:
+    """按 ``STATE_BACKEND`` 打开共享状态库（lifespan 启动时调用，可重复调用）。
+
+    打不开（路径不可写等）时记警告退回内存状态：单 worker 照常工作，多 worker
+    下会话和限流各管各的，跟以前一样。
+    """
+    global _backend
+    close_shared_state()
+    backend = (load_env.STATE_BACKEND or "auto").strip().lower()
+    if backend not in BACKENDS:
+        logger.warning("未知的 STATE_BACKEND %r，使用 memory。可选：%s", load_env.STATE_BACKEND, ", ".join(BACKENDS))
+        return None
+    if backend == "auto":
+        backend = "sqlite" if _web_concurrency() > 1 else "memory"
+    if backend == "memory":
+        return None
+    try:
+        _backend = SqliteStateBackend(load_env.STATE_DB_PATH)
+    except Exception:
+        logger.warning("共享状态库 %s 打开失败，退回进程内状态。", load_env.STATE_DB_PATH, exc_info=True)
+        _backend = None
+    return _backend
+
+
+def close_shared_state() -> None:
+    global _backend
+    backend, _backend = _backend, None
+    if backend is not None:
+        backend.close()
+
+
+def shared_backend() -> SqliteStateBackend | None:
+    """当前生效的共享后端；内存模式或还没初始化时为 None。"""
+    return _backend
@@ -0,0 +1,267 @@
+"""bge-m3 的稀疏（lexical weight）输出：跟 dense 向量同一次前向算出来。
+
+## 为什么
+
+bge-m3 除了 CLS 池化出来的 dense 向量，还带一个 ``sparse_linear`` 头：对最后
+一层每个 token 的隐状态做 ``relu(Linear(hidden, 1))``，得到该 token 的词项
+权重，同一个 token id 出现多次取最大值——这就是 FlagEmbedding
+``BGEM3FlagModel`` 的 ``lexical_weights``。两段文本的稀疏分是共有 token 的
+权重乘积之和。它跟 BM25 一样是词项级匹配，但：
+
+- 分词是模型自己的 tokenizer（XLM-R sentencepiece），不需要 jieba 词典，也就
+  没有"新词/专有名词切错"的问题；
+- 权重是学出来的，停用词天然接近 0，不靠 idf 统计——增删文档不会让其他
+  文档的分数漂移；
+- 最关键的：它是**同一次前向**的副产品。查询时 dense 检索本来就要嵌入一次
+  问题，稀疏权重顺手拿走；摄取时 dense 嵌入本来就要跑全部 chunk，稀疏权重
+  也顺手存下来，重建倒排表不再需要对全库跑任何分词。
+
+## 怎么拿到 token 级输出
+
+``HuggingFaceEmbedding`` 内部就是一个 ``SentenceTransformer``；
+``encode(output_value=None)`` 一次前向同时返回 ``sentence_embedding``（dense）
+和 ``token_embeddings`` / ``input_ids`` / ``attention_mask``，在这之上套
+``sparse_linear`` 就是稀疏权重，模型不多跑一遍。``sparse_linear.pt`` 不在
+sentence-transformers 的加载路径里，要从 bge-m3 模型仓库单独下载（几 KB）。
+
+## 查询侧去重
+
+混合检索两路并发：dense 腿经 ``Settings.embed_model`` 嵌入问题，稀疏腿要同一
+个问题的稀疏权重。``BGEM3SparseEmbedding`` 按归一化问题文本记一份
+``Future``，先到的那一路跑前向、后到的等同一个结果，两路加起来只有一次前向。
+外层 ``CachedEmbedding`` 命中时 dense 不会再进来，这时稀疏腿自己的 memo 通常
+也还在；都不在才单独为稀疏权重跑一次前向。
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import threading
+from collections import OrderedDict
+from collections.abc import Sequence
+from concurrent.futures import Future
+from typing import Any
+
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from pydantic import PrivateAttr
+from utils.embedding_cache import normalize_text_key
+
+logger = logging.getLogger(__name__)
+
+# 摄取时存进节点 metadata（也就进了 Chroma）的稀疏权重：JSON 字符串
+# ``{"token_id": weight}``。Chroma 的 metadata 值只能是标量，所以序列化成字符串；
+# 这个 key 会被加进节点的 excluded_embed/llm_metadata_keys，不进嵌入文本和 LLM 上下文。
+SPARSE_METADATA_KEY = "lexical_weights"
+
+SparseWeights = dict[str, float]
+
+_QUERY_MEMO_SIZE = 1024
+_WEIGHT_DECIMALS = 4
+
+
+def lexical_weights(input_ids: Sequence[int], token_weights: Sequence[float], skip_ids: set[int]) -> SparseWeights:
+    """把一段文本逐 token 的权重折叠成 ``{token_id: 最大权重}``，丢掉特殊 token
+    和权重为 0 的 token（跟 FlagEmbedding ``_process_token_weights`` 一致）。"""
+    weights: SparseWeights = {}
+    for token_id, weight in zip(input_ids, token_weights):
+        token_id = int(token_id)
+        weight = float(weight)
+        if token_id in skip_ids or weight <= 0:
+            continue
+        key = str(token_id)
+        if weight > weights.get(key, 0.0):
+            weights[key] = weight
+    return weights
+
+
+def dumps_weights(weights: SparseWeights) -> str:
+    return json.dumps({k: round(v, _WEIGHT_DECIMALS) for k, v in weights.items()}, separators=(",", ":"))
+
+
+def loads_weights(metadata: dict | None) -> SparseWeights | None:
+    """从节点 metadata 里读摄取时存下的稀疏权重；没存过（或坏了）返回 None。"""
+    raw = (metadata or {}).get(SPARSE_METADATA_KEY)
+    if not raw:
+        return None
+    try:
+        return {str(k): float(v) for k, v in json.loads(raw).items()}
+    except (TypeError, ValueError):
+        return None
+
+
+class BGEM3SparseEmbedding(BaseEmbedding):
+    """包在 bge-m3 ``HuggingFaceEmbedding`` 外面：dense 接口行为不变，额外提供
+    同一次前向的稀疏权重（``encode`` / ``query_sparse``）。"""
+
+    _inner: BaseEmbedding = PrivateAttr()
+    # torch.nn.Linear，模块顶层不 import torch
+    _sparse_linear: Any = PrivateAttr()
+    _skip_ids: set[int] = PrivateAttr()
+    _memo: OrderedDict = PrivateAttr()
+    _memo_lock: threading.Lock = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, sparse_linear, skip_ids: set[int], **kwargs) -> None:
+        super().__init__(model_name=inner.model_name, embed_batch_size=inner.embed_batch_size, **kwargs)
+        self._inner = inner
+        self._sparse_linear = sparse_linear
+        self._skip_ids = set(skip_ids)
+        self._memo = OrderedDict()
+        self._memo_lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "BGEM3SparseEmbedding"
+
+    @classmethod
+    def from_huggingface(cls, inner, repo_id: str | None = None) -> BGEM3SparseEmbedding:
+        """从已经加载好的 bge-m3 ``HuggingFaceEmbedding`` 构造：下载并加载
+        ``sparse_linear.pt``（默认从 ``inner.model_name`` 仓库，模型是从本地目录
+        加载的时候由 ``repo_id`` 指定）。下载/加载失败直接抛，由调用方决定怎么降级。"""
+        import torch
+        from huggingface_hub import hf_hub_download
+
+        model = inner._model
+        path = hf_hub_download(repo_id=repo_id or inner.model_name, filename="sparse_linear.pt")
+        state = torch.load(path, map_location=model.device, weights_only=True)
+        sparse_linear = torch.nn.Linear(state["weight"].shape[1], 1).to(model.device)
+        sparse_linear.load_state_dict(state)
+        sparse_linear.eval()
+        tokenizer = model.tokenizer
+        skip_ids = {
+            tokenizer.cls_token_id,
+            tokenizer.eos_token_id,
+            tokenizer.pad_token_id,
+            tokenizer.unk_token_id,
+        } - {None}
+        return cls(inner, sparse_linear, skip_ids)
+
+    @property
+    def inner(self) -> BaseEmbedding:
+        return self._inner
+
+    # ------------------------------------------------------------------ 前向
+
+    def encode(self, texts: list[str], prompt_name: str = "text") -> list[tuple[Embedding, SparseWeights]]:
+        """一次前向同时拿 dense 向量和稀疏权重。"""
+        import torch
+
+        if not texts:
+            return []
+        # HuggingFaceEmbedding 里的 SentenceTransformer。output_value=None 时返回
+        # 逐条的特征字典，它的类型标注描述不了，按 Any 用。
+        model: Any = getattr(self._inner, "_model")
+        outputs = model.encode(
+            texts,
+            batch_size=self._inner.embed_batch_size,
+            prompt_name=prompt_name if prompt_name in (model.prompts or {}) else None,
+            output_value=None,
+            show_progress_bar=False,
+        )
+        results = []
+        with torch.inference_mode():
+            for out in outputs:
+                dense = out["sentence_embedding"]
+                if getattr(self._inner, "normalize", True):
+                    dense = torch.nn.functional.normalize(dense, p=2, dim=0)
+                token_weights = torch.relu(self._sparse_linear(out["token_embeddings"])).squeeze(-1)
+                mask = out["attention_mask"].bool()
+                results.append(
+                    (
+                        dense.float().cpu().tolist(),
+                        lexical_weights(
+                            out["input_ids"][mask].cpu().tolist(),
+                            token_weights[mask].float().cpu().tolist(),
+                            self._skip_ids,
+                        ),
+                    )
+                )
+        return results
+
+    def encode_queries(self, queries: list[str]) -> list[tuple[Embedding, SparseWeights]]:
+        """一批查询的 dense + 稀疏，按归一化文本去重：memo 里已有（或正在算）的
+        直接等那一份，其余的一次前向算完。并发的 dense/稀疏两路、微批服务
+        （utils/embedding_batcher.py）攒起来的一批问题都走这里。"""
+        keys = [normalize_text_key(q) for q in queries]
+        futures: list[Future] = []
+        owned: dict[str, tuple[Future, str]] = {}
+        with self._memo_lock:
+            for query, key in zip(queries, keys):
+                future = self._memo.get(key)
+                if future is None:
+                    future = self._memo[key] = Future()
+                    owned[key] = (future, query)
+                else:
+                    self._memo.move_to_end(key)
+                futures.append(future)
+            while len(self._memo) > _QUERY_MEMO_SIZE:
+                self._memo.popitem(last=False)
+        if owned:
+            try:
+                results = self.encode([query for _, query in owned.values()], prompt_name="query")
+            except BaseException as exc:
+                with self._memo_lock:
+                    for key, (future, _) in owned.items():
+                        if self._memo.get(key) is future:
+                            del self._memo[key]
+                for future, _ in owned.values():
+                    future.set_exception(exc)
+            else:
+                for (future, _), result in zip(owned.values(), results):
+                    future.set_result(result)
+        return [future.result() for future in futures]
+
+    def encode_query(self, query: str) -> tuple[Embedding, SparseWeights]:
+        """查询的 dense + 稀疏，按归一化文本去重：并发的两路只跑一次前向。"""
+        return self.encode_queries([query])[0]
+
+    def query_sparse(self, query: str) -> SparseWeights:
+        return self.encode_query(query)[1]
+
+    # ------------------------------------------------------------------ BaseEmbedding
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self.encode_query(query)[0]
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return await asyncio.to_thread(self._get_query_embedding, query)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._inner._get_text_embedding(text)
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return await self._inner._aget_text_embedding(text)
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        return self._inner._get_text_embeddings(texts)
+
+
+def with_sparse_head(embed_model: BaseEmbedding, repo_id: str | None = None) -> BaseEmbedding:
+    """给 bge-m3 加上稀疏头；加载失败时记日志、原样返回（混合检索退回 jieba BM25）。"""
+    try:
+        return BGEM3SparseEmbedding.from_huggingface(embed_model, repo_id=repo_id)
+    except Exception:
+        logger.warning("bge-m3 稀疏头加载失败，混合检索继续使用 jieba BM25。", exc_info=True)
+        return embed_model
+
+
+def find_sparse_encoder(embed_model) -> BGEM3SparseEmbedding | None:
+    """在 ``embed_model`` 的包装链（``CachedEmbedding.inner`` ...）里找稀疏编码器。"""
+    seen = 0
+    while embed_model is not None and seen < 4:
+        if isinstance(embed_model, BGEM3SparseEmbedding):
+            return embed_model
+        embed_model = getattr(embed_model, "inner", None)
+        seen += 1
+    return None
+
+
+def get_sparse_encoder() -> BGEM3SparseEmbedding | None:
+    """全局嵌入模型带稀疏头时返回它，否则 None。
+
+    读 ``Settings._embed_model`` 而不是 ``Settings.embed_model``：后者没配置时
+    会去懒加载默认 OpenAI embedding，这里只是问"有没有"，不该触发任何加载。
+    """
+    from llama_index.core import Settings
+
+    return find_sparse_encoder(getattr(Settings, "_embed_model", None))
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+"""冷启动导入耗时基准：``python -X importtime`` 测后端关键模块的 import 开销。
+
+## 为什么
+
+``import main`` 原来要十几秒：``configs.llm_predictor`` 在模块顶层 import
+torch 和 ``HuggingFaceEmbedding``（连带 transformers / sentence-transformers），
+``handlers.vector_store`` 顶层 import chromadb。模型真正加载是在 lifespan 里
+调 ``init_settings`` 的时候，模块顶层提前 import 这些库只是让每一个 import 后端
+代码的进程——uvicorn 的 reload 子进程、``--help`` 一类的 CLI、每个测试进程——
+都白付一遍。现在这些库都推迟到第一次用到时才 import，这个脚本把它守住：
+
+- **重模块检查**（确定性的）：每个目标模块 import 完之后，``FORBIDDEN`` 里的
+  库一个都不能出现在 importtime 的输出里。谁又在顶层 import 了 torch，这一项
+  直接失败，并报出是哪条导入链拉进来的。
+- **耗时预算**（跟机器有关）：目标模块的累计导入耗时（importtime 的
+  cumulative，取 ``--repeat`` 次的中位数）不能超过预算。预算按开发机实测值
+  留了一倍左右余量；CI runner 慢的话用 ``--budget-scale`` 整体放宽，而不是
+  改掉预算本身。
+
+每次测量都在**新的子进程**里跑（``python -X importtime -c "import X"``），
+互不共享 ``sys.modules``。第一次运行会受磁盘缓存影响偏慢，所以默认跑 3 次
+取中位数。
+
+用法:
+    uv run python evals/bench_import_time.py
+    uv run python evals/bench_import_time.py --modules main,configs.llm_predictor --repeat 5
+    uv run python evals/bench_import_time.py --budget-scale 2      # 慢机器/CI
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from dataclasses import dataclass
+from datetime import UTC, datetime
+from pathlib import Path
+
+_REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from evals._common import BACKEND_APP_DIR, EVALS_DIR  # noqa: E402
+
+DEFAULT_RESULTS_DIR = EVALS_DIR / "results"
+DEFAULT_REPEAT = 3
+
+# 目标模块 -> 累计导入耗时预算（毫秒）。llama_index.core 本身就要 1.5s 左右，
+# 是 main / router 的大头，预算以它为底。
+BUDGETS_MS: dict[str, float] = {
+    "main": 5000,
+    "configs.llm_predictor": 3500,
+    "router.index": 5000,
+    "router.manage": 5000,
+    "handlers": 4000,
+    "utils.logger": 500,
+    "connectors": 500,
+}
+
+# import 后端模块时不允许出现的重依赖：都只在模型加载 / 第一次连库时才需要。
+FORBIDDEN = ("torch", "transformers", "sentence_transformers", "chromadb", "openai")
+
+_LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)\s*$")
+
+
+@dataclass(frozen=True)
+class ImportRecord:
+    name: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse_importtime(stderr: str) -> list[ImportRecord]:
+    """解析 ``-X importtime`` 的 stderr；表头和其他输出行忽略。
+
+    importtime 按模块**导入完成**的顺序输出，子模块在父模块之前，缩进（每层
+    两个空格）表示嵌套深度。
+    """
+    records = []
+    for line in stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            records.append(ImportRecord(name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return records
+
+
+def import_chain(records: list[ImportRecord], package: str) -> list[str]:
+    """``package`` 第一次被导入时的导入链（从目标模块往下），用于报错。
+
+    一个深度为 d 的记录，它的父模块是之后出现的第一个深度为 d-1 的记录。
+    """
+    for i, record in enumerate(records):
+        if record.name.split(".")[0] != package:
+            continue
+        chain = [record.name]
+        depth = record.depth
+        for later in records[i + 1:]:
+            if later.depth < depth:
+                chain.append(later.name)
+                depth = later.depth
+        return list(reversed(chain))
+    return []
+
+
+def heaviest_packages(records: list[ImportRecord], limit: int = 8) -> list[tuple[str, float]]:
+    """按顶层包汇总的自身耗时（毫秒），从大到小，用来看时间花在了谁身上。"""
+    totals: dict[str, int] = {}
+    for record in records:
+        package = record.name.split(".")[0]
+        totals[package] = totals.get(package, 0) + record.self_us
+    ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return [(package, round(us / 1000, 1)) for package, us in ranked]
+
+
+def measure(module: str) -> list[ImportRecord]:
+    """在新的子进程里 import ``module`` 一次，返回 importtime 记录。"""
+    python_path = os.pathsep.join(filter(None, [str(BACKEND_APP_DIR), os.environ.get("PYTHONPATH")]))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_APP_DIR,
+        env=dict(os.environ, PYTHONPATH=python_path),
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        tail = proc.stderr.strip().splitlines()[-1:] or [""]
+        raise RuntimeError(f"import {module} 失败：{tail[0]}")
+    return parse_importtime(proc.stderr)
+
+
+def evaluate(module: str, runs: list[list[ImportRecord]], budget_ms: float | None) -> dict:
+    """汇总一个模块的多次测量：中位耗时、预算、拉进来的重依赖及其导入链。"""
+    totals_ms = []
+    for records in runs:
+        own = [r for r in records if r.name == module and r.depth == 0]
+        totals_ms.append(own[-1].cumulative_us / 1000 if own else 0.0)
+    last = runs[-1]
+    loaded = {r.name.split(".")[0] for r in last}
+    forbidden = {package: import_chain(last, package) for package in FORBIDDEN if package in loaded}
+    median_ms = round(statistics.median(totals_ms), 1)
+    return {
+        "module": module,
+        "median_ms": median_ms,
+        "runs_ms": [round(t, 1) for t in totals_ms],
+        "budget_ms": budget_ms,
+        "over_budget": budget_ms is not None and median_ms > budget_ms,
+        "forbidden": forbidden,
+        "modules_loaded": len(last),
+        "heaviest": heaviest_packages(last),
+    }
+
+
+def _print_summary(results: list[dict]) -> None:
+    print("\n=== 导入耗时（-X importtime cumulative，中位数） ===")
+    for item in results:
+        budget = f"/ {item['budget_ms']:.0f}ms" if item["budget_ms"] is not None else ""
+        flag = "超预算" if item["over_budget"] else ("重依赖" if item["forbidden"] else "ok")
+        print(f"  {item['module']:<24} {item['median_ms']:>8.1f}ms {budget:<10} {flag:<6} 模块数 {item['modules_loaded']}")
+        print("    最重的包: " + ", ".join(f"{package} {ms}ms" for package, ms in item["heaviest"]))
+        for package, chain in item["forbidden"].items():
+            print(f"    不该出现 {package}: {' -> '.join(chain)}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", default=",".join(BUDGETS_MS), help="逗号分隔的模块名，默认全部目标")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="每个模块测几次（取中位数）")
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="预算整体乘这个系数（慢机器放宽用）")
+    parser.add_argument("--output-dir", type=Path, default=DEFAULT_RESULTS_DIR, help="结果输出目录")
+    args = parser.parse_args()
+
+    modules = [m.strip() for m in args.modules.split(",") if m.strip()]
+    results = []
+    for module in modules:
+        try:
+            runs = [measure(module) for _ in range(max(1, args.repeat))]
+        except RuntimeError as exc:
+            print(f"[bench_import_time] {exc}")
+            return 1
+        budget = BUDGETS_MS.get(module)
+        results.append(evaluate(module, runs, budget * args.budget_scale if budget is not None else None))
+    _print_summary(results)
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.now(UTC).strftime("%Y%m%d_%H%M%S")
+    output_path = args.output_dir / f"import_time_{timestamp}.json"
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump({"python": sys.version.split()[0], "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {output_path}")
+
+    failed = [item["module"] for item in results if item["over_budget"] or item["forbidden"]]
+    if failed:
+        print(f"[bench_import_time] 未通过: {failed}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+"""请求中间件开销微基准：``main.SessionAndStatsMiddleware`` 每个请求多花多少时间。
+
+只测**中间件本身**：拿合成的 ASGI scope 直接调中间件，下游是一个立即返回空
+响应的桩 app，不走路由、不碰模型。对比三组：
+
+- ``none``：直接调桩 app（构造响应的固定开销），其余两组都扣掉它；
+- ``legacy``：改造前的写法，原样抄在这个脚本里——``@app.middleware("http")``
+  也就是 ``BaseHTTPMiddleware``，每个 IP 一个时间戳列表、``pop(0)`` 裁剪、全局
+  ``asyncio.Lock`` 包住限流，统计再拿一次 ``access_stats_lock``；
+- ``current``：现在的纯 ASGI ``main.SessionAndStatsMiddleware``（分桶限流 +
+  ``AccessCounter``，都不拿锁）。
+
+两个场景：
+
+- ``spread``：``--ips`` 个 IP 各打 ``--requests-per-ip`` 次 LLM 端点，都在限额
+  以内（全部放行），代表正常高峰；
+- ``hot_ip``：同一个 IP（校园网 NAT 出口）连续打，超过限额之后全部 429。
+
+请求按 ``--concurrency`` 个一批 ``asyncio.gather``，模拟同一时刻挤进事件循环的
+并发请求。进程内计时，结果跟机器有关，看相对值。
+
+用法:
+    uv run python evals/bench_middleware.py
+    uv run python evals/bench_middleware.py --ips 500 --concurrency 200 --repeat 5
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+_REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from evals._common import bootstrap_backend_path  # noqa: E402
+
+DEFAULT_IPS = 200
+DEFAULT_REQUESTS_PER_IP = 25
+DEFAULT_CONCURRENCY = 100
+DEFAULT_REPEAT = 3
+_LLM_PATH = "/graph/ask_stream"
+
+
+def _scope(ip: str, path: str) -> dict:
+    return {
+        "type": "http", "method": "POST", "path": path, "raw_path": path.encode(), "root_path": "",
+        "scheme": "http", "query_string": b"", "headers": [(b"cookie", b"session_id=bench")],
+        "client": (ip, 50000), "server": ("testserver", 80), "http_version": "1.1",
+    }
+
+
+def make_legacy_middleware(main, app):
+    """改造前的中间件（``BaseHTTPMiddleware`` + 时间戳列表限流 + 加锁统计），包住 ``app``。"""
+    from fastapi import HTTPException, status
+    from fastapi.responses import JSONResponse
+    from starlette.middleware.base import BaseHTTPMiddleware
+
+    store: dict[str, list[float]] = defaultdict(list)
+    rate_lock = asyncio.Lock()
+    stats_lock = asyncio.Lock()
+    stats = {"total_visits": 0, "ip_count": 0, "user_visits": defaultdict(int), "endpoint_visits": defaultdict(int)}
+
+    async def check_rate_limit(client_ip: str) -> None:
+        now = time.time()
+        async with rate_lock:
+            timestamps = store[client_ip]
+            while timestamps and timestamps[0] < now - main.RATE_LIMIT_WINDOW:
+                timestamps.pop(0)
+            if len(timestamps) >= main.RATE_LIMIT_MAX_REQUESTS:
+                raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS)
+            timestamps.append(now)
+
+    async def dispatch(request, call_next):
+        is_static = main._is_static_path(request.url.path) or main._is_health_path(request.url.path)
+        client_ip = main.get_client_ip(request)
+        session_id = request.cookies.get("session_id")
+        has_session = bool(session_id)
+        if not has_session:
+            session_id = str(uuid.uuid4())
+        request.state.session_id = session_id
+        if not is_static and main.is_llm_endpoint(request.url.path):
+            try:
+                await check_rate_limit(client_ip)
+            except HTTPException:
+                return JSONResponse(content={"detail": "请求过于频繁，请稍后重试"}, status_code=429)
+        response = await call_next(request)
+        if not is_static:
+            async with stats_lock:
+                stats["total_visits"] += 1
+                stats["user_visits"][client_ip] += 1
+                stats["endpoint_visits"][request.url.path] += 1
+                stats["ip_count"] = len(stats["user_visits"])
+        if not has_session and not is_static:
+            response.set_cookie(key="session_id", value=session_id, path="/", httponly=True, samesite="lax")
+        return response
+
+    return BaseHTTPMiddleware(app, dispatch=dispatch)
+
+
+async def call_asgi(app, scope: dict) -> tuple[int, int, float]:
+    """按服务器的方式调一次 ASGI app，返回 (状态码, 响应体块数, 首个响应体块的耗时 µs)。"""
+    received = False
+    status_code, chunks, first_chunk_us = 0, 0, 0.0
+    started = time.perf_counter()
+
+    async def receive():
+        nonlocal received
+        if received:
+            await asyncio.Event().wait()  # 像真实连接一样挂着，直到被取消
+        received = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status_code, chunks, first_chunk_us
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+        elif message["type"] == "http.response.body" and message.get("body"):
+            chunks += 1
+            if chunks == 1:
+                first_chunk_us = (time.perf_counter() - started) * 1e6
+
+    await app(dict(scope), receive, send)
+    return status_code, chunks, first_chunk_us
+
+
+async def _drive(app, scopes: list[dict], concurrency: int) -> tuple[float, int]:
+    """按批并发跑完所有请求，返回 (每请求 µs, 429 个数)。"""
+    rejected = 0
+    started = time.perf_counter()
+    for i in range(0, len(scopes), concurrency):
+        results = await asyncio.gather(*(call_asgi(app, scope) for scope in scopes[i:i + concurrency]))
+        rejected += sum(1 for status_code, _, _ in results if status_code == 429)
+    return (time.perf_counter() - started) / len(scopes) * 1e6, rejected
+
+
+def run_benchmark(
+    ips: int = DEFAULT_IPS,
+    requests_per_ip: int = DEFAULT_REQUESTS_PER_IP,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    repeat: int = DEFAULT_REPEAT,
+) -> dict:
+    bootstrap_backend_path()
+    from unittest.mock import patch
+
+    import main
+    from starlette.responses import Response
+    from utils.access_counter import AccessCounter
+    from utils.rate_limit import BucketedRateLimiter
+
+    scenarios = {
+        # 按轮次交错排列：同一批并发里是不同 IP，跟真实高峰一样
+        "spread": [_scope(f"10.0.{i // 256}.{i % 256}", _LLM_PATH) for _ in range(requests_per_ip) for i in range(ips)],
+        "hot_ip": [_scope("202.115.0.1", _LLM_PATH) for _ in range(ips * requests_per_ip)],
+    }
+
+    endpoint = Response(b"")
+    results = {}
+    for name, scopes in scenarios.items():
+        samples: dict[str, list[float]] = {"none": [], "legacy": [], "current": []}
+        rejected: dict[str, int] = {}
+        for _ in range(max(1, repeat)):
+            # 每轮都从干净状态开始，否则第二轮的 spread 也会被限流
+            limiter = BucketedRateLimiter(main.RATE_LIMIT_MAX_REQUESTS, main.RATE_LIMIT_WINDOW)
+            with patch.object(main, "_rate_limiter", limiter), patch.object(main, "access_counter", AccessCounter()):
+                variants = {
+                    "none": endpoint,
+                    "legacy": make_legacy_middleware(main, endpoint),
+                    "current": main.SessionAndStatsMiddleware(endpoint),
+                }
+                for variant, app in variants.items():
+                    us, rejected[variant] = asyncio.run(_drive(app, scopes, concurrency))
+                    samples[variant].append(us)
+        base = statistics.median(samples["none"])
+        legacy = statistics.median(samples["legacy"]) - base
+        current = statistics.median(samples["current"]) - base
+        results[name] = {
+            "requests": len(scopes),
+            "baseline_us": round(base, 2),
+            "legacy_overhead_us": round(legacy, 2),
+            "current_overhead_us": round(current, 2),
+            "speedup": round(legacy / current, 2) if current > 0 else None,
+            "legacy_rejected": rejected["legacy"],
+            "current_rejected": rejected["current"],
+        }
+    return {"ips": ips, "requests_per_ip": requests_per_ip, "concurrency": concurrency, "scenarios": results}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ips", type=int, default=DEFAULT_IPS)
+    parser.add_argument("--requests-per-ip", type=int, default=DEFAULT_REQUESTS_PER_IP)
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="每批并发请求数")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="重复几轮取中位数")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.ips, args.requests_per_ip, args.concurrency, args.repeat)
+    print(f"{args.ips} 个 IP × {args.requests_per_ip} 次，每批并发 {args.concurrency}，{args.repeat} 轮中位数：")
+    for name, item in result["scenarios"].items():
+        print(f"  [{name}] {item['requests']} 个请求，桩 app 本身 {item['baseline_us']:.2f} µs/次")
+        print(f"    legacy   +{item['legacy_overhead_us']:>7.2f} µs/次  429 × {item['legacy_rejected']}")
+        print(f"    current  +{item['current_overhead_us']:>7.2f} µs/次  429 × {item['current_rejected']}"
+              f"  (x{item['speedup']})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+"""推理后端基准：bge-m3 / bge-reranker 在 torch、torch-int8、onnx、onnx-int8 下的
+准确率、延迟、吞吐和内存（后端说明见 backend/app/utils/model_backend.py）。
+
+每个后端在**独立子进程**里加载（spawn），常驻内存（RSS）才不会被前一个后端
+没还给系统的内存污染。每个后端测：
+
+- 嵌入：加载耗时、加载后 RSS 增量、单条查询嵌入延迟 p50/p95、批量嵌入吞吐
+  （条/秒）；准确率两项——golden 集上"问题找答案"的 hit@1 / MRR@5（问题向量
+  在全部 ``expected_answer`` 向量里检索，不依赖 Chroma），以及跟 torch fp32
+  查询向量的余弦（库里的向量是 fp32 摄取的，这个余弦决定了换后端后查询还能
+  不能对得上老向量）。给了 ``--collection`` 时再加一项：用该后端的查询向量在
+  真实 collection 上检索，按 ``expected_sources`` 算 hit_rate / MRR。
+- 重排：加载耗时、RSS 增量、每题一次 ``--candidates`` 对的打分延迟 p50/p95、
+  吞吐（对/秒）；准确率——每题的候选是它自己的 ``expected_answer`` 加上其余
+  题目的答案，看自己的答案能不能排第一（hit@1），以及 top1 跟 fp32 torch
+  是否一致、分数最大偏差。
+
+torch 总是作为基线跑一遍（没在 ``--backends`` 里也会跑），其余后端跟它比。
+加载失败的后端（比如没装 optimum 时的 onnx）记错误跳过，不影响其他后端。
+
+依赖：主依赖即可跑 torch / torch-int8；onnx / onnx-int8 需要
+``uv sync --extra onnx``。首次运行会下载模型（两个模型共约 4.5GB），
+onnx-int8 第一次还会导出量化模型到 MODEL_EXPORT_DIR。
+
+用法:
+    uv run python evals/bench_model_backend.py
+    uv run python evals/bench_model_backend.py --backends torch-int8,onnx-int8 --target reranker
+    uv run python evals/bench_model_backend.py --collection campus-corpus
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import statistics
+import sys
+import time
+from datetime import UTC, datetime
+from pathlib import Path
+
+_REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from evals._common import (  # noqa: E402
+    EVALS_DIR,
+    bootstrap_backend_path,
+    first_hit_rank,
+    hit_rate_at,
+    load_jsonl,
+    mrr_at,
+)
+
+DEFAULT_GOLDEN = EVALS_DIR / "golden.seed.jsonl"
+DEFAULT_RESULTS_DIR = EVALS_DIR / "results"
+DEFAULT_BACKENDS = "torch,torch-int8,onnx-int8"
+DEFAULT_TOP_K = 5
+DEFAULT_CANDIDATES = 20  # 与线上 RERANK_RECALL_K 一致
+DEFAULT_BATCH = 32
+
+
+def _rss_mb() -> float | None:
+    """当前进程常驻内存（MB），只支持 Linux（/proc），其他平台返回 None。"""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def _latency(samples_ms: list[float]) -> dict:
+    ordered = sorted(samples_ms)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] if ordered else 0.0
+    return {
+        "p50": round(statistics.median(ordered), 2) if ordered else 0.0,
+        "p95": round(p95, 2),
+        "avg": round(statistics.mean(ordered), 2) if ordered else 0.0,
+    }
+
+
+def rerank_candidates(golden: list[dict], n_candidates: int) -> list[list[str]]:
+    """每题的候选段落：自己的答案排第 0 位，后面依次是其后若干题的答案（确定性，
+    不同后端拿到的候选完全一样）。"""
+    answers = [item["expected_answer"] for item in golden]
+    n = min(n_candidates, len(answers))
+    return [[answers[(i + j) % len(answers)] for j in range(n)] for i in range(len(answers))]
+
+
+def _answer_ranks(question_vecs, answer_vecs) -> list[int | None]:
+    """问题 i 的正确答案是答案 i：返回它在余弦排序里的名次（1-based）。"""
+    import numpy as np
+
+    q = np.asarray(question_vecs, dtype=np.float32)
+    a = np.asarray(answer_vecs, dtype=np.float32)
+    sims = q @ a.T
+    ranks: list[int | None] = []
+    for i, row in enumerate(sims):
+        ranks.append(int((row > row[i]).sum()) + 1)
+    return ranks
+
+
+def _embedding_worker(backend: str, golden: list[dict], batch_size: int, collection: str | None, top_k: int) -> dict:
+    bootstrap_backend_path()
+    import configs.load_env as load_env
+
+    load_env.reload_env_variables()
+    load_env.EMBEDDING_BACKEND = backend
+    from configs.llm_predictor import build_embed_model
+
+    questions = [item["question"] for item in golden]
+    answers = [item["expected_answer"] for item in golden]
+
+    rss_before = _rss_mb()
+    t0 = time.perf_counter()
+    model = build_embed_model("cpu")
+    load_s = time.perf_counter() - t0
+    rss_after = _rss_mb()
+
+    model.get_query_embedding(questions[0])  # 首次前向不计入延迟
+    latencies, question_vecs = [], []
+    for question in questions:
+        t0 = time.perf_counter()
+        question_vecs.append(model.get_query_embedding(question))
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    model.embed_batch_size = batch_size
+    t0 = time.perf_counter()
+    answer_vecs = model.get_text_embedding_batch(answers)
+    throughput = len(answers) / (time.perf_counter() - t0)
+
+    ranks = _answer_ranks(question_vecs, answer_vecs)
+    result = {
+        "backend": backend,
+        "model_path": model.model_name,
+        "load_s": round(load_s, 2),
+        "rss_mb": round(rss_after - rss_before, 1) if rss_before is not None and rss_after is not None else None,
+        "query_latency_ms": _latency(latencies),
+        "batch_throughput_per_s": round(throughput, 1),
+        "answer_retrieval": {"hit@1": hit_rate_at(ranks, 1), "mrr@5": mrr_at(ranks, 5)},
+        "question_vectors": question_vecs,
+    }
+    if collection:
+        result["collection_retrieval"] = _collection_retrieval(model, golden, collection, question_vecs, top_k)
+    return result
+
+
+def _collection_retrieval(model, golden, collection_name, question_vecs, top_k) -> dict:
+    from handlers.vector_store import get_or_create_collection
+    from llama_index.core import VectorStoreIndex
+    from llama_index.core.schema import QueryBundle
+    from llama_index.vector_stores.chroma import ChromaVectorStore
+
+    vector_store = ChromaVectorStore(chroma_collection=get_or_create_collection(collection_name))
+    retriever = VectorStoreIndex.from_vector_store(vector_store, embed_model=model).as_retriever(
+        similarity_top_k=top_k
+    )
+    ranks = []
+    for item, vec in zip(golden, question_vecs):
+        nodes = retriever.retrieve(QueryBundle(item["question"], embedding=vec))
+        rank, _ = first_hit_rank(item.get("expected_sources") or [], nodes)
+        ranks.append(rank)
+    return {
+        "hit_rate@1": hit_rate_at(ranks, 1),
+        f"hit_rate@{top_k}": hit_rate_at(ranks, top_k),
+        f"mrr@{top_k}": mrr_at(ranks, top_k),
+    }
+
+
+def _reranker_worker(backend: str, golden: list[dict], n_candidates: int) -> dict:
+    bootstrap_backend_path()
+    import configs.load_env as load_env
+
+    load_env.reload_env_variables()
+    load_env.RERANKER_BACKEND = backend
+    from utils import rerank
+
+    candidates = rerank_candidates(golden, n_candidates)
+
+    rss_before = _rss_mb()
+    t0 = time.perf_counter()
+    rerank._get_reranker()
+    load_s = time.perf_counter() - t0
+    rss_after = _rss_mb()
+
+    first = golden[0]["question"]
+    rerank._cross_encoder_score_pairs([(first, c) for c in candidates[0]])  # 首次前向不计入延迟
+    latencies, scores = [], []
+    for item, passages in zip(golden, candidates):
+        t0 = time.perf_counter()
+        row = rerank._cross_encoder_score_pairs([(item["question"], p) for p in passages])
+        latencies.append((time.perf_counter() - t0) * 1000)
+        scores.append([float(s) for s in row])
+
+    ranks: list[int | None] = [int(sum(1 for s in row if s > row[0])) + 1 for row in scores]
+    total_pairs = sum(len(p) for p in candidates)
+    return {
+        "backend": backend,
+        "load_s": round(load_s, 2),
+        "rss_mb": round(rss_after - rss_before, 1) if rss_before is not None and rss_after is not None else None,
+        "latency_ms_per_query": _latency(latencies),
+        "pairs_per_s": round(total_pairs / (sum(latencies) / 1000), 1) if latencies else 0.0,
+        "answer_rerank": {"hit@1": hit_rate_at(ranks, 1), "mrr@5": mrr_at(ranks, 5)},
+        "scores": scores,
+    }
+
+
+def _run_isolated(func, *args) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(func, args)
+
+
+def compare_embeddings(baseline: list[list[float]], other: list[list[float]]) -> dict:
+    """同一批问题两组向量的逐条余弦。"""
+    import numpy as np
+
+    a = np.asarray(baseline, dtype=np.float32)
+    b = np.asarray(other, dtype=np.float32)
+    cos = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    return {"mean": round(float(cos.mean()), 5), "min": round(float(cos.min()), 5)}
+
+
+def compare_scores(baseline: list[list[float]], other: list[list[float]]) -> dict:
+    """两组重排分数：top1 一致率、分数最大绝对偏差。"""
+    def top1(row: list[float]) -> int:
+        return max(range(len(row)), key=row.__getitem__)
+
+    agree = sum(1 for a, b in zip(baseline, other) if top1(a) == top1(b))
+    max_diff = max((abs(x - y) for a, b in zip(baseline, other) for x, y in zip(a, b)), default=0.0)
+    return {"top1_agreement": round(agree / len(baseline), 4) if baseline else 0.0, "max_abs_diff": round(max_diff, 4)}
+
+
+def run_benchmark(
+    golden_path: Path,
+    backends: list[str],
+    target: str,
+    collection: str | None,
+    top_k: int,
+    n_candidates: int,
+    batch_size: int,
+) -> dict:
+    golden = load_jsonl(golden_path)
+    ordered = ["torch"] + [b for b in backends if b != "torch"]
+    result: dict = {
+        "golden_path": str(golden_path),
+        "num_questions": len(golden),
+        "config": {"backends": ordered, "collection": collection, "top_k": top_k, "candidates": n_candidates},
+    }
+
+    if target in ("embedding", "both"):
+        arms: dict = {}
+        for backend in ordered:
+            print(f"[bench_model_backend] 嵌入 {backend} ...", flush=True)
+            try:
+                arms[backend] = _run_isolated(_embedding_worker, backend, golden, batch_size, collection, top_k)
+            except Exception as e:
+                arms[backend] = {"backend": backend, "error": repr(e)}
+        baseline = arms.get("torch", {}).get("question_vectors")
+        for arm in arms.values():
+            vectors = arm.pop("question_vectors", None)
+            if baseline and vectors:
+                arm["cosine_vs_torch"] = compare_embeddings(baseline, vectors)
+        result["embedding"] = arms
+
+    if target in ("reranker", "both"):
+        arms = {}
+        for backend in ordered:
+            print(f"[bench_model_backend] 重排 {backend} ...", flush=True)
+            try:
+                arms[backend] = _run_isolated(_reranker_worker, backend, golden, n_candidates)
+            except Exception as e:
+                arms[backend] = {"backend": backend, "error": repr(e)}
+        baseline = arms.get("torch", {}).get("scores")
+        for arm in arms.values():
+            scores = arm.pop("scores", None)
+            if baseline and scores:
+                arm["vs_torch"] = compare_scores(baseline, scores)
+        result["reranker"] = arms
+    return result
+
+
+def _print_summary(result: dict) -> None:
+    print(f"\n== 推理后端基准（{result['num_questions']} 题）==")
+    for arm in result.get("embedding", {}).values():
+        if "error" in arm:
+            print(f"  嵌入 {arm['backend']:<11} 加载失败：{arm['error']}")
+            continue
+        cos = arm.get("cosine_vs_torch", {})
+        line = (
+            f"  嵌入 {arm['backend']:<11} 加载 {arm['load_s']:>6.1f}s  RSS +{arm['rss_mb']}MB  "
+            f"查询 p50 {arm['query_latency_ms']['p50']:>7.1f}ms p95 {arm['query_latency_ms']['p95']:>7.1f}ms  "
+            f"吞吐 {arm['batch_throughput_per_s']:>6.1f}/s  hit@1 {arm['answer_retrieval']['hit@1']:.3f}  "
+            f"cos(min) {cos.get('min', 1.0):.4f}"
+        )
+        if "collection_retrieval" in arm:
+            line += f"  collection {json.dumps(arm['collection_retrieval'])}"
+        print(line)
+    for arm in result.get("reranker", {}).values():
+        if "error" in arm:
+            print(f"  重排 {arm['backend']:<11} 加载失败：{arm['error']}")
+            continue
+        vs = arm.get("vs_torch", {})
+        print(
+            f"  重排 {arm['backend']:<11} 加载 {arm['load_s']:>6.1f}s  RSS +{arm['rss_mb']}MB  "
+            f"每题 p50 {arm['latency_ms_per_query']['p50']:>7.1f}ms p95 {arm['latency_ms_per_query']['p95']:>7.1f}ms  "
+            f"{arm['pairs_per_s']:>6.1f} 对/s  hit@1 {arm['answer_rerank']['hit@1']:.3f}  "
+            f"top1 一致 {vs.get('top1_agreement', 1.0):.3f}"
+        )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--golden", type=Path, default=DEFAULT_GOLDEN, help="golden 数据集路径")
+    parser.add_argument("--backends", default=DEFAULT_BACKENDS, help=f"逗号分隔，默认 {DEFAULT_BACKENDS}")
+    parser.add_argument("--target", choices=("embedding", "reranker", "both"), default="both")
+    parser.add_argument("--collection", default=None, help="额外在这个 Chroma collection 上测检索命中率")
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K)
+    parser.add_argument("--candidates", type=int, default=DEFAULT_CANDIDATES, help="每题重排的候选数")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH, help="批量嵌入吞吐的 batch 大小")
+    parser.add_argument("--output-dir", type=Path, default=DEFAULT_RESULTS_DIR, help="结果输出目录")
+    args = parser.parse_args()
+
+    if not args.golden.exists():
+        print(f"[bench_model_backend] golden 数据集不存在: {args.golden}")
+        return 1
+    bootstrap_backend_path()
+    from utils.model_backend import BACKENDS
+
+    backends = [b.strip().lower() for b in args.backends.split(",") if b.strip()]
+    unknown = [b for b in backends if b not in BACKENDS]
+    if unknown:
+        print(f"[bench_model_backend] 不认识的后端: {unknown}，可选 {list(BACKENDS)}")
+        return 1
+
+    result = run_benchmark(
+        args.golden, backends, args.target, args.collection, args.top_k, args.candidates, args.batch_size
+    )
+    _print_summary(result)
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.now(UTC).strftime("%Y%m%d_%H%M%S")
+    output_path = args.output_dir / f"model_backend_{timestamp}.json"
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {output_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""流式响应吞吐基准：请求中间件对 NDJSON 流式端点（/graph/ask_stream 那一类）的影响。
+
+下游是一个桩流式端点：``StreamingResponse`` 连续吐 ``--chunks`` 行 NDJSON
+（跟 /graph/ask_stream 的 token 事件一样大小），中间不 sleep，这样量出来的就是
+"每个分块穿过中间件"的纯开销，不被 LLM 的生成速度盖住。对比：
+
+- ``none``：不加中间件；
+- ``legacy``：改造前的 ``@app.middleware("http")`` 写法，即 ``BaseHTTPMiddleware``
+  （抄自 ``evals/bench_middleware.py``）——响应体每一块都要经过它内部的内存流和
+  转发任务；
+- ``current``：现在的纯 ASGI ``main.SessionAndStatsMiddleware``，响应体消息原样透传。
+
+报每秒分块数（吞吐）和首块耗时（TTFB），``--concurrency`` 路流同时跑，取
+``--repeat`` 轮中位数。不需要模型、不需要 API key。
+
+用法:
+    uv run python evals/bench_streaming.py
+    uv run python evals/bench_streaming.py --chunks 2000 --concurrency 20 --repeat 5
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+_REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from evals._common import bootstrap_backend_path  # noqa: E402
+from evals.bench_middleware import _scope, call_asgi, make_legacy_middleware  # noqa: E402
+
+DEFAULT_CHUNKS = 500
+DEFAULT_CONCURRENCY = 10
+DEFAULT_REPEAT = 3
+_TOKEN_LINE = (json.dumps({"type": "token", "content": "成都信息工程大学"}, ensure_ascii=False) + "\n").encode()
+
+
+def _streaming_endpoint(chunks: int):
+    from starlette.responses import StreamingResponse
+
+    async def app(scope, receive, send):
+        async def body():
+            for _ in range(chunks):
+                yield _TOKEN_LINE
+
+        await StreamingResponse(body(), media_type="application/x-ndjson")(scope, receive, send)
+
+    return app
+
+
+async def _run_streams(app, concurrency: int, round_no: int) -> tuple[float, float, int]:
+    """``concurrency`` 路流同时跑完，返回 (总分块数/秒, 首块耗时中位数 µs, 总分块数)。"""
+    # 每路一个 IP，一轮一个网段：都在限流额度内
+    scopes = [_scope(f"10.{round_no}.{i // 256}.{i % 256}", "/graph/ask_stream") for i in range(concurrency)]
+    started = time.perf_counter()
+    results = await asyncio.gather(*(call_asgi(app, scope) for scope in scopes))
+    elapsed = time.perf_counter() - started
+    total_chunks = sum(chunks for _, chunks, _ in results)
+    return total_chunks / elapsed, statistics.median(first for _, _, first in results), total_chunks
+
+
+def run_benchmark(
+    chunks: int = DEFAULT_CHUNKS, concurrency: int = DEFAULT_CONCURRENCY, repeat: int = DEFAULT_REPEAT
+) -> dict:
+    bootstrap_backend_path()
+    from unittest.mock import patch
+
+    import main
+    from utils.access_counter import AccessCounter
+    from utils.rate_limit import BucketedRateLimiter
+
+    endpoint = _streaming_endpoint(chunks)
+    variants = {
+        "none": endpoint,
+        "legacy": make_legacy_middleware(main, endpoint),
+        "current": main.SessionAndStatsMiddleware(endpoint),
+    }
+    limiter = BucketedRateLimiter(main.RATE_LIMIT_MAX_REQUESTS, main.RATE_LIMIT_WINDOW)
+    results = {}
+    with patch.object(main, "_rate_limiter", limiter), patch.object(main, "access_counter", AccessCounter()):
+        for name, app in variants.items():
+            rounds = [asyncio.run(_run_streams(app, concurrency, i)) for i in range(max(1, repeat))]
+            results[name] = {
+                "chunks_per_s": round(statistics.median(r[0] for r in rounds)),
+                "ttfb_us": round(statistics.median(r[1] for r in rounds), 1),
+                "chunks_received": rounds[-1][2],
+            }
+    for name in ("legacy", "current"):
+        results[name]["vs_none"] = round(results[name]["chunks_per_s"] / results["none"]["chunks_per_s"], 3)
+    return {"chunks_per_stream": chunks, "concurrency": concurrency, "variants": results}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=DEFAULT_CHUNKS, help="每路流的 NDJSON 行数")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="同时跑的流数")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="重复几轮取中位数")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.chunks, args.concurrency, args.repeat)
+    expected = args.chunks * args.concurrency
+    print(f"{args.concurrency} 路流 × {args.chunks} 块，{args.repeat} 轮中位数：")
+    for name, item in result["variants"].items():
+        ratio = f"  (无中间件的 {item['vs_none']:.0%})" if "vs_none" in item else ""
+        print(f"  {name:<8} {item['chunks_per_s']:>10,} 块/秒  TTFB {item['ttfb_us']:>8.1f} µs{ratio}")
+        if item["chunks_received"] != expected:
+            print(f"  {name} 只收到 {item['chunks_received']} / {expected} 块！", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,11 +13,17 @@
 三组都算 hit_rate@1/@2/@5 和 MRR@5（文件级命中，逻辑与 run_retrieval_eval/
 run_rerank_eval 一致，共用 evals/_common.py），并分别记录每题检索耗时。
 
+``--lexical sparse`` 把 B/C 组词项那一路从 jieba BM25 换成 bge-m3 稀疏权重
+（``LEXICAL_RETRIEVAL_MODE=sparse``，见 handlers/sparse_index.py），用来对比两种
+词项检索的命中率和延迟；稀疏头加载不了时自动退回 BM25，实际用的模式记在结果
+``config.hybrid.lexical`` 里。
+
 C 组依赖 sentence-transformers（主依赖，`uv sync` 就会装）。
 reranker 模型约 2.2GB，首次运行会从 HuggingFace 下载。
 
 用法:
     uv run python evals/run_hybrid_eval.py --collection campus-corpus
+    uv run python evals/run_hybrid_eval.py --collection campus-corpus --lexical sparse
 """
 from __future__ import annotations
 
@@ -69,8 +75,10 @@ def run_abc_eval(
     recall_k: int,
     reranker_model: str,
     skip_rerank: bool,
+    lexical: str = "bm25",
 ) -> dict | None:
     """跑一次 A/B/C 评测，返回结果 dict；索引/数据不可用时返回 None。"""
+    import configs.load_env as load_env
     from configs.llm_predictor import init_settings
     from handlers.hybrid_retriever import _build_hybrid_retriever
     from handlers.vector_store import build_index_from_collection, get_or_create_collection
@@ -91,7 +99,14 @@ def run_abc_eval(
         print(f"[run_hybrid_eval] collection {resolved_name!r} 是空的，没有可评测的数据。")
         return None
 
+    # 必须在 init_settings 之前设：稀疏头是加载嵌入模型时挂上去的。
+    load_env.LEXICAL_RETRIEVAL_MODE = lexical
     init_settings()
+    from utils.sparse_embedding import get_sparse_encoder
+
+    effective_lexical = "sparse" if lexical == "sparse" and get_sparse_encoder() is not None else "bm25"
+    if effective_lexical != lexical:
+        print("[run_hybrid_eval] bge-m3 稀疏头不可用，B/C 组的词项检索退回 jieba BM25。")
     index = build_index_from_collection(collection)
 
     retriever_a = index.as_retriever(similarity_top_k=top_k)
@@ -181,7 +196,7 @@ def run_abc_eval(
         "num_questions": len(details),
         "config": {
             "baseline": {"similarity_top_k": top_k},
-            "hybrid": {"similarity_top_k": top_k},
+            "hybrid": {"similarity_top_k": top_k, "lexical": effective_lexical},
             "hybrid_rerank": (
                 {"recall_k": recall_k, "top_n": top_k, "model": reranker_model} if reranker is not None else None
             ),
@@ -202,7 +217,10 @@ def _print_summary(result: dict) -> None:
         arms.append(("C 混合+rerank", "hybrid_rerank"))
 
     print()
-    print(f"Hybrid A/B/C — collection={result['collection']!r} questions={result['num_questions']}")
+    print(
+        f"Hybrid A/B/C — collection={result['collection']!r} questions={result['num_questions']} "
+        f"lexical={result['config']['hybrid'].get('lexical', 'bm25')}"
+    )
     print("-" * 88)
     header = f"{'指标':<16}" + "".join(f"{label:>16}" for label, _ in arms)
     print(header)
@@ -244,6 +262,12 @@ def main() -> int:
         "--reranker-model", default=DEFAULT_RERANKER, help=f"C 组 cross-encoder 模型，默认 {DEFAULT_RERANKER}"
     )
     parser.add_argument("--skip-rerank", action="store_true", help="只跑 A/B 两组，不跑 C（不需要 rerank 依赖）")
+    parser.add_argument(
+        "--lexical",
+        choices=("bm25", "sparse"),
+        default="bm25",
+        help="B/C 组词项那一路：jieba BM25（默认）或 bge-m3 稀疏权重",
+    )
     parser.add_argument("--output-dir", type=Path, default=DEFAULT_RESULTS_DIR, help="结果输出目录")
     args = parser.parse_args()
 
@@ -271,7 +295,9 @@ def main() -> int:
             skip_rerank = True
 
     try:
-        result = run_abc_eval(args.golden, args.collection, args.top_k, args.recall_k, args.reranker_model, skip_rerank)
+        result = run_abc_eval(
+            args.golden, args.collection, args.top_k, args.recall_k, args.reranker_model, skip_rerank, args.lexical
+        )
     except Exception as e:
         print(f"[run_hybrid_eval] 评测过程中出错: {e!r}")
         return 1
@@ -11,11 +11,19 @@
 共用 evals/_common.py 里的 first_hit_rank / hit_rate_at / mrr_at），并分别记录
 每题检索耗时，量化 rerank 的延迟代价。
 
+``--calibrate-skip`` 换成另一种模式：走线上同一个混合检索
+（``build_retriever_for_index``，BM25+dense RRF），对每题记录融合前的
+``FusionSignal`` 和"不重排/重排后"的命中排名，扫一遍
+RERANK_SKIP_DENSE_MIN × RERANK_SKIP_DENSE_MARGIN 网格，给出"跳过后 hit@1、
+hit@top_k 都不低于全量重排"的前提下跳过率最高的一组阈值——这就是
+``RERANK_SKIP_MODE=fusion`` 该用的值。
+
 依赖 sentence-transformers（主依赖，`uv sync` 就会装）。
 reranker 模型约 2.2GB，首次运行会从 HuggingFace 下载。
 
 用法:
     uv run python evals/run_rerank_eval.py --collection campus-corpus
+    uv run python evals/run_rerank_eval.py --collection campus-corpus --calibrate-skip
 """
 from __future__ import annotations
 
@@ -47,6 +55,10 @@ DEFAULT_TOP_K = 5  # 与线上主查询路径一致
 DEFAULT_RECALL_K = 20  # rerank 前的向量召回数
 DEFAULT_RERANKER = "BAAI/bge-reranker-v2-m3"
 HIT_KS = (1, 2, 5)
+# --calibrate-skip 扫的阈值网格（FusionSignal 里是由 Chroma L2 距离换算的余弦，
+# bge-m3 落在 0.3~0.9 之间）。
+SKIP_DENSE_MIN_GRID = tuple(round(0.5 + 0.025 * i, 3) for i in range(19))
+SKIP_DENSE_MARGIN_GRID = (0.0, 0.01, 0.02, 0.03, 0.05, 0.08, 0.1)
 
 
 def _arm_metrics(ranks: list[int | None], latencies_ms: list[float], top_k: int) -> dict:
@@ -164,6 +176,141 @@ def run_ab_eval(
     }
 
 
+def calibrate_skip_thresholds(records: list[dict], top_k: int) -> dict:
+    """对每组 (dense_min, dense_margin) 模拟"信号够强就不重排"的策略。
+
+    ``records`` 每条是 ``{"signal": {...} | None, "rank_fused": int|None,
+    "rank_reranked": int|None}``：``rank_fused`` 是不重排时（融合结果直接取
+    top_k）正确来源的排名，``rank_reranked`` 是重排后的排名。返回每组阈值的
+    跳过率/hit@1/hit@top_k，以及 ``recommended``：hit@1 和 hit@top_k 都不低于
+    全量重排的组里跳过率最高的一组（并列取阈值更严的），没有这样的组时为 None。
+    """
+    baseline_ranks = [r["rank_reranked"] for r in records]
+    baseline = {"hit@1": hit_rate_at(baseline_ranks, 1), f"hit@{top_k}": hit_rate_at(baseline_ranks, top_k)}
+    sweep = []
+    for dense_min in SKIP_DENSE_MIN_GRID:
+        for margin in SKIP_DENSE_MARGIN_GRID:
+            ranks = []
+            skipped = 0
+            for r in records:
+                signal = r["signal"]
+                skip = (
+                    signal is not None
+                    and signal["legs_agree"]
+                    and signal["dense_top1"] >= dense_min
+                    and signal["dense_margin"] >= margin
+                )
+                skipped += skip
+                ranks.append(r["rank_fused"] if skip else r["rank_reranked"])
+            sweep.append(
+                {
+                    "dense_min": dense_min,
+                    "dense_margin": margin,
+                    "skip_rate": skipped / len(records) if records else 0.0,
+                    "hit@1": hit_rate_at(ranks, 1),
+                    f"hit@{top_k}": hit_rate_at(ranks, top_k),
+                }
+            )
+    safe = [
+        row
+        for row in sweep
+        if row["skip_rate"] > 0
+        and row["hit@1"] >= baseline["hit@1"]
+        and row[f"hit@{top_k}"] >= baseline[f"hit@{top_k}"]
+    ]
+    recommended = (
+        max(safe, key=lambda row: (row["skip_rate"], row["dense_min"], row["dense_margin"])) if safe else None
+    )
+    return {"baseline": baseline, "sweep": sweep, "recommended": recommended}
+
+
+def run_skip_calibration(
+    golden_path: Path,
+    collection_name: str | None,
+    top_k: int,
+    recall_k: int,
+    reranker_model: str,
+) -> dict | None:
+    """``--calibrate-skip``：线上混合检索 + 重排，逐题记录信号和两种排名。"""
+    import configs.load_env as load_env
+    from configs.llm_predictor import init_settings
+    from handlers.hybrid_retriever import build_retriever_for_index
+    from handlers.vector_store import build_index_from_collection, get_or_create_collection
+    from llama_index.core.postprocessor import SentenceTransformerRerank
+    from llama_index.core.schema import QueryBundle
+
+    from evals.run_retrieval_eval import _detect_collection
+
+    resolved_name = _detect_collection(collection_name)
+    if resolved_name is None:
+        return None
+    collection = get_or_create_collection(resolved_name)
+    if not collection.count():
+        print(f"[run_rerank_eval] collection {resolved_name!r} 是空的，没有可评测的数据。")
+        return None
+
+    init_settings()
+    load_env.HYBRID_RETRIEVAL_ENABLED = True
+    index = build_index_from_collection(collection)
+    index.set_index_id(resolved_name)
+    retriever = build_retriever_for_index(index, recall_k)
+    reranker = SentenceTransformerRerank(model=reranker_model, top_n=top_k)
+
+    records = []
+    for item in load_jsonl(golden_path):
+        question = item["question"]
+        expected = item.get("expected_sources") or []
+        recalled = retriever.retrieve(question)
+        signal = getattr(recalled[0], "signal", None) if recalled else None
+        rank_fused, _ = first_hit_rank(expected, recalled[:top_k])
+        reranked = reranker.postprocess_nodes(list(recalled), query_bundle=QueryBundle(question))
+        rank_reranked, _ = first_hit_rank(expected, reranked)
+        records.append(
+            {
+                "id": item["id"],
+                "question": question,
+                "signal": None
+                if signal is None
+                else {
+                    "dense_top1": round(signal.dense_top1, 4),
+                    "dense_margin": round(signal.dense_margin, 4),
+                    "legs_agree": signal.legs_agree,
+                },
+                "rank_fused": rank_fused,
+                "rank_reranked": rank_reranked,
+            }
+        )
+
+    return {
+        "collection": resolved_name,
+        "golden_path": str(golden_path),
+        "num_questions": len(records),
+        "config": {"recall_k": recall_k, "top_n": top_k, "model": reranker_model},
+        "calibration": calibrate_skip_thresholds(records, top_k),
+        "details": records,
+    }
+
+
+def _print_calibration(result: dict) -> None:
+    top_k = result["config"]["top_n"]
+    calibration = result["calibration"]
+    print()
+    print(f"Rerank skip 标定 — collection={result['collection']!r} questions={result['num_questions']}")
+    print(
+        f"全量重排基线: hit@1={calibration['baseline']['hit@1']:.2%} "
+        f"hit@{top_k}={calibration['baseline'][f'hit@{top_k}']:.2%}"
+    )
+    best = calibration["recommended"]
+    if best is None:
+        print("没有任何一组阈值能在不降低 hit@k 的前提下跳过重排，保持 RERANK_SKIP_MODE=score。")
+    else:
+        print(
+            f"推荐: RERANK_SKIP_MODE=fusion RERANK_SKIP_DENSE_MIN={best['dense_min']} "
+            f"RERANK_SKIP_DENSE_MARGIN={best['dense_margin']}（跳过率 {best['skip_rate']:.0%}）"
+        )
+    print()
+
+
 def _print_summary(result: dict) -> None:
     top_k = result["config"]["baseline"]["similarity_top_k"]
     recall_k = result["config"]["rerank"]["recall_k"]
@@ -217,6 +364,11 @@ def main() -> int:
         "--reranker-model", default=DEFAULT_RERANKER, help=f"cross-encoder 模型，默认 {DEFAULT_RERANKER}"
     )
     parser.add_argument("--output-dir", type=Path, default=DEFAULT_RESULTS_DIR, help="结果输出目录")
+    parser.add_argument(
+        "--calibrate-skip",
+        action="store_true",
+        help="标定 RERANK_SKIP_MODE=fusion 的阈值（走混合检索），而不是跑 A/B",
+    )
     args = parser.parse_args()
 
     if not args.golden.exists():
@@ -240,8 +392,9 @@ def main() -> int:
         print("[run_rerank_eval] 缺少 rerank 依赖，请先执行: uv sync")
         return 1
 
+    run = run_skip_calibration if args.calibrate_skip else run_ab_eval
     try:
-        result = run_ab_eval(args.golden, args.collection, args.top_k, args.recall_k, args.reranker_model)
+        result = run(args.golden, args.collection, args.top_k, args.recall_k, args.reranker_model)
     except Exception as e:
         print(f"[run_rerank_eval] 评测过程中出错: {e!r}")
         return 1
@@ -249,11 +402,15 @@ def main() -> int:
     if result is None:
         return 0
 
-    _print_summary(result)
+    if args.calibrate_skip:
+        _print_calibration(result)
+    else:
+        _print_summary(result)
 
     args.output_dir.mkdir(parents=True, exist_ok=True)
     timestamp = datetime.now(UTC).strftime("%Y%m%d_%H%M%S")
-    output_path = args.output_dir / f"rerank_{timestamp}.json"
+    prefix = "rerank_skip" if args.calibrate_skip else "rerank"
+    output_path = args.output_dir / f"{prefix}_{timestamp}.json"
     with open(output_path, "w", encoding="utf-8") as f:
         json.dump(result, f, ensure_ascii=False, indent=2)
     print(f"结果已写入 {output_path}")
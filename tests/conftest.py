@@ -59,9 +59,29 @@ def _reset_hybrid_retriever_cache():
     invalidate_hybrid_retriever_cache()
 
 
+@pytest.fixture(autouse=True)
+def _isolate_bm25_index(tmp_path, monkeypatch):
+    """``handlers.bm25_index`` 有进程级注册表，还会把倒排表落盘到
+    ``{index_save_directory}/{name}_bm25/``。测试里大量复用同名 collection
+    （每个用例一个新的临时 Chroma 目录），如果注册表/磁盘上残留上一个用例的
+    倒排表，文档数恰好相同时一致性检查拦不住，查出来的 node_id 在新 collection
+    里根本不存在。注册表每个用例清空，落盘目录指到本用例的 tmp_path，也顺带
+    避免测试往真实的 data/indexes 里写东西。``handlers.sparse_index`` 同理。"""
+    import configs.load_env as load_env
+    from handlers.bm25_index import clear_bm25_registry
+    from handlers.sparse_index import clear_sparse_registry
+
+    monkeypatch.setattr(load_env, 'index_save_directory', str(tmp_path / 'indexes'))
+    clear_bm25_registry()
+    clear_sparse_registry()
+    yield
+    clear_bm25_registry()
+    clear_sparse_registry()
+
+
 @pytest.fixture(autouse=True)
 def _reset_rate_limit_store():
-    """``main._rate_limit_store`` 同样是模块级全局状态，按 IP 累计请求时间戳。
+    """``main._rate_limit_store`` 同样是模块级全局状态，按 IP 记限流状态。
 
     TestClient 发出的所有请求共用同一个 client host（``testclient``），所以整
     个测试会话里的请求会累加到同一个 IP 桶里。限流覆盖范围扩大到全部 LLM 端点
@@ -94,3 +114,43 @@ def _pin_admin_api_key_unset(monkeypatch):
     patch.dict/setenv 覆盖即可，monkeypatch 收尾时恢复。
     """
     monkeypatch.setenv('CUITCCA_API_KEY', '')
+
+
+@pytest.fixture(autouse=True)
+def _disable_startup_warmup(monkeypatch):
+    """``main.lifespan`` 启动后会在后台跑预热（``handlers/warmup.py``）：bge-m3
+    首次前向、加载 cross-encoder、给每个索引建 retriever。测试里这些要么是
+    mock，要么会去 HuggingFace 下载模型——后台线程还在跑时 TestClient 退出，
+    事件循环关不干净。默认关掉（lifespan 直接标记就绪），要测预热的用例自己
+    patch 回 True。"""
+    import configs.load_env as load_env
+
+    monkeypatch.setattr(load_env, 'WARMUP_ENABLED', False)
+
+
+@pytest.fixture(autouse=True)
+def _pin_memory_state_backend(monkeypatch):
+    """``STATE_BACKEND`` 默认是 auto：环境里 ``WEB_CONCURRENCY>1`` 时 lifespan
+    启动会打开 ``data/state.db``，会话缓存和限流都改走这个文件。测试进程里各个用例要的是
+    互不干扰的进程内状态（``_reset_rate_limit_store`` 清的就是内存桶），不能
+    往真实的 data 目录里写、也不能让上一个用例的会话留在库里。环境变量和模块
+    变量都钉住（有的用例不 patch ``reload_env_variables``），要测共享后端的用例
+    自己构造 ``SqliteStateBackend``。"""
+    import configs.load_env as load_env
+    from utils import shared_state
+
+    monkeypatch.setenv('STATE_BACKEND', 'memory')
+    monkeypatch.setattr(load_env, 'STATE_BACKEND', 'memory')
+    yield
+    shared_state.close_shared_state()
+
+
+@pytest.fixture(autouse=True)
+def _close_stats_db():
+    """utils/db 每个库文件常驻一个写线程和几个读连接。用例大多在临时目录里
+    建库，目录删掉之后这些连接还挂在模块级的注册表里：每个用例结束都关掉，
+    不让写线程越积越多，也不让下一个用例碰巧复用同一路径时拿到旧连接。"""
+    yield
+    from utils import db
+
+    db.close_db()
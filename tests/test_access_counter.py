@@ -0,0 +1,138 @@
+"""中间件访问计数（utils/access_counter.py）和 main._flush_access_stats 的测试。"""
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from collections import defaultdict
+from unittest.mock import patch
+
+import tests._pathsetup  # noqa: F401
+
+
+class AccessCounterTest(unittest.TestCase):
+    def test_drain_returns_delta_and_resets(self):
+        from utils.access_counter import AccessCounter
+
+        counter = AccessCounter()
+        counter.record("1.1.1.1", "/graph/ask_stream")
+        counter.record("1.1.1.1", "/index/list")
+        counter.record("2.2.2.2", "/index/list")
+
+        delta = counter.drain()
+
+        self.assertEqual(delta, {
+            "total_visits": 3,
+            "user_visits": {"1.1.1.1": 2, "2.2.2.2": 1},
+            "endpoint_visits": {"/graph/ask_stream": 1, "/index/list": 2},
+        })
+        self.assertEqual(counter.drain()["total_visits"], 0)
+
+        counter.restore(delta)
+        self.assertEqual(counter.drain(), delta)
+
+    def test_merged_with_overlays_pending_without_mutating(self):
+        from utils.access_counter import AccessCounter
+
+        counter = AccessCounter()
+        counter.record("2.2.2.2", "/index/list")
+        stats = {"total_visits": 5, "ip_count": 1, "user_visits": {"1.1.1.1": 5}, "endpoint_visits": {"/": 5}}
+
+        merged = counter.merged_with(stats)
+
+        self.assertEqual(merged["total_visits"], 6)
+        self.assertEqual(merged["ip_count"], 2)
+        self.assertEqual(merged["endpoint_visits"], {"/": 5, "/index/list": 1})
+        self.assertEqual(stats["user_visits"], {"1.1.1.1": 5})
+        self.assertEqual(counter.total, 1)
+
+
+class FlushAccessStatsTest(unittest.TestCase):
+    def test_single_worker_flush_folds_delta_in_memory(self):
+        import main
+        from utils import db
+        from utils.access_counter import AccessCounter
+
+        counter = AccessCounter()
+        stats = {"total_visits": 5, "ip_count": 1, "user_visits": defaultdict(int, {"1.1.1.1": 5}),
+                 "endpoint_visits": defaultdict(int)}
+        counter.record("1.1.1.1", "/index/list")
+        counter.record("2.2.2.2", "/index/list")
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "app.db")
+            with patch.object(main, "access_counter", counter), patch.object(main, "access_stats", stats), \
+                    patch.object(main.load_env, "db_path", db_path), \
+                    patch.object(main.stats_db, "load_stats", side_effect=AssertionError("不应该整表重读")):
+                asyncio.run(main._flush_access_stats())
+            self.assertEqual(db.load_stats(db_path)["total_visits"], 2)
+            db.close_db(db_path)
+
+        self.assertEqual(stats["total_visits"], 7)
+        self.assertEqual(dict(stats["user_visits"]), {"1.1.1.1": 6, "2.2.2.2": 1})
+        self.assertEqual(stats["endpoint_visits"]["/index/list"], 2)
+        self.assertEqual(stats["ip_count"], 2)
+
+    def test_multi_worker_flush_adds_delta_and_refreshes_totals(self):
+        import main
+        from utils import db
+        from utils.access_counter import AccessCounter
+
+        counter = AccessCounter()
+        stats = {"total_visits": 0, "ip_count": 0, "user_visits": defaultdict(int), "endpoint_visits": defaultdict(int)}
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "app.db")
+            db.init_db(db_path)
+            # 另一个 worker 已经刷进去的计数
+            db.add_stats_delta(db_path, {"total_visits": 4, "user_visits": {"9.9.9.9": 4}, "endpoint_visits": {}})
+            counter.record("1.1.1.1", "/index/list")
+            with patch.object(main, "access_counter", counter), patch.object(main, "access_stats", stats), \
+                    patch.object(main.load_env, "db_path", db_path), \
+                    patch.object(main.shared_state, "shared_backend", return_value=object()), \
+                    patch.object(main, "_stats_reloaded_at", 0.0):
+                asyncio.run(main._flush_access_stats())
+                asyncio.run(main._flush_access_stats())  # 没有新增量，不能重复累加
+
+            self.assertEqual(db.load_stats(db_path)["total_visits"], 5)
+            db.close_db(db_path)
+        self.assertEqual(stats["total_visits"], 5)
+        self.assertEqual(stats["ip_count"], 2)
+        self.assertEqual(counter.total, 0)
+
+    def test_multi_worker_flush_reloads_totals_only_once_per_interval(self):
+        import main
+        from utils import db
+        from utils.access_counter import AccessCounter
+
+        counter = AccessCounter()
+        stats = {"total_visits": 3, "ip_count": 1, "user_visits": defaultdict(int, {"9.9.9.9": 3}),
+                 "endpoint_visits": defaultdict(int)}
+        counter.record("1.1.1.1", "/index/list")
+        with tempfile.TemporaryDirectory() as tmp:
+            with patch.object(main, "access_counter", counter), patch.object(main, "access_stats", stats), \
+                    patch.object(main.load_env, "db_path", os.path.join(tmp, "app.db")), \
+                    patch.object(main.shared_state, "shared_backend", return_value=object()), \
+                    patch.object(main, "_stats_reloaded_at", time.monotonic()), \
+                    patch.object(main.stats_db, "load_stats", side_effect=AssertionError("不应该整表重读")):
+                asyncio.run(main._flush_access_stats())
+            db.close_db(os.path.join(tmp, "app.db"))
+
+        self.assertEqual(stats["total_visits"], 4)
+        self.assertEqual(dict(stats["user_visits"]), {"9.9.9.9": 3, "1.1.1.1": 1})
+
+    def test_failed_flush_keeps_delta_for_next_round(self):
+        import main
+        from utils.access_counter import AccessCounter
+
+        counter = AccessCounter()
+        counter.record("1.1.1.1", "/index/list")
+        with patch.object(main, "access_counter", counter), patch.object(
+            main.stats_db, "add_stats_delta", side_effect=OSError("disk full")
+        ):
+            with self.assertRaises(OSError):
+                asyncio.run(main._flush_access_stats())
+
+        self.assertEqual(counter.total, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -16,7 +16,7 @@
 全部用 patch 假索引/假 retriever/假 Chroma client，不碰真实索引、不联网。
 """
 import json
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 from agents import tools as agent_tools
@@ -78,7 +78,7 @@ async def test_search_knowledge_base_with_index_name_uses_build_retriever_for_in
     with patch("agents.tools.get_index_by_name", return_value=fake_index), \
             patch("agents.tools.build_retriever_for_index", return_value=fake_retriever) as mock_build, \
             patch("agents.tools.ConditionalRerankPostprocessor") as mock_rerank_cls:
-        mock_rerank_cls.return_value.postprocess_nodes.return_value = nodes
+        mock_rerank_cls.return_value.apostprocess_nodes = AsyncMock(return_value=nodes)
         result = json.loads(
             await agent_tools.search_knowledge_base(query="学校地址", index_name="idx1", top_k=3)
         )
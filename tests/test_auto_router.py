@@ -22,7 +22,7 @@
 全部用注入的 FakeRetriever / RecordingLLM，不碰真实索引、不联网、不需要
 真实的 cross-encoder 重排模型。
 """
-from unittest.mock import patch
+from unittest.mock import AsyncMock, patch
 
 import pytest
 
@@ -104,7 +104,7 @@ async def test_route_query_retrieval_error_falls_back_to_agent():
 async def test_route_query_high_confidence_goes_to_standard():
     """重排后 top1 >= 阈值：走 standard，RouteDecision 带上已经检索好的 nodes。
 
-    patch rerank_nodes 让它报告"真的重排过"——只有这样 top1 才是 cross-encoder
+    patch arerank_nodes 让它报告"真的重排过"——只有这样 top1 才是 cross-encoder
     分数、才允许拿去比阈值。不 patch 的话 1 个节点会走"候选数不够，跳过重排"
     那条路径，测到的就不是分数比较逻辑了。"""
     import configs.load_env as load_env
@@ -116,7 +116,7 @@ async def test_route_query_high_confidence_goes_to_standard():
     with patch.object(load_env, "RERANK_ENABLED", True), \
          patch.object(load_env, "AUTO_ROUTE_SCORE_THRESHOLD", 0.6), \
          patch.object(load_env, "RERANK_TOP_N", 5), \
-         patch("handlers.auto_router.rerank_nodes", return_value=(nodes, True)):
+         patch("handlers.auto_router.arerank_nodes", AsyncMock(return_value=(nodes, True))):
         decision = await route_query("图书馆几点开门", retriever=retriever)
 
     assert decision.mode == MODE_STANDARD
@@ -138,7 +138,7 @@ async def test_route_query_low_confidence_goes_to_agent():
     with patch.object(load_env, "RERANK_ENABLED", True), \
          patch.object(load_env, "AUTO_ROUTE_SCORE_THRESHOLD", 0.6), \
          patch.object(load_env, "RERANK_TOP_N", 5), \
-         patch("handlers.auto_router.rerank_nodes", return_value=(nodes, True)):
+         patch("handlers.auto_router.arerank_nodes", AsyncMock(return_value=(nodes, True))):
         decision = await route_query("一个语料没覆盖的问题", retriever=retriever)
 
     assert decision.mode == MODE_AGENT
@@ -0,0 +1,270 @@
+"""backend/app/handlers/bm25_index.py 的测试。
+
+覆盖四块：
+1. 打分跟 bm25s 默认参数逐位一致（换实现不能让 evals 基线漂移）。
+2. 增删：add / remove / remove_ref_doc 之后 df、avgdl 只统计存活文档。
+3. save -> load(mmap) 往返后结果不变；加载后继续增量写，再落盘仍然正确。
+4. get_bm25_index：磁盘上的倒排表跟 Chroma 文档数对不上时从 Chroma 重建。
+5. 摄取时存下的分词结果：从 Chroma 重建时直接用，不再跑 jieba。
+"""
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import tests._pathsetup  # noqa: F401
+
+CORPUS = {
+    "n1": "成都信息工程大学的校训是成于大气 信达天下",
+    "n2": "国家奖学金奖励标准为8000元每人每年",
+    "n3": "学校勤工助学的工资标准是150到200元每人每月",
+    "n4": "国家助学金分为一等二等三等 标准不同",
+}
+
+
+def _build(corpus=CORPUS):
+    from handlers.bm25_index import BM25Index, jieba_tokenize
+
+    index = BM25Index()
+    for node_id, text in corpus.items():
+        index.add(node_id, jieba_tokenize(text), ref_doc_id=f"doc-{node_id}")
+    return index
+
+
+class ScoringParityTest(unittest.TestCase):
+    def test_scores_match_bm25s_defaults(self):
+        import bm25s
+        from handlers.bm25_index import jieba_tokenize
+
+        node_ids = list(CORPUS)
+        corpus_tokens = [jieba_tokenize(CORPUS[n]) for n in node_ids]
+        reference = bm25s.BM25()
+        reference.index(corpus_tokens, show_progress=False)
+
+        index = _build()
+        for query in ["国家奖学金标准是多少", "校训", "每人每月 每人每年 标准"]:
+            query_tokens = jieba_tokenize(query)
+            expected = reference.get_scores(query_tokens)
+            got = dict(index.search(query_tokens, k=len(node_ids)))
+            for node_id, score in zip(node_ids, expected):
+                self.assertAlmostEqual(got.get(node_id, 0.0), float(score), places=4, msg=f"{query} / {node_id}")
+
+    def test_search_orders_by_score_and_truncates(self):
+        from handlers.bm25_index import jieba_tokenize
+
+        results = _build().search(jieba_tokenize("国家奖学金标准"), k=2)
+
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0][0], "n2")
+        self.assertGreaterEqual(results[0][1], results[1][1])
+
+    def test_empty_query_or_index_returns_nothing(self):
+        from handlers.bm25_index import BM25Index
+
+        self.assertEqual(BM25Index().search(["校训"], k=5), [])
+        self.assertEqual(_build().search([], k=5), [])
+
+
+class IncrementalUpdateTest(unittest.TestCase):
+    def test_removed_node_is_not_returned_and_stats_follow_live_docs(self):
+        from handlers.bm25_index import jieba_tokenize
+
+        index = _build()
+        index.remove("n2")
+
+        self.assertEqual(len(index), 3)
+        self.assertNotIn("n2", index)
+        self.assertNotIn("n2", [n for n, _ in index.search(jieba_tokenize("国家奖学金"), k=5)])
+
+        # 删除后的分数应当等于"从没加过 n2"的那份索引
+        expected = _build({k: v for k, v in CORPUS.items() if k != "n2"})
+        query = jieba_tokenize("国家助学金标准")
+        self.assertEqual(
+            [(n, round(s, 5)) for n, s in index.search(query, k=5)],
+            [(n, round(s, 5)) for n, s in expected.search(query, k=5)],
+        )
+
+    def test_remove_ref_doc_drops_all_its_chunks(self):
+        from handlers.bm25_index import BM25Index
+
+        index = BM25Index()
+        index.add("a-0", ["校训"], ref_doc_id="doc-a")
+        index.add("a-1", ["校训", "成于大气"], ref_doc_id="doc-a")
+        index.add("b-0", ["校训"], ref_doc_id="doc-b")
+
+        self.assertEqual(index.remove_ref_doc("doc-a"), 2)
+        self.assertEqual([n for n, _ in index.search(["校训"], k=5)], ["b-0"])
+
+    def test_add_existing_node_id_replaces_it(self):
+        index = _build()
+        index.add("n1", ["奖学金"], ref_doc_id="doc-n1")
+
+        self.assertEqual(len(index), 4)
+        self.assertEqual(index.search(["校训"], k=5), [])
+
+
+class PersistenceTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self._tmp_dir, "idx_bm25")
+
+    def test_save_and_mmap_load_round_trip(self):
+        from handlers.bm25_index import BM25Index, jieba_tokenize
+
+        index = _build()
+        index.remove("n3")
+        query = jieba_tokenize("国家奖学金标准")
+        before = index.search(query, k=5)
+
+        index.save(self.path)
+        loaded = BM25Index.load(self.path)
+
+        self.assertEqual(len(loaded), 3)
+        self.assertEqual(loaded.ref_doc_id_of("n1"), "doc-n1")
+        self.assertEqual(
+            [(n, round(s, 5)) for n, s in loaded.search(query, k=5)],
+            [(n, round(s, 5)) for n, s in before],
+        )
+
+    def test_delta_after_load_survives_next_save(self):
+        from handlers.bm25_index import BM25Index, jieba_tokenize
+
+        _build().save(self.path)
+        loaded = BM25Index.load(self.path)
+        loaded.add("n5", jieba_tokenize("图书馆开放时间是早八点到晚十点"), ref_doc_id="doc-n5")
+        loaded.remove("n1")
+        loaded.save(self.path)
+
+        reloaded = BM25Index.load(self.path)
+        self.assertEqual(reloaded.search(jieba_tokenize("图书馆开放时间"), k=1)[0][0], "n5")
+        self.assertNotIn("n1", reloaded)
+        parent, name = os.path.split(self.path)
+        self.assertEqual([entry for entry in os.listdir(parent) if entry.startswith(f"{name}.")], [])
+
+
+    def test_save_leaves_other_writers_temp_dirs_alone(self):
+        from handlers.bm25_index import BM25Index
+
+        # 另一个 worker 正在写的临时目录（以前是固定的 {path}.tmp）不能被这次 save 删掉。
+        foreign = tempfile.mkdtemp(prefix="idx_bm25.tmp.", dir=self._tmp_dir)
+        with open(os.path.join(foreign, "meta.json"), "w", encoding="utf-8") as f:
+            f.write("{}")
+
+        _build().save(self.path)
+
+        self.assertTrue(os.path.exists(os.path.join(foreign, "meta.json")))
+        self.assertEqual(len(BM25Index.load(self.path)), len(CORPUS))
+
+
+class GetBM25IndexTest(unittest.TestCase):
+    def setUp(self):
+        import chromadb
+        from llama_index.core.embeddings import MockEmbedding
+        from llama_index.core.schema import TextNode
+        from llama_index.vector_stores.chroma import ChromaVectorStore
+
+        self._tmp_dir = tempfile.mkdtemp()
+        self.client = chromadb.PersistentClient(path=self._tmp_dir)
+        self.addCleanup(self.client.clear_system_cache)
+        collection = self.client.get_or_create_collection("bm25-drift")
+        self.vector_store = ChromaVectorStore(chroma_collection=collection)
+        embed = MockEmbedding(embed_dim=8)
+        nodes = [TextNode(id_=k, text=v) for k, v in CORPUS.items()]
+        for node in nodes:
+            node.embedding = embed.get_text_embedding(node.text)
+        self.vector_store.add(nodes)
+
+    def test_builds_once_then_serves_from_registry(self):
+        from handlers import bm25_index
+
+        first = bm25_index.get_bm25_index("bm25-drift", self.vector_store)
+        second = bm25_index.get_bm25_index("bm25-drift", self.vector_store)
+
+        self.assertIs(first, second)
+        self.assertEqual(len(first), 4)
+        self.assertTrue(os.path.exists(os.path.join(bm25_index._bm25_persist_dir("bm25-drift"), "meta.json")))
+
+    def test_rebuilds_when_persisted_count_drifts_from_chroma(self):
+        from handlers import bm25_index
+
+        bm25_index.get_bm25_index("bm25-drift", self.vector_store)
+        bm25_index.clear_bm25_registry()
+        # 绕过增量钩子直接删 Chroma：磁盘上的倒排表还是 4 条
+        self.vector_store.delete_nodes(["n4"])
+
+        rebuilt = bm25_index.get_bm25_index("bm25-drift", self.vector_store)
+
+        self.assertEqual(len(rebuilt), 3)
+        self.assertNotIn("n4", rebuilt)
+
+    def test_hooks_are_noops_until_index_exists(self):
+        from handlers import bm25_index
+        from llama_index.core.schema import TextNode
+
+        bm25_index.apply_upserts("bm25-drift", [TextNode(id_="x", text="校训")])
+        bm25_index.remove_nodes("bm25-drift", ["n1"])
+
+        self.assertFalse(os.path.exists(bm25_index._bm25_persist_dir("bm25-drift")))
+
+    def test_hooks_update_persisted_index(self):
+        from handlers import bm25_index
+        from llama_index.core.schema import TextNode
+
+        bm25_index.get_bm25_index("bm25-drift", self.vector_store)
+        bm25_index.apply_upserts("bm25-drift", [TextNode(id_="n5", text="图书馆开放时间")])
+        bm25_index.remove_nodes("bm25-drift", ["n1"])
+        bm25_index.clear_bm25_registry()
+
+        loaded = bm25_index._load_persisted("bm25-drift")
+        self.assertIn("n5", loaded)
+        self.assertNotIn("n1", loaded)
+
+        bm25_index.drop_bm25_index("bm25-drift")
+        self.assertFalse(os.path.exists(bm25_index._bm25_persist_dir("bm25-drift")))
+
+
+
+class StoredTokensTest(unittest.TestCase):
+    def test_node_tokens_prefers_stored_tokens(self):
+        from handlers.bm25_index import TOKENS_METADATA_KEY, dumps_tokens, jieba_tokenize, node_tokens
+        from llama_index.core.schema import TextNode
+
+        tokens = jieba_tokenize(CORPUS["n2"])
+        stored = TextNode(text=CORPUS["n2"], metadata={TOKENS_METADATA_KEY: dumps_tokens(tokens)})
+
+        with patch("handlers.bm25_index.jieba.lcut", side_effect=AssertionError("jieba 不该被调用")):
+            self.assertEqual(node_tokens(stored), tokens)
+        self.assertEqual(node_tokens(TextNode(text=CORPUS["n2"])), tokens)
+
+    def test_pipeline_stores_tokens_and_rebuild_skips_jieba(self):
+        import chromadb
+        from handlers import bm25_index
+        from handlers.bm25_index import TOKENS_METADATA_KEY
+        from handlers.ingestion_pipeline import JiebaTokenizeTransform, build_pipeline
+        from llama_index.core import Document
+        from llama_index.core.embeddings import MockEmbedding
+        from llama_index.core.schema import MetadataMode
+        from llama_index.vector_stores.chroma import ChromaVectorStore
+
+        client = chromadb.PersistentClient(path=tempfile.mkdtemp())
+        self.addCleanup(client.clear_system_cache)
+        vector_store = ChromaVectorStore(chroma_collection=client.get_or_create_collection("bm25-stored"))
+        pipeline = build_pipeline(vector_store=vector_store, embed_model=MockEmbedding(embed_dim=8), min_chunk_length=1)
+        self.assertTrue(any(isinstance(t, JiebaTokenizeTransform) for t in pipeline.transformations))
+        pipeline.run(documents=[Document(text=text, id_=f"doc-{k}") for k, text in CORPUS.items()])
+
+        for node in vector_store.get_nodes(None):
+            self.assertIn(TOKENS_METADATA_KEY, node.metadata)
+            self.assertNotIn(TOKENS_METADATA_KEY, node.get_content(metadata_mode=MetadataMode.EMBED))
+            self.assertNotIn(TOKENS_METADATA_KEY, node.get_content(metadata_mode=MetadataMode.LLM))
+
+        with patch("handlers.bm25_index.jieba.lcut", side_effect=AssertionError("jieba 不该被调用")):
+            index = bm25_index.get_bm25_index("bm25-stored", vector_store)
+            results = index.search(["国家", "奖学金"], k=1)
+
+        self.assertEqual(len(index), 4)
+        self.assertIn("奖学金", vector_store.get_nodes([results[0][0]])[0].get_content())
+
+
+if __name__ == "__main__":
+    unittest.main()
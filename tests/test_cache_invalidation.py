@@ -7,6 +7,7 @@ from handlers.hybrid_retriever import (
     _hybrid_retriever_cache,
     build_retriever_for_index,
     invalidate_hybrid_retriever_cache,
+    refresh_index_retrievers,
 )
 from handlers.index_crud import _get_index_lock, _index_locks
 
@@ -20,6 +21,19 @@ class HybridRetrieverCacheInvalidationTest(unittest.TestCase):
     def tearDown(self):
         invalidate_hybrid_retriever_cache()
 
+    def test_invalidate_by_index_id_keeps_other_indexes(self):
+        """只失效被改动的索引：往小索引上传文件不应连带清掉 campus 的 retriever"""
+        campus_retriever = MagicMock()
+        _hybrid_retriever_cache[("campus", 5)] = campus_retriever
+        _hybrid_retriever_cache[("dept", 5)] = MagicMock()
+        _hybrid_retriever_cache[("dept", 2)] = MagicMock()
+
+        dropped = invalidate_hybrid_retriever_cache("dept")
+
+        self.assertEqual(sorted(dropped), [2, 5])
+        self.assertEqual(list(_hybrid_retriever_cache), [("campus", 5)])
+        self.assertIs(_hybrid_retriever_cache[("campus", 5)], campus_retriever)
+
     def test_invalidate_clears_all_cached_entries(self):
         """invalidate_hybrid_retriever_cache 应清空所有缓存条目"""
         _hybrid_retriever_cache[("idx1", 5)] = MagicMock()
@@ -85,6 +99,58 @@ class HybridRetrieverCacheInvalidationTest(unittest.TestCase):
         self.assertEqual(mock_build.call_count, 2)
 
 
+class RefreshIndexRetrieversTest(unittest.IsolatedAsyncioTestCase):
+    @patch('handlers.hybrid_retriever.load_env')
+    @patch('handlers.hybrid_retriever._build_hybrid_retriever')
+    async def test_refresh_prewarms_only_previously_cached_top_ks(self, mock_build, mock_load_env):
+        """内容变化后后台重建的只是之前确实在用的 top_k，其他索引不受影响"""
+        mock_load_env.HYBRID_RETRIEVAL_ENABLED = True
+        fake_index = MagicMock()
+        fake_index.index_id = "dept"
+        other = MagicMock()
+        _hybrid_retriever_cache[("dept", 5)] = MagicMock()
+        _hybrid_retriever_cache[("campus", 5)] = other
+        rebuilt = MagicMock()
+        mock_build.return_value = rebuilt
+
+        task = refresh_index_retrievers(fake_index)
+        await task
+
+        mock_build.assert_called_once_with(fake_index, 5)
+        self.assertIs(_hybrid_retriever_cache[("dept", 5)], rebuilt)
+        self.assertIs(_hybrid_retriever_cache[("campus", 5)], other)
+
+    @patch('handlers.hybrid_retriever.load_env')
+    @patch('handlers.hybrid_retriever._build_hybrid_retriever')
+    async def test_refresh_without_cached_entries_schedules_nothing(self, mock_build, mock_load_env):
+        mock_load_env.HYBRID_RETRIEVAL_ENABLED = True
+        fake_index = MagicMock()
+        fake_index.index_id = "cold"
+
+        self.assertIsNone(refresh_index_retrievers(fake_index))
+        mock_build.assert_not_called()
+
+    @patch('handlers.hybrid_retriever.load_env')
+    @patch('handlers.hybrid_retriever.is_chroma_store', return_value=True)
+    @patch('handlers.hybrid_retriever.bump_collection_generation')
+    async def test_generation_bump_runs_off_the_event_loop(self, mock_bump, _is_chroma, mock_load_env):
+        """版本号写回是同步的 Chroma modify，在后台线程里做，不阻塞事件循环"""
+        import threading
+
+        mock_load_env.HYBRID_RETRIEVAL_ENABLED = True
+        fake_index = MagicMock()
+        fake_index.index_id = "cold"
+        bump_threads = []
+        mock_bump.side_effect = lambda collection: bump_threads.append(threading.current_thread())
+
+        task = refresh_index_retrievers(fake_index)
+        mock_bump.assert_not_called()
+        await task
+
+        mock_bump.assert_called_once_with(fake_index.vector_store.client)
+        self.assertIsNot(bump_threads[0], threading.current_thread())
+
+
 class IndexLockTest(unittest.IsolatedAsyncioTestCase):
     """索引级锁测试：确保并发操作同一索引时使用正确的锁"""
 
@@ -1,5 +1,6 @@
 import os  # noqa: I001 (tests._pathsetup must precede utils below)
 import tempfile
+import threading
 import unittest
 
 import tests._pathsetup  # noqa: F401
@@ -13,8 +14,13 @@ class DbTest(unittest.TestCase):
         db.init_db(self.db_path)
 
     def tearDown(self):
+        db.close_db(self.db_path)
         self._tmpdir.cleanup()
 
+    def _writer_changes(self):
+        # 写线程那个连接累计改过的行数
+        return db._database(self.db_path).write(lambda conn: conn.total_changes)
+
     def test_init_db_creates_tables(self):
         conn = db._connect(self.db_path)
         tables = {
@@ -37,6 +43,17 @@ class DbTest(unittest.TestCase):
         self.assertEqual(loaded['user_visits']['1.2.3.4'], 3)
         self.assertEqual(loaded['endpoint_visits']['/graph/query'], 4)
 
+    def test_add_stats_delta_accumulates_across_writers(self):
+        # 两个 worker 各自刷增量，库里是两者之和而不是后写的覆盖先写的
+        db.add_stats_delta(self.db_path, {'total_visits': 3, 'user_visits': {'1.1.1.1': 3}, 'endpoint_visits': {}})
+        db.add_stats_delta(self.db_path, {
+            'total_visits': 2, 'user_visits': {'1.1.1.1': 1, '2.2.2.2': 1}, 'endpoint_visits': {'/graph/query': 2},
+        })
+        loaded = db.load_stats(self.db_path)
+        self.assertEqual(loaded['total_visits'], 5)
+        self.assertEqual(loaded['user_visits'], {'1.1.1.1': 4, '2.2.2.2': 1})
+        self.assertEqual(loaded['endpoint_visits'], {'/graph/query': 2})
+
     def test_save_and_list_feedback(self):
         db.save_feedback(self.db_path, '192.168.1.1', 'a@b.com', 'hello world')
         db.save_feedback(self.db_path, '192.168.1.2', None, 'no email here')
@@ -58,5 +75,83 @@ class DbTest(unittest.TestCase):
         self.assertEqual(loaded['endpoint_visits']['/graph/query'], 2)
 
 
+    def test_flush_stats_only_writes_changed_rows(self):
+        stats = {
+            'total_visits': 100,
+            'user_visits': {f'10.0.0.{i}': 1 for i in range(100)},
+            'endpoint_visits': {'/graph/query': 100},
+        }
+        db.flush_stats(self.db_path, stats)
+        before = self._writer_changes()
+
+        stats['total_visits'] += 1
+        stats['user_visits']['10.0.0.7'] += 1
+        stats['endpoint_visits']['/graph/query'] += 1
+        db.flush_stats(self.db_path, stats)
+
+        self.assertEqual(self._writer_changes() - before, 3)
+        loaded = db.load_stats(self.db_path)
+        self.assertEqual(loaded['total_visits'], 101)
+        self.assertEqual(len(loaded['user_visits']), 100)
+        self.assertEqual(loaded['user_visits']['10.0.0.7'], 2)
+
+    def test_add_stats_delta_with_empty_delta_does_not_write(self):
+        before = self._writer_changes()
+        db.add_stats_delta(self.db_path, {'total_visits': 0, 'user_visits': {}, 'endpoint_visits': {}})
+        self.assertEqual(self._writer_changes(), before)
+
+    def test_concurrent_writes_from_many_threads(self):
+        def _visit(i):
+            for _ in range(20):
+                db.record_visit(self.db_path, f'10.0.0.{i % 4}', '/graph/query')
+
+        threads = [threading.Thread(target=_visit, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        loaded = db.load_stats(self.db_path)
+        self.assertEqual(loaded['endpoint_visits']['/graph/query'], 160)
+        self.assertEqual(sum(loaded['user_visits'].values()), 160)
+
+    def test_failed_write_does_not_roll_back_others(self):
+        def _fail(conn):
+            conn.execute("INSERT INTO feedback (client_ip, email, message) VALUES ('x', NULL, 'rolled back')")
+            raise ValueError('boom')
+
+        with self.assertRaises(ValueError):
+            db._database(self.db_path).write(_fail)
+        db.save_feedback(self.db_path, '1.1.1.1', None, 'kept')
+
+        self.assertEqual([entry['message'] for entry in db.list_feedback(self.db_path)], ['kept'])
+
+    def test_reads_reuse_pooled_connections(self):
+        database = db._database(self.db_path)
+        with database.reader() as first:
+            pass
+        with database.reader() as second:
+            self.assertIs(second, first)
+            with self.assertRaises(Exception):
+                second.execute("DELETE FROM feedback")  # 读连接是只读的
+
+    def test_add_request_metrics_merges_and_prunes(self):
+        row = {'minute': 100, 'endpoint': '/graph/ask_stream', 'count': 2, 'errors': 1, 'histogram': [[5, 2]]}
+        db.add_request_metrics(self.db_path, [row])
+        db.add_request_metrics(self.db_path, [dict(row, count=1, errors=0, histogram=[[5, 1], [9, 1]])])
+        self.assertEqual(db.load_request_metrics(self.db_path, 0, 200), [
+            {'minute': 100, 'endpoint': '/graph/ask_stream', 'count': 3, 'errors': 1, 'histogram': [[5, 3], [9, 1]]},
+        ])
+
+        db.add_request_metrics(self.db_path, [dict(row, minute=100 + 2 * 24 * 60)], retention_days=1)
+        self.assertEqual([r['minute'] for r in db.load_request_metrics(self.db_path, 0, 10 ** 6)], [100 + 2 * 24 * 60])
+
+    def test_close_db_reopens_on_next_use(self):
+        db.save_feedback(self.db_path, '1.1.1.1', None, 'before close')
+        db.close_db(self.db_path)
+        db.save_feedback(self.db_path, '1.1.1.1', None, 'after close')
+        self.assertEqual(len(db.list_feedback(self.db_path)), 2)
+
+
 if __name__ == '__main__':
     unittest.main()
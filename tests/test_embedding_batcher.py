@@ -0,0 +1,141 @@
+"""查询嵌入微批服务（utils/embedding_batcher.py）的测试。
+
+不加载真实模型，批量前向换成记录每批内容的假函数，验证：
+1. 排队期间到达的问题被并进同一次前向，同一批里的重复问题只算一次；
+2. 前向出错时整批的调用方都收到异常，工作线程不退出；
+3. ``BatchedEmbedding`` 的同步/异步查询嵌入都走微批，文本嵌入透传；
+4. bge-m3 稀疏编码器批量前向时把稀疏权重记进 memo，稀疏检索那一路不再前向；
+5. ``/manage/stats`` 用的指标能穿过 ``CachedEmbedding`` 找到微批服务。
+"""
+import asyncio
+import threading
+import unittest
+from unittest.mock import patch
+
+import tests._pathsetup  # noqa: F401
+
+
+class _RecordingModel:
+    """假的 HuggingFaceEmbedding：只有批量前向 ``_embed``，记录每一批。"""
+
+    model_name = "fake"
+    embed_batch_size = 8
+
+    def __init__(self, gate: threading.Event | None = None):
+        self.batches: list[list[str]] = []
+        self.gate = gate
+
+    def _embed(self, queries, prompt_name=None):
+        if self.gate is not None and not self.batches:
+            self.gate.wait(timeout=5)
+        self.batches.append(list(queries))
+        return [[float(len(q)), 1.0] for q in queries]
+
+
+class EmbeddingBatcherTest(unittest.TestCase):
+    def _blocked_batcher(self):
+        """第一批前向卡住，后面提交的请求全部排在队列里，放行后一定同批。"""
+        from utils.embedding_batcher import EmbeddingBatcher, embed_queries
+
+        gate = threading.Event()
+        model = _RecordingModel(gate)
+        batcher = EmbeddingBatcher(lambda qs: embed_queries(model, qs), max_batch=8, max_wait_ms=0)
+        first = batcher.submit("第一个问题")
+        while batcher.stats()["queue_depth"]:
+            threading.Event().wait(0.001)
+        return batcher, model, gate, first
+
+    def test_queued_queries_share_one_forward_and_duplicates_are_folded(self):
+        batcher, model, gate, first = self._blocked_batcher()
+        futures = [batcher.submit(q) for q in ("图书馆几点开门", "奖学金", "图书馆几点开门", "校车")]
+        gate.set()
+
+        self.assertEqual(first.result(timeout=5), [5.0, 1.0])
+        results = [f.result(timeout=5) for f in futures]
+
+        self.assertEqual(model.batches, [["第一个问题"], ["图书馆几点开门", "奖学金", "校车"]])
+        self.assertEqual(results[0], results[2])
+        stats = batcher.stats()
+        self.assertEqual(stats["requests"], 5)
+        self.assertEqual(stats["batches"], 2)
+        self.assertEqual(stats["embedded"], 4)
+        self.assertEqual(stats["max_batch_size"], 3)
+
+    def test_forward_error_reaches_every_caller_and_worker_survives(self):
+        from utils.embedding_batcher import EmbeddingBatcher
+
+        calls = []
+
+        def flaky(queries):
+            calls.append(queries)
+            if len(calls) == 1:
+                raise RuntimeError("oom")
+            return [[1.0] for _ in queries]
+
+        batcher = EmbeddingBatcher(flaky, max_wait_ms=0)
+        with self.assertRaises(RuntimeError):
+            batcher.submit("a").result(timeout=5)
+        self.assertEqual(batcher.submit("b").result(timeout=5), [1.0])
+
+
+class BatchedEmbeddingTest(unittest.TestCase):
+    def test_concurrent_async_queries_are_batched(self):
+        from llama_index.core.embeddings import MockEmbedding
+        from utils.embedding_batcher import BatchedEmbedding
+
+        inner = MockEmbedding(embed_dim=2)
+        model = BatchedEmbedding(inner, max_batch=16, max_wait_ms=50)
+        sizes = []
+
+        def fake_embed_queries(embed_model, queries):
+            sizes.append(len(queries))
+            return [[1.0, 0.0]] * len(queries)
+
+        with patch("utils.embedding_batcher.embed_queries", side_effect=fake_embed_queries):
+            async def burst():
+                return await asyncio.gather(*(model.aget_query_embedding(f"问题{i}") for i in range(6)))
+
+            vectors = asyncio.run(burst())
+            sync_vector = model.get_query_embedding("单独一个")
+
+        self.assertEqual(len(vectors), 6)
+        self.assertEqual(sync_vector, [1.0, 0.0])
+        self.assertLess(len(sizes), 7)  # 6 个并发问题不会是 6 次 batch=1 的前向
+        self.assertEqual(sum(sizes), 7)
+        # 文本嵌入透传，不进队列。
+        self.assertEqual(model.get_text_embedding("文档"), inner.get_text_embedding("文档"))
+        self.assertEqual(model.batcher.stats()["requests"], 7)
+
+    def test_sparse_encoder_batch_fills_query_memo(self):
+        from llama_index.core.embeddings import MockEmbedding
+        from utils.embedding_batcher import embed_queries
+        from utils.sparse_embedding import BGEM3SparseEmbedding
+
+        encoder = BGEM3SparseEmbedding(MockEmbedding(embed_dim=2), sparse_linear=None, skip_ids=set())
+
+        def fake_encode(texts, prompt_name="text"):
+            return [([float(len(t)), 0.0], {str(len(t)): 1.0}) for t in texts]
+
+        with patch.object(BGEM3SparseEmbedding, "encode", side_effect=fake_encode) as encode:
+            dense = embed_queries(encoder, ["校训", "国家奖学金"])
+            weights = encoder.query_sparse("国家奖学金 ")
+
+        self.assertEqual(dense, [[2.0, 0.0], [5.0, 0.0]])
+        self.assertEqual(weights, {"5": 1.0})
+        encode.assert_called_once()  # 稀疏检索那一路直接用批量前向记下的权重
+
+    def test_stats_found_through_cached_embedding(self):
+        from llama_index.core import Settings
+        from llama_index.core.embeddings import MockEmbedding
+        from utils.embedding_batcher import BatchedEmbedding, embedding_batcher_stats
+        from utils.embedding_cache import CachedEmbedding
+
+        wrapped = CachedEmbedding(BatchedEmbedding(MockEmbedding(embed_dim=2)), max_bytes=1024)
+        with patch.object(Settings, "_embed_model", wrapped):
+            self.assertEqual(embedding_batcher_stats()["requests"], 0)
+        with patch.object(Settings, "_embed_model", MockEmbedding(embed_dim=2)):
+            self.assertIsNone(embedding_batcher_stats())
+
+
+if __name__ == "__main__":
+    unittest.main()
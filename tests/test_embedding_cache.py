@@ -0,0 +1,99 @@
+"""backend/app/utils/embedding_cache.py 的测试。
+
+内层嵌入模型用 llama-index 自带的 MockEmbedding 再包一层计数，验证：
+1. 同一（归一化后相同的）文本只真正嵌入一次，query / text 两种模式分开缓存；
+2. 批量嵌入透传、不进缓存；
+3. 字节预算到了按 LRU 淘汰；
+4. 走公开 API（get_query_embedding / aget_query_embedding）时同样命中。
+"""
+import asyncio
+import unittest
+
+from llama_index.core.embeddings import MockEmbedding
+
+import tests._pathsetup  # noqa: F401
+
+
+class _CountingEmbedding(MockEmbedding):
+    calls: int = 0
+
+    def _get_query_embedding(self, query):
+        self.calls += 1
+        return [float(len(query))] * self.embed_dim
+
+    async def _aget_query_embedding(self, query):
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text):
+        self.calls += 1
+        return [float(len(text)) + 0.5] * self.embed_dim
+
+    def _get_text_embeddings(self, texts):
+        self.calls += len(texts)
+        return [[0.0] * self.embed_dim for _ in texts]
+
+
+class NormalizeTextKeyTest(unittest.TestCase):
+    def test_collapses_whitespace_and_fullwidth_but_keeps_case(self):
+        from utils.embedding_cache import normalize_text_key
+
+        self.assertEqual(normalize_text_key("  图书馆　几点\n开门？ "), "图书馆 几点 开门?")
+        self.assertNotEqual(normalize_text_key("CET"), normalize_text_key("cet"))
+
+    def test_inner_whitespace_is_folded_but_kept(self):
+        from utils.embedding_cache import normalize_text_key
+
+        self.assertEqual(normalize_text_key(" 图书馆　几点开门"), normalize_text_key("图书馆  几点开门 "))
+        self.assertNotEqual(normalize_text_key("图书馆 几点开门"), normalize_text_key("图书馆几点开门"))
+
+
+class CachedEmbeddingTest(unittest.TestCase):
+    def setUp(self):
+        from utils.embedding_cache import CachedEmbedding
+
+        self.inner = _CountingEmbedding(embed_dim=4)
+        self.model = CachedEmbedding(self.inner, max_bytes=1024 * 1024)
+
+    def test_repeated_query_embeds_once(self):
+        first = self.model.get_query_embedding("图书馆几点开门")
+        second = self.model.get_query_embedding(" 图书馆几点开门 ")
+        third = asyncio.run(self.model.aget_query_embedding("图书馆几点开门"))
+
+        self.assertEqual(first, second)
+        self.assertEqual(first, third)
+        self.assertEqual(self.inner.calls, 1)
+        self.assertEqual(self.model.cache.stats()["hits"], 2)
+
+    def test_query_and_text_modes_are_cached_separately(self):
+        query = self.model.get_query_embedding("校训")
+        text = self.model.get_text_embedding("校训")
+
+        self.assertNotEqual(query, text)
+        self.model.get_text_embedding("校训")
+        self.assertEqual(self.inner.calls, 2)
+
+    def test_batch_embeddings_pass_through_uncached(self):
+        self.model.get_text_embedding_batch(["a", "b", "c"])
+
+        self.assertEqual(self.inner.calls, 3)
+        self.assertEqual(self.model.cache.stats()["entries"], 0)
+
+    def test_byte_budget_evicts_least_recently_used(self):
+        from utils.embedding_cache import CachedEmbedding
+
+        # 4 维 float32 一条 16 字节，预算只够两条
+        model = CachedEmbedding(self.inner, max_bytes=32)
+        model.get_query_embedding("一")
+        model.get_query_embedding("二")
+        model.get_query_embedding("一")  # "一" 变成最近使用
+        model.get_query_embedding("三")  # 挤掉 "二"
+        calls = self.inner.calls
+        model.get_query_embedding("一")
+        self.assertEqual(self.inner.calls, calls)
+        model.get_query_embedding("二")
+        self.assertEqual(self.inner.calls, calls + 1)
+        self.assertLessEqual(model.cache.stats()["bytes"], 32)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -109,6 +109,114 @@ def test_run_rerank_eval_module_imports_without_side_effects():
     assert run_rerank_eval.DEFAULT_RECALL_K == 20
 
 
+def test_run_rerank_eval_calibrate_skip_picks_highest_safe_skip_rate():
+    """标定只推荐"跳过后 hit@1/hit@k 不低于全量重排"的阈值组。"""
+    import evals.run_rerank_eval as run_rerank_eval
+
+    def record(top1, margin, agree, rank_fused, rank_reranked):
+        return {
+            "signal": {"dense_top1": top1, "dense_margin": margin, "legs_agree": agree},
+            "rank_fused": rank_fused,
+            "rank_reranked": rank_reranked,
+        }
+
+    records = [
+        record(0.85, 0.2, True, 1, 1),  # 信号强、不重排也对：可以跳
+        record(0.70, 0.2, True, 3, 1),  # 余弦不够高、重排才救回来：不能跳
+        record(0.90, 0.0, True, 2, 1),  # 间隔为 0：不能跳
+        record(0.95, 0.3, False, 1, 1),  # 两路不一致：永远不跳
+    ]
+
+    calibration = run_rerank_eval.calibrate_skip_thresholds(records, top_k=5)
+
+    best = calibration["recommended"]
+    assert best["skip_rate"] == 0.25
+    assert 0.70 < best["dense_min"] <= 0.85
+    assert best["dense_margin"] > 0.0
+    assert best["hit@1"] == calibration["baseline"]["hit@1"] == 1.0
+
+
+def test_bench_fusion_runs_and_matches_query_fusion_retriever():
+    """微基准跑几次就够：这里只验证两边融合结果一致、输出字段齐全。"""
+    import evals.bench_fusion as bench_fusion
+
+    result = bench_fusion.run_benchmark(n_nodes=10, iterations=2, top_k=5)
+
+    assert result["same_order"] is True
+    assert result["max_score_diff"] < 1e-12
+    assert result["query_fusion_us"] > 0 and result["hybrid_fusion_us"] > 0
+
+
+def test_bench_model_backend_accuracy_helpers(golden_records):
+    """推理后端基准：import 不加载模型；重排候选里自己的答案排第 0 位，
+    比对函数对同一组输入给出"完全一致"。"""
+    import evals.bench_model_backend as bench_model_backend
+
+    candidates = bench_model_backend.rerank_candidates(golden_records, 20)
+    assert len(candidates) == len(golden_records)
+    assert all(len(c) == 20 and c[0] == item["expected_answer"] for c, item in zip(candidates, golden_records))
+
+    vectors = [[1.0, 0.0], [0.6, 0.8]]
+    assert bench_model_backend.compare_embeddings(vectors, vectors)["min"] == 1.0
+    scores = [[0.9, 0.1], [0.2, 0.7]]
+    assert bench_model_backend.compare_scores(scores, scores) == {"top1_agreement": 1.0, "max_abs_diff": 0.0}
+    assert bench_model_backend._answer_ranks(vectors, vectors) == [1, 1]
+
+
+def test_bench_import_time_parses_importtime_and_traces_chain():
+    """导入耗时基准：解析 -X importtime 输出，能追出重依赖是哪条导入链拉进来的。"""
+    import evals.bench_import_time as bench_import_time
+
+    stderr = "\n".join([
+        "import time: self [us] | cumulative | imported package",
+        "import time:       900 |        900 |       torch._C",
+        "import time:      5000 |       5900 |     torch",
+        "import time:       100 |       6000 |   configs.llm_predictor",
+        "import time:       200 |       6200 | main",
+    ])
+    records = bench_import_time.parse_importtime(stderr)
+    assert [r.depth for r in records] == [3, 2, 1, 0]
+    assert bench_import_time.import_chain(records, "torch") == ["main", "configs.llm_predictor", "torch", "torch._C"]
+
+    result = bench_import_time.evaluate("main", [records, records], budget_ms=5.0)
+    assert result["median_ms"] == 6.2 and result["over_budget"]
+    assert list(result["forbidden"]) == ["torch"]
+    assert result["heaviest"][0] == ("torch", 5.9)
+
+
+def test_backend_config_import_does_not_load_torch_or_chromadb():
+    """configs.llm_predictor / handlers 在新进程里 import，不应拉进 torch、chromadb
+    这些只在模型加载、第一次连库时才需要的重依赖。"""
+    import evals.bench_import_time as bench_import_time
+
+    for module in ("configs.llm_predictor", "handlers"):
+        result = bench_import_time.evaluate(module, [bench_import_time.measure(module)], budget_ms=None)
+        assert result["forbidden"] == {}, result["forbidden"]
+
+
+def test_bench_middleware_runs_and_rejects_like_legacy():
+    """中间件基准跑一小轮：新旧实现对同一批请求放行/拒绝的个数一致。"""
+    import evals.bench_middleware as bench_middleware
+
+    result = bench_middleware.run_benchmark(ips=20, requests_per_ip=2, concurrency=8, repeat=1)
+
+    spread, hot = result["scenarios"]["spread"], result["scenarios"]["hot_ip"]
+    assert spread["legacy_rejected"] == spread["current_rejected"] == 0
+    assert hot["requests"] == 40
+    assert hot["current_rejected"] == hot["legacy_rejected"] == 10  # 同一个 IP 超出 30 次限额的部分
+
+
+def test_bench_streaming_delivers_every_chunk_through_each_variant():
+    """流式吞吐基准跑一小轮：三组都要把每一块都送到。"""
+    import evals.bench_streaming as bench_streaming
+
+    result = bench_streaming.run_benchmark(chunks=5, concurrency=2, repeat=1)
+
+    for name in ("none", "legacy", "current"):
+        assert result["variants"][name]["chunks_received"] == 10
+    assert result["variants"]["current"]["chunks_per_s"] > 0
+
+
 def test_run_refusal_eval_module_imports_without_side_effects():
     import evals.run_refusal_eval as run_refusal_eval
 
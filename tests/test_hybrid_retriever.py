@@ -7,8 +7,13 @@
    similarity_top_k 很小时，两路召回宽度不足会把真正命中的文档在融合前就
    截没的回归测试（这是实现时用真实语料 smoke 测试出来的 bug）。
 3. 按 (index_id, similarity_top_k) 缓存 + invalidate_hybrid_retriever_cache
-   清空的行为。
+   清空的行为，以及 collection 内容版本号变化后按索引失效。
+4. HybridFusionRetriever / fuse_legs：融合结果带上融合前的 FusionSignal 和两路
+   原始分，score 仍是 RRF 分；等权时跟 QueryFusionRetriever 的 RRF 逐位一致。
+5. 异步检索：BM25 腿在专用线程池里跑、跟 dense 腿并行，两路耗时记在结果上。
 """
+import os
+import shutil
 import tempfile
 import unittest
 from unittest.mock import patch
@@ -42,6 +47,212 @@ class JiebaBM25RetrieverTest(unittest.TestCase):
         self.assertEqual(retriever._retrieve(QueryBundle(query_str="随便问点什么")), [])
 
 
+def _legs(dense, bm25):
+    from llama_index.core.schema import NodeWithScore, TextNode
+
+    nodes = {name: TextNode(id_=name, text=name) for name in {*dense, *bm25}}
+    return (
+        [NodeWithScore(node=nodes[name], score=score) for name, score in dense.items()],
+        [NodeWithScore(node=nodes[name], score=score) for name, score in bm25.items()],
+    )
+
+
+class FusionSignalTest(unittest.TestCase):
+    def test_signal_reads_raw_leg_scores_before_fusion(self):
+        from handlers.hybrid_retriever import FusedNodeWithScore, fuse_legs
+
+        fused = fuse_legs(*_legs(dense={"a": 0.82, "b": 0.70, "c": 0.40}, bm25={"a": 9.1, "c": 3.0}), top_k=5)
+
+        self.assertEqual(fused[0].node.node_id, "a")
+        self.assertIsInstance(fused[0], FusedNodeWithScore)
+        # score 仍是 RRF 分：两路都排第一 = 2/60
+        self.assertAlmostEqual(fused[0].score, 2 / 60)
+        signal = fused[0].signal
+        self.assertAlmostEqual(signal.dense_top1, 0.82)
+        self.assertAlmostEqual(signal.dense_margin, 0.12)
+        self.assertTrue(signal.legs_agree)
+        self.assertIs(fused[-1].signal, signal)
+
+    def test_chroma_dense_scores_are_converted_to_cosine(self):
+        """l2 空间的 collection 返回 exp(-d)，d = 2 - 2cos：信号和 dense_score 都得是余弦。"""
+        import math
+
+        from handlers.hybrid_retriever import HybridFusionRetriever
+        from llama_index.core.retrievers import BaseRetriever
+
+        class StaticRetriever(BaseRetriever):
+            def __init__(self, nodes):
+                self._nodes = nodes
+                super().__init__()
+
+            def _retrieve(self, query_bundle):
+                return list(self._nodes)
+
+        dense, bm25 = _legs(dense={"a": math.exp(-0.4), "b": math.exp(-0.6)}, bm25={"a": 9.1})
+        retriever = HybridFusionRetriever(StaticRetriever(dense), StaticRetriever(bm25), 5, dense_space="l2")
+
+        fused = retriever.retrieve("q")
+
+        self.assertAlmostEqual(fused[0].signal.dense_top1, 0.8)
+        self.assertAlmostEqual(fused[0].signal.dense_margin, 0.1)
+        self.assertAlmostEqual(fused[0].dense_score, 0.8)
+        self.assertAlmostEqual(dense[0].score, math.exp(-0.4))  # dense 腿自己的结果不改
+
+    def test_legs_disagree_when_top1_differs(self):
+        from handlers.hybrid_retriever import _fusion_signal
+
+        signal = _fusion_signal(*_legs(dense={"a": 0.6}, bm25={"b": 5.0, "a": 1.0}))
+
+        self.assertFalse(signal.legs_agree)
+        self.assertAlmostEqual(signal.dense_margin, 0.6)
+
+    def test_no_dense_results_means_no_signal(self):
+        from handlers.hybrid_retriever import _fusion_signal
+
+        self.assertIsNone(_fusion_signal(*_legs(dense={}, bm25={"b": 5.0})))
+
+
+class FuseLegsTest(unittest.TestCase):
+    def test_matches_query_fusion_retriever_rrf(self):
+        """等权时跟 llama_index 的 QueryFusionRetriever（RRF 模式）逐位一致：
+        同样的分数、同样的同分顺序。"""
+        from handlers.hybrid_retriever import JiebaBM25Retriever, fuse_legs
+        from llama_index.core.llms import MockLLM
+        from llama_index.core.retrievers import QueryFusionRetriever
+
+        dense, bm25 = _legs(
+            dense={"a": 0.9, "b": 0.8, "c": 0.7, "d": 0.6},
+            bm25={"e": 7.0, "c": 6.0, "f": 5.0, "b": 4.0},
+        )
+        stub_legs = [JiebaBM25Retriever(nodes=[]), JiebaBM25Retriever(nodes=[])]
+        reference = QueryFusionRetriever(retrievers=stub_legs, llm=MockLLM(), num_queries=1)._reciprocal_rerank_fusion(
+            {("q", 0): [n.model_copy() for n in dense], ("q", 1): [n.model_copy() for n in bm25]}
+        )
+
+        fused = fuse_legs(dense, bm25, top_k=len(reference))
+
+        self.assertEqual([n.node.node_id for n in fused], [n.node.node_id for n in reference])
+        for got, expected in zip(fused, reference):
+            self.assertAlmostEqual(got.score, expected.score, places=12)
+
+    def test_carries_raw_leg_scores_and_truncates(self):
+        from handlers.hybrid_retriever import fuse_legs
+
+        fused = fuse_legs(*_legs(dense={"a": 0.9, "b": 0.5}, bm25={"b": 8.0, "c": 2.0}), top_k=2)
+
+        self.assertEqual([n.node.node_id for n in fused], ["b", "a"])
+        self.assertEqual((fused[0].dense_score, fused[0].bm25_score), (0.5, 8.0))
+        self.assertEqual((fused[1].dense_score, fused[1].bm25_score), (0.9, None))
+
+    def test_weights_shift_the_ranking(self):
+        from handlers.hybrid_retriever import fuse_legs
+
+        legs = _legs(dense={"a": 0.9, "b": 0.5}, bm25={"b": 8.0, "a": 2.0})
+
+        self.assertEqual(fuse_legs(*legs, top_k=2, weights=(2.0, 1.0))[0].node.node_id, "a")
+        self.assertEqual(fuse_legs(*legs, top_k=2, weights=(1.0, 2.0))[0].node.node_id, "b")
+        fused = fuse_legs(*legs, top_k=2, weights=(2.0, 1.0))
+        self.assertAlmostEqual(fused[0].score, 2 / 60 + 1 / 61)
+
+    def test_empty_legs(self):
+        from handlers.hybrid_retriever import fuse_legs
+
+        self.assertEqual(fuse_legs([], [], top_k=5), [])
+
+
+class AsyncLegsTest(unittest.TestCase):
+    def test_bm25_aretrieve_runs_off_the_event_loop_thread(self):
+        import asyncio
+        import threading
+
+        from handlers.hybrid_retriever import JiebaBM25Retriever
+        from llama_index.core.schema import QueryBundle, TextNode
+
+        retriever = JiebaBM25Retriever(nodes=[TextNode(text="成都信息工程大学的校训")], similarity_top_k=1)
+        seen_threads = []
+        real_retrieve = retriever._retrieve
+
+        def spy(query_bundle):
+            seen_threads.append(threading.current_thread().name)
+            return real_retrieve(query_bundle)
+
+        with patch.object(retriever, "_retrieve", side_effect=spy):
+            results = asyncio.run(retriever.aretrieve(QueryBundle(query_str="校训")))
+
+        self.assertEqual(len(results), 1)
+        self.assertTrue(seen_threads[0].startswith("bm25"), seen_threads)
+
+    def test_dense_leg_runs_off_the_event_loop_thread(self):
+        import asyncio
+        import threading
+
+        from handlers.hybrid_retriever import HybridFusionRetriever
+        from llama_index.core.retrievers import BaseRetriever
+        from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+
+        seen_threads = {}
+
+        class SyncOnlyRetriever(BaseRetriever):
+            # 跟 ChromaVectorStore 一样：异步入口最终在调用线程上同步执行。
+            def __init__(self, leg):
+                self._leg = leg
+                super().__init__()
+
+            def _retrieve(self, query_bundle):
+                seen_threads[self._leg] = threading.current_thread()
+                return [NodeWithScore(node=TextNode(id_=self._leg, text=self._leg), score=1.0)]
+
+        async def run():
+            retriever = HybridFusionRetriever(SyncOnlyRetriever("dense"), SyncOnlyRetriever("bm25"), similarity_top_k=2)
+            results = await retriever.aretrieve(QueryBundle(query_str="q"))
+            return results, threading.current_thread()
+
+        results, loop_thread = asyncio.run(run())
+
+        self.assertEqual(len(results), 2)
+        self.assertIsNot(seen_threads["dense"], loop_thread)
+        # 桩 bm25 腿走 BaseRetriever 默认的 _aretrieve，仍在事件循环线程上，对照用。
+        self.assertIs(seen_threads["bm25"], loop_thread)
+
+    def test_legs_run_concurrently_and_timings_are_recorded(self):
+        import asyncio
+        import time
+
+        from handlers import hybrid_retriever
+        from handlers.hybrid_retriever import HybridFusionRetriever
+        from llama_index.core.retrievers import BaseRetriever
+        from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+
+        class SleepyRetriever(BaseRetriever):
+            def __init__(self, node_id, delay):
+                self._node = TextNode(id_=node_id, text=node_id)
+                self._delay = delay
+                super().__init__()
+
+            def _retrieve(self, query_bundle):
+                time.sleep(self._delay)
+                return [NodeWithScore(node=self._node, score=1.0)]
+
+            async def _aretrieve(self, query_bundle):
+                await asyncio.sleep(self._delay)
+                return [NodeWithScore(node=self._node, score=1.0)]
+
+        hybrid_retriever._leg_stats.clear()
+        self.addCleanup(hybrid_retriever._leg_stats.clear)
+        retriever = HybridFusionRetriever(SleepyRetriever("d", 0.2), SleepyRetriever("b", 0.2), similarity_top_k=2)
+
+        started = time.perf_counter()
+        results = asyncio.run(retriever.aretrieve(QueryBundle(query_str="q")))
+        elapsed = time.perf_counter() - started
+
+        self.assertLess(elapsed, 0.35)  # max(0.2, 0.2)，不是 0.4
+        self.assertEqual(set(results[0].leg_ms), {"dense", "bm25"})
+        self.assertGreaterEqual(results[0].leg_ms["bm25"], 150)
+        stats = hybrid_retriever.hybrid_leg_stats()
+        self.assertEqual(stats["queries"], 1)
+        self.assertGreaterEqual(stats["avg_dense_ms"], 150)
+
+
 class BuildRetrieverForIndexTest(unittest.TestCase):
     def setUp(self):
         import chromadb
@@ -61,12 +272,18 @@ class BuildRetrieverForIndexTest(unittest.TestCase):
         self._enabled_patcher.start()
         self.addCleanup(self._enabled_patcher.stop)
 
-        # QueryFusionRetriever.__init__ 即使 num_queries=1（本模块用不到查询
-        # 扩写、永远不会真的调用这个 llm）也会在构造时急切读一次 Settings.llm
-        # 兜底——不显式配置的话，它会尝试懒加载默认 OpenAI 模型，在没有
-        # OPENAI_API_KEY 的环境（比如 CI）里直接抛 ValueError。生产环境这里
-        # 不会出问题（configs.llm_predictor.init_settings() 在启动时就配置好了
-        # 真实 LLM），但测试要自己隔离，不能依赖本机 .env 里恰好有没有 key。
+        # 建 retriever 会把 BM25 倒排表落盘到 {index_save_directory}/{name}_bm25/：
+        # 指到本用例自己的临时目录，不往源码树里的 data/indexes 写。
+        self._save_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._save_dir, ignore_errors=True)
+        save_dir_patcher = patch.object(load_env, "index_save_directory", self._save_dir)
+        save_dir_patcher.start()
+        self.addCleanup(save_dir_patcher.stop)
+
+        # 融合器本身已经不需要 llm，但索引的其他路径仍可能急切读一次
+        # Settings.llm 兜底——不显式配置的话，它会尝试懒加载默认 OpenAI 模型，
+        # 在没有 OPENAI_API_KEY 的环境（比如 CI）里直接抛 ValueError。测试要
+        # 自己隔离，不能依赖本机 .env 里恰好有没有 key。
         #
         # 直接读写私有的 _llm 字段，而不是 patch.object(Settings, "llm", ...)：
         # Settings.llm 是只有 getter+setter、没有 deleter 的 property，
@@ -111,6 +328,13 @@ class BuildRetrieverForIndexTest(unittest.TestCase):
         file_names = [r.node.metadata["file_name"] for r in results]
         self.assertIn("a.txt", file_names)
 
+    def test_dense_leg_uses_the_collection_distance_space(self):
+        from handlers.hybrid_retriever import build_retriever_for_index
+
+        retriever = build_retriever_for_index(self._build_index("hybrid-dense-space"), similarity_top_k=2)
+
+        self.assertEqual(retriever.inner._dense_space, "l2")
+
     def test_caches_by_index_id_and_top_k(self):
         from handlers.hybrid_retriever import build_retriever_for_index
 
@@ -123,6 +347,31 @@ class BuildRetrieverForIndexTest(unittest.TestCase):
         self.assertIs(retriever_a, retriever_a_again)
         self.assertIsNot(retriever_a, retriever_b)
 
+    def test_top_k_variants_share_one_bm25_index(self):
+        """不同 top_k 的缓存条目必须共享同一份倒排表：第二个 top_k 变体既不
+        重新分词、也不再从 Chroma 拉全量语料。"""
+        from handlers import bm25_index
+        from handlers.hybrid_retriever import JiebaBM25Retriever, build_retriever_for_index
+
+        index = self._build_index("hybrid-shared-corpus")
+        small = build_retriever_for_index(index, similarity_top_k=2)
+        with patch.object(bm25_index, "rebuild_bm25_index") as mock_rebuild, \
+                patch.object(bm25_index.BM25Index, "add_nodes") as mock_add_nodes:
+            large = build_retriever_for_index(index, similarity_top_k=20)
+        mock_rebuild.assert_not_called()
+        mock_add_nodes.assert_not_called()
+
+        def bm25_of(cached):
+            # build_retriever_for_index 外面包着一层检索结果缓存。
+            fused = cached.inner
+            self.assertIsInstance(fused._bm25, JiebaBM25Retriever)
+            return fused._bm25._bm25
+
+        self.assertIsNot(small, large)
+        self.assertIs(bm25_of(small), bm25_of(large))
+        self.assertEqual(large.retrieve("国家奖学金标准")[0].node.metadata["file_name"], "b.txt")
+        self.assertTrue(os.path.isdir(os.path.join(self._save_dir, "hybrid-shared-corpus_bm25")))
+
     def test_invalidate_cache_forces_rebuild(self):
         from handlers.hybrid_retriever import build_retriever_for_index, invalidate_hybrid_retriever_cache
 
@@ -134,11 +383,26 @@ class BuildRetrieverForIndexTest(unittest.TestCase):
 
         self.assertIsNot(retriever_before, retriever_after)
 
-    def test_empty_collection_falls_back_to_vector_retriever(self):
+    def test_generation_bump_invalidates_only_that_index(self):
+        """collection 内容版本号变了（别处写入后 bump）时旧缓存条目视同失效，
+        即使没人显式调 invalidate；其他索引的条目原样保留。"""
         from handlers.hybrid_retriever import build_retriever_for_index
+        from handlers.vector_store import bump_collection_generation
+
+        index = self._build_index("hybrid-generation-test")
+        other = self._build_index("hybrid-generation-other")
+        retriever_before = build_retriever_for_index(index, similarity_top_k=2)
+        other_before = build_retriever_for_index(other, similarity_top_k=2)
+
+        bump_collection_generation(index.vector_store.client)
+
+        self.assertIsNot(build_retriever_for_index(index, similarity_top_k=2), retriever_before)
+        self.assertIs(build_retriever_for_index(other, similarity_top_k=2), other_before)
+
+    def test_empty_collection_falls_back_to_vector_retriever(self):
+        from handlers.hybrid_retriever import HybridFusionRetriever, build_retriever_for_index
         from llama_index.core import VectorStoreIndex
         from llama_index.core.embeddings import MockEmbedding
-        from llama_index.core.retrievers import QueryFusionRetriever
         from llama_index.vector_stores.chroma import ChromaVectorStore
 
         collection = self.client.get_or_create_collection("hybrid-empty-test")
@@ -148,7 +412,7 @@ class BuildRetrieverForIndexTest(unittest.TestCase):
 
         retriever = build_retriever_for_index(index, similarity_top_k=2)
 
-        self.assertNotIsInstance(retriever, QueryFusionRetriever)
+        self.assertNotIsInstance(retriever.inner, HybridFusionRetriever)
 
 
 class HybridRetrievalDisabledTest(unittest.TestCase):
@@ -154,6 +154,26 @@ class UpdateNodeByIdTest(unittest.TestCase):
             ids=["n1"], documents=["new text"], embeddings=[[0.1, 0.2, 0.3]]
         )
 
+    @patch('llama_index.core.Settings')
+    def test_refreshes_stored_tokens_in_node_metadata(self, mock_settings):
+        import json
+
+        from handlers.bm25_index import TOKENS_METADATA_KEY, jieba_tokenize
+
+        old_metadata = {
+            TOKENS_METADATA_KEY: "旧 文本",
+            "_node_content": json.dumps({"metadata": {TOKENS_METADATA_KEY: "旧 文本"}}),
+        }
+        self._fake_collection.get.return_value = {"ids": ["n1"], "documents": ["旧文本"], "metadatas": [old_metadata]}
+        mock_settings.embed_model.get_text_embedding.return_value = [0.1, 0.2, 0.3]
+
+        index_crud.updateNodeById(self.fake_index, "n1", "国家奖学金标准")
+
+        metadata = self._fake_collection.update.call_args.kwargs["metadatas"][0]
+        expected = " ".join(jieba_tokenize("国家奖学金标准"))
+        self.assertEqual(metadata[TOKENS_METADATA_KEY], expected)
+        self.assertEqual(json.loads(metadata["_node_content"])["metadata"][TOKENS_METADATA_KEY], expected)
+
     def test_raises_key_error_when_node_not_found(self):
         self._fake_collection.get.return_value = {"ids": [], "documents": [], "metadatas": []}
 
@@ -0,0 +1,308 @@
+"""backend/app/handlers/index_router.py（多索引嵌入路由）的测试。
+
+覆盖四块：
+1. select_indexes / rrf_merge 两个纯函数：margin 内的索引都选上，超过
+   扇出上限交给 LLM 兜底；合并按名次做全局 RRF。
+2. index_profile：摘要嵌入混入 chunk 质心（随机抽样，不偏向最早写入的
+   chunk）、按 (内容版本号, 摘要) 缓存。
+3. EmbeddingIndexRouter：只查选中的索引、并发检索后合并；区分不开或嵌入
+   失败时才构造并调用 LLM 兜底检索器。
+4. FanOutRetriever：所有索引并发查，慢/坏的索引按超时/异常跳过，问题向量
+   只算一次、随 QueryBundle 传给各索引。
+
+嵌入模型用一个按关键词给方向的假模型，不加载 bge-m3。
+"""
+import asyncio
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+
+import tests._pathsetup  # noqa: F401
+
+# 三个主题各占一个维度：问题/摘要里出现哪个关键词，向量就指向哪个维度。
+_TOPICS = ("宿舍", "奖学金", "图书馆")
+
+
+class KeywordEmbedding(MockEmbedding):
+    def _vector(self, text: str) -> list[float]:
+        vector = [1.0 if topic in text else 0.0 for topic in _TOPICS]
+        return vector if any(vector) else [0.1, 0.1, 0.1]
+
+    def _get_query_embedding(self, query: str) -> list[float]:
+        return self._vector(query)
+
+    async def _aget_query_embedding(self, query: str) -> list[float]:
+        return self._vector(query)
+
+    def _get_text_embedding(self, text: str) -> list[float]:
+        return self._vector(text)
+
+
+def _fake_index(index_id: str, summary: str):
+    index = MagicMock()
+    index.index_id = index_id
+    index.summary = summary
+    index.vector_store = None
+    return index
+
+
+class _FixedRetriever:
+    def __init__(self, nodes, delay=0.0, error=None):
+        self.nodes = nodes
+        self.delay = delay
+        self.error = error
+        self.bundles = []
+
+    async def aretrieve(self, query_bundle):
+        self.bundles.append(query_bundle)
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return list(self.nodes)
+
+    def retrieve(self, query_bundle):
+        self.bundles.append(query_bundle)
+        if self.error is not None:
+            raise self.error
+        return list(self.nodes)
+
+
+def _node(node_id: str, score: float) -> NodeWithScore:
+    return NodeWithScore(node=TextNode(id_=node_id, text=node_id), score=score)
+
+
+class SelectAndMergeTest(unittest.TestCase):
+    def test_clear_winner_is_routed_alone(self):
+        from handlers.index_router import select_indexes
+
+        self.assertEqual(select_indexes([("a", 0.9), ("b", 0.6)], margin=0.05, max_fanout=3), ["a"])
+
+    def test_close_scores_fan_out_and_too_many_fall_back(self):
+        from handlers.index_router import select_indexes
+
+        ranked = [("a", 0.80), ("b", 0.78), ("c", 0.77), ("d", 0.50)]
+        self.assertEqual(select_indexes(ranked, margin=0.05, max_fanout=3), ["a", "b", "c"])
+        self.assertIsNone(select_indexes(ranked, margin=0.05, max_fanout=2))
+        self.assertIsNone(select_indexes([], margin=0.05, max_fanout=3))
+
+    def test_rrf_merge_fuses_by_rank_not_raw_score(self):
+        from handlers.index_router import rrf_merge
+
+        # 第二个索引分数量级大得多，按原始分数比会把它的结果全排前面
+        merged = rrf_merge([[_node("x", 0.03), _node("y", 0.02)], [_node("z", 0.9), _node("x", 0.8)]], top_k=2)
+
+        self.assertEqual([n.node.node_id for n in merged], ["x", "z"])
+        self.assertAlmostEqual(merged[0].score, 1 / 60 + 1 / 61)
+        self.assertAlmostEqual(merged[1].score, 1 / 60)
+
+    def test_rrf_merge_does_not_rescore_the_input_nodes(self):
+        from handlers.hybrid_retriever import FusedNodeWithScore
+        from handlers.index_router import rrf_merge
+
+        fused = FusedNodeWithScore(node=TextNode(id_="x", text="x"), score=0.03, dense_score=0.8)
+        merged = rrf_merge([[fused], [_node("z", 0.9)]], top_k=2)
+
+        self.assertEqual(fused.score, 0.03)
+        self.assertIsNot(merged[0], fused)
+        self.assertIsInstance(merged[0], FusedNodeWithScore)
+        self.assertEqual(merged[0].dense_score, 0.8)
+        self.assertAlmostEqual(merged[0].score, 1 / 60)
+
+    def test_rrf_merge_single_list_is_passed_through(self):
+        from handlers.index_router import rrf_merge
+
+        merged = rrf_merge([[], [_node("x", 0.5), _node("y", 0.4)]], top_k=1)
+
+        self.assertEqual([(n.node.node_id, n.score) for n in merged], [("x", 0.5)])
+
+
+class IndexProfileTest(unittest.TestCase):
+    def setUp(self):
+        import chromadb
+        from handlers import index_router
+        from llama_index.vector_stores.chroma import ChromaVectorStore
+
+        index_router.clear_index_profiles()
+        self.addCleanup(index_router.clear_index_profiles)
+        self.client = chromadb.PersistentClient(path=tempfile.mkdtemp())
+        self.addCleanup(self.client.clear_system_cache)
+        collection = self.client.get_or_create_collection("profile-test")
+        collection.add(ids=["n1", "n2"], embeddings=[[0.0, 0.0, 1.0], [0.0, 0.0, 1.0]], documents=["a", "b"])
+        self.vector_store = ChromaVectorStore(chroma_collection=collection)
+
+    def test_profile_blends_centroid_and_is_cached_per_generation(self):
+        import configs.load_env as load_env
+        from handlers import index_router
+        from handlers.vector_store import bump_collection_generation
+
+        index = _fake_index("profile-test", "宿舍管理规定")
+        index.vector_store = self.vector_store
+        embed = KeywordEmbedding(embed_dim=3)
+
+        with patch.object(index_router.Settings, "_embed_model", embed), \
+                patch.object(load_env, "INDEX_ROUTE_CENTROID_WEIGHT", 0.5), \
+                patch.object(embed, "_get_text_embedding", wraps=embed._get_text_embedding) as spy:
+            profile = index_router.index_profile(index)
+            index_router.index_profile(index)
+            self.assertEqual(spy.call_count, 1)
+
+            bump_collection_generation(self.vector_store.client)
+            index_router.index_profile(index)
+            self.assertEqual(spy.call_count, 2)
+
+        # 摘要指向"宿舍"维度、质心指向"图书馆"维度，各占一半
+        self.assertAlmostEqual(float(profile[0]), float(profile[2]), places=5)
+        self.assertAlmostEqual(float(profile[1]), 0.0)
+
+    def test_centroid_samples_across_the_collection(self):
+        import configs.load_env as load_env
+        from handlers import index_router
+
+        # 最早写入的两个 chunk 指向另一个维度；抽样不能只拿开头那几个
+        self.vector_store.client.add(
+            ids=[f"m{i}" for i in range(8)], embeddings=[[1.0, 0.0, 0.0]] * 8, documents=["c"] * 8
+        )
+        with patch.object(load_env, "INDEX_ROUTE_CENTROID_SAMPLE", 2), \
+                patch.object(index_router.random, "sample", side_effect=lambda ids, k: ids[-k:]) as sample:
+            centroid = index_router._chunk_centroid(self.vector_store)
+        self.assertEqual(len(sample.call_args.args[0]), 10)
+        self.assertAlmostEqual(float(centroid[0]), 1.0)
+
+        with patch.object(load_env, "INDEX_ROUTE_CENTROID_SAMPLE", 50), \
+                patch.object(index_router.random, "sample") as sample:
+            centroid = index_router._chunk_centroid(self.vector_store)
+        sample.assert_not_called()
+        self.assertAlmostEqual(float(centroid[0] / centroid[2]), 4.0, places=4)
+
+
+class EmbeddingIndexRouterTest(unittest.TestCase):
+    def setUp(self):
+        import configs.load_env as load_env
+        from handlers import index_router
+
+        index_router.clear_index_profiles()
+        self.addCleanup(index_router.clear_index_profiles)
+        self.indexes = [
+            _fake_index("dorm", "宿舍管理规定"),
+            _fake_index("aid", "奖学金评定办法"),
+            _fake_index("lib", "图书馆借阅"),
+        ]
+        self.retrievers = {
+            "dorm": _FixedRetriever([_node("dorm-1", 0.03)]),
+            "aid": _FixedRetriever([_node("aid-1", 0.02)]),
+            "lib": _FixedRetriever([_node("lib-1", 0.01)]),
+        }
+        for patcher in (
+            patch.object(index_router.Settings, "_embed_model", KeywordEmbedding(embed_dim=3)),
+            patch.object(load_env, "INDEX_ROUTE_MARGIN", 0.05),
+            patch.object(load_env, "INDEX_ROUTE_MAX_FANOUT", 2),
+            patch.object(load_env, "INDEX_ROUTE_CENTROID_WEIGHT", 0.0),
+            patch.object(
+                index_router,
+                "build_retriever_for_index",
+                side_effect=lambda index, top_k: self.retrievers[index.index_id],
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.fallback = _FixedRetriever([_node("fallback", 0.5)])
+        self.fallback_factory = MagicMock(return_value=self.fallback)
+
+    def _router(self):
+        from handlers.index_router import EmbeddingIndexRouter
+
+        return EmbeddingIndexRouter(self.indexes, similarity_top_k=5, fallback_factory=self.fallback_factory)
+
+    def test_routes_to_most_similar_index_without_llm(self):
+        results = asyncio.run(self._router().aretrieve(QueryBundle("宿舍几点熄灯")))
+
+        self.assertEqual([n.node.node_id for n in results], ["dorm-1"])
+        self.fallback_factory.assert_not_called()
+
+    def test_fans_out_when_question_spans_indexes(self):
+        results = self._router().retrieve(QueryBundle("住宿舍的同学能申请奖学金吗"))
+
+        self.assertEqual([n.node.node_id for n in results], ["dorm-1", "aid-1"])
+        self.fallback_factory.assert_not_called()
+        # 路由时算好的问题向量随 QueryBundle 传下去，dense 腿不再重算
+        self.assertEqual(self.retrievers["dorm"].bundles[0].embedding, [1.0, 1.0, 0.0])
+
+    def test_ambiguous_question_falls_back_to_llm_selector(self):
+        results = asyncio.run(self._router().aretrieve(QueryBundle("你好")))
+
+        self.assertEqual([n.node.node_id for n in results], ["fallback"])
+        self.fallback_factory.assert_called_once()
+
+    def test_embedding_failure_falls_back_to_llm_selector(self):
+        from handlers import index_router
+
+        with patch.object(index_router, "index_profile", side_effect=RuntimeError("boom")):
+            results = asyncio.run(self._router().aretrieve(QueryBundle("宿舍几点熄灯")))
+
+        self.assertEqual([n.node.node_id for n in results], ["fallback"])
+
+
+class FanOutRetrieverTest(unittest.TestCase):
+    def setUp(self):
+        import configs.load_env as load_env
+        from handlers import index_router
+
+        self.indexes = [_fake_index("a", ""), _fake_index("b", ""), _fake_index("c", "")]
+        self.retrievers = {
+            "a": _FixedRetriever([_node("a-1", 0.03), _node("a-2", 0.02)]),
+            "b": _FixedRetriever([_node("b-1", 0.5)]),
+            "c": _FixedRetriever([_node("c-1", 0.9)]),
+        }
+        self.embed = KeywordEmbedding(embed_dim=3)
+        for patcher in (
+            patch.object(index_router.Settings, "_embed_model", self.embed),
+            patch.object(load_env, "INDEX_FANOUT_TIMEOUT_S", 0.2),
+            patch.object(
+                index_router,
+                "build_retriever_for_index",
+                side_effect=lambda index, top_k: self.retrievers[index.index_id],
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_queries_every_index_and_merges_with_rrf(self):
+        from handlers.index_router import FanOutRetriever
+
+        with patch.object(self.embed, "_aget_query_embedding", wraps=self.embed._aget_query_embedding) as spy:
+            results = asyncio.run(FanOutRetriever(self.indexes, similarity_top_k=4).aretrieve(QueryBundle("宿舍")))
+
+        self.assertEqual({n.node.node_id for n in results[:3]}, {"a-1", "b-1", "c-1"})
+        self.assertEqual(results[-1].node.node_id, "a-2")
+        spy.assert_called_once()
+        self.assertTrue(all(r.bundles[0].embedding == [1.0, 0.0, 0.0] for r in self.retrievers.values()))
+
+    def test_slow_or_failing_index_is_skipped_without_holding_the_request(self):
+        import time
+
+        from handlers.index_router import FanOutRetriever
+
+        self.retrievers["b"].delay = 5.0
+        self.retrievers["c"].error = RuntimeError("collection gone")
+
+        started = time.perf_counter()
+        results = asyncio.run(FanOutRetriever(self.indexes, similarity_top_k=4).aretrieve(QueryBundle("宿舍")))
+
+        self.assertLess(time.perf_counter() - started, 2.0)
+        self.assertEqual([n.node.node_id for n in results], ["a-1", "a-2"])
+
+    def test_sync_path_isolates_failures_too(self):
+        from handlers.index_router import FanOutRetriever
+
+        self.retrievers["c"].error = RuntimeError("collection gone")
+
+        results = FanOutRetriever(self.indexes, similarity_top_k=2).retrieve(QueryBundle("宿舍"))
+
+        self.assertEqual([n.node.node_id for n in results], ["a-1", "b-1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
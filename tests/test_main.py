@@ -1,5 +1,5 @@
+import asyncio
 import unittest
-from collections import defaultdict
 from unittest.mock import AsyncMock, patch
 
 import pytest
@@ -145,13 +145,10 @@ class TestSessionAndStatsMiddleware(unittest.TestCase):
         ]
         for p in self._lifespan_patches:
             p.start()
-        self._stats_dict = {
-            "total_visits": 0,
-            "ip_count": 0,
-            "user_visits": defaultdict(int),
-            "endpoint_visits": defaultdict(int),
-        }
-        self._stats_patch = patch('main.access_stats', self._stats_dict)
+        from utils.access_counter import AccessCounter
+
+        self._counter = AccessCounter()
+        self._stats_patch = patch('main.access_counter', self._counter)
         self._stats_patch.start()
 
     def tearDown(self):
@@ -179,10 +176,134 @@ class TestSessionAndStatsMiddleware(unittest.TestCase):
     def test_stats_increment_on_request(self):
         """统计只记 API 请求，静态页面/资源不计（静态路径豁免）。"""
         with TestClient(app) as client:
+            client.get("/")
             client.get("/docs")
             client.get("/docs")
             client.get("/docs")
-        self.assertGreaterEqual(self._stats_dict["total_visits"], 3)
+            # 中间件只累加增量，lifespan 退出时才刷库，所以在 with 里面看
+            self.assertEqual(self._counter.total, 3)
+            self.assertEqual(self._counter.endpoint_visits["/docs"], 3)
+
+    def test_request_metrics_use_route_template(self):
+        from utils.request_metrics import RequestMetrics
+
+        metrics = RequestMetrics()
+        with patch('main.request_metrics', metrics), patch('main.stats_db.add_request_metrics'):
+            with TestClient(app) as client:
+                client.get("/docs")
+                client.get("/manage/stats")
+                client.get("/index/some-index/no-such-thing")
+                client.get("/index/some-index/info")
+                # 知识库名跟路径里的固定段同名，模板也不能被换错
+                client.get("/index/info/info")
+                client.get("/")
+                rows = metrics.pending_rows(0, 2 ** 40)
+        counts = {row["endpoint"]: row["count"] for row in rows}
+        self.assertEqual(counts, {
+            "/docs": 1, "/manage/stats": 1, "/index/{index_name}/info": 2, "(unmatched)": 1,
+        })
+
+    def test_sessions_and_rate_limit_go_through_sqlite_backend(self):
+        """``STATE_BACKEND=sqlite`` 时 lifespan 打开共享状态库：会话历史和限流计数
+        都落在库里（路由经 ``aget``/``aset`` 在线程里读写），内存桶不再使用。"""
+        import tempfile
+
+        import configs.load_env as load_env
+        from utils import shared_state
+
+        _rate_limit_store.clear()
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch.object(load_env, 'STATE_BACKEND', 'sqlite'), \
+                patch.object(load_env, 'STATE_DB_PATH', f"{tmp}/state.db"):
+            with TestClient(app) as client:
+                backend = shared_state.shared_backend()
+                self.assertIsNotNone(backend)
+                client.post("/graph/create")
+                session_id = client.cookies["session_id"]
+                history = client.post("/graph/query_history")
+                self.assertEqual(history.status_code, 200)
+                self.assertEqual(history.json(), {"history": []})
+                self.assertEqual(backend.cache_get("chat_histories", session_id, 60), [])
+
+                statuses = [client.get("/index/no-such-index/query").status_code for _ in range(31)]
+                self.assertNotIn(429, statuses[:30])
+                self.assertEqual(statuses[30], 429)
+                self.assertEqual(len(_rate_limit_store), 0)
+
+
+class TestSessionAndStatsAsgi(unittest.IsolatedAsyncioTestCase):
+    """纯 ASGI 中间件直接拿 scope 调，不经过 TestClient：流式响应体要逐块原样
+    透传，Set-Cookie 和访问统计只落在 http.response.start 上。"""
+
+    def _scope(self, path, cookie=None):
+        headers = [(b"cookie", cookie.encode())] if cookie else []
+        return {"type": "http", "method": "GET", "path": path, "headers": headers, "client": ("9.9.9.9", 1)}
+
+    async def _call(self, middleware, scope):
+        sent = []
+        requests = [{"type": "http.request", "body": b"", "more_body": False}]
+
+        async def receive():
+            if requests:
+                return requests.pop()
+            await asyncio.Event().wait()  # 跟真实连接一样，请求体读完之后挂着等断开
+
+        async def send(message):
+            sent.append(message)
+
+        await middleware(scope, receive, send)
+        return sent
+
+    async def test_streaming_body_passes_through_chunk_by_chunk(self):
+        from main import SessionAndStatsMiddleware
+        from starlette.responses import StreamingResponse
+        from utils.access_counter import AccessCounter
+
+        seen_state = {}
+
+        async def endpoint(scope, receive, send):
+            seen_state.update(scope["state"])
+
+            async def body():
+                for i in range(3):
+                    yield f'{{"i": {i}}}\n'
+
+            await StreamingResponse(body(), media_type="application/x-ndjson")(scope, receive, send)
+
+        counter = AccessCounter()
+        with patch('main.access_counter', counter):
+            sent = await self._call(SessionAndStatsMiddleware(endpoint), self._scope("/graph/ask_stream"))
+
+        start, *bodies = sent
+        cookies = [v for k, v in start["headers"] if k == b"set-cookie"]
+        self.assertEqual(len(cookies), 1)
+        self.assertIn(f"session_id={seen_state['session_id']}".encode(), cookies[0])
+        self.assertIn(b"HttpOnly", cookies[0])
+        self.assertEqual([m["body"] for m in bodies if m["body"]], [b'{"i": 0}\n', b'{"i": 1}\n', b'{"i": 2}\n'])
+        self.assertEqual(counter.endpoint_visits["/graph/ask_stream"], 1)
+
+    async def test_existing_session_and_static_paths_get_no_cookie_or_stats(self):
+        from main import SessionAndStatsMiddleware
+        from starlette.responses import PlainTextResponse
+        from utils.access_counter import AccessCounter
+
+        counter = AccessCounter()
+        with patch('main.access_counter', counter):
+            middleware = SessionAndStatsMiddleware(PlainTextResponse("ok"))
+            with_session = await self._call(middleware, self._scope("/index/list", cookie="session_id=abc"))
+            static = await self._call(middleware, self._scope("/assets/app.js"))
+
+        for sent in (with_session, static):
+            self.assertNotIn(b"set-cookie", [k for k, _ in sent[0]["headers"]])
+        self.assertEqual(counter.total, 1)
+
+    async def test_non_http_scopes_are_passed_through(self):
+        from main import SessionAndStatsMiddleware
+
+        inner = AsyncMock()
+        scope = {"type": "websocket", "path": "/graph/ws"}
+        await SessionAndStatsMiddleware(inner)(scope, None, None)
+        inner.assert_awaited_once_with(scope, None, None)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,118 @@
+"""推理后端选择（utils/model_backend.py）的测试。
+
+不加载真实模型：只验证后端解析、int8 量化确实替换了 Linear、ONNX 后端的加载
+参数和导出复用、以及优化后端加载失败时退回 fp32 torch。
+"""
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+
+import tests._pathsetup  # noqa: F401
+
+
+class ResolveBackendTest(unittest.TestCase):
+    def test_unknown_and_gpu_fall_back_to_torch(self):
+        from utils.model_backend import resolve_backend
+
+        self.assertEqual(resolve_backend(" ONNX-int8 ", "cpu"), "onnx-int8")
+        self.assertEqual(resolve_backend("tensorrt", "cpu"), "torch")
+        self.assertEqual(resolve_backend("torch-int8", "cuda"), "torch")
+        self.assertEqual(resolve_backend(None, "cpu"), "torch")
+
+
+class QuantizeTest(unittest.TestCase):
+    def test_linear_layers_become_dynamic_int8(self):
+        import torch
+        from utils.model_backend import quantize_dynamic_int8
+
+        module = torch.nn.Sequential(torch.nn.Linear(8, 8), torch.nn.ReLU(), torch.nn.Linear(8, 2))
+        x = torch.randn(3, 8)
+        expected = module(x)
+
+        quantize_dynamic_int8(module)
+
+        self.assertFalse(any(type(m) is torch.nn.Linear for m in module.modules()))
+        self.assertTrue(torch.allclose(module(x), expected, atol=0.1))
+
+
+class OnnxLoadArgsTest(unittest.TestCase):
+    def test_int8_export_is_reused_once_present(self):
+        import tempfile
+
+        import configs.load_env as load_env
+        from utils import model_backend
+
+        model_cls = MagicMock()
+        with tempfile.TemporaryDirectory() as tmp, patch.object(load_env, "MODEL_EXPORT_DIR", tmp):
+            self.assertEqual(
+                model_backend.onnx_load_args(model_cls, "BAAI/bge-m3", "onnx"), ("BAAI/bge-m3", {"backend": "onnx"})
+            )
+
+            export_dir = model_backend._export_dir("BAAI/bge-m3")
+            quantized = os.path.join(export_dir, model_backend._quantized_file_name())
+            os.makedirs(os.path.dirname(quantized))
+            open(quantized, "wb").close()
+            path, extra = model_backend.onnx_load_args(model_cls, "BAAI/bge-m3", "onnx-int8")
+
+        self.assertEqual(path, export_dir)
+        self.assertEqual(extra["model_kwargs"]["file_name"], model_backend._quantized_file_name())
+        model_cls.assert_not_called()  # 已经导出过，不再加载 fp32 模型重新量化
+
+
+class RerankerBackendTest(unittest.TestCase):
+    def setUp(self):
+        from utils import rerank
+
+        patcher = patch.object(rerank, "_reranker_instance", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_failed_optimized_backend_falls_back_to_torch(self):
+        import configs.load_env as load_env
+        from utils import model_backend, rerank
+
+        fallback = MagicMock()
+        with patch.object(load_env, "RERANKER_BACKEND", "onnx-int8"), patch(
+            "llama_index.core.utils.infer_torch_device", return_value="cpu"
+        ), patch.object(
+            model_backend, "build_cross_encoder_rerank", side_effect=ImportError("optimum")
+        ) as build, patch(
+            "llama_index.core.postprocessor.SentenceTransformerRerank", return_value=fallback
+        ) as torch_cls:
+            self.assertIs(rerank._get_reranker(), fallback)
+
+        build.assert_called_once()
+        torch_cls.assert_called_once_with(model=load_env.RERANKER_MODEL, top_n=load_env.RERANK_TOP_N)
+
+    def test_onnx_backend_skips_torch_load(self):
+        from utils import model_backend
+
+        cross_encoder = MagicMock()
+        with patch("sentence_transformers.CrossEncoder", return_value=cross_encoder) as ce_cls, patch(
+            "llama_index.core.postprocessor.SentenceTransformerRerank.__init__", side_effect=AssertionError
+        ):
+            reranker = model_backend.build_cross_encoder_rerank("BAAI/bge-reranker-v2-m3", 5, "onnx")
+
+        self.assertIs(model_backend.cross_encoder(reranker), cross_encoder)
+        self.assertEqual(reranker.top_n, 5)
+        self.assertEqual(ce_cls.call_args.kwargs["backend"], "onnx")
+
+
+class EmbedModelBackendTest(unittest.TestCase):
+    def test_torch_int8_quantizes_loaded_model(self):
+        import configs.load_env as load_env
+        from configs import llm_predictor
+
+        embed_model = MagicMock()
+        # HuggingFaceEmbedding 在 build_embed_model 里才 import，按来源模块打补丁。
+        with patch.object(load_env, "EMBEDDING_BACKEND", "torch-int8"), patch(
+            "llama_index.embeddings.huggingface.HuggingFaceEmbedding", return_value=embed_model
+        ) as hf_cls, patch.object(llm_predictor, "quantize_dynamic_int8") as quantize:
+            self.assertIs(llm_predictor.build_embed_model("cpu"), embed_model)
+
+        self.assertEqual(hf_cls.call_args.kwargs["model_name"], "BAAI/bge-m3")
+        quantize.assert_called_once_with(embed_model._model)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -10,7 +10,9 @@
 覆盖：
 1. auto 条目：逐字相同命中；近重复（0.95）命中；意思不同（0.5）不命中
 2. curated 条目：同义改写级别（0.95）命中（比 auto 更宽的阈值）
-3. 完整链路（store -> lookup）：真实 llama-index 嵌入 API + 内存 Chroma
+3. 完整链路（store -> lookup）：真实 llama-index 嵌入 API + 内存 Chroma；
+   进程内镜像命中不再碰 Chroma、写入同步进镜像、命中计数批量写回、TTL 重载；
+   逐字重复提问走精确匹配、不算嵌入；collection 句柄只打开一次
 4. 👎 删除：delete_by_question 按问题文本删掉缓存条目
 5. 驱逐：auto 超上限按命中次数升序驱逐，curated 不驱逐
 6. 统计：stats() 分类计数
@@ -145,14 +147,111 @@ class QaCacheRoundTripTest(QaCacheBaseTest):
         asyncio.run(qa_cache.store_auto("同一个问题", "答案", []))
         for _ in range(3):
             asyncio.run(qa_cache.lookup("同一个问题"))
+        # 命中计数写回是批量的：flush 之前 Chroma 里还是 0
+        metas = self.collection.get(include=["metadatas"])["metadatas"]
+        self.assertEqual(metas[0]["hits"], 0)
+        asyncio.run(qa_cache.flush_hits())
         metas = self.collection.get(include=["metadatas"])["metadatas"]
         self.assertEqual(len(metas), 1)
         self.assertEqual(metas[0]["hits"], 3)
 
+    def test_lookup_after_mirror_loaded_does_not_query_chroma(self):
+        asyncio.run(qa_cache.store_auto("宿舍几点熄灯", "十一点", []))
+        self.assertIsNotNone(asyncio.run(qa_cache.lookup("宿舍几点熄灯")))
+        with patch.object(self.collection, "query") as mock_query, \
+                patch.object(self.collection, "get") as mock_get, \
+                patch.object(self.collection, "update") as mock_update:
+            for _ in range(3):
+                self.assertIsNotNone(asyncio.run(qa_cache.lookup("宿舍几点熄灯")))
+        mock_query.assert_not_called()
+        mock_get.assert_not_called()
+        mock_update.assert_not_called()
+
+    def test_exact_repeat_skips_embedding(self):
+        asyncio.run(qa_cache.store_auto("图书馆怎么借书", "刷校园卡", []))
+        with patch("handlers.qa_cache._embed") as mock_embed:
+            entry = asyncio.run(qa_cache.lookup(" 图书馆怎么借书  "))
+        mock_embed.assert_not_called()
+        self.assertEqual(entry.answer, "刷校园卡")
+
+    def test_exact_match_prefers_curated_entry(self):
+        asyncio.run(qa_cache.store_auto("奖学金什么时候评", "自动答案", []))
+        asyncio.run(qa_cache.store_curated("奖学金什么时候评", "人工答案", []))
+        entry = asyncio.run(qa_cache.lookup("奖学金什么时候评"))
+        self.assertEqual(entry.kind, qa_cache.KIND_CURATED)
+        self.assertEqual(entry.answer, "人工答案")
+
+    def test_writes_after_mirror_loaded_are_visible_to_lookup(self):
+        # 先让镜像加载（空 collection），之后的写入/删除必须同步进镜像
+        self.assertIsNone(asyncio.run(qa_cache.lookup("校医院在哪")))
+        asyncio.run(qa_cache.store_curated("校医院在哪", "航空港校区东门", []))
+        self.assertEqual(asyncio.run(qa_cache.lookup("校医院在哪")).answer, "航空港校区东门")
+        asyncio.run(qa_cache.store_curated("校医院在哪", "已搬到南门", []))
+        self.assertEqual(asyncio.run(qa_cache.lookup("校医院在哪")).answer, "已搬到南门")
+        asyncio.run(qa_cache.delete_by_question("校医院在哪"))
+        self.assertIsNone(asyncio.run(qa_cache.lookup("校医院在哪")))
+
+    def test_mirror_reloads_after_ttl(self):
+        self.assertIsNone(asyncio.run(qa_cache.lookup("别的进程写的问题")))
+        # 绕过本进程直接写 Chroma（模拟另一个 worker），TTL 内看不到、过期后可见
+        self.collection.upsert(
+            ids=["auto:external"],
+            documents=["别的进程写的问题"],
+            embeddings=[asyncio.run(qa_cache._embed("别的进程写的问题"))],
+            metadatas=[{"kind": qa_cache.KIND_AUTO, "question": "别的进程写的问题", "answer": "外部答案", "hits": 0}],
+        )
+        self.assertIsNone(asyncio.run(qa_cache.lookup("别的进程写的问题")))
+        with patch.object(qa_cache, "_MIRROR_TTL_SECONDS", 0.0):
+            self.assertEqual(asyncio.run(qa_cache.lookup("别的进程写的问题")).answer, "外部答案")
+
+    def test_concurrent_lookups_after_ttl_share_one_reload(self):
+        asyncio.run(qa_cache.store_auto("食堂几点关门", "晚上八点", []))
+        self.assertIsNotNone(asyncio.run(qa_cache.lookup("食堂几点关门")))
+
+        async def burst():
+            return await asyncio.gather(*(qa_cache.lookup("食堂几点关门") for _ in range(5)))
+
+        with patch.object(qa_cache, "_MIRROR_TTL_SECONDS", 0.0), \
+                patch.object(qa_cache, "_load_mirror_sync", wraps=qa_cache._load_mirror_sync) as load:
+            entries = asyncio.run(burst())
+        self.assertEqual(load.call_count, 1)
+        self.assertTrue(all(e is not None and e.answer == "晚上八点" for e in entries))
+
     def test_lookup_on_empty_collection_returns_none(self):
         self.assertIsNone(asyncio.run(qa_cache.lookup("任何问题")))
 
 
+class QaCacheCollectionHandleTest(QaCacheBaseTest):
+    """collection 句柄进程内缓存：命中路径不再每次 get_or_create_collection。"""
+
+    def setUp(self):
+        super().setUp()
+        self.collection = _ephemeral_collection()
+        self.client = object()
+        for target, kwargs in [
+            ("handlers.qa_cache._embed", {"new": _controlled_embed}),
+            ("handlers.qa_cache._collection_handle", {"new": None}),
+            ("handlers.vector_store._get_client", {"side_effect": lambda: self.client}),
+        ]:
+            patcher = patch(target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch("handlers.vector_store.get_or_create_collection", return_value=self.collection)
+        self.mock_open = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_lookup_reuses_collection_handle(self):
+        with patch.object(load_env, "QA_CACHE_COLLECTION", self.collection.name):
+            asyncio.run(qa_cache.store_curated("图书馆几点开门", "八点", []))
+            for _ in range(3):
+                self.assertEqual(asyncio.run(qa_cache.lookup("图书馆几点开门")).answer, "八点")
+            self.assertEqual(self.mock_open.call_count, 1)
+            # 换了 chromadb 客户端（reset_client 之后）就重新打开
+            self.client = object()
+            asyncio.run(qa_cache.lookup("图书馆几点开门"))
+        self.assertEqual(self.mock_open.call_count, 2)
+
+
 class QaCacheLifecycleTest(QaCacheBaseTest):
     """删除 / 驱逐 / 统计 / 禁用开关。"""
 
@@ -12,7 +12,8 @@
 3. **防投毒校验**：response 不等于本会话最后一条 assistant 消息时返回 400
    （curated 条目会被所有用户以宽松阈值复用，不接受任意问答对）。
 4. 非法 vote / 空 query 返回 400。
-5. /graph/cache_stats 返回统计字典。
+5. /graph/cache_stats 返回统计字典（含重排分数缓存的 rerank 字段、检索结果
+   缓存的 retrieval 字段）。
 """
 import unittest
 from unittest.mock import AsyncMock, patch
@@ -134,6 +135,8 @@ class CacheStatsEndpointTest(unittest.TestCase):
         self.assertEqual(data["total"], 5)
         self.assertEqual(data["auto"], 4)
         self.assertEqual(data["curated"], 1)
+        self.assertIn("enabled", data["rerank"])
+        self.assertIn("enabled", data["retrieval"])
 
 
 if __name__ == "__main__":
@@ -17,7 +17,7 @@
 全部用注入的 FakeRetriever / MockLLM（或能捕获调用参数的假 LLM），不碰真实
 索引、不联网、不需要 API key。
 """
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 from handlers.qa_workflow import (
@@ -208,6 +208,7 @@ def test_build_retriever_multi_index_and_generate_query_engine_tools_agree_on_de
     现在都调用共享的 utils.llama.index_description()，对同一批索引应该产出
     完全相同的 description 字符串（覆盖有 summary 和没有 summary 两种情况）。
     """
+    import configs.load_env as load_env
     import utils.llama as llama_utils
     from llama_index.core import Settings
     from llama_index.core.tools import RetrieverTool
@@ -247,6 +248,7 @@ def test_build_retriever_multi_index_and_generate_query_engine_tools_agree_on_de
         return real_from_defaults(*args, **kwargs)
 
     with patch("handlers.qa_workflow.indexes", indexes_list), \
+            patch.object(load_env, "INDEX_ROUTING_MODE", "llm"), \
             patch.object(Settings, "_llm", MagicMock()), \
             patch("handlers.qa_workflow.RetrieverTool.from_defaults", side_effect=_capture):
         _build_retriever()
@@ -254,10 +256,11 @@ def test_build_retriever_multi_index_and_generate_query_engine_tools_agree_on_de
     assert tool_descriptions == captured_retriever_descriptions == ["campus dorm rules", "知识库索引: idx2"]
 
 
-def test_build_retriever_with_multiple_indexes_uses_router_retriever():
-    """多个索引应该走 RouterRetriever（RetrieverTool + 同一个 LLMSingleSelector），
-    和 graph_builder._build_query_engine 的多索引分支用同一套选择器类，不是
-    重新发明的路由逻辑。"""
+def test_build_retriever_with_multiple_indexes_in_llm_mode_uses_router_retriever():
+    """INDEX_ROUTING_MODE=llm 时多个索引走 RouterRetriever（RetrieverTool + 同一个
+    LLMSingleSelector），和 graph_builder._build_query_engine 的多索引分支用同一套
+    选择器类，不是重新发明的路由逻辑。"""
+    import configs.load_env as load_env
     from llama_index.core import Settings
     from llama_index.core.retrievers import RouterRetriever
 
@@ -275,12 +278,48 @@ def test_build_retriever_with_multiple_indexes_uses_router_retriever():
     # 未配置 API key 的环境里会报错——和 test_graph_router.py 里同样的原因，
     # 这里同样直接把 Settings._llm 打桩掉，只关心路由到了 RouterRetriever。
     with patch("handlers.qa_workflow.indexes", [fake_index1, fake_index2]), \
+            patch.object(load_env, "INDEX_ROUTING_MODE", "llm"), \
             patch.object(Settings, "_llm", MagicMock()):
         retriever = _build_retriever()
 
     assert isinstance(retriever, RouterRetriever)
 
 
+def test_build_retriever_with_multiple_indexes_defaults_to_embedding_router():
+    """默认的嵌入路由不在构造时碰 LLM 选择器（那是省掉的那次 LLM 往返）。"""
+    import configs.load_env as load_env
+    from handlers.index_router import EmbeddingIndexRouter
+
+    fake_index1 = MagicMock()
+    fake_index1.index_id = "idx1"
+    fake_index2 = MagicMock()
+    fake_index2.index_id = "idx2"
+
+    with patch("handlers.qa_workflow.indexes", [fake_index1, fake_index2]), \
+            patch.object(load_env, "INDEX_ROUTING_MODE", "embedding"), \
+            patch("handlers.qa_workflow.LLMSingleSelector") as mock_selector:
+        retriever = _build_retriever()
+
+    assert isinstance(retriever, EmbeddingIndexRouter)
+    mock_selector.from_defaults.assert_not_called()
+
+
+def test_build_retriever_with_multiple_indexes_in_fanout_mode_queries_all():
+    import configs.load_env as load_env
+    from handlers.index_router import FanOutRetriever
+
+    fake_index1 = MagicMock()
+    fake_index1.index_id = "idx1"
+    fake_index2 = MagicMock()
+    fake_index2.index_id = "idx2"
+
+    with patch("handlers.qa_workflow.indexes", [fake_index1, fake_index2]), \
+            patch.object(load_env, "INDEX_ROUTING_MODE", "fanout"):
+        retriever = _build_retriever()
+
+    assert isinstance(retriever, FanOutRetriever)
+
+
 # ── QAWorkflow: 事件流转 / 流式 / 兜底文案 ──────────────────────────
 
 
@@ -378,7 +417,8 @@ async def test_chat_history_is_forwarded_to_llm():
 @pytest.mark.asyncio
 async def test_retrieve_step_applies_conditional_rerank_postprocessor():
     """retrieve step 检索完之后应该经过
-    ConditionalRerankPostprocessor.postprocess_nodes，这是生产环境已上线的
+    ConditionalRerankPostprocessor.apostprocess_nodes（异步接口，前向在重排
+    服务的工作线程里跑、不卡事件循环），这是生产环境已上线的
     条件触发式 rerank 钩子（见模块 docstring"rerank：挂钩，不重新实现"）。
     patch 目标是 qa_workflow 模块顶层 import 进来的引用，不是 utils.rerank
     源头——qa_workflow.py 用的是 `from utils.rerank import
@@ -390,7 +430,7 @@ async def test_retrieve_step_applies_conditional_rerank_postprocessor():
     retriever = FakeRetriever(raw_nodes)
 
     mock_postprocessor_instance = MagicMock()
-    mock_postprocessor_instance.postprocess_nodes.return_value = reranked_nodes
+    mock_postprocessor_instance.apostprocess_nodes = AsyncMock(return_value=reranked_nodes)
     mock_postprocessor_cls = MagicMock(return_value=mock_postprocessor_instance)
 
     with patch("handlers.qa_workflow.ConditionalRerankPostprocessor", mock_postprocessor_cls):
@@ -398,8 +438,9 @@ async def test_retrieve_step_applies_conditional_rerank_postprocessor():
         result = await workflow.run(query="学校的校训是什么？", streaming=False)
 
     mock_postprocessor_cls.assert_called_once()
-    mock_postprocessor_instance.postprocess_nodes.assert_called_once()
-    call_args = mock_postprocessor_instance.postprocess_nodes.call_args
+    mock_postprocessor_instance.apostprocess_nodes.assert_awaited_once()
+    mock_postprocessor_instance.postprocess_nodes.assert_not_called()
+    call_args = mock_postprocessor_instance.apostprocess_nodes.call_args
     assert call_args.args[0] == raw_nodes
     assert call_args.kwargs["query_bundle"].query_str == "学校的校训是什么？"
     assert result.source_nodes == reranked_nodes
@@ -730,7 +771,9 @@ def test_index_description_truncates_long_summary():
 async def test_multi_index_retriever_tools_have_unique_names():
     """多索引分支的每个 RetrieverTool 应该带唯一 name（index_id），而不是全部
     落在默认的 "retriever_tool"——同名工具会让 LLMSingleSelector 解析出越界
-    索引（"Failed to select retriever"）。这也是修复该线上 bug 的回归测试。"""
+    索引（"Failed to select retriever"）。这也是修复该线上 bug 的回归测试。
+    LLM 选择器现在是 INDEX_ROUTING_MODE=llm / 嵌入路由兜底时才用，直接测它的构造。"""
+    import configs.load_env as load_env
     from llama_index.core import Settings
     from llama_index.core.tools import RetrieverTool
 
@@ -752,6 +795,7 @@ async def test_multi_index_retriever_tools_have_unique_names():
         return real_from_defaults(*args, **kwargs)
 
     with patch("handlers.qa_workflow.indexes", [fake_index1, fake_index2]), \
+            patch.object(load_env, "INDEX_ROUTING_MODE", "llm"), \
             patch.object(Settings, "_llm", MagicMock()), \
             patch("handlers.qa_workflow.RetrieverTool.from_defaults", side_effect=_capture):
         _build_retriever()
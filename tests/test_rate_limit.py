@@ -0,0 +1,57 @@
+"""进程内分桶限流（utils/rate_limit.py）的测试。时间全部显式传入，不 sleep。"""
+import unittest
+
+import tests._pathsetup  # noqa: F401
+
+
+class BucketedRateLimiterTest(unittest.TestCase):
+    def _limiter(self, limit=30, window=60, **kwargs):
+        from utils.rate_limit import BucketedRateLimiter
+
+        return BucketedRateLimiter(limit, window, **kwargs)
+
+    def test_burst_up_to_limit_then_rejects(self):
+        limiter = self._limiter()
+        self.assertTrue(all(limiter.hit("ip", now=1000.0) for _ in range(30)))
+        self.assertFalse(limiter.hit("ip", now=1000.0))
+        self.assertTrue(limiter.hit("other", now=1000.0))
+
+    def test_recovers_once_hits_slide_out_of_window(self):
+        limiter = self._limiter()
+        for _ in range(30):
+            limiter.hit("ip", now=1000.0)  # 桶 [1000, 1010)
+
+        self.assertFalse(limiter.hit("ip", now=1060.0))  # 还在覆盖范围内（多出不到一个桶宽）
+        self.assertTrue(all(limiter.hit("ip", now=1070.0) for _ in range(30)))
+
+    def test_never_exceeds_limit_within_any_window(self):
+        # 原来按时间戳列表实现的约束：任意 window 秒内最多 limit 次
+        limiter = self._limiter(limit=5, window=10, buckets=5)
+        admitted = [t / 10 for t in range(0, 600) if limiter.hit("ip", now=t / 10)]
+        self.assertGreater(len(admitted), 5 * 4)
+        for start in admitted:
+            in_window = [t for t in admitted if start <= t < start + 10]
+            self.assertLessEqual(len(in_window), 5)
+
+    def test_rejected_hits_are_not_counted(self):
+        limiter = self._limiter(limit=2, window=10, buckets=5)
+        limiter.hit("ip", now=0.0)
+        limiter.hit("ip", now=0.0)
+        for _ in range(100):
+            self.assertFalse(limiter.hit("ip", now=1.0))
+        self.assertTrue(limiter.hit("ip", now=12.0))
+
+    def test_evict_expired_and_max_keys(self):
+        limiter = self._limiter(limit=2, window=10, buckets=5, max_keys=3)
+        for key in ("a", "b", "c"):
+            limiter.hit(key, now=0.0)
+        limiter.hit("d", now=0.0)  # 满了，丢掉最早加入的 a
+        self.assertEqual(set(limiter.buckets), {"b", "c", "d"})
+
+        limiter.hit("b", now=5.0)
+        self.assertEqual(limiter.evict_expired(now=13.0), 2)
+        self.assertEqual(set(limiter.buckets), {"b"})
+
+
+if __name__ == "__main__":
+    unittest.main()
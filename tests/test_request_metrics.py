@@ -0,0 +1,127 @@
+"""按分钟分桶的请求指标（utils/request_metrics.py）和 /manage/stats/requests 的测试。"""
+import os
+import random
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import tests._pathsetup  # noqa: F401
+
+
+class LatencyHistogramTest(unittest.TestCase):
+    def test_percentiles_within_relative_error(self):
+        from utils.request_metrics import LatencyHistogram
+
+        rng = random.Random(7)
+        samples = [rng.lognormvariate(-1, 1.2) for _ in range(5000)]  # 秒，长尾
+        histogram = LatencyHistogram()
+        for value in samples:
+            histogram.record(value)
+
+        ordered = sorted(samples)
+        for q in (50, 95, 99):
+            exact_ms = ordered[int(len(ordered) * q / 100) - 1] * 1000
+            self.assertAlmostEqual(histogram.percentile(q), exact_ms, delta=exact_ms * 0.03)
+        self.assertAlmostEqual(histogram.percentile(100), ordered[-1] * 1000, delta=ordered[-1] * 1000 * 0.02)
+        self.assertLess(len(histogram.counts), 600)
+
+    def test_merge_equals_recording_everything_in_one(self):
+        from utils.request_metrics import LatencyHistogram
+
+        a, b, both = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+        for i, value in enumerate([0.001, 0.02, 0.3, 4.0, 0.05, 0.0001]):
+            (a if i % 2 else b).record(value)
+            both.record(value)
+        merged = LatencyHistogram.from_pairs(a.to_pairs())
+        merged.merge(b)
+        self.assertEqual(merged.counts, both.counts)
+        self.assertIsNone(LatencyHistogram().percentile(50))
+
+
+class RequestMetricsTest(unittest.TestCase):
+    def test_drain_takes_only_completed_minutes(self):
+        from utils.request_metrics import RequestMetrics
+
+        metrics = RequestMetrics()
+        metrics.record("/graph/ask_stream", 1.5, False, now=60.0)
+        metrics.record("/graph/ask_stream", 2.5, True, now=61.0)
+        metrics.record("/graph/ask_stream", 0.5, False, now=125.0)
+
+        rows = metrics.drain_completed(now=130.0)
+        self.assertEqual([(r["minute"], r["count"], r["errors"]) for r in rows], [(1, 2, 1)])
+        self.assertEqual(list(metrics.minutes), [2])
+        self.assertEqual(metrics.drain_completed(now=130.0), [])
+
+        metrics.restore(rows)
+        self.assertEqual(len(metrics.pending_rows(0, 10)), 2)
+        self.assertEqual(len(metrics.drain_completed(now=130.0, include_current=True)), 2)
+        self.assertEqual(metrics.minutes, {})
+
+    def test_ring_keeps_only_latest_minutes(self):
+        from utils.request_metrics import RequestMetrics
+
+        metrics = RequestMetrics(ring_minutes=3)
+        for minute in range(10):
+            metrics.record("/x", 0.01, False, now=minute * 60.0)
+        self.assertEqual(sorted(metrics.minutes), [7, 8, 9])
+
+    def test_merge_rows_recomputes_percentiles_across_steps(self):
+        from utils.request_metrics import RequestMetrics, merge_rows
+
+        metrics = RequestMetrics()
+        for minute in range(4):
+            for _ in range(99):
+                metrics.record("/graph/ask_stream", 0.1, False, now=minute * 60.0)
+            metrics.record("/graph/ask_stream", 10.0, False, now=minute * 60.0)
+            metrics.record("/index/list", 0.01, False, now=minute * 60.0)
+        rows = metrics.pending_rows(0, 10)
+
+        per_minute = merge_rows(rows, endpoint="/graph/ask_stream")
+        self.assertEqual([b["start"] for b in per_minute], [0, 60, 120, 180])
+        combined = merge_rows(rows, step=60)
+        self.assertEqual(
+            [(b["endpoint"], b["count"]) for b in combined], [("/graph/ask_stream", 400), ("/index/list", 4)]
+        )
+        self.assertAlmostEqual(combined[0]["p50_ms"], 100, delta=2)
+        self.assertAlmostEqual(combined[0]["max_ms"], 10000, delta=200)
+
+
+class RequestMetricsEndpointTest(unittest.TestCase):
+    def test_combines_stored_and_pending_minutes(self):
+        from fastapi import FastAPI
+        from fastapi.testclient import TestClient
+        from router.manage import manage_app
+        from utils import db
+        from utils.request_metrics import RequestMetrics
+
+        metrics = RequestMetrics()
+        metrics.record("/graph/ask_stream", 0.2, False, now=600.0)
+        metrics.record("/graph/ask_stream", 0.4, True, now=660.0)
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "app.db")
+            # 另一个 worker 已经落库的同一分钟
+            other = RequestMetrics()
+            other.record("/graph/ask_stream", 0.3, False, now=600.0)
+            db.add_request_metrics(db_path, other.drain_completed(now=700.0))
+            db.add_request_metrics(db_path, metrics.drain_completed(now=660.0))
+
+            app = FastAPI()
+            app.include_router(manage_app, prefix='/manage')
+            with patch.dict(os.environ, {'CUITCCA_API_KEY': 'secret'}), \
+                    patch('router.manage.load_env.db_path', db_path), \
+                    patch('router.manage.request_metrics', metrics):
+                client = TestClient(app)
+                headers = {"Authorization": "Bearer secret"}
+                response = client.get("/manage/stats/requests?since=600&until=719", headers=headers)
+                rejected = client.get("/manage/stats/requests?since=700&until=600", headers=headers)
+            db.close_db(db_path)
+
+        self.assertEqual(response.status_code, 200)
+        buckets = response.json()["buckets"]
+        self.assertEqual([(b["start"], b["count"], b["errors"]) for b in buckets], [(600, 2, 0), (660, 1, 1)])
+        self.assertAlmostEqual(buckets[0]["p50_ms"], 200, delta=4)
+        self.assertEqual(rejected.status_code, 422)
+
+
+if __name__ == "__main__":
+    unittest.main()
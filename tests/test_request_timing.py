@@ -0,0 +1,130 @@
+"""请求内分阶段耗时（utils/request_timing.py）的测试：ContextVar 能不能穿过
+Workflow 的 step 任务、各输出口（done 事件、Server-Timing、query 日志）有没有带上。"""
+import asyncio
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+
+import configs.load_env as load_env
+
+import tests._pathsetup  # noqa: F401
+
+
+class RequestTimingTest(unittest.TestCase):
+    def test_noop_outside_request(self):
+        from utils import request_timing
+
+        request_timing.stop()
+        with request_timing.stage("retrieve"):
+            pass
+        request_timing.mark("first_token")
+        self.assertIsNone(request_timing.current())
+        self.assertEqual(request_timing.log_line(), "-")
+
+    def test_stages_accumulate_and_child_tasks_share_the_same_timings(self):
+        from utils import request_timing
+
+        async def retrieve():
+            with request_timing.stage("retrieve"):
+                await asyncio.sleep(0.01)
+
+        async def handle():
+            timings = request_timing.start()
+            # 子任务复制的是上下文，拿到的是同一个 RequestTimings 对象
+            await asyncio.gather(asyncio.create_task(retrieve()), asyncio.create_task(retrieve()))
+            request_timing.mark("first_token")
+            request_timing.mark("first_token")  # 同名只记第一次
+            return timings
+
+        timings = asyncio.run(handle())
+        result = timings.as_dict()
+        self.assertEqual(list(result), ["retrieve", "first_token", "total"])
+        self.assertGreaterEqual(result["retrieve"], 20)
+        self.assertGreaterEqual(result["total"], result["first_token"])
+        self.assertRegex(timings.server_timing(), r"^retrieve;dur=[\d.]+, first_token;dur=[\d.]+, total;dur=[\d.]+$")
+
+
+class QAWorkflowTimingTest(unittest.TestCase):
+    def test_workflow_steps_record_into_request_timings(self):
+        from handlers.qa_workflow import QAWorkflow
+        from llama_index.core.llms import MockLLM
+        from llama_index.core.schema import NodeWithScore, TextNode
+        from utils import request_timing
+
+        from tests.test_qa_workflow import FakeRetriever
+
+        nodes = [NodeWithScore(node=TextNode(text="校训是成于大气 信达天下"), score=0.9)]
+
+        async def run():
+            timings = request_timing.start()
+            workflow = QAWorkflow(retriever=FakeRetriever(nodes), llm=MockLLM(), timeout=30)
+            handler = workflow.run(query="学校的校训是什么？", streaming=True)
+            async for _ in handler.stream_events():
+                pass
+            await handler
+            return timings
+
+        with patch.object(load_env, "RERANK_ENABLED", False), patch.object(load_env, "QUERY_REWRITE_ENABLED", False):
+            stages = asyncio.run(run()).stages
+        self.assertTrue({"retrieve", "rerank", "generate", "first_token"} <= set(stages))
+        self.assertNotIn("condense", stages)  # 没有历史，零 LLM 调用
+        self.assertNotIn("rewrite", stages)
+
+
+class TimingOutputsTest(unittest.TestCase):
+    def test_ask_stream_done_event_carries_timings(self):
+        from fastapi.testclient import TestClient
+        from handlers.auto_router import RouteDecision
+        from handlers.qa_workflow import QAWorkflowResult
+        from main import app
+
+        from tests.test_graph_ask_stream_router import _FakeQAWorkflowHandler
+
+        workflow = MagicMock()
+        workflow.run = MagicMock(
+            return_value=_FakeQAWorkflowHandler(tokens=["答"], result=QAWorkflowResult(response="答", source_nodes=[]))
+        )
+        decision = RouteDecision(mode="standard", nodes=[], query_str="问题", reason="r")
+        with patch.object(load_env, "QA_CACHE_ENABLED", False), \
+                patch("handlers.auto_router.route_query", return_value=decision), \
+                patch("handlers.auto_router.generate_followup_suggestions", return_value=[]), \
+                patch("handlers.qa_workflow.QAWorkflow", return_value=workflow), \
+                patch("router.graph_ask.query_logger") as query_logger:
+            response = TestClient(app).post("/graph/ask_stream", data={"query": "问题"})
+
+        done = [json.loads(line) for line in response.text.splitlines() if '"done"' in line][0]
+        self.assertIn("cache", done["timings"])
+        self.assertIn("route", done["timings"])
+        self.assertIn("total", done["timings"])
+        self.assertNotIn("server-timing", response.headers)
+        logged = [call.args[0] for call in query_logger.info.call_args_list]
+        self.assertTrue(any(line.startswith("ask_stream timings: cache=") for line in logged))
+
+    def test_non_streaming_response_gets_server_timing_header(self):
+        from main import SessionAndStatsMiddleware
+        from starlette.responses import PlainTextResponse
+        from utils import request_timing
+
+        async def endpoint(scope, receive, send):
+            with request_timing.stage("retrieve"):
+                await asyncio.sleep(0)
+            await PlainTextResponse("ok")(scope, receive, send)
+
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "method": "GET", "path": "/graph/query", "headers": [], "client": ("9.9.9.9", 1)}
+        asyncio.run(SessionAndStatsMiddleware(endpoint)(scope, receive, send))
+
+        header = dict(sent[0]["headers"])[b"server-timing"].decode()
+        self.assertRegex(header, r"^retrieve;dur=[\d.]+, total;dur=[\d.]+$")
+        self.assertIsNone(request_timing.current())
+
+
+if __name__ == "__main__":
+    unittest.main()
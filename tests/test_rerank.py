@@ -13,7 +13,8 @@
    postprocess_nodes，且返回值就是 mock 的返回值。
 
 额外覆盖 _get_reranker() 的懒加载 + 缓存逻辑（mock 掉 SentenceTransformerRerank
-本身，绝不真的实例化/下载模型）。
+本身，绝不真的实例化/下载模型），以及异步路径 arerank_nodes / RerankService
+（注入假的打分函数）：跳过条件一致、并发请求合批、打分失败不打死工作线程。
 
 全程通过 monkeypatch 改 configs.load_env 的模块属性（该模块用
 `import configs.load_env as load_env` + `load_env.XXX` 的方式读取配置，不是
@@ -220,3 +221,240 @@ def test_rerank_nodes_reports_true_when_rerank_actually_runs(monkeypatch):
 
     assert result is reranked_sentinel
     assert did_rerank is True
+
+
+# ── arerank_nodes / RerankService：工作线程 + 并发请求微批 ────────────────
+
+
+def test_arerank_nodes_skips_without_touching_service(monkeypatch):
+    """跳过路径跟同步版完全一致：不创建服务、不提交任何打分请求。"""
+    import asyncio
+
+    monkeypatch.setattr(load_env, "RERANK_ENABLED", True)
+    monkeypatch.setattr(load_env, "RERANK_TOP_N", 5)
+    nodes = [_make_node("n0", 0.1)]
+
+    with patch.object(rerank_module, "get_rerank_service") as mock_service:
+        result, did_rerank = asyncio.run(rerank_module.arerank_nodes(nodes))
+
+    assert result == nodes
+    assert did_rerank is False
+    mock_service.assert_not_called()
+
+
+def test_arerank_nodes_scores_via_service_and_keeps_top_n(monkeypatch):
+    import asyncio
+
+    monkeypatch.setattr(load_env, "RERANK_ENABLED", True)
+    monkeypatch.setattr(load_env, "RERANK_SCORE_THRESHOLD", 0.75)
+    monkeypatch.setattr(load_env, "RERANK_TOP_N", 2)
+    nodes = [_make_node(f"n{i}", score) for i, score in enumerate([0.3, 0.25, 0.2])]
+    # 按文本给分：n2 最相关
+    service = rerank_module.RerankService(
+        lambda pairs: [{"n0": 0.1, "n1": 0.5, "n2": 0.9}[text] for _, text in pairs]
+    )
+
+    with patch.object(rerank_module, "get_rerank_service", return_value=service):
+        result, did_rerank = asyncio.run(rerank_module.arerank_nodes(nodes, QueryBundle("问题")))
+
+    assert did_rerank is True
+    assert [n.node.get_content() for n in result] == ["n2", "n1"]
+    assert [n.score for n in result] == [0.9, 0.5]
+
+
+def test_conditional_postprocessor_async_path_uses_arerank(monkeypatch):
+    """query engine 的 aquery 走 apostprocess_nodes：必须用异步重排，不能退回
+    基类默认的 to_thread(同步 rerank_nodes)。"""
+    import asyncio
+    from unittest.mock import AsyncMock
+
+    reranked = [_make_node("r", 0.9)]
+    with patch.object(rerank_module, "arerank_nodes", AsyncMock(return_value=(reranked, True))) as mock_arerank, \
+            patch.object(rerank_module, "rerank_nodes") as mock_sync:
+        result = asyncio.run(
+            rerank_module.ConditionalRerankPostprocessor().apostprocess_nodes([], query_bundle=QueryBundle("q"))
+        )
+
+    assert result == reranked
+    mock_arerank.assert_awaited_once()
+    mock_sync.assert_not_called()
+
+
+def test_rerank_service_batches_concurrent_requests():
+    """第一个请求的前向进行中到达的请求，应该在下一次前向里合成一批。"""
+    import asyncio
+    import threading
+
+    first_batch_started = threading.Event()
+    release_first_batch = threading.Event()
+    batches = []
+
+    def score_pairs(pairs):
+        batches.append(list(pairs))
+        if len(batches) == 1:
+            first_batch_started.set()
+            release_first_batch.wait(timeout=5)
+        return [float(len(text)) for _, text in pairs]
+
+    service = rerank_module.RerankService(score_pairs, max_wait_ms=0)
+
+    async def main():
+        first = asyncio.ensure_future(service.score("q0", ["a"]))
+        await asyncio.to_thread(first_batch_started.wait, 5)
+        rest = [asyncio.ensure_future(service.score(f"q{i}", ["bb", "ccc"])) for i in range(1, 4)]
+        await asyncio.sleep(0.05)
+        release_first_batch.set()
+        return await first, await asyncio.gather(*rest)
+
+    first_scores, rest_scores = asyncio.run(main())
+
+    assert first_scores == [1.0]
+    assert rest_scores == [[2.0, 3.0]] * 3
+    assert [len(b) for b in batches] == [1, 6]
+    stats = service.stats()
+    assert stats["batches"] == 2
+    assert stats["requests"] == 4
+    assert stats["max_batch_pairs"] == 6
+    assert stats["queue_depth"] == 0
+
+
+def test_rerank_service_propagates_errors_and_keeps_running():
+    import asyncio
+
+    import pytest
+
+    calls = []
+
+    def score_pairs(pairs):
+        calls.append(pairs)
+        if len(calls) == 1:
+            raise RuntimeError("model load failed")
+        return [1.0] * len(pairs)
+
+    service = rerank_module.RerankService(score_pairs, max_wait_ms=0)
+    with pytest.raises(RuntimeError):
+        asyncio.run(service.score("q", ["a"]))
+    assert asyncio.run(service.score("q", ["a"])) == [1.0]
+
+
+def test_arerank_nodes_reuses_cached_scores_for_repeated_pairs(monkeypatch):
+    """同一 query（归一化后）+ 同一批节点第二次重排时不再进模型。"""
+    import asyncio
+
+    monkeypatch.setattr(load_env, "RERANK_ENABLED", True)
+    monkeypatch.setattr(load_env, "RERANK_TOP_N", 2)
+    monkeypatch.setattr(load_env, "RERANK_CACHE_ENABLED", True)
+    monkeypatch.setattr(rerank_module, "_score_cache", rerank_module.RerankScoreCache(100))
+    nodes = [_make_node(f"n{i}", 0.1) for i in range(3)]
+    scored_pairs = []
+
+    def score_pairs(pairs):
+        scored_pairs.extend(pairs)
+        return [{"n0": 0.1, "n1": 0.5, "n2": 0.9}[text] for _, text in pairs]
+
+    service = rerank_module.RerankService(score_pairs)
+    with patch.object(rerank_module, "get_rerank_service", return_value=service):
+        asyncio.run(rerank_module.arerank_nodes(nodes, QueryBundle("图书馆 几点开门")))
+        again = [NodeWithScore(node=n.node, score=0.1) for n in nodes]
+        result, did_rerank = asyncio.run(rerank_module.arerank_nodes(again, QueryBundle("图书馆 几点开门 ")))
+
+    assert did_rerank is True
+    assert len(scored_pairs) == 3
+    assert [n.score for n in result] == [0.9, 0.5]
+    stats = rerank_module.rerank_cache_stats()
+    assert stats["hits"] == 3
+    assert stats["misses"] == 3
+    assert stats["hit_rate"] == 0.5
+
+
+def test_arerank_nodes_rescores_node_whose_content_changed(monkeypatch):
+    """key 里带节点内容 hash：节点被 /updateNodeById 改过后旧分数不能复用。"""
+    import asyncio
+
+    monkeypatch.setattr(load_env, "RERANK_ENABLED", True)
+    monkeypatch.setattr(load_env, "RERANK_TOP_N", 1)
+    monkeypatch.setattr(load_env, "RERANK_CACHE_ENABLED", True)
+    monkeypatch.setattr(rerank_module, "_score_cache", rerank_module.RerankScoreCache(100))
+    scored_texts = []
+
+    def score_pairs(pairs):
+        scored_texts.extend(text for _, text in pairs)
+        return [0.5 for _ in pairs]
+
+    service = rerank_module.RerankService(score_pairs)
+    nodes = [NodeWithScore(node=TextNode(id_=f"id{i}", text=f"旧{i}"), score=0.1) for i in range(2)]
+    with patch.object(rerank_module, "get_rerank_service", return_value=service):
+        asyncio.run(rerank_module.arerank_nodes(nodes, QueryBundle("q")))
+        nodes[0].node.set_content("新0")
+        asyncio.run(rerank_module.arerank_nodes(nodes, QueryBundle("q")))
+
+    assert scored_texts == ["旧0", "旧1", "新0"]
+
+
+def test_rerank_score_cache_evicts_least_recently_used():
+    cache = rerank_module.RerankScoreCache(2)
+    cache.put_many([(("q", "a", "h"), 0.1), (("q", "b", "h"), 0.2)])
+    cache.get_many([("q", "a", "h")])
+    cache.put_many([(("q", "c", "h"), 0.3)])
+
+    assert cache.get_many([("q", "a", "h"), ("q", "b", "h"), ("q", "c", "h")]) == [0.1, None, 0.3]
+    assert cache.stats()["entries"] == 2
+
+
+def _fused(text: str, score: float, **signal):
+    from handlers.hybrid_retriever import FusedNodeWithScore, FusionSignal
+
+    return FusedNodeWithScore(node=TextNode(text=text), score=score, signal=FusionSignal(**signal))
+
+
+def test_fusion_skip_mode_skips_when_signal_is_confident(monkeypatch):
+    monkeypatch.setattr(load_env, "RERANK_ENABLED", True)
+    monkeypatch.setattr(load_env, "RERANK_TOP_N", 2)
+    monkeypatch.setattr(load_env, "RERANK_SKIP_MODE", "fusion")
+    monkeypatch.setattr(load_env, "RERANK_SKIP_DENSE_MIN", 0.75)
+    monkeypatch.setattr(load_env, "RERANK_SKIP_DENSE_MARGIN", 0.05)
+    signal = {"dense_top1": 0.8, "dense_margin": 0.1, "legs_agree": True}
+    nodes = [_fused(f"n{i}", 0.03, **signal) for i in range(4)]
+
+    with patch.object(rerank_module, "_get_reranker") as mock_get_reranker:
+        result, did_rerank = rerank_module.rerank_nodes(nodes)
+
+    assert result == nodes[:2]
+    assert did_rerank is False
+    mock_get_reranker.assert_not_called()
+
+
+def test_fusion_skip_mode_reranks_when_any_condition_fails(monkeypatch):
+    monkeypatch.setattr(load_env, "RERANK_ENABLED", True)
+    monkeypatch.setattr(load_env, "RERANK_TOP_N", 2)
+    monkeypatch.setattr(load_env, "RERANK_SKIP_MODE", "fusion")
+    monkeypatch.setattr(load_env, "RERANK_SKIP_DENSE_MIN", 0.75)
+    monkeypatch.setattr(load_env, "RERANK_SKIP_DENSE_MARGIN", 0.05)
+    weak_signals = [
+        {"dense_top1": 0.8, "dense_margin": 0.1, "legs_agree": False},
+        {"dense_top1": 0.7, "dense_margin": 0.1, "legs_agree": True},
+        {"dense_top1": 0.8, "dense_margin": 0.01, "legs_agree": True},
+    ]
+    for signal in weak_signals:
+        nodes = [_fused(f"n{i}", 0.03, **signal) for i in range(4)]
+        mock_reranker = MagicMock()
+        mock_reranker.postprocess_nodes.return_value = nodes[:2]
+        with patch.object(rerank_module, "_get_reranker", return_value=mock_reranker):
+            _, did_rerank = rerank_module.rerank_nodes(nodes)
+        assert did_rerank is True, signal
+
+
+def test_score_skip_mode_ignores_fusion_signal(monkeypatch):
+    """默认 score 模式行为不变：即便信号很强，RRF 分够不到阈值照样重排。"""
+    monkeypatch.setattr(load_env, "RERANK_ENABLED", True)
+    monkeypatch.setattr(load_env, "RERANK_TOP_N", 2)
+    monkeypatch.setattr(load_env, "RERANK_SKIP_MODE", "score")
+    monkeypatch.setattr(load_env, "RERANK_SCORE_THRESHOLD", 0.75)
+    nodes = [_fused(f"n{i}", 0.03, dense_top1=0.95, dense_margin=0.3, legs_agree=True) for i in range(4)]
+    mock_reranker = MagicMock()
+    mock_reranker.postprocess_nodes.return_value = nodes[:2]
+
+    with patch.object(rerank_module, "_get_reranker", return_value=mock_reranker):
+        _, did_rerank = rerank_module.rerank_nodes(nodes)
+
+    assert did_rerank is True
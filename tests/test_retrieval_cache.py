@@ -0,0 +1,243 @@
+"""backend/app/handlers/retrieval_cache.py 的测试。
+
+覆盖三块：
+1. RetrievalResultCache：LRU 淘汰、按索引失效、命中统计。
+2. CachedRetriever：同一问题（归一化后）第二次检索不再走内层 retriever，
+   节点按 id 从 Chroma 还原，融合附加字段（FusionSignal 等）原样带回；
+   内容版本号变化、开关关闭、节点已被外部删掉时老老实实重新检索。
+3. 跟 build_retriever_for_index / invalidate_hybrid_retriever_cache 的接线；
+   router 里改节点、QA 导入之后再查拿到的是新结果。
+"""
+import asyncio
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import tests._pathsetup  # noqa: F401
+
+
+class RetrievalResultCacheTest(unittest.TestCase):
+    def test_lru_eviction_and_stats(self):
+        from handlers.retrieval_cache import RetrievalResultCache
+
+        cache = RetrievalResultCache(max_entries=2)
+        cache.put(("idx", 0, "a", 5), [("n1", 0.9, None)])
+        cache.put(("idx", 0, "b", 5), [("n2", 0.8, None)])
+        cache.get(("idx", 0, "a", 5))  # a 变成最近使用
+        cache.put(("idx", 0, "c", 5), [])
+
+        self.assertIsNone(cache.get(("idx", 0, "b", 5)))
+        self.assertEqual(cache.get(("idx", 0, "a", 5)), [("n1", 0.9, None)])
+        self.assertEqual(cache.get(("idx", 0, "c", 5)), [])
+        stats = cache.stats()
+        self.assertEqual((stats["entries"], stats["hits"], stats["misses"]), (2, 3, 1))
+
+    def test_invalidate_only_drops_that_index(self):
+        from handlers.retrieval_cache import RetrievalResultCache
+
+        cache = RetrievalResultCache(max_entries=10)
+        cache.put(("a", 0, "q", 5), [])
+        cache.put(("a", 1, "q", 5), [])
+        cache.put(("b", 0, "q", 5), [])
+
+        self.assertEqual(cache.invalidate("a"), 2)
+        self.assertEqual(cache.stats()["entries"], 1)
+
+
+class _ChromaIndexCase(unittest.TestCase):
+    """临时目录里的真实 Chroma 索引，两个节点，结果缓存打开。"""
+
+    def setUp(self):
+        import chromadb
+        import configs.load_env as load_env
+        from handlers import retrieval_cache
+        from llama_index.core import Document, VectorStoreIndex
+        from llama_index.core.embeddings import MockEmbedding
+        from llama_index.vector_stores.chroma import ChromaVectorStore
+
+        self._tmp_dir = tempfile.mkdtemp()
+        self.client = chromadb.PersistentClient(path=self._tmp_dir)
+        self.addCleanup(self.client.clear_system_cache)
+        patcher = patch.object(load_env, "RETRIEVAL_CACHE_ENABLED", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        retrieval_cache.invalidate_retrieval_cache()
+        self.addCleanup(retrieval_cache.invalidate_retrieval_cache)
+
+        collection = self.client.get_or_create_collection("retrieval-cache")
+        vector_store = ChromaVectorStore(chroma_collection=collection)
+        self.index = VectorStoreIndex.from_vector_store(
+            vector_store=vector_store, embed_model=MockEmbedding(embed_dim=8)
+        )
+        self.index.set_index_id("retrieval-cache")
+        for text in ["国家奖学金奖励标准为8000元每人每年", "成都信息工程大学的校训是成于大气 信达天下"]:
+            self.index.insert(Document(text=text))
+        self.node_ids = list(self.index.vector_store.client.get()["ids"])
+
+
+class CachedRetrieverTest(_ChromaIndexCase):
+    def _counting_inner(self):
+        from handlers.hybrid_retriever import FusedNodeWithScore, FusionSignal
+        from llama_index.core.retrievers import BaseRetriever
+
+        vector_store = self.index.vector_store
+        node_ids = self.node_ids
+
+        class CountingRetriever(BaseRetriever):
+            calls = 0
+
+            def _retrieve(self, query_bundle):
+                CountingRetriever.calls += 1
+                nodes = vector_store.get_nodes(node_ids)
+                signal = FusionSignal(dense_top1=0.8, dense_margin=0.1, legs_agree=True)
+                return [
+                    FusedNodeWithScore(node=node, score=1 / (60 + rank), dense_score=0.8, signal=signal, leg_ms={})
+                    for rank, node in enumerate(nodes)
+                ]
+
+        return CountingRetriever()
+
+    def test_second_identical_question_skips_inner_retriever(self):
+        from handlers.hybrid_retriever import FusedNodeWithScore
+        from handlers.retrieval_cache import CachedRetriever
+
+        inner = self._counting_inner()
+        retriever = CachedRetriever(inner, self.index, similarity_top_k=5)
+
+        first = retriever.retrieve("国家奖学金 多少钱")
+        second = retriever.retrieve(" 国家奖学金  多少钱")  # 归一化后同一个 key
+        third = asyncio.run(retriever.aretrieve("国家奖学金 多少钱"))
+
+        self.assertEqual(type(inner).calls, 1)
+        for cached in (second, third):
+            self.assertEqual([n.node.node_id for n in cached], [n.node.node_id for n in first])
+            self.assertEqual([n.score for n in cached], [n.score for n in first])
+            self.assertIsInstance(cached[0], FusedNodeWithScore)
+            self.assertEqual(cached[0].signal, first[0].signal)
+            self.assertEqual(cached[0].node.get_content(), first[0].node.get_content())
+            self.assertIsNone(cached[0].leg_ms)
+
+    def test_generation_bump_and_top_k_are_part_of_the_key(self):
+        from handlers.retrieval_cache import CachedRetriever
+        from handlers.vector_store import bump_collection_generation
+
+        inner = self._counting_inner()
+        retriever = CachedRetriever(inner, self.index, similarity_top_k=5)
+        retriever.retrieve("校训")
+        CachedRetriever(inner, self.index, similarity_top_k=2).retrieve("校训")
+        self.assertEqual(type(inner).calls, 2)
+
+        bump_collection_generation(self.index.vector_store.client)
+        retriever.retrieve("校训")
+
+        self.assertEqual(type(inner).calls, 3)
+
+    def test_disabled_flag_always_hits_inner_retriever(self):
+        import configs.load_env as load_env
+        from handlers.retrieval_cache import CachedRetriever
+
+        inner = self._counting_inner()
+        retriever = CachedRetriever(inner, self.index, similarity_top_k=5)
+        with patch.object(load_env, "RETRIEVAL_CACHE_ENABLED", False):
+            retriever.retrieve("校训")
+            retriever.retrieve("校训")
+
+        self.assertEqual(type(inner).calls, 2)
+
+    def test_node_deleted_behind_the_cache_is_a_miss(self):
+        from handlers.retrieval_cache import CachedRetriever
+
+        inner = self._counting_inner()
+        retriever = CachedRetriever(inner, self.index, similarity_top_k=5)
+        retriever.retrieve("校训")
+        # 绕过 router/index.py 直接删 Chroma：版本号没变，但缓存里的 id 取不回来了
+        self.index.vector_store.delete_nodes([self.node_ids[0]])
+        self.node_ids.pop(0)
+
+        results = retriever.retrieve("校训")
+
+        self.assertEqual(type(inner).calls, 2)
+        self.assertEqual(len(results), 1)
+
+    def test_build_retriever_wraps_and_index_invalidation_clears_entries(self):
+        import configs.load_env as load_env
+        from handlers import retrieval_cache
+        from handlers.hybrid_retriever import build_retriever_for_index, invalidate_hybrid_retriever_cache
+        from handlers.retrieval_cache import CachedRetriever
+
+        with patch.object(load_env, "HYBRID_RETRIEVAL_ENABLED", False):
+            retriever = build_retriever_for_index(self.index, 2)
+            self.assertIsInstance(retriever, CachedRetriever)
+            retriever.retrieve("校训")
+        self.assertEqual(retrieval_cache.retrieval_cache_stats()["entries"], 1)
+
+        invalidate_hybrid_retriever_cache("retrieval-cache")
+
+        self.assertEqual(retrieval_cache.retrieval_cache_stats()["entries"], 0)
+
+
+
+class RouterWriteInvalidationTest(_ChromaIndexCase):
+    """改节点、QA 导入这两个写接口也要让缓存失效：查一次、经 router 写入、再查，
+    拿到的是新结果而不是缓存里的旧排名。"""
+
+    def setUp(self):
+        super().setUp()
+        import configs.load_env as load_env
+        from fastapi.testclient import TestClient
+        from main import app
+        from router.index import get_index
+
+        patcher = patch.object(load_env, "HYBRID_RETRIEVAL_ENABLED", False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        app.dependency_overrides[get_index] = lambda: self.index
+        self.addCleanup(app.dependency_overrides.clear)
+        self.client_app = TestClient(app)
+
+    def _query(self):
+        from handlers.hybrid_retriever import build_retriever_for_index
+
+        nodes = build_retriever_for_index(self.index, 5).retrieve("校训")
+        return {n.node.node_id: (n.node.get_content(), n.score) for n in nodes}
+
+    def test_update_node_refreshes_cached_scores(self):
+        before = self._query()
+        edited = self.node_ids[0]
+
+        def fake_update(index, node_id, text):
+            index.vector_store.client.update(ids=[node_id], documents=[text], embeddings=[[1.0] + [0.0] * 7])
+
+        with patch("router.index.updateNodeById", side_effect=fake_update):
+            response = self.client_app.post(
+                f"/index/retrieval-cache/update?nodeId={edited}", data={"text": "改过的校训"}
+            )
+        self.assertEqual(response.status_code, 200)
+
+        after = self._query()
+        self.assertEqual(after[edited][0], "改过的校训")
+        self.assertNotEqual(after[edited][1], before[edited][1])
+
+    def test_upload_qa_makes_new_nodes_visible(self):
+        from llama_index.core import Document
+
+        before = self._query()
+
+        async def fake_embedding_qa(index, qa_data, doc_id):
+            index.insert(Document(text="问：校训是什么？答：成于大气 信达天下"))
+
+        with patch("router.index.read_file_contents", return_value="内容"), \
+                patch("router.index.generate_qa_batched", return_value=[]), \
+                patch("router.index.embeddingQA", side_effect=fake_embedding_qa):
+            response = self.client_app.post(
+                "/index/retrieval-cache/upload_file_by_QA",
+                files={"file": ("qa.txt", b"some content", "text/plain")},
+            )
+        self.assertEqual(response.status_code, 200)
+
+        after = self._query()
+        self.assertEqual(len(before), 2)
+        self.assertEqual(len(after), 3)
+
+if __name__ == "__main__":
+    unittest.main()
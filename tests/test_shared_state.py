@@ -0,0 +1,188 @@
+"""多 worker 共享状态（utils/shared_state.py、handlers/index_events.py）的测试。
+
+两个 ``SqliteStateBackend`` 打开同一个文件，模拟同一台机器上的两个 worker：
+会话缓存、限流计数要互相看得见，索引变更事件要跳过自己发的。
+"""
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, patch
+
+import tests._pathsetup  # noqa: F401
+
+
+class SqliteStateBackendTest(unittest.TestCase):
+    def setUp(self):
+        from utils.shared_state import SqliteStateBackend
+
+        self._tmpdir = tempfile.TemporaryDirectory()
+        path = os.path.join(self._tmpdir.name, 'state', 'state.db')
+        self.worker_a = SqliteStateBackend(path)
+        self.worker_b = SqliteStateBackend(path)
+
+    def tearDown(self):
+        self.worker_a.close()
+        self.worker_b.close()
+        self._tmpdir.cleanup()
+
+    def test_session_written_by_one_worker_is_read_by_another(self):
+        from llama_index.core.base.llms.types import ChatMessage, MessageRole
+
+        history = [ChatMessage(role=MessageRole.USER, content="你好")]
+        self.worker_a.cache_set("chat", "client-1", history, max_size=10)
+
+        self.assertEqual(self.worker_b.cache_get("chat", "client-1", ttl=60), history)
+        self.assertIsNone(self.worker_b.cache_get("other", "client-1", ttl=60))
+        self.assertIsNone(self.worker_b.cache_get("chat", "client-1", ttl=-1))  # 过期即删
+        self.assertEqual(self.worker_a.cache_len("chat"), 0)
+
+    def test_cache_evicts_oldest_writes_beyond_max_size(self):
+        for i in range(5):
+            self.worker_a.cache_set("chat", f"c{i}", i, max_size=3)
+
+        self.assertEqual(self.worker_b.cache_len("chat"), 3)
+        self.assertIsNone(self.worker_b.cache_get("chat", "c0", ttl=60))
+        self.assertEqual(self.worker_b.cache_get("chat", "c4", ttl=60), 4)
+
+    def test_rate_limit_is_shared_across_workers(self):
+        now = 1000.0
+        self.assertTrue(self.worker_a.rate_limit_hit("1.2.3.4", 60, 2, now=now))
+        self.assertTrue(self.worker_b.rate_limit_hit("1.2.3.4", 60, 2, now=now + 1))
+        self.assertFalse(self.worker_a.rate_limit_hit("1.2.3.4", 60, 2, now=now + 2))
+        self.assertTrue(self.worker_b.rate_limit_hit("5.6.7.8", 60, 2, now=now + 2))
+        # 跟进程内的分桶限流一样，窗口加一个桶宽（10 秒）滑过去之后恢复
+        self.assertFalse(self.worker_b.rate_limit_hit("1.2.3.4", 60, 2, now=now + 61))
+        self.assertTrue(self.worker_b.rate_limit_hit("1.2.3.4", 60, 2, now=now + 71))
+
+    def test_rate_limit_keeps_one_row_per_bucket(self):
+        for i in range(50):
+            self.worker_a.rate_limit_hit("1.2.3.4", 60, 100, now=1000.0 + i * 0.1)
+        rows = self.worker_b._conn.execute("SELECT epoch, count FROM rate_limit_buckets").fetchall()
+        self.assertEqual(sorted(rows), [(100, 50)])
+
+    def test_events_skip_own_origin(self):
+        from utils import shared_state
+
+        start = self.worker_b.latest_event_id()
+        self.worker_a.publish("index", {"index": "idx", "kind": "content"})
+
+        # 两个 backend 在同一个进程里，origin 相同；换一个身份模拟另一个 worker 来读
+        self.assertEqual(self.worker_b.events_since("index", start), [])
+        with patch.object(shared_state, "PROCESS_ID", "other-worker"):
+            events = self.worker_b.events_since("index", start)
+        self.assertEqual([payload for _, payload in events], [{"index": "idx", "kind": "content"}])
+        self.assertEqual(self.worker_b.latest_event_id(), events[-1][0])
+
+    def test_prune_drops_expired_rate_limit_hits(self):
+        self.worker_a.rate_limit_hit("1.2.3.4", 60, 1, now=1000.0)
+        self.worker_a.prune(60, now=2000.0)
+        self.assertEqual(self.worker_a._conn.execute("SELECT COUNT(*) FROM rate_limit_buckets").fetchone()[0], 0)
+        self.assertTrue(self.worker_b.rate_limit_hit("1.2.3.4", 60, 1, now=1030.0))
+
+
+class TTLCacheDelegationTest(unittest.TestCase):
+    def test_ttl_cache_uses_shared_backend_when_active(self):
+        import configs.load_env as load_env
+        from router.graph_session import TTLCache
+        from utils import shared_state
+
+        with tempfile.TemporaryDirectory() as tmp, patch.object(load_env, "STATE_BACKEND", "sqlite"), patch.object(
+            load_env, "STATE_DB_PATH", os.path.join(tmp, "state.db")
+        ):
+            cache = TTLCache("test_ns", max_size=10, ttl=60)
+            try:
+                shared_state.init_shared_state()
+                cache.set("k", {"v": 1})
+                self.assertEqual(cache._data, {})  # 没进进程内的字典
+                self.assertEqual(shared_state.shared_backend().cache_get("test_ns", "k", 60), {"v": 1})
+                self.assertEqual(cache.get("k"), {"v": 1})
+                self.assertEqual(len(cache), 1)
+            finally:
+                shared_state.close_shared_state()
+
+        self.assertIsNone(cache.get("k"))  # 回到内存模式
+
+    def test_unknown_backend_falls_back_to_memory(self):
+        import configs.load_env as load_env
+        from utils import shared_state
+
+        with patch.object(load_env, "STATE_BACKEND", "redis"):
+            self.assertIsNone(shared_state.init_shared_state())
+        self.assertIsNone(shared_state.shared_backend())
+
+    def test_auto_backend_uses_sqlite_only_with_several_workers(self):
+        import configs.load_env as load_env
+        from utils import shared_state
+
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch.object(load_env, "STATE_BACKEND", "auto"), \
+                patch.object(load_env, "STATE_DB_PATH", os.path.join(tmp, "state.db")):
+            with patch.dict(os.environ, {"WEB_CONCURRENCY": "1"}):
+                self.assertIsNone(shared_state.init_shared_state())
+            with patch.dict(os.environ, {"WEB_CONCURRENCY": "4"}):
+                self.assertIsNotNone(shared_state.init_shared_state())
+            shared_state.close_shared_state()
+
+
+class IndexEventsTest(unittest.TestCase):
+    def test_watch_reloads_once_per_batch_of_remote_events(self):
+        import configs.load_env as load_env
+        from handlers import index_events
+        from utils import shared_state
+        from utils.shared_state import SqliteStateBackend
+
+        async def scenario(backend):
+            with patch.object(load_env, "INDEX_EVENT_POLL_SECONDS", 0.01), patch.object(
+                shared_state, "_backend", backend
+            ), patch.object(index_events, "apply_remote_index_changes", new_callable=AsyncMock) as apply:
+                task = asyncio.create_task(index_events.watch_index_changes())
+                await asyncio.sleep(0.05)
+                with patch.object(shared_state, "PROCESS_ID", "other-worker"):
+                    backend.publish(index_events.CHANNEL, {"index": "a", "kind": "content"})
+                    backend.publish(index_events.CHANNEL, {"index": "b", "kind": "deleted"})
+                index_events.publish_index_change("c", "summary")  # 本进程自己发的，不触发重载
+                for _ in range(100):
+                    if apply.await_count:
+                        break
+                    await asyncio.sleep(0.01)
+                await asyncio.sleep(0.05)
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+            return apply
+
+        with tempfile.TemporaryDirectory() as tmp:
+            backend = SqliteStateBackend(os.path.join(tmp, "state.db"))
+            try:
+                apply = asyncio.run(scenario(backend))
+            finally:
+                backend.close()
+
+        apply.assert_awaited_once()
+        self.assertEqual(
+            apply.await_args.args[0], [{"index": "a", "kind": "content"}, {"index": "b", "kind": "deleted"}]
+        )
+
+    def test_publish_without_backend_is_noop(self):
+        from handlers import index_events
+
+        index_events.publish_index_change("idx", "created")  # 不抛
+
+    def test_apply_reopens_client_and_reloads_indexes(self):
+        from handlers import index_events
+
+        with patch("handlers.vector_store.reset_client") as reset, patch(
+            "handlers.index_crud.loadAllIndexes", new_callable=AsyncMock
+        ) as load_all, patch("handlers.hybrid_retriever.invalidate_hybrid_retriever_cache") as invalidate:
+            asyncio.run(index_events.apply_remote_index_changes([{"index": "idx", "kind": "content"}]))
+
+        reset.assert_called_once()
+        load_all.assert_awaited_once()
+        invalidate.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,255 @@
+"""bge-m3 稀疏检索（utils/sparse_embedding.py + handlers/sparse_index.py）的测试。
+
+不加载真实模型：编码器用按字符出权重的假实现，只验证管线本身——
+1. lexical_weights 的折叠规则（同 token 取最大、丢特殊 token 和 0 权重）。
+2. SparseIndex：稀疏点积打分、删除、落盘往返后 float 权重不丢精度。
+3. 摄取：build_pipeline 在稀疏模式下一次前向同时写 dense 向量和权重 metadata，
+   之后从 Chroma 建稀疏索引直接读 metadata，不再调编码器。
+4. 查询：dense 嵌入和稀疏权重共用一次前向；混合检索的词项腿换成稀疏检索器。
+"""
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+import tests._pathsetup  # noqa: F401
+
+CORPUS = {
+    "n1": "成都信息工程大学的校训是成于大气 信达天下",
+    "n2": "国家奖学金奖励标准为8000元每人每年",
+    "n3": "学校勤工助学的工资标准是150到200元每人每月",
+}
+
+
+def _char_weights(text: str) -> dict[str, float]:
+    """假编码器的"稀疏头"：每个非空白字符一个 token，出现次数越多权重越高。"""
+    weights: dict[str, float] = {}
+    for ch in text:
+        if not ch.isspace():
+            key = str(ord(ch))
+            weights[key] = weights.get(key, 0.0) + 0.5
+    return weights
+
+
+def _fake_encode(texts, prompt_name="text"):
+    return [([0.1] * 8, _char_weights(text)) for text in texts]
+
+
+class FakeEncoder:
+    embed_batch_size = 2
+
+    def __init__(self):
+        self.encoded: list[str] = []
+
+    def encode(self, texts, prompt_name="text"):
+        self.encoded.extend(texts)
+        return _fake_encode(texts, prompt_name)
+
+    def query_sparse(self, query):
+        return _char_weights(query)
+
+
+def _sparse_embedding():
+    from llama_index.core.embeddings import MockEmbedding
+    from utils.sparse_embedding import BGEM3SparseEmbedding
+
+    return BGEM3SparseEmbedding(MockEmbedding(embed_dim=8), sparse_linear=None, skip_ids={0, 2})
+
+
+class LexicalWeightsTest(unittest.TestCase):
+    def test_max_per_token_and_special_tokens_dropped(self):
+        from utils.sparse_embedding import dumps_weights, lexical_weights, loads_weights
+
+        weights = lexical_weights([0, 5, 7, 5, 9, 2], [0.9, 0.2, 0.0, 0.4, 0.3, 0.8], skip_ids={0, 2})
+
+        self.assertEqual(weights, {"5": 0.4, "9": 0.3})
+        self.assertEqual(loads_weights({"lexical_weights": dumps_weights(weights)}), weights)
+        self.assertIsNone(loads_weights({}))
+        self.assertIsNone(loads_weights({"lexical_weights": "not json"}))
+
+
+class SparseIndexTest(unittest.TestCase):
+    def _build(self):
+        from handlers.sparse_index import SparseIndex
+
+        index = SparseIndex()
+        for node_id, text in CORPUS.items():
+            index.add_weights(node_id, _char_weights(text), ref_doc_id=f"doc-{node_id}")
+        return index
+
+    def test_scores_are_sparse_dot_products(self):
+        index = self._build()
+        query = _char_weights("奖学金标准")
+
+        results = index.search(query, k=3)
+
+        expected = {
+            node_id: sum(w * _char_weights(text).get(t, 0.0) for t, w in query.items())
+            for node_id, text in CORPUS.items()
+        }
+        self.assertEqual(results[0][0], "n2")
+        for node_id, score in results:
+            self.assertAlmostEqual(score, expected[node_id], places=5)
+        self.assertEqual(index.search({}, k=3), [])
+
+    def test_remove_and_save_load_round_trip(self):
+        from handlers.sparse_index import SparseIndex
+
+        index = self._build()
+        index.remove("n2")
+        query = _char_weights("每人每年的标准")
+        before = index.search(query, k=3)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "idx_sparse")
+            index.save(path)
+            loaded = SparseIndex.load(path)
+            after = loaded.search(query, k=3)
+
+        self.assertNotIn("n2", [node_id for node_id, _ in before])
+        self.assertEqual([n for n, _ in after], [n for n, _ in before])
+        for (_, a), (_, b) in zip(after, before):
+            self.assertAlmostEqual(a, b, places=5)
+
+    def test_add_tokens_is_rejected(self):
+        from handlers.sparse_index import SparseIndex
+
+        with self.assertRaises(TypeError):
+            SparseIndex().add("n1", ["校训"])
+
+
+class SparseIngestionTest(unittest.TestCase):
+    def setUp(self):
+        import chromadb
+        from llama_index.vector_stores.chroma import ChromaVectorStore
+
+        self._tmp_dir = tempfile.mkdtemp()
+        self.client = chromadb.PersistentClient(path=self._tmp_dir)
+        self.addCleanup(self.client.clear_system_cache)
+        self.vector_store = ChromaVectorStore(chroma_collection=self.client.get_or_create_collection("sparse"))
+
+    def test_pipeline_stores_weights_and_index_builds_from_metadata(self):
+        import configs.load_env as load_env
+        from handlers import sparse_index
+        from handlers.ingestion_pipeline import SparseEmbedTransform, build_pipeline
+        from llama_index.core import Document
+        from llama_index.core.schema import MetadataMode
+        from utils.sparse_embedding import SPARSE_METADATA_KEY, BGEM3SparseEmbedding
+
+        embed_model = _sparse_embedding()
+        docs = [Document(text=text * 3, id_=f"doc-{node_id}") for node_id, text in CORPUS.items()]
+        with patch.object(load_env, "LEXICAL_RETRIEVAL_MODE", "sparse"), patch.object(
+            BGEM3SparseEmbedding, "encode", side_effect=_fake_encode, autospec=False
+        ) as encode:
+            pipeline = build_pipeline(vector_store=self.vector_store, embed_model=embed_model, min_chunk_length=1)
+            self.assertIsInstance(pipeline.transformations[-1], SparseEmbedTransform)
+            nodes = pipeline.run(documents=docs)
+            self.assertEqual(encode.call_count, 1)
+
+        self.assertEqual(len(nodes), 3)
+        stored = self.vector_store.get_nodes(None)
+        for node in stored:
+            self.assertIn(SPARSE_METADATA_KEY, node.metadata)
+            self.assertNotIn(SPARSE_METADATA_KEY, node.get_content(metadata_mode=MetadataMode.EMBED))
+            self.assertNotIn(SPARSE_METADATA_KEY, node.get_content(metadata_mode=MetadataMode.LLM))
+
+        encoder = FakeEncoder()
+        index = sparse_index.get_sparse_index("sparse", self.vector_store, encoder)
+
+        self.assertEqual(len(index), 3)
+        self.assertEqual(encoder.encoded, [])  # 权重全部来自 metadata，没有重新编码
+
+    def test_chunks_without_weights_are_backfilled_with_encoder(self):
+        from handlers import sparse_index
+        from llama_index.core.schema import TextNode
+
+        nodes = [TextNode(id_=node_id, text=text, embedding=[0.1] * 8) for node_id, text in CORPUS.items()]
+        self.vector_store.add(nodes)
+        encoder = FakeEncoder()
+
+        index = sparse_index.get_sparse_index("sparse", self.vector_store, encoder)
+
+        self.assertEqual(len(index), 3)
+        self.assertEqual(len(encoder.encoded), 3)
+        self.assertEqual(index.search(_char_weights("校训"), k=1)[0][0], "n1")
+
+        sparse_index.drop_sparse_index("sparse")
+        self.assertFalse(os.path.exists(sparse_index._sparse_persist_dir("sparse")))
+
+
+class QuerySideTest(unittest.TestCase):
+    def test_dense_and_sparse_share_one_forward(self):
+        from utils.sparse_embedding import BGEM3SparseEmbedding
+
+        embed_model = _sparse_embedding()
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_encode(texts, prompt_name="text"):
+            started.set()
+            release.wait(timeout=5)
+            return _fake_encode(texts, prompt_name)
+
+        with patch.object(BGEM3SparseEmbedding, "encode", side_effect=slow_encode) as encode:
+            # dense 腿先进来跑前向，稀疏腿在前向还没结束时到达，应当等同一个结果。
+            dense_result = []
+            dense_thread = threading.Thread(
+                target=lambda: dense_result.append(embed_model.get_query_embedding("国家奖学金 多少钱"))
+            )
+            dense_thread.start()
+            started.wait(timeout=5)
+            threading.Timer(0.05, release.set).start()
+            weights = embed_model.query_sparse(" 国家奖学金  多少钱")
+            dense_thread.join(timeout=5)
+            dense = dense_result[0]
+
+        self.assertEqual(encode.call_count, 1)
+        self.assertEqual(encode.call_args.kwargs["prompt_name"], "query")
+        self.assertEqual(dense, [0.1] * 8)
+        self.assertEqual(weights, _char_weights("国家奖学金 多少钱"))
+
+    def test_find_sparse_encoder_looks_through_cached_embedding(self):
+        from llama_index.core.embeddings import MockEmbedding
+        from utils.embedding_cache import CachedEmbedding
+        from utils.sparse_embedding import find_sparse_encoder
+
+        embed_model = _sparse_embedding()
+
+        self.assertIs(find_sparse_encoder(CachedEmbedding(embed_model, max_bytes=1024)), embed_model)
+        self.assertIsNone(find_sparse_encoder(CachedEmbedding(MockEmbedding(embed_dim=8), max_bytes=1024)))
+
+    def test_hybrid_retriever_uses_sparse_leg_in_sparse_mode(self):
+        import chromadb
+        import configs.load_env as load_env
+        from handlers import hybrid_retriever
+        from handlers.hybrid_retriever import HybridFusionRetriever, SparseLexicalRetriever
+        from llama_index.core import Document, VectorStoreIndex
+        from llama_index.core.embeddings import MockEmbedding
+        from llama_index.vector_stores.chroma import ChromaVectorStore
+
+        client = chromadb.PersistentClient(path=tempfile.mkdtemp())
+        self.addCleanup(client.clear_system_cache)
+        vector_store = ChromaVectorStore(chroma_collection=client.get_or_create_collection("sparse-hybrid"))
+        index = VectorStoreIndex.from_vector_store(vector_store=vector_store, embed_model=MockEmbedding(embed_dim=8))
+        index.set_index_id("sparse-hybrid")
+        for text in CORPUS.values():
+            index.insert(Document(text=text))
+
+        encoder = FakeEncoder()
+        with patch.object(load_env, "LEXICAL_RETRIEVAL_MODE", "sparse"), patch.object(
+            hybrid_retriever, "get_sparse_encoder", return_value=encoder
+        ):
+            retriever = hybrid_retriever._build_hybrid_retriever(index, 2)
+
+        self.assertIsInstance(retriever, HybridFusionRetriever)
+        self.assertIsInstance(retriever._bm25, SparseLexicalRetriever)
+        lexical = retriever._bm25.retrieve("勤工助学工资")
+        self.assertIn("勤工助学", lexical[0].node.get_content())
+        # MockEmbedding 下 dense 腿分数全相同，融合名次没有意义，只看词项腿的分数带过来了。
+        fused = {n.node.node_id: n for n in retriever.retrieve("勤工助学工资")}
+        self.assertEqual(fused[lexical[0].node.node_id].bm25_score, lexical[0].score)
+
+
+if __name__ == "__main__":
+    unittest.main()
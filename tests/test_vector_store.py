@@ -11,7 +11,7 @@ class VectorStoreTest(unittest.TestCase):
         self._client_instance_patcher.start()
         self.mock_chroma_client = MagicMock()
         self.mock_chromadb_patch = patch(
-            'handlers.vector_store.chromadb.PersistentClient',
+            'chromadb.PersistentClient',
             return_value=self.mock_chroma_client,
         )
         self.mock_chromadb = self.mock_chromadb_patch.start()
@@ -138,7 +138,7 @@ class VectorStoreTest(unittest.TestCase):
         mock_rmtree.assert_not_called()
         self.mock_chroma_client.delete_collection.assert_called_once_with('to-delete')
 
-    @patch('handlers.vector_store.ChromaVectorStore')
+    @patch('llama_index.vector_stores.chroma.ChromaVectorStore')
     @patch('handlers.vector_store.VectorStoreIndex')
     @patch('handlers.vector_store.Settings')
     def test_build_index_from_collection(self, mock_settings, mock_vsi, mock_cvs):
@@ -158,7 +158,7 @@ class VectorStoreTest(unittest.TestCase):
         )
         self.assertIs(result, fake_index)
 
-    @patch('handlers.vector_store.ChromaVectorStore')
+    @patch('llama_index.vector_stores.chroma.ChromaVectorStore')
     @patch('handlers.vector_store.VectorStoreIndex')
     @patch('handlers.vector_store.Settings')
     def test_create_empty_index(self, mock_settings, mock_vsi, mock_cvs):
@@ -182,5 +182,103 @@ class VectorStoreTest(unittest.TestCase):
         self.assertIs(result, fake_index)
 
 
+class ResetClientTest(unittest.TestCase):
+    def test_stops_evicted_systems(self):
+        import handlers.vector_store as vs
+        from chromadb.api.client import SharedSystemClient
+
+        system = MagicMock()
+        with patch.object(SharedSystemClient, '_identifier_to_system', {'/data/chroma': system}), \
+                patch.object(SharedSystemClient, '_identifier_to_refcount', {'/data/chroma': 1}), \
+                patch.object(vs, '_client_instance', MagicMock()):
+            vs.reset_client()
+
+            self.assertIsNone(vs._client_instance)
+            self.assertEqual(SharedSystemClient._identifier_to_system, {})
+        system.stop.assert_called_once_with()
+
+
+class CollectionGenerationTest(unittest.TestCase):
+    """内容版本号存在真实 Chroma collection 的 metadata 里，用真实 client 测：
+    要验证的恰恰是 Chroma 对 modify(metadata=...) 的两个行为（整体替换、
+    拒绝 hnsw:* key）。"""
+
+    def setUp(self):
+        import tempfile
+
+        import chromadb
+
+        self.client = chromadb.PersistentClient(path=tempfile.mkdtemp())
+        self.addCleanup(self.client.clear_system_cache)
+
+    def test_bump_starts_from_zero_and_increments(self):
+        from handlers.vector_store import bump_collection_generation, get_collection_generation
+
+        collection = self.client.get_or_create_collection('gen-plain')
+        self.assertEqual(get_collection_generation(collection), 0)
+        self.assertEqual(bump_collection_generation(collection), 1)
+        self.assertEqual(bump_collection_generation(collection), 2)
+        self.assertEqual(get_collection_generation(self.client.get_collection('gen-plain')), 2)
+
+    def test_bump_keeps_other_metadata_and_cosine_space(self):
+        from handlers.vector_store import bump_collection_generation
+
+        collection = self.client.get_or_create_collection(
+            'gen-cosine', metadata={'hnsw:space': 'cosine', 'owner': 'qa_cache'}
+        )
+        bump_collection_generation(collection)
+
+        reloaded = self.client.get_collection('gen-cosine')
+        self.assertEqual(reloaded.metadata['owner'], 'qa_cache')
+        self.assertEqual(reloaded.configuration_json['hnsw']['space'], 'cosine')
+
+    def test_saving_summary_keeps_generation(self):
+        """存索引摘要走合并写：上传后 _save_summary 不能把版本号抹回 0。"""
+        from handlers import index_crud
+        from handlers.vector_store import bump_collection_generation, get_collection_generation
+
+        collection = self.client.get_or_create_collection('gen-summary')
+        bump_collection_generation(collection)
+        index = MagicMock(index_id='gen-summary', summary='新摘要')
+
+        with patch.object(index_crud, 'get_or_create_collection', return_value=collection):
+            index_crud._save_summary(index)
+
+        reloaded = self.client.get_collection('gen-summary')
+        self.assertEqual(get_collection_generation(reloaded), 1)
+        self.assertEqual(reloaded.metadata['summary'], '新摘要')
+
+
+class ChromaScoreToCosineTest(unittest.TestCase):
+    """``ChromaVectorStore`` 的 score 是 ``exp(-距离)``：用真实 Chroma 在两种距离
+    空间里查一对夹角已知的单位向量，换算回来必须是它们的余弦。"""
+
+    def setUp(self):
+        import tempfile
+
+        import chromadb
+
+        self.client = chromadb.PersistentClient(path=tempfile.mkdtemp())
+        self.addCleanup(self.client.clear_system_cache)
+
+    def _score(self, collection):
+        import math
+
+        collection.add(ids=['doc'], embeddings=[[1.0, 0.0, 0.0]])
+        distance = collection.query(query_embeddings=[[0.6, 0.8, 0.0]], n_results=1)['distances'][0][0]
+        return math.exp(-distance)  # 跟 ChromaVectorStore._query 一样
+
+    def test_l2_and_cosine_collections_convert_to_the_same_cosine(self):
+        from handlers.vector_store import chroma_score_to_cosine, collection_space
+
+        l2 = self.client.get_or_create_collection('space-l2')
+        cosine = self.client.get_or_create_collection('space-cosine', metadata={'hnsw:space': 'cosine'})
+
+        self.assertEqual(collection_space(l2), 'l2')
+        self.assertEqual(collection_space(cosine), 'cosine')
+        self.assertAlmostEqual(chroma_score_to_cosine(self._score(l2), 'l2'), 0.6, places=4)
+        self.assertAlmostEqual(chroma_score_to_cosine(self._score(cosine), 'cosine'), 0.6, places=4)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,114 @@
+"""启动预热与就绪探针（handlers/warmup.py + main./health/ready）的测试。
+
+预热项本身（bge-m3 前向、cross-encoder 加载）在测试里都换成假函数，只验证：
+1. 每一项的 ok / skipped / failed 都被记录，某一项失败不妨碍最终就绪；
+2. /health/ready 在预热跑完之前是 503，之后是 200，响应体带启动各步耗时；
+3. 健康探针不计入访问统计、不发 session cookie。
+"""
+import asyncio
+import threading
+import unittest
+from unittest.mock import AsyncMock, patch
+
+import tests._pathsetup  # noqa: F401
+
+
+class RunWarmupTest(unittest.TestCase):
+    def test_records_each_phase_and_marks_ready_even_if_one_fails(self):
+        import configs.load_env as load_env
+        from handlers import warmup
+
+        calls = []
+
+        def ok():
+            calls.append("embedding")
+            return "warm"
+
+        def skipped():
+            raise warmup.PhaseSkipped("not in use")
+
+        def broken():
+            raise RuntimeError("offline")
+
+        funcs = {"embedding": ok, "jieba": skipped, "reranker": broken, "retrievers": ok}
+        state = warmup.WarmupState()
+        with patch.dict(warmup._PHASE_FUNCS, funcs), patch.object(
+            load_env, "WARMUP_PHASES", ["reranker", "embedding", "jieba", "bogus"]
+        ):
+            asyncio.run(warmup.run_warmup(state))
+
+        snapshot = state.snapshot()
+        self.assertTrue(snapshot["ready"])
+        self.assertIsNotNone(snapshot["ready_after_ms"])
+        # 按 KNOWN_PHASES 的顺序执行，没配置的 retrievers 和不认识的 bogus 都不跑。
+        self.assertEqual(
+            [(p["name"], p["status"]) for p in snapshot["warmup"]],
+            [("embedding", "ok"), ("jieba", "skipped"), ("reranker", "failed")],
+        )
+        self.assertEqual(snapshot["warmup"][0]["detail"], "warm")
+        self.assertIn("offline", snapshot["warmup"][2]["detail"])
+        self.assertEqual(calls, ["embedding"])
+
+    def test_disabled_warmup_is_ready_immediately(self):
+        import configs.load_env as load_env
+        from handlers import warmup
+
+        state = warmup.WarmupState()
+        with patch.object(load_env, "WARMUP_ENABLED", False):
+            self.assertIsNone(warmup.start_warmup(state))
+        self.assertTrue(state.ready)
+        self.assertEqual(state.snapshot()["warmup"], [])
+
+
+class ReadinessEndpointTest(unittest.TestCase):
+    def setUp(self):
+        self._lifespan_patches = [
+            patch("main.loadAllIndexes", new_callable=AsyncMock),
+            patch("main.load_env.reload_env_variables"),
+            patch("main.init_settings"),
+        ]
+        for p in self._lifespan_patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_ready_flips_only_after_warmup_finishes(self):
+        import configs.load_env as load_env
+        from fastapi.testclient import TestClient
+        from handlers import warmup
+        from main import access_counter, app
+
+        release = threading.Event()
+
+        def slow_phase():
+            release.wait(timeout=5)
+
+        with patch.object(load_env, "WARMUP_ENABLED", True), patch.object(
+            load_env, "WARMUP_PHASES", ["embedding"]
+        ), patch.dict(warmup._PHASE_FUNCS, {"embedding": slow_phase}):
+            with TestClient(app) as client:
+                visits_before = access_counter.total
+                cold = client.get("/health/ready")
+                release.set()
+                for _ in range(100):
+                    warm = client.get("/health/ready")
+                    if warm.status_code == 200:
+                        break
+                    threading.Event().wait(0.02)
+                visits_after = access_counter.total
+
+        self.assertEqual(cold.status_code, 503)
+        self.assertFalse(cold.json()["ready"])
+        self.assertEqual(warm.status_code, 200)
+        body = warm.json()
+        self.assertEqual(
+            [p["name"] for p in body["startup"]],
+            ["env", "observability", "shared_state", "embedding_model", "indexes", "stats_db"],
+        )
+        self.assertTrue(all(p["status"] == "ok" for p in body["startup"]))
+        self.assertEqual(body["warmup"][0]["status"], "ok")
+        self.assertNotIn("session_id", cold.cookies)
+        self.assertEqual(visits_after, visits_before)
+
+
+if __name__ == "__main__":
+    unittest.main()